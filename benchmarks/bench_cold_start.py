@@ -0,0 +1,93 @@
+"""Measure what the lambdas spend on AWS clients during a cold start, and then once warm.
+
+Each cold start is simulated by a fresh Python interpreter. No request is sent to AWS: building a
+client only loads its service model and resolves its endpoint.
+
+Usage: python -m benchmarks.bench_cold_start [--rounds 5]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+# Runs in a fresh interpreter and prints its timings as JSON
+COLD_START_SCRIPT = '''
+import json
+import time
+
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+{first_use}
+first_use = time.perf_counter()
+{warm_use}
+warm_use = time.perf_counter()
+
+print(json.dumps({{
+    'import': imported - start,
+    'first_use': first_use - imported,
+    'warm_use': warm_use - first_use,
+}}))
+'''
+
+SCENARIOS = (
+    # How the clients used to be built: at import time for metadata.py, and at every invocation
+    # for copy_to_bucket.py
+    ('metadata, eager', 'maven_lambda.metadata', (
+        "import boto3; boto3.resource('s3'); boto3.client('cloudfront')"
+    ), (
+        "pass"
+    )),
+    ('metadata, lazy', 'maven_lambda.metadata', (
+        "maven_lambda.metadata.s3.meta; maven_lambda.metadata.cloudfront.meta"
+    ), (
+        "maven_lambda.metadata.s3.meta; maven_lambda.metadata.cloudfront.meta"
+    )),
+    ('copy, per call', 'maven_lambda.copy_to_bucket', (
+        "import boto3; boto3.client('s3')"
+    ), (
+        "boto3.client('s3')"
+    )),
+    ('copy, lazy', 'maven_lambda.copy_to_bucket', (
+        "maven_lambda.copy_to_bucket.s3.meta"
+    ), (
+        "maven_lambda.copy_to_bucket.s3.meta"
+    )),
+)
+
+
+def run_cold_start(module, first_use, warm_use):
+    script = COLD_START_SCRIPT.format(module=module, first_use=first_use, warm_use=warm_use)
+    environment = dict(os.environ, AWS_DEFAULT_REGION=os.environ.get(
+        'AWS_DEFAULT_REGION', 'us-west-2'
+    ))
+    output = subprocess.check_output([sys.executable, '-c', script], env=environment)
+    # metadata.py prints when loaded
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    print('Best of {} cold starts'.format(args.rounds))
+    print('{:<16} {:>11} {:>15} {:>15} {:>14}'.format(
+        'scenario', 'import (ms)', 'first use (ms)', 'cold total (ms)', 'warm use (ms)'
+    ))
+    for name, module, first_use, warm_use in SCENARIOS:
+        timings = [run_cold_start(module, first_use, warm_use) for _ in range(args.rounds)]
+        for timing in timings:
+            timing['cold_total'] = timing['import'] + timing['first_use']
+        print('{:<16} {:>11.1f} {:>15.1f} {:>15.1f} {:>14.3f}'.format(
+            name, *(
+                min(timing[step] for timing in timings) * 1000
+                for step in ('import', 'first_use', 'cold_total', 'warm_use')
+            )
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Measure what the gzip variant of maven-metadata.xml saves, and what it costs to upload.
+
+For each size, maven-metadata.xml of a geckoview-nightly-like artifact is rendered, then
+compressed at several levels. The download time assumes a client on a --bandwidth link. The
+upload time is the one of upload_maven_metadata(), with and without METADATA_GZIP, while every
+S3 request waits for --latency milliseconds.
+
+Usage: python -m benchmarks.bench_compression [--versions 1000 10000 30000] [--latency 20]
+"""
+import argparse
+import contextlib
+import gzip
+import io
+import os
+import time
+
+from unittest.mock import patch
+
+from benchmarks.synthetic import GECKOVIEW_NIGHTLY_FOLDER, generate_nightly_versions
+from maven_lambda.metadata import (
+    METADATA_GZIP_ENV_VAR,
+    generate_content_hash,
+    generate_metadata_and_checksums,
+    stream_release_maven_metadata,
+    upload_maven_metadata,
+)
+from maven_lambda.test.stand_ins import S3ClientStandIn, S3ResourceStandIn
+
+
+BUCKET_NAME = 'benchmark-bucket'
+COMPRESS_LEVELS = (1, 6, 9)
+
+
+def render(number_of_versions):
+    pom_files = [
+        '{folder}{version}/geckoview-nightly-{version}.pom'.format(
+            folder=GECKOVIEW_NIGHTLY_FOLDER, version=version
+        )
+        for version in generate_nightly_versions(number_of_versions)
+    ]
+    return generate_metadata_and_checksums(stream_release_maven_metadata(BUCKET_NAME, pom_files))
+
+
+def best_time(function, rounds):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def measure_upload(metadata, checksums, latency, with_gzip_variant, rounds):
+    s3_client = S3ClientStandIn()
+    s3_client.latency = latency
+
+    def upload():
+        # Every round starts from an empty folder, so that nothing is skipped
+        s3_client._objects_per_bucket.clear()
+        s3_client._sorted_keys_per_bucket.clear()
+        upload_maven_metadata(
+            BUCKET_NAME, GECKOVIEW_NIGHTLY_FOLDER, metadata, checksums,
+            generate_content_hash(metadata), metadata_state=(None, None)
+        )
+
+    environment = {METADATA_GZIP_ENV_VAR: '1'} if with_gzip_variant else {}
+    with patch('maven_lambda.metadata.s3', S3ResourceStandIn(s3_client)), \
+            patch.dict(os.environ, environment), \
+            contextlib.redirect_stdout(io.StringIO()):
+        if not with_gzip_variant:
+            os.environ.pop(METADATA_GZIP_ENV_VAR, None)
+        return best_time(upload, rounds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--versions', type=int, nargs='+', default=[1000, 10000, 30000])
+    parser.add_argument('--latency', type=float, default=20, help='In milliseconds')
+    parser.add_argument('--bandwidth', type=float, default=10, help='In Mbit/s')
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    bytes_per_second = args.bandwidth * 1000 * 1000 / 8
+    print('{:>8} {:>6} {:>10} {:>7} {:>14} {:>16} {:>15}'.format(
+        'versions', 'level', 'size (KiB)', 'ratio', 'compress (ms)', 'decompress (ms)',
+        'download (ms)'
+    ))
+    for number_of_versions in args.versions:
+        metadata, _ = render(number_of_versions)
+        data = metadata.encode()
+        print('{:>8} {:>6} {:>10.1f} {:>7} {:>14} {:>16} {:>15.1f}'.format(
+            number_of_versions, '-', len(data) / 1024, '1.00', '-', '-',
+            len(data) / bytes_per_second * 1000
+        ))
+        for level in COMPRESS_LEVELS:
+            compressed = gzip.compress(data, compresslevel=level, mtime=0)
+            print('{:>8} {:>6} {:>10.1f} {:>7.2f} {:>14.2f} {:>16.2f} {:>15.1f}'.format(
+                number_of_versions, level, len(compressed) / 1024, len(compressed) / len(data),
+                best_time(
+                    lambda: gzip.compress(data, compresslevel=level, mtime=0), args.rounds
+                ) * 1000,
+                best_time(lambda: gzip.decompress(compressed), args.rounds) * 1000,
+                len(compressed) / bytes_per_second * 1000
+            ))
+
+    print()
+    print('upload_maven_metadata() with a {:.0f} ms latency per request'.format(args.latency))
+    print('{:>8} {:>16} {:>16}'.format('versions', 'plain (ms)', 'with gzip (ms)'))
+    for number_of_versions in args.versions:
+        metadata, checksums = render(number_of_versions)
+        print('{:>8} {:>16.1f} {:>16.1f}'.format(number_of_versions, *(
+            measure_upload(
+                metadata, checksums, args.latency / 1000, with_gzip_variant, args.rounds
+            ) * 1000
+            for with_gzip_variant in (False, True)
+        )))
+
+
+if __name__ == '__main__':
+    main()
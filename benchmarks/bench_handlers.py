@@ -0,0 +1,226 @@
+"""Run both lambdas against synthetic repositories of several sizes, and store the results.
+
+Each scale is a geckoview-nightly artifact with that many versions, next to android-components
+artifacts holding as many versions in total. The event is a release push: a new version of
+every artifact. Every S3 and CloudFront request waits for --latency milliseconds.
+
+Results are appended to --results (one JSON line per run, along with the git commit) and
+compared with the previous run.
+
+Usage: python -m benchmarks.bench_handlers [--scales 100 1000 10000] [--latency 0] [--rounds 3]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+
+from datetime import datetime
+from unittest.mock import patch
+
+from benchmarks.synthetic import (
+    ANDROID_COMPONENTS_FOLDER,
+    GECKOVIEW_NIGHTLY_FOLDER,
+    VERSION_FILE_SUFFIXES,
+    generate_nightly_versions,
+    generate_release_versions,
+    get_version_keys,
+    populate_artifact,
+)
+from maven_lambda import copy_to_bucket, metadata
+from maven_lambda.invalidation import InvalidationBatcher
+from maven_lambda.test.stand_ins import (
+    CloudFrontClientStandIn,
+    S3ClientStandIn,
+    S3ResourceStandIn,
+)
+
+
+BUCKET_NAME = 'benchmark-bucket'
+TARGET_BUCKET_NAME = 'benchmark-target-bucket'
+NUMBER_OF_COMPONENTS = 10
+DEFAULT_RESULTS_PATH = os.path.join(os.path.dirname(__file__), 'results', 'handlers.jsonl')
+
+
+def populate_repository(s3_client, scale):
+    # Returns the keys of the release push (which are already uploaded), and the number of objects
+    artifact_folders_and_versions = [
+        (GECKOVIEW_NIGHTLY_FOLDER, generate_nightly_versions(scale + 1)),
+    ] + [
+        (
+            '{}component{}/'.format(ANDROID_COMPONENTS_FOLDER, index),
+            generate_release_versions(max(1, scale // NUMBER_OF_COMPONENTS) + 1),
+        )
+        for index in range(NUMBER_OF_COMPONENTS)
+    ]
+    for artifact_folder, versions in artifact_folders_and_versions:
+        populate_artifact(s3_client, BUCKET_NAME, artifact_folder, versions)
+    return [
+        key
+        for artifact_folder, versions in artifact_folders_and_versions
+        for key in get_version_keys(artifact_folder, versions[-1])
+    ], sum(len(versions) for _, versions in artifact_folders_and_versions) * len(
+        VERSION_FILE_SUFFIXES
+    )
+
+
+def generate_event(keys):
+    return {'Records': [
+        {'s3': {'bucket': {'name': BUCKET_NAME}, 'object': {'key': key, 'size': 0}}}
+        for key in keys
+    ]}
+
+
+def run_metadata_handler(s3_client, cloudfront_client, event):
+    # Warm invocations would reuse these caches. A new release mostly hits cold containers.
+    metadata._parse_version_string.cache_clear()
+    metadata._packaging_per_pom.clear()
+    with patch('maven_lambda.metadata.s3', S3ResourceStandIn(s3_client)), \
+            patch('maven_lambda.metadata.cloudfront', cloudfront_client), \
+            patch('maven_lambda.metadata.invalidation_batcher', InvalidationBatcher()), \
+            patch.dict(os.environ, {'CLOUDFRONT_DISTRIBUTION_ID': 'BENCHMARK'}):
+        os.environ.pop(metadata.WORK_QUEUE_TABLE_ENV_VAR, None)
+        return metadata.lambda_handler(event, None)
+
+
+def run_copy_handler(s3_client, _, event):
+    with patch('maven_lambda.copy_to_bucket.s3', s3_client), \
+            patch.dict(copy_to_bucket._versioning_status_per_bucket, clear=True), \
+            patch.dict(os.environ, {'TARGET_BUCKET': TARGET_BUCKET_NAME}):
+        return copy_to_bucket.lambda_handler(event, None)
+
+
+HANDLERS = (
+    ('metadata', run_metadata_handler),
+    ('copy_to_bucket', run_copy_handler),
+)
+
+
+def run_once(run_handler, scale, latency, trace_memory=False):
+    s3_client = S3ClientStandIn()
+    # copy_to_bucket only copies keys that have a single version
+    s3_client.put_bucket_versioning(
+        Bucket=BUCKET_NAME, VersioningConfiguration={'Status': 'Enabled'}
+    )
+    keys, number_of_objects = populate_repository(s3_client, scale)
+    event = generate_event(keys)
+    s3_client.calls.clear()
+    s3_client.latency = latency
+    cloudfront_client = CloudFrontClientStandIn(latency=latency)
+
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        run_handler(s3_client, cloudfront_client, event)
+    duration = time.perf_counter() - start
+    peak_memory = None
+    if trace_memory:
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        'objects': number_of_objects,
+        'records': len(event['Records']),
+        'duration': duration,
+        'peakMemory': peak_memory,
+        'apiCalls': dict(sorted((s3_client.calls + cloudfront_client.calls).items())),
+        'listedEntries': s3_client.listed_entries,
+    }
+
+
+def measure(handler_name, run_handler, scale, latency, rounds):
+    durations = [run_once(run_handler, scale, latency)['duration'] for _ in range(rounds)]
+    # tracemalloc slows everything down: memory is measured apart from time
+    result = run_once(run_handler, scale, latency, trace_memory=True)
+    result.update(handler=handler_name, scale=scale, duration=min(durations))
+    return result
+
+
+def get_git_commit():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, check=True, text=True
+        ).stdout.strip()
+        is_dirty = bool(subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True,
+            check=True, text=True
+        ).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return '{}-dirty'.format(commit) if is_dirty else commit
+
+
+def load_previous_run(results_path, latency):
+    # Only runs with the same latency can be compared
+    previous_run = None
+    if os.path.exists(results_path):
+        with open(results_path) as results_file:
+            for line in results_file:
+                run = json.loads(line)
+                if run['latencyMs'] == latency:
+                    previous_run = run
+    return previous_run
+
+
+def format_change(value, previous_result, field):
+    if previous_result is None or not previous_result.get(field) or value is None:
+        return ''
+    return '{:+.0%}'.format(value / previous_result[field] - 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--latency', type=float, default=0, help='In milliseconds')
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--results', default=DEFAULT_RESULTS_PATH)
+    parser.add_argument('--no-save', action='store_true', help='Do not store the results')
+    args = parser.parse_args()
+
+    previous_run = load_previous_run(args.results, args.latency)
+    previous_result_per_scenario = {} if previous_run is None else {
+        (result['handler'], result['scale']): result for result in previous_run['results']
+    }
+    if previous_run is not None:
+        print('Compared with {} ({})'.format(previous_run['commit'], previous_run['date']))
+
+    print('{:<16} {:>8} {:>8} {:>10} {:>7} {:>9} {:>9} {:>10} {:>7}'.format(
+        'handler', 'versions', 'objects', 'time (ms)', 'change', 'S3 calls', 'CF calls',
+        'peak (KiB)', 'change'
+    ))
+    results = []
+    for scale in args.scales:
+        for handler_name, run_handler in HANDLERS:
+            result = measure(handler_name, run_handler, scale, args.latency / 1000, args.rounds)
+            results.append(result)
+            previous_result = previous_result_per_scenario.get((handler_name, scale))
+            api_calls = result['apiCalls']
+            print('{:<16} {:>8} {:>8} {:>10.1f} {:>7} {:>9} {:>9} {:>10.0f} {:>7}'.format(
+                handler_name, scale, result['objects'], result['duration'] * 1000,
+                format_change(result['duration'], previous_result, 'duration'),
+                sum(calls for name, calls in api_calls.items() if name != 'CreateInvalidation'),
+                api_calls.get('CreateInvalidation', 0), result['peakMemory'] / 1024,
+                format_change(result['peakMemory'], previous_result, 'peakMemory'),
+            ))
+
+    if not args.no_save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.results)), exist_ok=True)
+        with open(args.results, 'a') as results_file:
+            results_file.write(json.dumps({
+                'commit': get_git_commit(),
+                'date': datetime.utcnow().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'latencyMs': args.latency,
+                'rounds': args.rounds,
+                'results': results,
+            }, sort_keys=True) + '\n')
+        print('Results appended to {}'.format(args.results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Compare the ways metadata.py can list the .pom files of an artifact folder.
+
+Every S3 request waits for --latency milliseconds, like a real round trip would.
+
+Usage: python -m benchmarks.bench_listing [--versions 5000] [--latency 20]
+"""
+import argparse
+import time
+
+from functools import partial
+
+from benchmarks.synthetic import (
+    GECKOVIEW_NIGHTLY_FOLDER,
+    generate_nightly_versions,
+    populate_artifact,
+)
+from maven_lambda.metadata import (
+    list_pom_files_in_ranges,
+    list_pom_files_in_subfolders,
+    list_pom_files_in_version_folders,
+)
+from maven_lambda.test.stand_ins import S3ClientStandIn, S3ResourceStandIn
+
+
+BUCKET_NAME = 'benchmark-bucket'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--versions', type=int, default=5000)
+    parser.add_argument('--latency', type=float, default=20, help='In milliseconds')
+    args = parser.parse_args()
+
+    s3_client = S3ClientStandIn()
+    populate_artifact(
+        s3_client, BUCKET_NAME, GECKOVIEW_NIGHTLY_FOLDER, generate_nightly_versions(args.versions)
+    )
+    s3_client.latency = args.latency / 1000
+    bucket = S3ResourceStandIn(s3_client).Bucket(BUCKET_NAME)
+
+    print('Artifact with {} versions ({} objects), {} ms per request'.format(
+        args.versions, args.versions * 12, args.latency
+    ))
+    print('{:<28} {:>10} {:>10} {:>10} {:>10}'.format(
+        'listing', 'LIST calls', 'entries', 'HEAD calls', 'time (ms)'
+    ))
+
+    reference_pom_files = None
+    for name, function in (
+        ('objects', list_pom_files_in_subfolders),
+        ('version-folders', list_pom_files_in_version_folders),
+        (
+            'checked-version-folders',
+            partial(list_pom_files_in_version_folders, check_pom_exists=True),
+        ),
+        ('ranges (4)', partial(list_pom_files_in_ranges, number_of_ranges=4)),
+        ('ranges (8)', partial(list_pom_files_in_ranges, number_of_ranges=8)),
+        ('ranges (16)', partial(list_pom_files_in_ranges, number_of_ranges=16)),
+    ):
+        s3_client.calls.clear()
+        s3_client.listed_entries = 0
+        start = time.perf_counter()
+        pom_files = function(bucket, GECKOVIEW_NIGHTLY_FOLDER)
+        elapsed = time.perf_counter() - start
+
+        if reference_pom_files is None:
+            reference_pom_files = pom_files
+        elif pom_files != reference_pom_files:
+            raise Exception('"{}" listed different .pom files'.format(name))
+
+        print('{:<28} {:>10} {:>10} {:>10} {:>10.1f}'.format(
+            name, s3_client.calls['ListObjectsV2'], s3_client.listed_entries,
+            s3_client.calls['HeadObject'], elapsed * 1000
+        ))
+
+
+if __name__ == '__main__':
+    main()
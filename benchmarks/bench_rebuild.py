@@ -0,0 +1,88 @@
+"""Rebuild a whole synthetic repository with several worker configurations.
+
+Every S3 request waits for --latency milliseconds, like a real round trip would. The listing then
+comes from a live LIST, then from an S3 Inventory (written locally).
+
+Usage: python -m benchmarks.bench_rebuild [--artifacts 200] [--versions 50] [--latency 20]
+"""
+import argparse
+import contextlib
+import io
+import tempfile
+
+from unittest.mock import patch
+
+from benchmarks.synthetic import generate_nightly_versions, populate_artifact
+from maven_lambda.inventory import Inventory
+from maven_lambda.rebuild import rebuild_repository
+from maven_lambda.test.stand_ins import S3ClientStandIn, S3ResourceStandIn, deliver_inventory
+
+
+BUCKET_NAME = 'benchmark-bucket'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--artifacts', type=int, default=200)
+    parser.add_argument('--versions', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=20, help='In milliseconds')
+    args = parser.parse_args()
+
+    versions = generate_nightly_versions(args.versions)
+    print('Rebuilding {} artifacts of {} versions each'.format(args.artifacts, args.versions))
+    print('{:<24} {:>10} {:>10}'.format('workers (io/render)', 'time (s)', 'folders/s'))
+
+    for io_workers, render_workers in ((1, 0), (16, 0), (16, 4), (32, 4)):
+        # Every configuration starts from a repository without any maven-metadata.xml
+        s3_client = _populate(args.artifacts, versions)
+        s3_client.latency = args.latency / 1000
+        report = _rebuild(s3_client, io_workers=io_workers, render_workers=render_workers)
+
+        print('{:<24} {:>10.2f} {:>10.1f}'.format(
+            '{}/{}'.format(io_workers, render_workers), report.duration,
+            report.to_dict()['foldersPerSecond']
+        ))
+
+    # The repository is rebuilt once, so that maven-metadata.xml files predate the inventory
+    print()
+    print('{:<24} {:>12} {:>10} {:>10}'.format('listing', 'listing (s)', 'LIST', 'time (s)'))
+    s3_client = _populate(args.artifacts, versions)
+    _rebuild(s3_client, io_workers=16, render_workers=0)
+    s3_client.latency = args.latency / 1000
+    with tempfile.TemporaryDirectory() as directory:
+        manifest_key = deliver_inventory(s3_client, BUCKET_NAME, directory)
+        for name, inventory in (
+            ('live', None), ('inventory', Inventory.from_location(directory, manifest_key)),
+        ):
+            s3_client.calls.clear()
+            # Nothing changes once the inventory is delivered: no folder needs to be listed again
+            report = _rebuild(
+                s3_client, io_workers=16, render_workers=0, inventory=inventory,
+                recent_changes_window=0
+            )
+            print('{:<24} {:>12.2f} {:>10} {:>10.2f}'.format(
+                name, report.listing_duration, s3_client.calls['ListObjectsV2'], report.duration
+            ))
+
+
+def _populate(number_of_artifacts, versions):
+    s3_client = S3ClientStandIn()
+    for index in range(number_of_artifacts):
+        populate_artifact(
+            s3_client, BUCKET_NAME,
+            'maven2/org/mozilla/group{}/artifact{}/'.format(index % 10, index), versions
+        )
+    return s3_client
+
+
+def _rebuild(s3_client, **kwargs):
+    # The stand-in shares our clock: maven-metadata.xml files written by the previous rebuild
+    # must not look like they changed since the listing
+    with patch('maven_lambda.metadata.s3', S3ResourceStandIn(s3_client)), \
+            patch('maven_lambda.rebuild.CLOCK_SKEW_MARGIN', 0), \
+            contextlib.redirect_stdout(io.StringIO()):
+        return rebuild_repository(BUCKET_NAME, **kwargs)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Compare the streaming maven-metadata.xml renderer with the former ElementTree-based one.
+
+Usage: python -m benchmarks.bench_rendering [--versions 10000] [--rounds 5]
+"""
+import argparse
+import io
+import time
+import tracemalloc
+
+from unittest.mock import patch
+from xml.etree import ElementTree as ET
+
+from benchmarks.synthetic import GECKOVIEW_NIGHTLY_FOLDER, generate_nightly_versions
+from maven_lambda.metadata import (
+    generate_metadata_and_checksums,
+    generate_versions,
+    get_artifact_id,
+    get_group_id,
+    get_latest_version,
+    stream_release_maven_metadata,
+)
+
+
+# Both renderers must write the same lastUpdated for their outputs to be compared
+LAST_UPDATED = '20190901093520'
+
+
+def render_with_element_tree(folder_content_keys, latest_version):
+    # How maven-metadata.xml used to be generated, kept here as a reference
+    versions_per_path = generate_versions(folder_content_keys)
+
+    root = ET.Element('metadata')
+    ET.SubElement(root, 'groupId').text = get_group_id(folder_content_keys[0])
+    ET.SubElement(root, 'artifactId').text = get_artifact_id(folder_content_keys[0])
+    versioning = ET.SubElement(root, 'versioning')
+    ET.SubElement(versioning, 'latest').text = latest_version
+    ET.SubElement(versioning, 'release').text = '' if latest_version is None else latest_version
+    versions = ET.SubElement(versioning, 'versions')
+    for version in sorted(set(versions_per_path.values())):
+        ET.SubElement(versions, 'version').text = version
+    ET.SubElement(versioning, 'lastUpdated').text = LAST_UPDATED
+
+    stream = io.StringIO()
+    ET.ElementTree(root).write(
+        stream, encoding='unicode', xml_declaration=True, method='xml', short_empty_elements=False
+    )
+    return generate_metadata_and_checksums(stream.getvalue())
+
+
+def render_with_stream(folder_content_keys, latest_version):
+    # Version parsing isn't part of the rendering: the latest version is computed upfront
+    with patch('maven_lambda.metadata.generate_last_updated', lambda: LAST_UPDATED), \
+            patch('maven_lambda.metadata.get_latest_version', lambda *_: latest_version):
+        return generate_metadata_and_checksums(
+            stream_release_maven_metadata('benchmark-bucket', folder_content_keys)
+        )
+
+
+def measure(function, pom_files, latest_version, rounds):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = function(pom_files, latest_version)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function(pom_files, latest_version)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, min(timings), peak_memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--versions', type=int, default=10000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    pom_files = [
+        '{folder}{version}/geckoview-nightly-{version}.pom'.format(
+            folder=GECKOVIEW_NIGHTLY_FOLDER, version=version
+        )
+        for version in generate_nightly_versions(args.versions)
+    ]
+    latest_version = get_latest_version(generate_versions(pom_files))
+
+    print('Rendering maven-metadata.xml and its checksums for {} versions'.format(args.versions))
+    print('{:<16} {:>14} {:>18}'.format('renderer', 'best time (ms)', 'peak memory (KiB)'))
+
+    results = {}
+    for name, function in (
+        ('element-tree', render_with_element_tree),
+        ('stream', render_with_stream),
+    ):
+        results[name], best_time, peak_memory = measure(
+            function, pom_files, latest_version, args.rounds
+        )
+        print('{:<16} {:>14.1f} {:>18.0f}'.format(name, best_time * 1000, peak_memory / 1024))
+
+    if results['element-tree'] != results['stream']:
+        raise Exception('Renderers generated different maven-metadata.xml')
+    print('Outputs and checksums are byte-identical ({} bytes)'.format(
+        len(results['stream'][0].encode())
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+# Helpers to fill the S3 stand-in with repositories shaped like maven.mozilla.org
+
+GECKOVIEW_NIGHTLY_FOLDER = 'maven2/org/mozilla/geckoview/geckoview-nightly/'
+ANDROID_COMPONENTS_FOLDER = 'maven2/org/mozilla/components/'
+
+# What beetmover uploads for every version of an Android library
+VERSION_FILE_SUFFIXES = (
+    '.pom', '.pom.md5', '.pom.sha1',
+    '.aar', '.aar.md5', '.aar.sha1',
+    '-sources.jar', '-sources.jar.md5', '-sources.jar.sha1',
+    '-javadoc.jar', '-javadoc.jar.md5', '-javadoc.jar.sha1',
+)
+
+
+def generate_nightly_versions(number_of_versions, major_version=70):
+    # Nightly versions look like "70.0.20190901093520". Spread them over a few major versions
+    # and build dates so that sorting is actually exercised.
+    return [
+        '{}.0.2019{:02d}{:02d}{:06d}'.format(
+            major_version + index // 1000, index // 31 % 12 + 1, index % 28 + 1, index
+        )
+        for index in range(number_of_versions)
+    ]
+
+
+def generate_release_versions(number_of_versions, major_version=1):
+    # android-components ships versions like "1.2.3", several patch releases per minor version
+    return [
+        '{}.{}.{}'.format(major_version + index // 100, index // 5 % 20, index % 5)
+        for index in range(number_of_versions)
+    ]
+
+
+def populate_artifact(s3_client, bucket_name, artifact_folder, versions, body=b''):
+    for version in versions:
+        for key in get_version_keys(artifact_folder, version):
+            s3_client.put_object(Bucket=bucket_name, Key=key, Body=body)
+    s3_client.calls.clear()
+    s3_client.listed_entries = 0
+
+
+def get_version_keys(artifact_folder, version):
+    artifact_id = artifact_folder.rstrip('/').split('/')[-1]
+    return [
+        '{}{}/{}-{}{}'.format(artifact_folder, version, artifact_id, version, suffix)
+        for suffix in VERSION_FILE_SUFFIXES
+    ]
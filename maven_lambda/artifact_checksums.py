@@ -0,0 +1,156 @@
+import hashlib
+
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from maven_lambda.conditional_writes import (
+    get_error_code,
+    get_write_conditions,
+    is_concurrent_write_error,
+)
+
+
+# Artifacts come with checksum files (".md5", ".sha1"...) computed by whoever uploaded them. Each
+# newly uploaded artifact is read once, in chunks, through every hash algorithm at the same time.
+# Existing checksum files are then verified, and the missing ones may be written. Nothing is held
+# in memory besides a single chunk, whatever the size of the artifact.
+CHECKSUM_ALGORITHMS = ('md5', 'sha1', 'sha256', 'sha512')
+CHUNK_SIZE = 1024 * 1024
+MAX_ARTIFACT_WORKERS = 8
+
+ARTIFACT_CHECKSUMS_ENV_VAR = 'ARTIFACT_CHECKSUMS'
+# Uploaders provide .md5 and .sha1, and Gradle 6+ also provides .sha256 and .sha512, possibly after
+# the event of the artifact. Writing them here would race with the uploader, and give these files
+# a second version, which copy_to_bucket refuses to copy. Checksums are therefore only verified,
+# unless ARTIFACT_CHECKSUMS lists the algorithms to write.
+DEFAULT_ALGORITHMS_TO_WRITE = ()
+
+NOT_AN_ARTIFACT_SUFFIXES = tuple(
+    '.{}'.format(algorithm) for algorithm in CHECKSUM_ALGORITHMS
+) + ('.asc', '/')
+NOT_AN_ARTIFACT_FILE_NAMES = ('maven-metadata.xml', 'maven-lambda-index.json')
+
+
+def get_algorithms_to_write(environment_value):
+    # "1" (or any value that isn't a list of algorithms) only verifies checksums
+    algorithms = [
+        algorithm.strip() for algorithm in environment_value.split(',')
+        if algorithm.strip() in CHECKSUM_ALGORITHMS
+    ]
+    return tuple(algorithms) if algorithms else DEFAULT_ALGORITHMS_TO_WRITE
+
+
+def is_artifact(key):
+    file_name = key.split('/')[-1]
+    return not (
+        key.endswith(NOT_AN_ARTIFACT_SUFFIXES) or
+        any(file_name.startswith(name) for name in NOT_AN_ARTIFACT_FILE_NAMES)
+    )
+
+
+def process_artifact_checksums(
+    s3_client, bucket_and_keys, algorithms_to_write=DEFAULT_ALGORITHMS_TO_WRITE
+):
+    bucket_and_keys = [
+        (bucket_name, key) for bucket_name, key in bucket_and_keys if is_artifact(key)
+    ]
+    if not bucket_and_keys:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(MAX_ARTIFACT_WORKERS, len(bucket_and_keys))) as \
+            executor:
+        return list(executor.map(
+            lambda bucket_and_key: _try_to_process_artifact(
+                s3_client, *bucket_and_key, algorithms_to_write=algorithms_to_write
+            ),
+            bucket_and_keys
+        ))
+
+
+def _try_to_process_artifact(s3_client, bucket_name, key, algorithms_to_write):
+    try:
+        return process_artifact(s3_client, bucket_name, key, algorithms_to_write)
+    except Exception as e:
+        # Checksums must not prevent maven-metadata.xml from being generated
+        print('Could not process checksums of "{}": {}'.format(key, e))
+        return {'bucket': bucket_name, 'key': key, 'status': 'failed', 'error': str(e)}
+
+
+def process_artifact(
+    s3_client, bucket_name, key, algorithms_to_write=DEFAULT_ALGORITHMS_TO_WRITE
+):
+    result = {
+        'bucket': bucket_name,
+        'key': key,
+        'verifiedChecksums': [],
+        'writtenChecksums': [],
+        'mismatchingChecksums': [],
+    }
+    try:
+        digests = compute_digests(s3_client, bucket_name, key)
+    except ClientError as e:
+        if get_error_code(e) not in ('404', 'NoSuchKey'):
+            raise
+        # Deleted in the meantime
+        result['status'] = 'missing'
+        return result
+
+    for algorithm, digest in digests.items():
+        checksum_key = '{}.{}'.format(key, algorithm)
+        existing_digest = fetch_checksum_file(s3_client, bucket_name, checksum_key)
+        if existing_digest is None and algorithm in algorithms_to_write:
+            if write_checksum_file(s3_client, bucket_name, checksum_key, digest):
+                result['writtenChecksums'].append(algorithm)
+                continue
+            # The uploader wrote it meanwhile
+            existing_digest = fetch_checksum_file(s3_client, bucket_name, checksum_key)
+
+        if existing_digest is None:
+            continue
+        elif existing_digest == digest:
+            result['verifiedChecksums'].append(algorithm)
+        else:
+            print('ERROR: "{}" contains {}, but the {} of "{}" is {}'.format(
+                checksum_key, existing_digest, algorithm, key, digest
+            ))
+            result['mismatchingChecksums'].append(algorithm)
+
+    result['status'] = 'mismatch' if result['mismatchingChecksums'] else 'verified'
+    return result
+
+
+def compute_digests(s3_client, bucket_name, key, chunk_size=CHUNK_SIZE):
+    hashes = {algorithm: hashlib.new(algorithm) for algorithm in CHECKSUM_ALGORITHMS}
+    body = s3_client.get_object(Bucket=bucket_name, Key=key)['Body']
+    while True:
+        chunk = body.read(chunk_size)
+        if not chunk:
+            break
+        for hash_ in hashes.values():
+            hash_.update(chunk)
+    return {algorithm: hash_.hexdigest() for algorithm, hash_ in hashes.items()}
+
+
+def fetch_checksum_file(s3_client, bucket_name, checksum_key):
+    try:
+        content = s3_client.get_object(Bucket=bucket_name, Key=checksum_key)['Body'].read()
+    except ClientError as e:
+        if get_error_code(e) in ('404', 'NoSuchKey'):
+            return None
+        raise
+    # Some tools write "<digest>  <file name>", like sha1sum does
+    words = content.decode('utf-8', errors='replace').split()
+    return words[0].lower() if words else ''
+
+
+def write_checksum_file(s3_client, bucket_name, checksum_key, digest):
+    # Returns False if the checksum file appeared since it was fetched. It's never overwritten.
+    try:
+        s3_client.put_object(
+            Bucket=bucket_name, Key=checksum_key, Body=digest, ContentType='text/plain',
+            **get_write_conditions(s3_client, checksum_key, e_tag=None)
+        )
+    except ClientError as e:
+        if is_concurrent_write_error(e):
+            return False
+        raise
+    return True
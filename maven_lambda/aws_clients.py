@@ -0,0 +1,117 @@
+import os
+import threading
+
+
+# Building a boto3 session and its first client is the most expensive part of a cold start. Clients
+# are therefore only built the first time they are used, and then reused for as long as the lambda
+# stays warm. boto3 itself isn't imported until then. Tests and benchmarks can inject stand-ins
+# with set_client() and set_resource().
+MAX_POOL_CONNECTIONS_ENV_VAR = 'AWS_MAX_POOL_CONNECTIONS'
+# Must be at least as large as the thread pools that share a client
+DEFAULT_MAX_POOL_CONNECTIONS = 32
+MAX_ATTEMPTS_ENV_VAR = 'AWS_MAX_ATTEMPTS'
+DEFAULT_MAX_ATTEMPTS = 5
+RETRY_MODE_ENV_VAR = 'AWS_RETRY_MODE'
+DEFAULT_RETRY_MODE = 'standard'
+
+_session = None
+_clients = {}
+_resources = {}
+# boto3 sessions aren't thread-safe, but the clients they create are
+_lock = threading.Lock()
+# Resources aren't thread-safe either. Each thread gets its own copy of the shared resource,
+# which reuses its client: unlike building a resource, that takes microseconds.
+_thread_local = threading.local()
+
+
+def get_client(service_name):
+    return _get_or_build(_clients, service_name, lambda session, config: session.client(
+        service_name, config=config
+    ))
+
+
+def get_resource(service_name):
+    shared_resource = _get_or_build(
+        _resources, service_name, lambda session, config: session.resource(
+            service_name, config=config
+        )
+    )
+    copies_per_service_name = getattr(_thread_local, 'copies_per_service_name', None)
+    if copies_per_service_name is None:
+        copies_per_service_name = _thread_local.copies_per_service_name = {}
+    copied_resource, resource = copies_per_service_name.get(service_name, (None, None))
+    # reset() and set_resource() replace the shared resource
+    if copied_resource is not shared_resource:
+        resource = type(shared_resource)(client=shared_resource.meta.client)
+        copies_per_service_name[service_name] = (shared_resource, resource)
+    return resource
+
+
+def lazy_client(service_name):
+    return _LazyProxy(get_client, service_name)
+
+
+def lazy_resource(service_name):
+    return _LazyProxy(get_resource, service_name)
+
+
+def set_client(service_name, client):
+    with _lock:
+        _clients[service_name] = client
+
+
+def set_resource(service_name, resource):
+    with _lock:
+        _resources[service_name] = resource
+
+
+def reset():
+    global _session
+    with _lock:
+        _session = None
+        _clients.clear()
+        _resources.clear()
+
+
+def build_config():
+    from botocore.config import Config
+
+    return Config(
+        max_pool_connections=int(os.environ.get(
+            MAX_POOL_CONNECTIONS_ENV_VAR, DEFAULT_MAX_POOL_CONNECTIONS
+        )),
+        retries={
+            'max_attempts': int(os.environ.get(MAX_ATTEMPTS_ENV_VAR, DEFAULT_MAX_ATTEMPTS)),
+            'mode': os.environ.get(RETRY_MODE_ENV_VAR, DEFAULT_RETRY_MODE),
+        },
+    )
+
+
+def _get_or_build(cache, service_name, build_function):
+    # Fast path: no lock once the client exists
+    try:
+        return cache[service_name]
+    except KeyError:
+        pass
+
+    global _session
+    with _lock:
+        if service_name not in cache:
+            if _session is None:
+                import boto3
+                _session = boto3.session.Session()
+            cache[service_name] = build_function(_session, build_config())
+        return cache[service_name]
+
+
+class _LazyProxy:
+    # Stands for a client (or a resource) at module level, without building it at import time
+    def __init__(self, get_function, service_name):
+        self._get_function = get_function
+        self._service_name = service_name
+
+    def __getattr__(self, name):
+        return getattr(self._get_function(self._service_name), name)
+
+    def __repr__(self):
+        return '<lazy {} "{}">'.format(self._get_function.__name__, self._service_name)
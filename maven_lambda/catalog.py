@@ -0,0 +1,107 @@
+import gzip
+import json
+
+from botocore.exceptions import ClientError
+from maven_lambda.conditional_writes import (
+    get_error_code,
+    get_write_conditions,
+    is_concurrent_write_error,
+    wait_before_retrying,
+)
+
+
+# The catalog tells what artifacts a repository holds, and what their latest version is, without
+# crawling the whole bucket. It's sharded by groupId: artifacts of different groups never write
+# to the same file. Each shard is a gzipped JSON file, like
+# "catalog/org.mozilla.components.json.gz", that gets updated every time an artifact of the group
+# gets a new maven-metadata.xml.
+CATALOG_FORMAT = 1
+CATALOG_SHARD_SUFFIX = '.json.gz'
+MAX_CATALOG_WRITE_ATTEMPTS = 5
+CATALOG_WRITE_BASE_DELAY = 0.1
+
+
+def get_catalog_shard_key(catalog_prefix, group_id):
+    if not group_id:
+        raise ValueError('Artifacts without a groupId are not cataloged')
+    return '{}/{}{}'.format(catalog_prefix.rstrip('/'), group_id, CATALOG_SHARD_SUFFIX)
+
+
+def build_catalog_entry(latest_version, number_of_versions, last_updated):
+    return {
+        'latest': latest_version,
+        'versionCount': number_of_versions,
+        'lastUpdated': last_updated,
+    }
+
+
+def build_catalog_shard(group_id, entries_per_artifact_id):
+    return {
+        'format': CATALOG_FORMAT,
+        'groupId': group_id,
+        'artifacts': dict(sorted(entries_per_artifact_id.items())),
+    }
+
+
+def update_catalog(bucket, catalog_prefix, group_id, artifact_id, entry):
+    # Artifacts of the same group update the same shard concurrently: each invocation only
+    # replaces the shard it read. The one that lost reads the shard again, and adds its entry.
+    key = get_catalog_shard_key(catalog_prefix, group_id)
+    for attempt in range(MAX_CATALOG_WRITE_ATTEMPTS):
+        shard, e_tag = fetch_catalog_shard_and_e_tag(bucket, key)
+        entries_per_artifact_id = {} if shard is None else shard['artifacts']
+        entries_per_artifact_id[artifact_id] = entry
+        try:
+            return upload_catalog_shard(
+                bucket, key, build_catalog_shard(group_id, entries_per_artifact_id),
+                **get_write_conditions(bucket.meta.client, key, e_tag)
+            )
+        except ClientError as e:
+            if not is_concurrent_write_error(e) or attempt + 1 == MAX_CATALOG_WRITE_ATTEMPTS:
+                raise
+            delay = wait_before_retrying(attempt, CATALOG_WRITE_BASE_DELAY)
+            print('Catalog shard "{}" was updated meanwhile. Read it again after {:.2f}s'.format(
+                key, delay
+            ))
+
+
+def fetch_catalog_shard(bucket, key):
+    return fetch_catalog_shard_and_e_tag(bucket, key)[0]
+
+
+def fetch_catalog_shard_and_e_tag(bucket, key):
+    # The ETag is None if there's no shard, the shard is None if it can't be used
+    try:
+        response = bucket.Object(key).get()
+    except ClientError as e:
+        if get_error_code(e) in ('NoSuchKey', '404'):
+            return None, None
+        raise
+    e_tag = response.get('ETag')
+
+    try:
+        shard = json.loads(gzip.decompress(response['Body'].read()))
+    except (OSError, EOFError, ValueError):
+        # The shard is rebuilt from the artifacts that get updated next, or by a full rebuild
+        print('WARN: "{}" is not valid gzipped JSON. Ignoring it.'.format(key))
+        return None, e_tag
+
+    if not isinstance(shard, dict) or shard.get('format') != CATALOG_FORMAT:
+        print('WARN: "{}" has an unknown format. Ignoring it.'.format(key))
+        return None, e_tag
+
+    return shard, e_tag
+
+
+def upload_catalog_shard(bucket, key, shard, **write_conditions):
+    # mtime=0 keeps the output identical for identical shards. Full rebuilds own every shard:
+    # they write them without conditions.
+    data = gzip.compress(json.dumps(shard, separators=(',', ':')).encode(), mtime=0)
+    bucket.Object(key).put(
+        Body=data,
+        ContentType='application/json',
+        ContentEncoding='gzip',
+        CacheControl='no-cache',
+        **write_conditions
+    )
+    return key
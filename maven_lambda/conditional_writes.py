@@ -0,0 +1,43 @@
+import random
+import time
+
+
+# Files that are read, changed, then written back (maven-metadata.xml, version indexes, catalog
+# shards) are only replaced if they're still the ones that were read: If-Match their ETag, or
+# If-None-Match: * if they didn't exist. S3 answers 412 if the file changed (or appeared) since,
+# and 409 if another conditional write of the same key is ongoing. The writer then reads the file
+# again, and merges its change into it.
+CONCURRENT_WRITE_ERROR_CODES = ('PreconditionFailed', '412', 'ConditionalRequestConflict', '409')
+
+
+def supports_conditional_writes(s3_client):
+    # botocore only sends If-Match and If-None-Match on PutObject since late 2024
+    service_model = getattr(getattr(s3_client, 'meta', None), 'service_model', None)
+    if service_model is None:
+        # Stand-ins
+        return True
+    return 'IfMatch' in service_model.operation_model('PutObject').input_shape.members
+
+
+def get_write_conditions(s3_client, key, e_tag):
+    # Keyword arguments of put_object() and Object.put(). e_tag is None if key didn't exist.
+    if not supports_conditional_writes(s3_client):
+        print('WARN: This botocore can\'t send If-Match. "{}" is written unconditionally: '
+              'concurrent invocations may overwrite each other.'.format(key))
+        return {}
+    return {'IfNoneMatch': '*'} if e_tag is None else {'IfMatch': e_tag}
+
+
+def is_concurrent_write_error(error):
+    return get_error_code(error) in CONCURRENT_WRITE_ERROR_CODES
+
+
+def get_error_code(error):
+    return error.response.get('Error', {}).get('Code')
+
+
+def wait_before_retrying(attempt, base_delay):
+    # Jittered, so that the writers that lost don't collide again
+    delay = random.uniform(0, base_delay * 2 ** attempt)
+    time.sleep(delay)
+    return delay
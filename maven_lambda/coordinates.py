@@ -0,0 +1,239 @@
+import json
+import os
+
+from mozilla_version.maven import MavenVersion
+from mozilla_version.mobile import MobileVersion
+
+
+# Keys look like "maven2/org/mozilla/geckoview/geckoview/65.0/geckoview-65.0.pom": an optional
+# repository root, one folder per part of the groupId, then the artifactId, the version, and the
+# file name. Each key is split once into a MavenCoordinate, which every other helper reads.
+#
+# What the roots are, and how versions of each group are ordered, is described by a
+# RepositoryLayout. The default one matches maven.mozilla.org. Another one can be given as JSON,
+# in REPOSITORY_LAYOUT, like:
+#   {"roots": ["maven2"], "versionSchemes": {"org.mozilla.components": "mobile"},
+#    "defaultVersionScheme": "maven"}
+REPOSITORY_LAYOUT_ENV_VAR = 'REPOSITORY_LAYOUT'
+
+VERSION_SCHEME_MAVEN = 'maven'
+VERSION_SCHEME_MOBILE = 'mobile'
+SNAPSHOT_VERSION_SUFFIX = '-SNAPSHOT'
+
+
+class MobileSnapshotVersion(MobileVersion):
+    # MobileVersion doesn't know "0.30.0-SNAPSHOT", which android-components publish nonetheless.
+    # Like MavenVersion does, a snapshot precedes its release, and follows what precedes the
+    # release. Python lets a subclass reflect the comparisons of its parent first: releases compare
+    # to snapshots through the operators below.
+    __hash__ = MobileVersion.__hash__
+
+    @classmethod
+    def parse(cls, version_string):
+        if not version_string.endswith(SNAPSHOT_VERSION_SUFFIX):
+            return MobileVersion.parse(version_string)
+        return super().parse(version_string[:-len(SNAPSHOT_VERSION_SUFFIX)])
+
+    def __str__(self):
+        return '{}{}'.format(super().__str__(), SNAPSHOT_VERSION_SUFFIX)
+
+    def __eq__(self, other):
+        return self._compare(other) == 0
+
+    def __ne__(self, other):
+        return self._compare(other) != 0
+
+    def __lt__(self, other):
+        return self._compare(other) < 0
+
+    def __le__(self, other):
+        return self._compare(other) <= 0
+
+    def __gt__(self, other):
+        return self._compare(other) > 0
+
+    def __ge__(self, other):
+        return self._compare(other) >= 0
+
+    def _compare(self, other):
+        if isinstance(other, str):
+            other = MobileSnapshotVersion.parse(other)
+        difference = super()._compare(other)
+        if difference != 0:
+            return difference
+        return 0 if isinstance(other, MobileSnapshotVersion) else -1
+
+
+VERSION_CLASS_PER_SCHEME = {
+    VERSION_SCHEME_MAVEN: MavenVersion,
+    VERSION_SCHEME_MOBILE: MobileSnapshotVersion,
+}
+
+# Artifacts are usually uploaded under maven2/, which is not part of the groupId
+DEFAULT_ROOTS = ('maven', 'maven2')
+# android-components follow the version numbers of Firefox (like "109.0b1")
+DEFAULT_VERSION_SCHEME_PER_GROUP_ID = {
+    'org.mozilla.components': VERSION_SCHEME_MOBILE,
+}
+DEFAULT_VERSION_SCHEME = VERSION_SCHEME_MAVEN
+
+# Repositories hold a few hundred groups, at most. Resolving one is cached, whatever the number
+# of keys it holds.
+GROUP_CACHE_SIZE = 4096
+
+
+class MavenCoordinate:
+    # Rebuilds hold millions of these: no __dict__. Every coordinate of an artifact shares the
+    # same artifact folder, groupId... strings (see RepositoryLayout.parse_many()).
+    __slots__ = (
+        'key', 'artifact_folder', 'root', 'group_id', 'artifact_id', 'version', 'file_name',
+        'version_scheme',
+    )
+
+    def __init__(
+        self, key, artifact_folder, root, group_id, artifact_id, version, file_name,
+        version_scheme
+    ):
+        self.key = key
+        self.artifact_folder = artifact_folder
+        self.root = root
+        self.group_id = group_id
+        self.artifact_id = artifact_id
+        self.version = version
+        self.file_name = file_name
+        self.version_scheme = version_scheme
+
+    @property
+    def version_folder(self):
+        return self.key[:len(self.key) - len(self.file_name)]
+
+    def __eq__(self, other):
+        if not isinstance(other, MavenCoordinate):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join(
+            '{}={!r}'.format(name, getattr(self, name)) for name in self.__slots__
+        ))
+
+
+class RepositoryLayout:
+    def __init__(
+        self, roots=DEFAULT_ROOTS, version_scheme_per_group_id=None,
+        default_version_scheme=DEFAULT_VERSION_SCHEME
+    ):
+        if version_scheme_per_group_id is None:
+            version_scheme_per_group_id = DEFAULT_VERSION_SCHEME_PER_GROUP_ID
+        for version_scheme in (default_version_scheme, *version_scheme_per_group_id.values()):
+            if version_scheme not in VERSION_CLASS_PER_SCHEME:
+                raise ValueError('Unknown version scheme "{}". Known ones: {}'.format(
+                    version_scheme, sorted(VERSION_CLASS_PER_SCHEME)
+                ))
+        self.roots = frozenset(roots)
+        self.version_scheme_per_group_id = dict(version_scheme_per_group_id)
+        self.default_version_scheme = default_version_scheme
+        self._group_per_path = {}
+
+    @classmethod
+    def from_json(cls, value):
+        try:
+            config = json.loads(value)
+            return cls(
+                roots=config.get('roots', DEFAULT_ROOTS),
+                version_scheme_per_group_id=config.get('versionSchemes', None),
+                default_version_scheme=config.get('defaultVersionScheme', DEFAULT_VERSION_SCHEME),
+            )
+        except (AttributeError, TypeError, ValueError) as error:
+            raise ValueError(
+                'Invalid {}: {!r}'.format(REPOSITORY_LAYOUT_ENV_VAR, value)
+            ) from error
+
+    def get_version_scheme(self, group_id):
+        # The most specific groupId wins: "org.mozilla.components" also covers
+        # "org.mozilla.components.support", but not "org.mozilla.componentsx"
+        parts = group_id.split('.')
+        for number_of_parts in range(len(parts), 0, -1):
+            version_scheme = self.version_scheme_per_group_id.get(
+                '.'.join(parts[:number_of_parts])
+            )
+            if version_scheme is not None:
+                return version_scheme
+        return self.default_version_scheme
+
+    def get_version_scheme_of_key(self, key):
+        # Only the groupId matters, which is resolved once per group
+        return self._resolve_group(_split_key(key)[0])[2]
+
+    def parse(self, key):
+        group_path, artifact_id, version, file_name = _split_key(key)
+        root, group_id, version_scheme = self._resolve_group(group_path)
+        return MavenCoordinate(
+            key, key[:len(key) - len(file_name) - len(version) - 1], root, group_id, artifact_id,
+            version, file_name, version_scheme
+        )
+
+    def parse_many(self, keys):
+        # Listings come sorted: consecutive keys usually share their artifact folder. Only what
+        # follows it gets split, and coordinates of the same artifact share the same strings.
+        previous = None
+        artifact_folder = None
+        for key in keys:
+            if artifact_folder is not None and key.startswith(artifact_folder):
+                start = len(artifact_folder)
+                separator_index = key.find('/', start)
+                if separator_index != -1 and key.find('/', separator_index + 1) == -1:
+                    yield MavenCoordinate(
+                        key, artifact_folder, previous.root, previous.group_id,
+                        previous.artifact_id, key[start:separator_index],
+                        key[separator_index + 1:], previous.version_scheme
+                    )
+                    continue
+            previous = self.parse(key)
+            artifact_folder = previous.artifact_folder
+            yield previous
+
+    def _resolve_group(self, group_path):
+        group = self._group_per_path.get(group_path)
+        if group is None:
+            folder_names = group_path.split('/') if group_path else []
+            if folder_names and folder_names[0] in self.roots:
+                root, folder_names = folder_names[0], folder_names[1:]
+            else:
+                root = ''
+            group_id = '.'.join(folder_names)
+            group = (root, group_id, self.get_version_scheme(group_id))
+            if len(self._group_per_path) >= GROUP_CACHE_SIZE:
+                self._group_per_path.clear()
+            self._group_per_path[group_path] = group
+        return group
+
+
+def _split_key(key):
+    # Keys too short to hold every part of a coordinate get empty leading parts
+    parts = key.rsplit('/', 3)
+    return parts if len(parts) == 4 else [''] * (4 - len(parts)) + parts
+
+
+_layout_per_environment_value = {}
+
+
+def get_repository_layout():
+    # Parsed once per value of the environment variable
+    value = os.environ.get(REPOSITORY_LAYOUT_ENV_VAR, None) or ''
+    layout = _layout_per_environment_value.get(value)
+    if layout is None:
+        layout = RepositoryLayout.from_json(value) if value else RepositoryLayout()
+        _layout_per_environment_value[value] = layout
+    return layout
+
+
+def parse_coordinate(key):
+    return get_repository_layout().parse(key)
+
+
+def parse_coordinates(keys):
+    return get_repository_layout().parse_many(keys)
@@ -1,5 +1,23 @@
-import boto3
 import os
+import time
+import urllib.parse
+
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from maven_lambda.aws_clients import lazy_client
+from maven_lambda.multipart_copy import copy_s3_object
+
+
+s3 = lazy_client("s3")
+
+MAX_COPY_WORKERS = 16
+
+# Enough for 2 versions of a key, plus a delete marker or the first version of a sibling (like
+# foo.pom.sha1 for foo.pom), which tells the listing went past the key
+VERSION_PROBE_PAGE_SIZE = 4
+# S3 takes up to 15 minutes to propagate a change of versioning
+VERSIONING_STATUS_MAX_AGE = 5 * 60
+_versioning_status_per_bucket = {}
 
 
 class NotFound(Exception):
@@ -8,31 +26,105 @@ class NotFound(Exception):
 
 def lambda_handler(event, context):
     TARGET_BUCKET = os.environ["TARGET_BUCKET"]
-    s3 = boto3.client("s3")
-    s3_event = event["Records"][0]["s3"]
+    # A release push delivers many files per event. Each one is processed, once. Keys come
+    # URL-encoded, like "some+artifact%2Bplus-1.0.pom".
+    size_per_bucket_and_key = {
+        (
+            record["s3"]["bucket"]["name"],
+            urllib.parse.unquote_plus(record["s3"]["object"]["key"], encoding="utf-8"),
+        ): record["s3"]["object"].get("size")
+        for record in event["Records"]
+    }
+    if size_per_bucket_and_key:
+        max_workers = min(MAX_COPY_WORKERS, len(size_per_bucket_and_key))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results_and_errors = list(executor.map(
+                lambda item: _try_to_copy_object(TARGET_BUCKET, *item[0], size=item[1]),
+                size_per_bucket_and_key.items()
+            ))
+    else:
+        results_and_errors = []
+
+    errors = [error for _, error in results_and_errors if error is not None]
+    if errors:
+        # Let AWS retry the event. Copies are idempotent and conflicts are checked again.
+        raise errors[0]
+
+    return {"results": [result for result, _ in results_and_errors]}
+
+
+def _try_to_copy_object(target_bucket, bucket, key, size=None):
+    result = {"bucket": bucket, "key": key}
     try:
-        if s3_object_has_more_than_one_version(
-            s3, s3_event["bucket"]["name"], s3_event["object"]["key"]
-        ):
-            return {"statusCode": 409}
+        result["statusCode"] = copy_object(target_bucket, bucket, key, size)
+    except Exception as e:
+        print('Could not copy "{}" from bucket "{}": {}'.format(key, bucket, e))
+        result["statusCode"] = 500
+        return result, e
+    return result, None
+
+
+def copy_object(target_bucket, bucket, key, size=None):
+    try:
+        if s3_object_has_more_than_one_version(s3, bucket, key):
+            return 409
     except NotFound:
-        return {"statusCode": 404}
-    s3.copy_object(
-        Bucket=TARGET_BUCKET,
-        CopySource={
-            "Bucket": s3_event["bucket"]["name"],
-            "Key": s3_event["object"]["key"],
-        },
-        Key=s3_event["object"]["key"],
-    )
-    return {"statusCode": 200}
+        return 404
+    # S3 events tell the size of the object. Large objects are copied in parts.
+    copy_s3_object(s3, bucket, key, target_bucket, size=size)
+    return 200
 
 
 def s3_object_has_more_than_one_version(s3, bucket, key):
-    versions = s3.list_object_versions(Bucket=bucket, Prefix=key)
-    try:
-        versions = versions["Versions"]
-    except KeyError:
+    if not is_bucket_versioned(s3, bucket):
+        # A bucket that has never been versioned only holds one version of each object
+        try:
+            s3.head_object(Bucket=bucket, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                raise NotFound()
+            raise
+        return False
+
+    # Versions are listed by key, so the versions of the exact key come before the ones of the
+    # other keys sharing its prefix
+    arguments = {"Bucket": bucket, "Prefix": key, "MaxKeys": VERSION_PROBE_PAGE_SIZE}
+    number_of_versions = 0
+    while True:
+        response = s3.list_object_versions(**arguments)
+        number_of_versions += len([v for v in response.get("Versions", []) if v["Key"] == key])
+        if number_of_versions > 1:
+            return True
+
+        listed_keys = [
+            entry["Key"]
+            for entry in response.get("Versions", []) + response.get("DeleteMarkers", [])
+        ]
+        if not response.get("IsTruncated") or any(k != key for k in listed_keys):
+            break
+        arguments["KeyMarker"] = response["NextKeyMarker"]
+        arguments["VersionIdMarker"] = response["NextVersionIdMarker"]
+
+    if number_of_versions == 0:
         raise NotFound()
-    versions = [v for v in versions if v["Key"] == key]
-    return len(versions) > 1
+    return False
+
+
+def is_bucket_versioned(s3, bucket, now=None):
+    now = time.time() if now is None else now
+    is_versioned, checked_at = _versioning_status_per_bucket.get(bucket, (None, None))
+    if is_versioned is not None and now - checked_at < VERSIONING_STATUS_MAX_AGE:
+        return is_versioned
+
+    try:
+        status = s3.get_bucket_versioning(Bucket=bucket).get("Status")
+    except ClientError as e:
+        # Listing versions is always correct, just slower
+        print("WARN: Could not get versioning status of bucket {}: {}".format(bucket, e))
+        is_versioned = True
+    else:
+        # Suspended buckets still hold the versions created before suspension
+        is_versioned = status in ("Enabled", "Suspended")
+
+    _versioning_status_per_bucket[bucket] = (is_versioned, now)
+    return is_versioned
@@ -0,0 +1,174 @@
+import random
+import slugid
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+
+# See https://docs.aws.amazon.com/AmazonCloudFront/latest/DeveloperGuide/cloudfront-limits.html
+# These limits apply to every invalidation in progress at once, not to each request. Sending
+# several requests back to back only gets the later ones refused: a flush sends a single one.
+MAX_PATHS_IN_PROGRESS = 3000
+MAX_WILDCARD_PATHS_IN_PROGRESS = 15
+
+DEFAULT_MAX_EXPLICIT_PATHS = 100
+DEFAULT_MAX_ATTEMPTS = 4
+DEFAULT_BASE_DELAY = 1
+
+RETRYABLE_ERROR_CODES = (
+    'ServiceUnavailable',
+    'Throttling',
+    'TooManyInvalidationsInProgress',
+)
+
+
+class InvalidationBatcher:
+    # Paths are accumulated until the next flush(). Those which couldn't be invalidated (even after
+    # retrying) are kept and sent again at the next flush, which may happen during the next
+    # invocation of a warm lambda.
+    def __init__(
+        self, max_explicit_paths=DEFAULT_MAX_EXPLICIT_PATHS, max_attempts=DEFAULT_MAX_ATTEMPTS,
+        base_delay=DEFAULT_BASE_DELAY, sleep=time.sleep
+    ):
+        self.max_explicit_paths = max_explicit_paths
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self._sleep = sleep
+        self._pending_paths = {}
+        self._lock = threading.Lock()
+
+    @property
+    def pending_paths(self):
+        with self._lock:
+            return list(self._pending_paths)
+
+    def add(self, paths):
+        with self._lock:
+            for path in sanitize_invalidation_paths(paths):
+                self._pending_paths[path] = None
+
+    def flush(self, cloudfront_client, distribution_id):
+        # Returns the invalidated batches: at most one
+        with self._lock:
+            paths = coalesce_invalidation_paths(self._pending_paths, self.max_explicit_paths)
+            self._pending_paths = {}
+
+        if not paths:
+            return []
+        if self._invalidate_batch(cloudfront_client, distribution_id, paths):
+            return [paths]
+        self.add(paths)
+        return []
+
+    def _invalidate_batch(self, cloudfront_client, distribution_id, paths):
+        print('Invalidating {} CloudFront paths: {}'.format(len(paths), paths))
+        # The same caller reference is reused across retries, so that CloudFront doesn't create
+        # 2 invalidations if a request actually succeeded but its response got lost
+        caller_reference = slugid.nice()
+        for attempt in range(self.max_attempts):
+            try:
+                cloudfront_client.create_invalidation(
+                    DistributionId=distribution_id,
+                    InvalidationBatch={
+                        'Paths': {
+                            'Quantity': len(paths),
+                            'Items': paths,
+                        },
+                        'CallerReference': caller_reference,
+                    }
+                )
+                return True
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') not in RETRYABLE_ERROR_CODES:
+                    print('WARN: Could not invalidate cache. Reason: {}'.format(e))
+                    # Retrying wouldn't help. We don't want to keep these paths around either.
+                    return True
+
+                if attempt + 1 < self.max_attempts:
+                    delay = random.uniform(0, self.base_delay * 2 ** attempt)
+                    print('WARN: Could not invalidate cache. Retrying in {:.1f}s. '
+                          'Reason: {}'.format(delay, e))
+                    self._sleep(delay)
+                else:
+                    print('WARN: Could not invalidate cache after {} attempts. Keeping paths for '
+                          'the next flush. Reason: {}'.format(self.max_attempts, e))
+        return False
+
+
+def sanitize_invalidation_paths(paths):
+    return [path if path.startswith('/') else '/{}'.format(path) for path in paths]
+
+
+def coalesce_invalidation_paths(paths, max_explicit_paths=DEFAULT_MAX_EXPLICIT_PATHS):
+    # Duplicates are removed, but order is kept
+    paths = list(dict.fromkeys(sanitize_invalidation_paths(paths)))
+    max_paths = min(max_explicit_paths, MAX_PATHS_IN_PROGRESS)
+    if len(paths) <= max_paths and _count_wildcards(paths) <= MAX_WILDCARD_PATHS_IN_PROGRESS:
+        return paths
+
+    # CloudFront only accepts wildcards at the end of a path. First, maven-metadata.xml and its
+    # checksums become "maven-metadata.xml*". Then, the deepest directories which are shared by
+    # several paths are wildcarded, until there are few enough paths, and few enough wildcards.
+    paths = _collapse_file_families(paths)
+    while len(paths) > max_paths or _count_wildcards(paths) > MAX_WILDCARD_PATHS_IN_PROGRESS:
+        directory = _find_deepest_shared_directory(paths)
+        if directory is None:
+            break
+        paths = _replace_paths_under_directory(paths, directory)
+    return paths
+
+
+def _count_wildcards(paths):
+    return sum(path.endswith('*') for path in paths)
+
+
+def _collapse_file_families(paths):
+    # A family is made of files that live in the same directory and start with the same name,
+    # like maven-metadata.xml, maven-metadata.xml.md5 and maven-metadata.xml.sha1
+    root_per_path = {}
+    family_size_per_root = {}
+    current_root = None
+    for path in sorted(paths):
+        if (
+            current_root is not None and path.startswith(current_root) and
+            '/' not in path[len(current_root):]
+        ):
+            family_size_per_root[current_root] += 1
+        else:
+            current_root = path
+            family_size_per_root[current_root] = 1
+        root_per_path[path] = current_root
+
+    return list(dict.fromkeys(
+        '{}*'.format(root_per_path[path]) if family_size_per_root[root_per_path[path]] > 1
+        else path
+        for path in paths
+    ))
+
+
+def _find_deepest_shared_directory(paths):
+    number_of_paths_per_directory = {}
+    for path in paths:
+        parts = path.split('/')[:-1]
+        for depth in range(1, len(parts) + 1):
+            directory = '/'.join(parts[:depth]) + '/'
+            number_of_paths_per_directory[directory] = \
+                number_of_paths_per_directory.get(directory, 0) + 1
+
+    shared_directories = [
+        (directory.count('/'), count, directory)
+        for directory, count in number_of_paths_per_directory.items()
+        if count > 1
+    ]
+    if not shared_directories:
+        return None
+    return max(shared_directories)[2]
+
+
+def _replace_paths_under_directory(paths, directory):
+    wildcard = '{}*'.format(directory)
+    result = {}
+    for path in paths:
+        result[wildcard if path.startswith(directory) else path] = None
+    return list(result)
@@ -0,0 +1,136 @@
+import contextlib
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import urllib.parse
+
+from datetime import datetime, timezone
+
+
+# S3 Inventory writes, once a day (or a week), the list of every object of a bucket: a
+# manifest.json that points at a few gzipped CSV files. Reading them replaces a full-bucket
+# listing, which costs a request per 1000 keys. See
+# https://docs.aws.amazon.com/AmazonS3/latest/userguide/storage-inventory-location.html
+#
+# Data files are streamed one at a time, row by row: memory doesn't depend on the size of the
+# inventory. Each of them is checked against the MD5 the manifest gives.
+#
+# An inventory is a snapshot: it misses what changed since it was created (and S3 doesn't
+# guarantee it holds what changed shortly before). Callers reconcile these changes with a live
+# listing, see maven_lambda/rebuild.py.
+INVENTORY_FILE_FORMAT_CSV = 'CSV'
+INVENTORY_FIELD_KEY = 'Key'
+INVENTORY_FIELD_SIZE = 'Size'
+INVENTORY_FIELD_E_TAG = 'ETag'
+INVENTORY_FIELD_IS_LATEST = 'IsLatest'
+INVENTORY_FIELD_IS_DELETE_MARKER = 'IsDeleteMarker'
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+class InventoryError(Exception):
+    pass
+
+
+class Inventory:
+    def __init__(self, manifest, open_file):
+        # open_file(key) returns a binary file object, whatever the inventory is stored in
+        file_format = manifest.get('fileFormat')
+        if file_format != INVENTORY_FILE_FORMAT_CSV:
+            # ORC and Parquet would need pyarrow, which is too heavy for this package
+            raise InventoryError(
+                'Unsupported inventory format "{}". Configure the inventory as {}.'.format(
+                    file_format, INVENTORY_FILE_FORMAT_CSV
+                )
+            )
+        try:
+            self.source_bucket = manifest['sourceBucket']
+            self.created_at = datetime.fromtimestamp(
+                int(manifest['creationTimestamp']) / 1000, tz=timezone.utc
+            )
+            self.fields = [field.strip() for field in manifest['fileSchema'].split(',')]
+            self.files = manifest['files']
+        except (KeyError, TypeError, ValueError) as e:
+            raise InventoryError('Invalid inventory manifest: {}'.format(e)) from e
+        if INVENTORY_FIELD_KEY not in self.fields:
+            raise InventoryError('The inventory doesn\'t hold keys: {}'.format(self.fields))
+        self._open_file = open_file
+
+    @classmethod
+    def from_location(cls, location, manifest_key, s3_client=None):
+        # location is either "s3://destination-bucket", or a local copy of it
+        if location.startswith('s3://'):
+            bucket_name = location[len('s3://'):].rstrip('/')
+
+            def open_file(key):
+                return contextlib.closing(
+                    s3_client.get_object(Bucket=bucket_name, Key=key)['Body']
+                )
+        else:
+            def open_file(key):
+                return open(os.path.join(location, key), 'rb')
+
+        with open_file(manifest_key) as manifest_file:
+            return cls(json.loads(manifest_file.read()), open_file)
+
+    def iterate_objects(self, prefix=''):
+        # Yields 'Contents'-like entries ('Key', 'Size', 'ETag'), like a listing does. Data files
+        # are read in the order of the manifest: keys are only sorted within each of them.
+        for file_ in self.files:
+            yield from self._iterate_file_objects(file_, prefix)
+
+    def _iterate_file_objects(self, file_, prefix):
+        indexes = {field: index for index, field in enumerate(self.fields)}
+        key_index = indexes[INVENTORY_FIELD_KEY]
+        with self._open_file(file_['key']) as raw_file:
+            checked_file = _MD5CheckingReader(raw_file)
+            with io.TextIOWrapper(gzip.GzipFile(fileobj=checked_file), encoding='utf-8',
+                                  newline='') as text_file:
+                for row in csv.reader(text_file):
+                    # Keys are URL-encoded
+                    key = urllib.parse.unquote_plus(row[key_index], encoding='utf-8')
+                    if key.startswith(prefix) and _is_current_object(row, indexes):
+                        yield _to_content(key, row, indexes)
+            checked_file.check(file_)
+
+
+class _MD5CheckingReader:
+    # What gzip reads goes through MD5 on its way
+    def __init__(self, raw_file):
+        self._raw_file = raw_file
+        self._md5 = hashlib.md5()
+
+    def read(self, size=-1):
+        data = self._raw_file.read(READ_CHUNK_SIZE if size is None or size < 0 else size)
+        self._md5.update(data)
+        return data
+
+    def check(self, file_):
+        # gzip may stop before the end of the file
+        while self.read():
+            pass
+        if file_.get('MD5checksum') not in (None, self._md5.hexdigest()):
+            raise InventoryError('Corrupted inventory file "{}": MD5 mismatch'.format(
+                file_['key']
+            ))
+
+
+def _is_current_object(row, indexes):
+    # Inventories of versioned buckets list every version, delete markers included
+    if INVENTORY_FIELD_IS_LATEST in indexes and row[indexes[INVENTORY_FIELD_IS_LATEST]] != 'true':
+        return False
+    return not (
+        INVENTORY_FIELD_IS_DELETE_MARKER in indexes and
+        row[indexes[INVENTORY_FIELD_IS_DELETE_MARKER]] == 'true'
+    )
+
+
+def _to_content(key, row, indexes):
+    content = {'Key': key}
+    if INVENTORY_FIELD_SIZE in indexes:
+        content['Size'] = int(row[indexes[INVENTORY_FIELD_SIZE]] or 0)
+    if INVENTORY_FIELD_E_TAG in indexes:
+        content['ETag'] = '"{}"'.format(row[indexes[INVENTORY_FIELD_E_TAG]])
+    return content
@@ -0,0 +1,245 @@
+import math
+import queue
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+# A single paginated listing is a chain of requests: each one needs the continuation token of the
+# previous one. To list faster, the prefix is split into shards (the sub-prefixes found a few
+# levels below it, with a delimiter) that are listed concurrently. Shards are still yielded in
+# order, so the merged stream is sorted like a regular listing. Memory stays bounded: only a few
+# shards are listed ahead, and each of them only buffers a few pages.
+#
+# Listing every sub-prefix on its own costs at least a request per sub-prefix, which is wasteful
+# for the thousands of small version folders of an artifact. Such a prefix is rather split into a
+# few ranges of consecutive sub-prefixes, each of them listed with StartAfter. S3 can't stop at the
+# end of a range: its last page is sized from the number of objects per sub-prefix seen so far, so
+# that it doesn't read much past it. There are fewer ranges if they would hold less than a page.
+DEFAULT_SHARD_DEPTH = 3
+DEFAULT_MAX_SHARDS_IN_FLIGHT = 16
+DEFAULT_PAGES_PER_SHARD = 4
+DEFAULT_NUMBER_OF_RANGES = 8
+# What S3 returns at most per page
+MAX_KEYS_PER_PAGE = 1000
+# Until a range lists its first page. A version folder holds a .pom, a .jar or an .aar, sources,
+# and their checksums.
+ESTIMATED_OBJECTS_PER_SUB_PREFIX = 10
+# How often blocked producers check whether the consumer went away
+_PRODUCER_POLL_INTERVAL = 0.1
+
+
+def discover_shards(s3_client, bucket_name, prefix='', shard_depth=DEFAULT_SHARD_DEPTH,
+                    executor=None):
+    # Returns a sorted list of ('prefix', sub_prefix) and ('object', content). Objects that sit
+    # directly at a discovered level are kept, at their place in the listing order.
+    shards = [('prefix', prefix)]
+    for _ in range(shard_depth):
+        prefixes = [value for type_, value in shards if type_ == 'prefix']
+        if not prefixes:
+            break
+
+        map_function = map if executor is None else executor.map
+        levels = list(map_function(
+            lambda prefix: _list_one_level(s3_client, bucket_name, prefix), prefixes
+        ))
+
+        shards = [shard for shard in shards if shard[0] == 'object']
+        for contents, common_prefixes in levels:
+            shards.extend(('object', content) for content in contents)
+            shards.extend(('prefix', common_prefix) for common_prefix in common_prefixes)
+        shards.sort(key=_get_shard_sort_key)
+    return shards
+
+
+def discover_range_shards(
+    s3_client, bucket_name, prefix, number_of_ranges=DEFAULT_NUMBER_OF_RANGES,
+    page_size=MAX_KEYS_PER_PAGE
+):
+    # Returns up to number_of_ranges ('range', (prefix, start_after, last_key, sub_prefix_count))
+    # shards that cover every key under prefix, once. A range holds the keys k such that
+    # start_after < k <= last_key, which belong to sub_prefix_count sub-prefixes. Boundaries are
+    # sub-prefixes, evenly picked among the ones found with a delimiter.
+    _, sub_prefixes = _list_one_level(s3_client, bucket_name, prefix)
+    estimated_number_of_pages = math.ceil(
+        len(sub_prefixes) * ESTIMATED_OBJECTS_PER_SUB_PREFIX / page_size
+    )
+    number_of_ranges = max(1, min(number_of_ranges, len(sub_prefixes), estimated_number_of_pages))
+    boundary_indexes = [
+        len(sub_prefixes) * index // number_of_ranges for index in range(1, number_of_ranges)
+    ]
+    boundaries = [sub_prefixes[index] for index in boundary_indexes]
+    return [
+        ('range', (prefix, start_after, last_key, end_index - start_index))
+        for start_after, last_key, start_index, end_index in zip(
+            [None] + boundaries, boundaries + [None],
+            [0] + boundary_indexes, boundary_indexes + [len(sub_prefixes)]
+        )
+    ]
+
+
+def iterate_objects(
+    s3_client, bucket_name, prefix='', shard_depth=DEFAULT_SHARD_DEPTH,
+    max_shards_in_flight=DEFAULT_MAX_SHARDS_IN_FLIGHT, pages_per_shard=DEFAULT_PAGES_PER_SHARD,
+    shards=None, executor=None
+):
+    # Yields the 'Contents' entries of every object under prefix, sorted by key. Shards are
+    # discovered, unless given. Listing happens in executor, if any.
+    if executor is None:
+        with ThreadPoolExecutor(max_workers=max_shards_in_flight) as executor:
+            yield from iterate_objects(
+                s3_client, bucket_name, prefix, shard_depth, max_shards_in_flight,
+                pages_per_shard, shards, executor
+            )
+        return
+
+    if shards is None:
+        shards = discover_shards(s3_client, bucket_name, prefix, shard_depth, executor)
+    stop_listing = threading.Event()
+    page_queues = []
+    next_shard_index = 0
+    try:
+        for shard_index, (type_, value) in enumerate(shards):
+            # Keep up to max_shards_in_flight shards listing ahead of the consumer
+            while (
+                next_shard_index < len(shards) and
+                next_shard_index < shard_index + max_shards_in_flight
+            ):
+                page_queues.append(_start_shard(
+                    executor, s3_client, bucket_name, shards[next_shard_index],
+                    pages_per_shard, stop_listing
+                ))
+                next_shard_index += 1
+
+            page_queue = page_queues[shard_index]
+            page_queues[shard_index] = None
+            if page_queue is None:
+                yield value
+                continue
+
+            while True:
+                page = page_queue.get()
+                if page is None:
+                    break
+                if isinstance(page, Exception):
+                    raise page
+                yield from page
+    finally:
+        # Lets producers return, even if the consumer stopped early
+        stop_listing.set()
+
+
+def iterate_objects_in_ranges(
+    s3_client, bucket_name, prefix, number_of_ranges=DEFAULT_NUMBER_OF_RANGES,
+    pages_per_shard=None, page_size=MAX_KEYS_PER_PAGE
+):
+    # Suits a prefix made of many small sub-prefixes, like the version folders of an artifact.
+    # Ranges only split a single prefix, so their pages aren't bounded by default: otherwise,
+    # later ranges would stop listing until the consumer reaches them.
+    shards = discover_range_shards(s3_client, bucket_name, prefix, number_of_ranges, page_size)
+    yield from iterate_objects(
+        s3_client, bucket_name, prefix, max_shards_in_flight=len(shards),
+        pages_per_shard=pages_per_shard, shards=shards
+    )
+
+
+def _start_shard(executor, s3_client, bucket_name, shard, pages_per_shard, stop_listing):
+    type_, value = shard
+    if type_ == 'object':
+        return None
+    prefix, start_after, last_key, sub_prefix_count = \
+        value if type_ == 'range' else (value, None, None, None)
+    # None means unbounded
+    page_queue = queue.Queue(maxsize=pages_per_shard or 0)
+    executor.submit(
+        _list_shard_into_queue, s3_client, bucket_name, prefix, page_queue, stop_listing,
+        start_after, last_key, sub_prefix_count
+    )
+    return page_queue
+
+
+def _list_shard_into_queue(
+    s3_client, bucket_name, prefix, page_queue, stop_listing, start_after=None, last_key=None,
+    sub_prefix_count=None
+):
+    arguments = {'Bucket': bucket_name, 'Prefix': prefix}
+    if start_after is not None:
+        arguments['StartAfter'] = start_after
+    listed_sub_prefixes = set()
+    number_of_listed_objects = 0
+    try:
+        while True:
+            if last_key is not None:
+                # The last range can't read past its end: only the other ones are sized
+                arguments['MaxKeys'] = _get_range_page_size(
+                    sub_prefix_count, len(listed_sub_prefixes), number_of_listed_objects
+                )
+            page = s3_client.list_objects_v2(**arguments)
+            contents = page.get('Contents', [])
+            is_past_range = last_key is not None and contents and contents[-1]['Key'] > last_key
+            if is_past_range:
+                contents = [content for content in contents if content['Key'] <= last_key]
+            if not _put(page_queue, contents, stop_listing) or is_past_range or \
+                    not page.get('IsTruncated'):
+                break
+            arguments['ContinuationToken'] = page['NextContinuationToken']
+            number_of_listed_objects += len(contents)
+            listed_sub_prefixes.update(
+                content['Key'][len(prefix):].split('/', 1)[0] for content in contents
+                if '/' in content['Key'][len(prefix):]
+            )
+    except Exception as e:
+        _put(page_queue, e, stop_listing)
+        return
+    # End of shard
+    _put(page_queue, None, stop_listing)
+
+
+def _put(page_queue, item, stop_listing):
+    while not stop_listing.is_set():
+        try:
+            page_queue.put(item, timeout=_PRODUCER_POLL_INTERVAL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get_range_page_size(
+    sub_prefix_count, number_of_listed_sub_prefixes, number_of_listed_objects
+):
+    # The last listed sub-prefix may not be complete: it's counted among the remaining ones
+    if number_of_listed_sub_prefixes:
+        objects_per_sub_prefix = number_of_listed_objects / number_of_listed_sub_prefixes
+        remaining_sub_prefixes = max(1, sub_prefix_count - number_of_listed_sub_prefixes + 1)
+    else:
+        objects_per_sub_prefix = ESTIMATED_OBJECTS_PER_SUB_PREFIX
+        remaining_sub_prefixes = sub_prefix_count
+    # Plus one, to see the first key past the range instead of asking for another page
+    return max(1, min(
+        MAX_KEYS_PER_PAGE, math.ceil(remaining_sub_prefixes * objects_per_sub_prefix) + 1
+    ))
+
+
+def _list_one_level(s3_client, bucket_name, prefix):
+    paginator = s3_client.get_paginator('list_objects_v2')
+    contents = []
+    common_prefixes = []
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix, Delimiter='/'):
+        contents.extend(page.get('Contents', []))
+        common_prefixes.extend(
+            common_prefix['Prefix'] for common_prefix in page.get('CommonPrefixes', [])
+        )
+    return contents, common_prefixes
+
+
+def _get_shard_sort_key(shard):
+    type_, value = shard
+    # A key that doesn't start with a prefix sorts either before or after all the keys under it.
+    # Sorting keys and prefixes together therefore gives the order of a regular listing.
+    if type_ == 'object':
+        return value['Key']
+    if type_ == 'range':
+        prefix, start_after, _, _ = value
+        return prefix if start_after is None else start_after
+    return value
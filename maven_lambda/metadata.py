@@ -1,203 +1,903 @@
 
-import boto3
+import gzip
 import hashlib
-import io
 import os
-import slugid
-import tempfile
+import re
+import threading
 import urllib.parse
 
 from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from functools import reduce
-from mozilla_version.maven import MavenVersion
-from mozilla_version.mobile import MobileVersion
+from functools import lru_cache, partial
+from maven_lambda import metrics
+from maven_lambda.artifact_checksums import (
+    ARTIFACT_CHECKSUMS_ENV_VAR,
+    get_algorithms_to_write,
+    is_artifact,
+    process_artifact_checksums,
+)
+from maven_lambda.aws_clients import get_client, lazy_client, lazy_resource
+from maven_lambda.catalog import build_catalog_entry, update_catalog
+from maven_lambda.conditional_writes import (
+    get_error_code,
+    get_write_conditions,
+    is_concurrent_write_error,
+    wait_before_retrying,
+)
+from maven_lambda.coordinates import (
+    SNAPSHOT_VERSION_SUFFIX,
+    VERSION_CLASS_PER_SCHEME,
+    get_repository_layout,
+    parse_coordinate,
+    parse_coordinates,
+)
+from maven_lambda.invalidation import DEFAULT_MAX_EXPLICIT_PATHS, InvalidationBatcher
+from maven_lambda.listing import DEFAULT_NUMBER_OF_RANGES, iterate_objects_in_ranges
+from maven_lambda.version_index import list_pom_files_with_version_index, s3_object_exists
+from maven_lambda.work_queue import DynamoDBWorkQueue
 from mozilla_version.errors import PatternNotMatchedError
 from xml.etree import cElementTree as ET
+from xml.sax.saxutils import escape
 
 
 # logging doesn't work on AWS Lambda, at first
 print('Loading function')
 
-s3 = boto3.resource('s3')
-cloudfront = boto3.client('cloudfront')
+# Built on first use, then reused across warm invocations. Each thread gets its own copy of the
+# resource. Buckets and objects made by one thread therefore only hand their name and their
+# client to other threads.
+s3 = lazy_resource('s3')
+cloudfront = lazy_client('cloudfront')
+# Lives as long as the lambda is warm: paths that couldn't be invalidated are retried at the next
+# invocation
+invalidation_batcher = InvalidationBatcher(max_explicit_paths=int(os.environ.get(
+    'CLOUDFRONT_MAX_EXPLICIT_PATHS', DEFAULT_MAX_EXPLICIT_PATHS
+)))
 
 METADATA_BASE_FILE_NAME = 'maven-metadata.xml'
+CONTENT_HASH_METADATA_KEY = 'content-sha1'
+LAST_UPDATED_PATTERN = re.compile(r'<lastUpdated>[^<]*</lastUpdated>')
+# maven-metadata.xml is only replaced if it's still the one that existed before the .pom files
+# got listed (see conditional_writes.py)
+MAX_METADATA_WRITE_ATTEMPTS = 5
+METADATA_WRITE_BASE_DELAY = 0.1
+
+# Opt-in: a gzip-encoded copy of maven-metadata.xml is stored next to it, as
+# maven-metadata.xml.gz, for the CDN to serve to clients that accept gzip. Checksum files remain
+# the ones of the uncompressed XML, which is what clients verify once they decoded the response.
+METADATA_GZIP_ENV_VAR = 'METADATA_GZIP'
+GZIP_VARIANT_SUFFIX = '.gz'
+# Level 9 saves 2% more than 6 on large artifacts, but takes about 7 times longer to compress
+GZIP_COMPRESS_LEVEL = 6
+# Stored along with the content hash, so that turning the variant on uploads it even if
+# maven-metadata.xml didn't change
+GZIP_CONTENT_HASH_SUFFIX = '+gzip'
 
 ET.register_namespace('', 'http://maven.apache.org/POM/4.0.0')
-XML_NAMESPACES = {
-    'm': 'http://maven.apache.org/POM/4.0.0',
-}
 
 POM_TIMESTAMP = '%Y%m%d%H%M%S'
 SNAPSHOT_FILE_TIMESTAMP = '%Y%m%d.%H%M%S'
 
+# Snapshot version folders (like "0.30.0-SNAPSHOT/") hold timestamped builds (like
+# "browser-domains-0.30.0-20181030.164630-2.pom") and get their own maven-metadata.xml, which
+# tells clients what the latest build is, and every file it's made of
+SNAPSHOT_POM_FILE_NAME_PATTERN = re.compile(r'-(\d{8}\.\d{6})-(\d+)\.pom$')
+MAX_SNAPSHOT_FOLDER_WORKERS = 8
+# Only the beginning of a POM is downloaded, as long as <packaging> is in there. Builds are
+# immutable, so packagings are cached along with the ETag of their POM.
+POM_RANGE_SIZE = 4096
+DEFAULT_PACKAGING = 'jar'
+PACKAGING_CACHE_SIZE = 4096
+_packaging_per_pom = {}
+_packaging_cache_lock = threading.Lock()
+
+XML_DECLARATION = "<?xml version='1.0' encoding='utf-8'?>\n"
+VERSIONS_PER_CHUNK = 1000
+
+PARSED_VERSIONS_CACHE_SIZE = 32768
+
+VERSIONS_ORDER_ENV_VAR = 'VERSIONS_ORDER'
+VERSIONS_ORDER_LEXICAL = 'lexical'
+VERSIONS_ORDER_VERSION = 'version'
+
+WORK_QUEUE_TABLE_ENV_VAR = 'WORK_QUEUE_TABLE'
+QUIET_WINDOW_ENV_VAR = 'DEBOUNCE_QUIET_WINDOW_SECONDS'
+DEFAULT_QUIET_WINDOW = 60
+# Folders that never stay quiet long enough (like during a long release push) are still
+# regenerated this long after their first event
+MAX_DELAY_ENV_VAR = 'DEBOUNCE_MAX_DELAY_SECONDS'
+DEFAULT_MAX_DELAY = 15 * 60
+
+USE_VERSION_INDEX_ENV_VAR = 'USE_VERSION_INDEX'
+VERSION_INDEX_MAX_AGE_ENV_VAR = 'VERSION_INDEX_MAX_AGE_SECONDS'
+DEFAULT_VERSION_INDEX_MAX_AGE = 24 * 60 * 60
+
+CATALOG_PREFIX_ENV_VAR = 'CATALOG_PREFIX'
+
+LISTING_MODE_ENV_VAR = 'LISTING_MODE'
+LISTING_MODE_OBJECTS = 'objects'
+LISTING_MODE_VERSION_FOLDERS = 'version-folders'
+LISTING_MODE_CHECKED_VERSION_FOLDERS = 'checked-version-folders'
+LISTING_MODE_RANGES = 'ranges'
+LISTING_RANGES_ENV_VAR = 'LISTING_RANGES'
+POM_EXISTENCE_CHECK_WORKERS = 16
+MAX_FOLDER_WORKERS = 8
+
+
+class ConcurrentUpdateError(Exception):
+    def __init__(self, folder):
+        super().__init__(
+            'maven-metadata.xml of "{}" was updated by another invocation meanwhile'.format(folder)
+        )
+
+
+class UploadError(Exception):
+    def __init__(self, folder, errors_per_file_name):
+        self.errors_per_file_name = errors_per_file_name
+        super().__init__(
+            'Could not upload {} to "{}". maven-metadata.xml was left untouched. '
+            'Errors: {}'.format(sorted(errors_per_file_name), folder, errors_per_file_name)
+        )
+
 
+@metrics.record_invocation(lambda: {'S3Calls': s3.meta.client})
 def lambda_handler(event, context):
     print('Processing a new event...')
-    print('Event: {}. Context: {}'.format(event, context))
 
-    bucket_name = event['Records'][0]['s3']['bucket']['name']
-    key = urllib.parse.unquote_plus(event['Records'][0]['s3']['object']['key'], encoding='utf-8')
-    print('Processing key "{}" from bucket "{}"...'.format(key, bucket_name))
+    keys_per_artifact_folder = group_keys_per_artifact_folder(event['Records'])
+    print('Found {} artifact folder(s) to process in {} record(s)'.format(
+        len(keys_per_artifact_folder), len(event['Records'])
+    ))
 
-    bucket = s3.Bucket(bucket_name)
+    checksum_results = process_checksums_of_artifacts(keys_per_artifact_folder)
 
-    try:
-        artifact_folder = get_artifact_folder(key)
-        print('Extracted artifact folder "{}" from key'.format(artifact_folder))
-        poms_in_artifact_folder = list_pom_files_in_subfolders(bucket, artifact_folder)
-        print('Found .pom in artifact folder (and subfolders): {}'.format(poms_in_artifact_folder))
-        uploaded_metadata_files = craft_and_upload_maven_metadata(
-            bucket, artifact_folder, poms_in_artifact_folder,
-            metadata_function=generate_release_maven_metadata
-        )
+    work_queue = get_work_queue()
+    if work_queue is not None:
+        # Debouncing mode: metadata is regenerated later on, by drain_handler()
+        response = enqueue_artifact_folders(work_queue, keys_per_artifact_folder)
+    else:
+        results, first_error = regenerate_artifact_folders(keys_per_artifact_folder)
+        if first_error is not None:
+            raise first_error
+        response = {'artifactFolders': results}
+
+    if checksum_results is not None:
+        response['artifactChecksums'] = checksum_results
+    return response
+
+
+def process_checksums_of_artifacts(keys_per_artifact_folder):
+    environment_value = os.environ.get(ARTIFACT_CHECKSUMS_ENV_VAR, None)
+    if not environment_value:
+        return None
+    return process_artifact_checksums(
+        s3.meta.client,
+        [
+            (bucket_name, key)
+            for (bucket_name, _), keys in keys_per_artifact_folder.items()
+            for key in keys
+        ],
+        get_algorithms_to_write(environment_value),
+    )
+
+
+@metrics.record_invocation(lambda: {'S3Calls': s3.meta.client})
+def drain_handler(event, context):
+    print('Draining pending artifact folders...')
+
+    work_queue = get_work_queue()
+    if work_queue is None:
+        raise ValueError('{} not set. No work queue to drain.'.format(WORK_QUEUE_TABLE_ENV_VAR))
+
+    quiet_window = float(os.environ.get(QUIET_WINDOW_ENV_VAR, DEFAULT_QUIET_WINDOW))
+    max_delay = float(os.environ.get(MAX_DELAY_ENV_VAR, DEFAULT_MAX_DELAY))
+    return drain_work_queue(work_queue, quiet_window, max_delay=max_delay)
+
+
+def get_work_queue():
+    table_name = os.environ.get(WORK_QUEUE_TABLE_ENV_VAR, None)
+    if not table_name:
+        return None
+    return DynamoDBWorkQueue(table_name, get_client('dynamodb'))
+
+
+def enqueue_artifact_folders(work_queue, keys_per_artifact_folder):
+    results = []
+    for (bucket_name, artifact_folder), keys in keys_per_artifact_folder.items():
+        work_queue.enqueue(bucket_name, artifact_folder, keys)
+        print('Enqueued folder "{}" from bucket "{}"'.format(artifact_folder, bucket_name))
+        results.append(_generate_folder_result(
+            bucket_name, artifact_folder, keys, status='enqueued'
+        ))
+    return {'artifactFolders': results}
+
+
+def drain_work_queue(work_queue, quiet_window, now=None, max_delay=None):
+    quiet_folders = work_queue.get_quiet_folders(quiet_window, now, max_delay)
+    print('Found {} quiet artifact folder(s) to regenerate'.format(len(quiet_folders)))
+
+    # Like in lambda_handler(), the keys of the events let the version index skip a full listing
+    keys_per_artifact_folder = {
+        (bucket_name, artifact_folder): list(keys)
+        for bucket_name, artifact_folder, _, keys in quiet_folders
+    }
+    results, first_error = regenerate_artifact_folders(keys_per_artifact_folder)
+
+    # Failed folders stay in the queue, they will be retried at the next drain
+    for (bucket_name, artifact_folder, event_time, keys), result in zip(quiet_folders, results):
+        if result['status'] != 'failed':
+            work_queue.acknowledge(bucket_name, artifact_folder, event_time, keys)
+
+    if first_error is not None:
+        raise first_error
+
+    return {'artifactFolders': results}
+
+
+def regenerate_artifact_folders(keys_per_artifact_folder):
+    folders_and_keys = list(keys_per_artifact_folder.items())
+    if folders_and_keys:
+        max_workers = min(MAX_FOLDER_WORKERS, len(folders_and_keys))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results_and_errors = list(
+                executor.map(_try_to_regenerate_artifact_folder, folders_and_keys)
+            )
+    else:
+        results_and_errors = []
 
+    results = [result for result, _ in results_and_errors]
+    errors = [error for _, error in results_and_errors if error is not None]
+
+    uploaded_metadata_files = [
+        uploaded_file for result in results for uploaded_file in result['uploadedFiles']
+    ]
+    if uploaded_metadata_files:
         invalidate_cloudfront_cache(uploaded_metadata_files)
 
+    return results, errors[0] if errors else None
+
+
+def _try_to_regenerate_artifact_folder(folder_and_keys):
+    (bucket_name, artifact_folder), keys = folder_and_keys
+    print('Processing folder "{}" from bucket "{}" (keys: {})...'.format(
+        artifact_folder, bucket_name, keys
+    ))
+    try:
+        uploaded_files = regenerate_artifact_folder(bucket_name, artifact_folder, keys)
     except Exception as e:
+        # Don't let a single faulty folder prevent the other ones from being processed
         print(e)
-        raise
+        return _generate_folder_result(
+            bucket_name, artifact_folder, keys, status='failed', error=str(e)
+        ), e
 
     print('Done processing folder "{}"'.format(artifact_folder))
+    return _generate_folder_result(
+        bucket_name, artifact_folder, keys,
+        status='updated' if uploaded_files else 'unchanged', uploaded_files=uploaded_files
+    ), None
+
+
+def group_keys_per_artifact_folder(records):
+    # Several files of the same version (.pom, .jar, .aar, checksums...) may be delivered in a
+    # single batch. They all lead to the same maven-metadata.xml, which we want to generate once.
+    keys_per_artifact_folder = {}
+    coordinates = parse_coordinates(
+        urllib.parse.unquote_plus(record['s3']['object']['key'], encoding='utf-8')
+        for record in records
+    )
+    for record, coordinate in zip(records, coordinates):
+        keys = keys_per_artifact_folder.setdefault(
+            (record['s3']['bucket']['name'], coordinate.artifact_folder), []
+        )
+        if coordinate.key not in keys:
+            keys.append(coordinate.key)
+    return keys_per_artifact_folder
 
 
-def get_artifact_folder(key):
-    return _take_items_out_of_path(key, number_of_items=2)
+def regenerate_artifact_folder(bucket_name, artifact_folder, keys=()):
+    bucket = s3.Bucket(bucket_name)
+    uploaded_files, poms_in_artifact_folder = craft_and_upload_maven_metadata(
+        bucket, artifact_folder,
+        partial(list_pom_files_of_artifact, bucket, artifact_folder, keys),
+        metadata_function=stream_release_maven_metadata
+    )
+    catalog_prefix = os.environ.get(CATALOG_PREFIX_ENV_VAR, None)
+    if catalog_prefix and uploaded_files:
+        uploaded_files += update_catalog_of_artifact(
+            bucket, catalog_prefix, poms_in_artifact_folder
+        )
+    return uploaded_files + regenerate_snapshot_version_folders(
+        bucket, poms_in_artifact_folder, keys
+    )
 
 
-def get_version_folder(key):
-    return _take_items_out_of_path(key, number_of_items=1)
+def list_pom_files_of_artifact(bucket, artifact_folder, keys=()):
+    list_function = get_listing_function()
+    if os.environ.get(USE_VERSION_INDEX_ENV_VAR, None):
+        max_age = float(
+            os.environ.get(VERSION_INDEX_MAX_AGE_ENV_VAR, DEFAULT_VERSION_INDEX_MAX_AGE)
+        )
+        pom_files = list_pom_files_with_version_index(
+            bucket, artifact_folder, keys, list_function, max_age
+        )
+    else:
+        pom_files = list_function(bucket, artifact_folder)
+    print('Found {} .pom file(s) in artifact folder "{}" (and subfolders)'.format(
+        len(pom_files), artifact_folder
+    ))
+    metrics.add('ListedPomFiles', len(pom_files))
+    return pom_files
 
 
-def _take_items_out_of_path(key, number_of_items):
-    split_path_without_last_two_items = key.split('/')[:-number_of_items]
-    folder = '/'.join(split_path_without_last_two_items)
-    folder_with_trailing_slash = '{}/'.format(folder)
-    return folder_with_trailing_slash
+def update_catalog_of_artifact(bucket, catalog_prefix, pom_files):
+    first_pom_file = parse_coordinate(pom_files[0])
+    try:
+        catalog_shard_key = update_catalog(
+            bucket, catalog_prefix, first_pom_file.group_id, first_pom_file.artifact_id,
+            generate_catalog_entry(pom_files)
+        )
+    except Exception as e:
+        # maven-metadata.xml is already uploaded: failing now would prevent the next attempt
+        # from updating the catalog, because the metadata wouldn't have changed anymore. The next
+        # change of the artifact (or a full rebuild) fixes the catalog.
+        print('WARN: Could not update the catalog: {}'.format(e))
+        return []
+    return [catalog_shard_key]
+
+
+def generate_catalog_entry(pom_files):
+    versions_per_path = generate_versions(pom_files)
+    return build_catalog_entry(
+        get_latest_version(versions_per_path, parse_coordinate(pom_files[0]).version_scheme),
+        len(set(versions_per_path.values())),
+        generate_last_updated()
+    )
 
 
-def list_pom_files_in_subfolders(bucket, folder_key):
+def regenerate_snapshot_version_folders(bucket, pom_files, keys=(), changed_since=None):
+    # Without keys, every snapshot version folder is regenerated. Unchanged ones aren't uploaded.
+    # changed_since is when pom_files were listed, if they weren't listed just now.
+    pom_files_per_version_folder = {}
+    for pom_file in parse_coordinates(pom_files):
+        if pom_file.version.endswith(SNAPSHOT_VERSION_SUFFIX) and \
+                SNAPSHOT_POM_FILE_NAME_PATTERN.search(pom_file.file_name):
+            pom_files_per_version_folder.setdefault(pom_file.version_folder, []).append(
+                pom_file.key
+            )
+    if keys:
+        # Version folders are listed again, once the state of their maven-metadata.xml is known.
+        # See craft_and_upload_maven_metadata().
+        version_folders = {key.version_folder for key in parse_coordinates(keys)}
+        list_function_per_version_folder = {
+            version_folder: partial(list_snapshot_pom_files, bucket, version_folder)
+            for version_folder in pom_files_per_version_folder
+            if version_folder in version_folders
+        }
+    elif changed_since is not None:
+        # Full rebuilds reuse their listing, unless the version folder changed since
+        list_function_per_version_folder = {
+            version_folder: partial(
+                list_snapshot_pom_files_if_changed, bucket, version_folder, version_pom_files,
+                changed_since
+            )
+            for version_folder, version_pom_files in pom_files_per_version_folder.items()
+        }
+    else:
+        list_function_per_version_folder = {
+            version_folder: partial(list, version_pom_files)
+            for version_folder, version_pom_files in pom_files_per_version_folder.items()
+        }
+    if not list_function_per_version_folder:
+        return []
+
+    max_workers = min(MAX_SNAPSHOT_FOLDER_WORKERS, len(list_function_per_version_folder))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        uploaded_files_and_pom_files_per_version_folder = executor.map(
+            lambda item: craft_and_upload_maven_metadata(
+                bucket, *item, metadata_function=stream_snapshot_maven_metadata
+            ),
+            sorted(list_function_per_version_folder.items())
+        )
+        return [
+            uploaded_file
+            for uploaded_files, _ in uploaded_files_and_pom_files_per_version_folder
+            for uploaded_file in uploaded_files
+        ]
+
+
+def list_snapshot_pom_files(bucket, version_folder):
     return [
-        file.key for file in bucket.objects.filter(Prefix=folder_key)
-        if file.key.endswith('.pom')
+        pom_file for pom_file in list_pom_files_in_subfolders(bucket, version_folder)
+        if SNAPSHOT_POM_FILE_NAME_PATTERN.search(pom_file)
     ]
 
 
-def get_group_id(key):
-    folder_names_but_last_three = key.split('/')[:-3]
-    if folder_names_but_last_three[0] in ('maven', 'maven2'):
-        # artifacts are usually uploaded under maven2/ which is not part of the groupId
-        folder_names_without_maven_prefix = folder_names_but_last_three[1:]
-    else:
-        folder_names_without_maven_prefix = folder_names_but_last_three
-    return '.'.join(folder_names_without_maven_prefix)
+def list_snapshot_pom_files_if_changed(bucket, version_folder, pom_files, changed_since):
+    # Called once the state of maven-metadata.xml is known. If it changed since pom_files were
+    # listed, a new build got published meanwhile: the version folder is listed again.
+    head_response = fetch_metadata_head(bucket.name, version_folder)
+    if head_response is not None and head_response['LastModified'] >= changed_since:
+        return list_snapshot_pom_files(bucket, version_folder)
+    return pom_files
 
 
-def get_artifact_id(key):
-    return key.split('/')[-3]
+def _generate_folder_result(bucket_name, artifact_folder, keys, status, uploaded_files=(),
+                            error=None):
+    result = {
+        'bucket': bucket_name,
+        'artifactFolder': artifact_folder,
+        'keys': keys,
+        'status': status,
+        'uploadedFiles': list(uploaded_files),
+    }
+    if error is not None:
+        result['error'] = error
+    return result
 
 
-def get_version(key):
-    return key.split('/')[-2]
+def get_artifact_folder(key):
+    return parse_coordinate(key).artifact_folder
 
 
-def craft_and_upload_maven_metadata(bucket, folder, pom_files, metadata_function):
-    bucket_name = bucket.name
-    metadata = metadata_function(bucket_name, pom_files)
-    print('Generated maven-metadata content: {}'.format(metadata))
-    uploaded_metadata_files = []
-    uploaded_metadata_files.append(upload_s3_file(
-        bucket_name, folder, METADATA_BASE_FILE_NAME, metadata, content_type='text/xml'
-    ))
-    print('Uploaded new maven-metadata.xml')
+def get_version_folder(key):
+    return parse_coordinate(key).version_folder
 
-    checksums = generate_checksums(metadata)
-    print('New maven-metadata.xml checksums: {}'.format(checksums))
-    for type_, sum_ in checksums.items():
-        uploaded_metadata_files.append(upload_s3_file(
-            bucket_name, folder, '{}.{}'.format(METADATA_BASE_FILE_NAME, type_), sum_
-        ))
-        print('Uploaded new {} checksum file'.format(type_))
 
-    return uploaded_metadata_files
+@metrics.timed('Listing')
+def list_pom_files_in_subfolders(bucket, folder_key):
+    paginator = bucket.meta.client.get_paginator('list_objects_v2')
+    return [
+        content['Key']
+        for page in paginator.paginate(Bucket=bucket.name, Prefix=folder_key)
+        for content in page.get('Contents', [])
+        if content['Key'].endswith('.pom')
+    ]
+
 
+@metrics.timed('Listing')
+def list_pom_files_in_version_folders(bucket, folder_key, check_pom_exists=False):
+    # Listing version folders (instead of every .jar, .aar, checksum... they contain) returns
+    # about 12 times fewer entries. The .pom key is then inferred from the version folder.
+    # SNAPSHOT version folders hold timestamped builds instead: they're listed like in the
+    # default mode.
+    folder_key = '{}/'.format(folder_key.rstrip('/'))
+    artifact_id = folder_key.split('/')[-2]
+    paginator = bucket.meta.client.get_paginator('list_objects_v2')
+    version_folders = [
+        common_prefix['Prefix']
+        for page in paginator.paginate(Bucket=bucket.name, Prefix=folder_key, Delimiter='/')
+        for common_prefix in page.get('CommonPrefixes', [])
+    ]
+    pom_files = [
+        '{}{}-{}.pom'.format(version_folder, artifact_id, version_folder[len(folder_key):-1])
+        for version_folder in version_folders
+        if not version_folder.endswith('{}/'.format(SNAPSHOT_VERSION_SUFFIX))
+    ]
 
-def generate_release_maven_metadata(_, folder_content_keys):
-    versions_per_path = generate_versions(folder_content_keys)
-    latest_version = get_latest_version(versions_per_path)
+    if check_pom_exists:
+        # A version folder may exist without its .pom, while an upload is ongoing for instance
+        with ThreadPoolExecutor(max_workers=POM_EXISTENCE_CHECK_WORKERS) as executor:
+            existences = list(executor.map(lambda key: s3_object_exists(bucket, key), pom_files))
+        pom_files = [pom_file for pom_file, exists in zip(pom_files, existences) if exists]
+
+    for version_folder in version_folders:
+        if version_folder.endswith('{}/'.format(SNAPSHOT_VERSION_SUFFIX)):
+            pom_files.extend(list_pom_files_in_subfolders(bucket, version_folder))
+    return sorted(pom_files)
+
+
+def list_pom_files_in_ranges(bucket, folder_key, number_of_ranges=DEFAULT_NUMBER_OF_RANGES):
+    # Same result as list_pom_files_in_subfolders, but ranges of version folders are listed
+    # concurrently
+    return [
+        content['Key'] for content in iterate_objects_in_ranges(
+            bucket.meta.client, bucket.name, folder_key, number_of_ranges
+        )
+        if content['Key'].endswith('.pom')
+    ]
 
-    root = _generate_xml_root_of_common_maven_metadata(folder_content_keys)
 
-    versioning = ET.SubElement(root, 'versioning')
+def get_listing_function():
+    listing_mode = os.environ.get(LISTING_MODE_ENV_VAR, None) or LISTING_MODE_OBJECTS
+    if listing_mode == LISTING_MODE_OBJECTS:
+        return list_pom_files_in_subfolders
+    elif listing_mode == LISTING_MODE_VERSION_FOLDERS:
+        return list_pom_files_in_version_folders
+    elif listing_mode == LISTING_MODE_CHECKED_VERSION_FOLDERS:
+        return partial(list_pom_files_in_version_folders, check_pom_exists=True)
+    elif listing_mode == LISTING_MODE_RANGES:
+        return partial(
+            list_pom_files_in_ranges,
+            number_of_ranges=int(os.environ.get(LISTING_RANGES_ENV_VAR, DEFAULT_NUMBER_OF_RANGES))
+        )
+    raise ValueError('Unknown {}: "{}"'.format(LISTING_MODE_ENV_VAR, listing_mode))
 
-    ET.SubElement(versioning, 'latest').text = latest_version
-    ET.SubElement(versioning, 'release').text = '' if latest_version is None \
-        else latest_version
 
-    versions = ET.SubElement(versioning, 'versions')
+def get_group_id(key):
+    return parse_coordinate(key).group_id
 
-    for version in sorted(set(versions_per_path.values())):
-        ET.SubElement(versions, 'version').text = version
 
-    ET.SubElement(versioning, 'lastUpdated').text = generate_last_updated()
+def get_artifact_id(key):
+    return parse_coordinate(key).artifact_id
 
-    return _convert_xml_root_to_string(root)
 
+def get_version(key):
+    return parse_coordinate(key).version
 
-def _generate_xml_root_of_common_maven_metadata(folder_content_keys):
-    first_listed_version_key = folder_content_keys[0]
 
-    root = ET.Element('metadata')
-    ET.SubElement(root, 'groupId').text = get_group_id(first_listed_version_key)
-    ET.SubElement(root, 'artifactId').text = get_artifact_id(first_listed_version_key)
+def craft_and_upload_maven_metadata(bucket, folder, list_pom_files, metadata_function):
+    # Concurrent invocations may regenerate the same folder. The state of maven-metadata.xml is
+    # fetched before listing, and the upload is conditional on it. If another invocation replaced
+    # the file meanwhile, its listing may hold .pom files this one didn't see (or the other way
+    # around): .pom files are listed again, and maven-metadata.xml is rendered again.
+    bucket_name = bucket.name
+    uploaded_checksums = False
+    for attempt in range(MAX_METADATA_WRITE_ATTEMPTS):
+        e_tag, content_hash_in_bucket = fetch_metadata_state(bucket_name, folder)
+        pom_files = list_pom_files()
+        if not pom_files:
+            # Only a .jar got uploaded so far, or the artifact got deleted. The next .pom brings
+            # the folder back.
+            print('No .pom file found in "{}". Nothing to regenerate.'.format(folder))
+            return [], pom_files
+        metadata, checksums = generate_metadata_and_checksums(
+            metadata_function(bucket_name, pom_files)
+        )
+        print('Generated maven-metadata.xml of "{}" ({} characters)'.format(
+            folder, len(metadata)
+        ))
+        if uploaded_checksums:
+            # Checksums of the lost attempt may have replaced the ones of maven-metadata.xml
+            content_hash_in_bucket = None
 
-    return root
+        try:
+            return upload_maven_metadata(
+                bucket_name, folder, metadata, checksums, generate_content_hash(metadata),
+                metadata_state=(e_tag, content_hash_in_bucket)
+            ), pom_files
+        except ConcurrentUpdateError as e:
+            if attempt + 1 == MAX_METADATA_WRITE_ATTEMPTS:
+                # Checksums of this render may have replaced the ones of the winning
+                # maven-metadata.xml. Without its content hash, the next invocation uploads
+                # them again, even if it renders the same file.
+                forget_content_hash(bucket_name, folder)
+                raise
+            uploaded_checksums = True
+            delay = wait_before_retrying(attempt, METADATA_WRITE_BASE_DELAY)
+            print('{}. Listing again in {:.2f}s'.format(e, delay))
+
+
+def upload_maven_metadata(
+    bucket_name, folder, metadata, checksums, content_hash, metadata_state=None
+):
+    # metadata_state is what fetch_metadata_state() returned before the .pom files were listed
+    e_tag, content_hash_in_bucket = fetch_metadata_state(bucket_name, folder) \
+        if metadata_state is None else metadata_state
+    with_gzip_variant = bool(os.environ.get(METADATA_GZIP_ENV_VAR, None))
+    if with_gzip_variant:
+        content_hash += GZIP_CONTENT_HASH_SUFFIX
+    if content_hash == content_hash_in_bucket:
+        print('maven-metadata.xml did not change (besides lastUpdated). Skipping upload.')
+        return []
+
+    # Checksums (and the gzip variant) are uploaded first: maven-metadata.xml holds the content
+    # hash, which must only be stored once every file is uploaded. Otherwise, a retry would skip
+    # missing checksums.
+    print('New maven-metadata.xml checksums: {}'.format(checksums))
+    with ThreadPoolExecutor(max_workers=len(checksums) + 1) as executor:
+        futures_per_file_name = {
+            '{}.{}'.format(METADATA_BASE_FILE_NAME, type_): executor.submit(
+                upload_s3_file, bucket_name, folder,
+                '{}.{}'.format(METADATA_BASE_FILE_NAME, type_), sum_
+            )
+            for type_, sum_ in checksums.items()
+        }
+        if with_gzip_variant:
+            # Compressed while checksums are being uploaded
+            futures_per_file_name[METADATA_BASE_FILE_NAME + GZIP_VARIANT_SUFFIX] = \
+                executor.submit(upload_gzip_variant, bucket_name, folder, metadata)
+
+    uploaded_checksum_files = []
+    errors_per_file_name = {}
+    for file_name, future in futures_per_file_name.items():
+        try:
+            uploaded_checksum_files.append(future.result())
+        except Exception as e:
+            errors_per_file_name[file_name] = e
+        else:
+            print('Uploaded new {}'.format(file_name))
 
+    if errors_per_file_name:
+        raise UploadError(folder, errors_per_file_name)
 
-def _convert_xml_root_to_string(root):
-    # XXX ET.tostring() strips the xml_declaration out if using encoding='unicode'
-    stream = io.StringIO()
-    ET.ElementTree(root).write(
-        stream, encoding='unicode', xml_declaration=True, method='xml', short_empty_elements=False
+    write_conditions = get_write_conditions(
+        s3.meta.client, '{}/{}'.format(folder.rstrip('/'), METADATA_BASE_FILE_NAME), e_tag
     )
-    return stream.getvalue()
+    try:
+        uploaded_metadata_file = upload_s3_file(
+            bucket_name, folder, METADATA_BASE_FILE_NAME, metadata, content_type='text/xml',
+            metadata={CONTENT_HASH_METADATA_KEY: content_hash}, write_conditions=write_conditions
+        )
+    except ClientError as e:
+        if is_concurrent_write_error(e):
+            raise ConcurrentUpdateError(folder) from e
+        raise
+    print('Uploaded new maven-metadata.xml')
 
+    return [uploaded_metadata_file] + uploaded_checksum_files
 
-def _extract_build_number_from_file_name(file_name):
-    file_name_without_extension = file_name.rstrip('.pom')
-    build_number = file_name_without_extension.split('-')[-1]
-    return int(build_number)
 
+def upload_gzip_variant(bucket_name, folder, metadata):
+    return upload_s3_file(
+        bucket_name, folder, METADATA_BASE_FILE_NAME + GZIP_VARIANT_SUFFIX,
+        compress_metadata(metadata), content_type='text/xml', content_encoding='gzip'
+    )
 
-def _fetch_extension_from_pom_file_content(bucket_name, pom_key):
-    with tempfile.TemporaryDirectory() as d:
-        temporary_pom_path = os.path.join(d, 'pom.xml')
-        s3.Bucket(bucket_name).download_file(pom_key, temporary_pom_path)
-        tree = ET.parse(temporary_pom_path)
 
-    root = tree.getroot()
-    packaging_element = root.find('m:packaging', XML_NAMESPACES)
+@metrics.timed('Compression')
+def compress_metadata(metadata):
+    # mtime is fixed: the same maven-metadata.xml always gives the same bytes, and the same ETag
+    return gzip.compress(metadata.encode(), compresslevel=GZIP_COMPRESS_LEVEL, mtime=0)
 
-    # Bug 1616010 - Jars don't necessarily specify a packaging `entry`
-    if packaging_element is None:
-        return 'jar'
 
-    return packaging_element.text
+def generate_content_hash(metadata):
+    # lastUpdated changes at every generation, even if no version was added or removed
+    return hashlib.sha1(LAST_UPDATED_PATTERN.sub('', metadata).encode()).hexdigest()
 
 
-def _extract_timestamp_from_file_name(file_name):
-    timestamp = file_name.split('-')[-2]
-    return datetime.strptime(timestamp, SNAPSHOT_FILE_TIMESTAMP)
+def fetch_metadata_state(bucket_name, folder):
+    # Returns the ETag and the content hash of maven-metadata.xml, or None twice if it's missing
+    return get_metadata_state(fetch_metadata_head(bucket_name, folder))
 
 
-def _extract_version_from_file_name(file_name):
-    return file_name.split('-')[-3]
+def fetch_metadata_head(bucket_name, folder):
+    # Returns the HEAD response of maven-metadata.xml, or None if it's missing
+    key = '{}/{}'.format(folder.rstrip('/'), METADATA_BASE_FILE_NAME)
+    try:
+        return s3.meta.client.head_object(Bucket=bucket_name, Key=key)
+    except ClientError as e:
+        if get_error_code(e) in ('404', 'NoSuchKey'):
+            return None
+        raise
+
+
+def get_metadata_state(head_response):
+    if head_response is None:
+        return None, None
+    return (
+        head_response.get('ETag'),
+        head_response.get('Metadata', {}).get(CONTENT_HASH_METADATA_KEY),
+    )
+
+
+def forget_content_hash(bucket_name, folder):
+    # maven-metadata.xml is copied onto itself, without its metadata. The copy only happens if
+    # no other invocation replaced the file meanwhile: that one uploaded its own checksums.
+    key = '{}/{}'.format(folder.rstrip('/'), METADATA_BASE_FILE_NAME)
+    try:
+        head_response = fetch_metadata_head(bucket_name, folder)
+        if head_response is None:
+            return
+        s3.meta.client.copy_object(
+            Bucket=bucket_name, Key=key, CopySource={'Bucket': bucket_name, 'Key': key},
+            CopySourceIfMatch=head_response['ETag'], MetadataDirective='REPLACE',
+            ContentType=head_response.get('ContentType', 'text/xml'),
+            CacheControl=head_response.get('CacheControl', 'max-age=600'), Metadata={},
+        )
+    except ClientError as e:
+        # The ConcurrentUpdateError being raised matters more
+        print('WARN: Could not forget the content hash of "{}": {}'.format(key, e))
+    else:
+        print('Forgot the content hash of "{}"'.format(key))
+
+
+@metrics.timed('Rendering')
+def generate_metadata_and_checksums(metadata_chunks):
+    # Checksums are computed while the body is assembled, instead of re-encoding it afterwards
+    if isinstance(metadata_chunks, str):
+        metadata_chunks = (metadata_chunks,)
+
+    md5 = hashlib.md5()
+    sha1 = hashlib.sha1()
+    chunks = []
+    for chunk in metadata_chunks:
+        encoded_chunk = chunk.encode()
+        md5.update(encoded_chunk)
+        sha1.update(encoded_chunk)
+        chunks.append(chunk)
+
+    metadata = ''.join(chunks)
+    metrics.add('RenderedCharacters', len(metadata))
+    return metadata, {
+        'md5': md5.hexdigest(),
+        'sha1': sha1.hexdigest(),
+    }
+
+
+def stream_release_maven_metadata(_, folder_content_keys):
+    # maven-metadata.xml is emitted piece by piece, without building any XML tree. The output is
+    # byte-identical to what ElementTree generates (with short_empty_elements=False).
+    # Every key belongs to the same artifact, hence the same version scheme
+    first_listed_version = parse_coordinate(folder_content_keys[0])
+    version_scheme = first_listed_version.version_scheme
+    versions_per_path = generate_versions(folder_content_keys)
+    latest_version = get_latest_version(versions_per_path, version_scheme)
+
+    yield XML_DECLARATION
+    yield '<metadata>'
+    yield _render_xml_element('groupId', first_listed_version.group_id)
+    yield _render_xml_element('artifactId', first_listed_version.artifact_id)
+    yield '<versioning>'
+    yield _render_xml_element('latest', latest_version)
+    yield _render_xml_element('release', '' if latest_version is None else latest_version)
+
+    yield '<versions>'
+    versions = _sort_versions_for_metadata(versions_per_path, version_scheme)
+    for index in range(0, len(versions), VERSIONS_PER_CHUNK):
+        yield ''.join(
+            _render_xml_element('version', version)
+            for version in versions[index:index + VERSIONS_PER_CHUNK]
+        )
+    yield '</versions>'
+
+    yield _render_xml_element('lastUpdated', generate_last_updated())
+    yield '</versioning>'
+    yield '</metadata>'
+
+
+def stream_snapshot_maven_metadata(bucket_name, version_folder_pom_keys):
+    # Clients resolve "0.30.0-SNAPSHOT" to the latest build, which is found by timestamp, then
+    # build number. Its POM tells the extension of the main artifact, which may not be uploaded
+    # yet. Classifiers (like "-sources.jar") are only known by listing the files of the build.
+    latest_pom_key = max(version_folder_pom_keys, key=_parse_snapshot_pom_file_name)
+    timestamp, build_number = _parse_snapshot_pom_file_name(latest_pom_key)
+    latest_pom = parse_coordinate(latest_pom_key)
+    version = latest_pom.version
+    value = '{}-{}-{}'.format(version[:-len(SNAPSHOT_VERSION_SUFFIX)], timestamp, build_number)
+    updated = datetime.strptime(timestamp, SNAPSHOT_FILE_TIMESTAMP).strftime(POM_TIMESTAMP)
+    extension = fetch_packaging(bucket_name, latest_pom_key)
+    classifiers_and_extensions = {('', extension), ('', 'pom')}
+    classifiers_and_extensions.update(list_snapshot_build_files(bucket_name, latest_pom_key))
+
+    yield XML_DECLARATION
+    yield '<metadata>'
+    yield _render_xml_element('groupId', latest_pom.group_id)
+    yield _render_xml_element('artifactId', latest_pom.artifact_id)
+    yield _render_xml_element('version', version)
+    yield '<versioning>'
+    yield '<snapshot>'
+    yield _render_xml_element('timestamp', timestamp)
+    yield _render_xml_element('buildNumber', str(build_number))
+    yield '</snapshot>'
+    yield _render_xml_element('lastUpdated', generate_last_updated())
+    yield '<snapshotVersions>'
+    for classifier, snapshot_extension in sorted(classifiers_and_extensions):
+        yield '<snapshotVersion>'
+        if classifier:
+            yield _render_xml_element('classifier', classifier)
+        yield _render_xml_element('extension', snapshot_extension)
+        yield _render_xml_element('value', value)
+        yield _render_xml_element('updated', updated)
+        yield '</snapshotVersion>'
+    yield '</snapshotVersions>'
+    yield '</versioning>'
+    yield '</metadata>'
+
+
+def list_snapshot_build_files(bucket_name, pom_key):
+    # Files of a build share the name of its POM: "browser-domains-0.30.0-20181030.164630-2"
+    # followed by ".aar", or "-sources.jar"... Checksums and signatures aren't listed.
+    build_prefix = pom_key[:-len('.pom')]
+    classifiers_and_extensions = set()
+    for file in s3.Bucket(bucket_name).objects.filter(Prefix=build_prefix):
+        suffix = file.key[len(build_prefix):]
+        if suffix.startswith('-'):
+            classifier, _, extension = suffix[1:].partition('.')
+        elif suffix.startswith('.'):
+            classifier, extension = '', suffix[1:]
+        else:
+            # Another build, like "-20" when looking for "-2"
+            continue
+        if extension and is_artifact(file.key):
+            classifiers_and_extensions.add((classifier, extension))
+    return classifiers_and_extensions
+
+
+def _parse_snapshot_pom_file_name(pom_key):
+    # Timestamps have a fixed width: they sort like strings
+    match = SNAPSHOT_POM_FILE_NAME_PATTERN.search(pom_key)
+    return match.group(1), int(match.group(2))
+
+
+def _sort_versions_for_metadata(versions_per_path, version_scheme=None):
+    versions_order = os.environ.get(VERSIONS_ORDER_ENV_VAR, None) or VERSIONS_ORDER_LEXICAL
+    if versions_order == VERSIONS_ORDER_LEXICAL:
+        return sorted(set(versions_per_path.values()))
+    elif versions_order == VERSIONS_ORDER_VERSION:
+        return sort_versions(versions_per_path, version_scheme)
+    raise ValueError('Unknown {}: "{}"'.format(VERSIONS_ORDER_ENV_VAR, versions_order))
+
+
+def _render_xml_element(tag, text):
+    return '<{tag}>{text}</{tag}>'.format(tag=tag, text='' if text is None else escape(text))
+
+
+def fetch_packaging(bucket_name, pom_key):
+    s3_client = s3.meta.client
+    cache_key = (bucket_name, pom_key)
+    cached_e_tag, cached_packaging = _packaging_per_pom.get(cache_key, (None, None))
+
+    # Feeding the POM range by range, to an incremental parser, lets us stop as soon as
+    # <packaging> is found. Nothing touches the disk.
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    depth = 0
+    e_tag = None
+    position = 0
+    while True:
+        arguments = {
+            'Bucket': bucket_name,
+            'Key': pom_key,
+            'Range': 'bytes={}-{}'.format(position, position + POM_RANGE_SIZE - 1),
+        }
+        if e_tag is not None:
+            # Next ranges must come from the same POM, even if it got overwritten meanwhile
+            arguments['IfMatch'] = e_tag
+        elif cached_e_tag is not None:
+            arguments['IfNoneMatch'] = cached_e_tag
+        try:
+            response = s3_client.get_object(**arguments)
+        except ClientError as e:
+            if e_tag is None and get_error_code(e) in ('304', 'NotModified'):
+                return cached_packaging
+            raise
+        e_tag = response['ETag']
+        data = response['Body'].read()
+        position += len(data)
+        parser.feed(data)
+
+        packaging, depth = _find_packaging(parser, depth)
+        if packaging is None and position >= _get_total_size(response):
+            parser.close()
+            packaging, depth = _find_packaging(parser, depth)
+            # Bug 1616010 - Jars don't necessarily specify a packaging `entry`
+            packaging = DEFAULT_PACKAGING if packaging is None else packaging
+        if packaging is not None:
+            break
+
+    with _packaging_cache_lock:
+        if len(_packaging_per_pom) >= PACKAGING_CACHE_SIZE:
+            # Drops the oldest entry
+            del _packaging_per_pom[next(iter(_packaging_per_pom))]
+        _packaging_per_pom[cache_key] = (e_tag, packaging)
+    return packaging
+
+
+def _find_packaging(parser, depth):
+    for event, element in parser.read_events():
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 0:
+            # </project>: there's no <packaging>
+            return DEFAULT_PACKAGING, depth
+        # Only a direct child of <project> counts, not the one of a <dependency>, for instance
+        if depth == 1 and element.tag.split('}')[-1] == 'packaging':
+            return (element.text or '').strip() or DEFAULT_PACKAGING, depth
+    return None, depth
+
+
+def _get_total_size(response):
+    # "bytes 0-4095/12345"
+    return int(response['ContentRange'].split('/')[-1])
 
 
 def generate_versions(folder_content_keys):
     return {
-        key: get_version(key) for key in folder_content_keys if key
+        coordinate.key: coordinate.version
+        for coordinate in parse_coordinates(filter(None, folder_content_keys))
     }
 
 
@@ -205,70 +905,79 @@ def generate_last_updated():
     return datetime.utcnow().strftime(POM_TIMESTAMP)
 
 
-def get_latest_version(versions_per_path):
-    maven_versions = [
-        _parse_version(version, path)
-        for path, version in versions_per_path.items()
-    ]
+@metrics.timed('VersionParsing')
+def get_latest_version(versions_per_path, version_scheme=None):
+    parsed_versions = parse_versions(versions_per_path, version_scheme)
 
-    if not maven_versions:
+    if not parsed_versions:
         return None
 
-    latest_version = reduce(lambda x, y: x if x >= y else y, maven_versions)
+    # max() keeps the first of equal versions, like the former pairwise reduction did
+    latest_version = max(parsed_versions.values())
     return str(latest_version)
 
 
-def _parse_version(version_string, path):
-    parse_func = MobileVersion.parse if path.startswith("maven2/org/mozilla/components/") \
-        else MavenVersion.parse
+def sort_versions(versions_per_path, version_scheme=None):
+    # Lexical order first, so that equal versions (like "1.0" and "1.0.0") stay deterministic
+    parsed_versions = parse_versions(versions_per_path, version_scheme)
+    return sorted(sorted(parsed_versions), key=parsed_versions.__getitem__)
+
+
+def parse_versions(versions_per_path, version_scheme=None):
+    # Several paths usually share the same version (.pom, .jar, .aar...). Each distinct version
+    # of the artifact is parsed once. Without a version scheme, paths may belong to several
+    # artifacts: the scheme is looked up for each of them.
+    repository_layout = get_repository_layout()
+    parsed_versions = {}
+    for path, version in versions_per_path.items():
+        if version not in parsed_versions:
+            parsed_versions[version] = _parse_version(
+                version, path, version_scheme or repository_layout.get_version_scheme_of_key(path)
+            )
+    return parsed_versions
+
+
+def _parse_version(version_string, path, version_scheme):
     try:
-        return parse_func(version_string)
+        return _parse_version_string(version_string, version_scheme)
     except PatternNotMatchedError as error:
         raise ValueError(
             '"{}" does not contain a valid version. See root error.'.format(path)
         ) from error
 
 
-def upload_s3_file(bucket_name, folder, file_name, data, content_type='text/plain'):
+# Warm Lambda invocations reuse this module, and therefore this cache. Parsed versions are
+# immutable, so they can safely be shared across invocations.
+@lru_cache(maxsize=PARSED_VERSIONS_CACHE_SIZE)
+def _parse_version_string(version_string, version_scheme):
+    return VERSION_CLASS_PER_SCHEME[version_scheme].parse(version_string)
+
+
+@metrics.timed('Upload')
+def upload_s3_file(bucket_name, folder, file_name, data, content_type='text/plain',
+                   metadata=None, write_conditions=None, content_encoding=None):
+    # write_conditions is what get_write_conditions() returned
     folder = folder.rstrip('/')
     key = '{}/{}'.format(folder, file_name)
-    s3.Object(bucket_name, key).put(Body=data, ContentType=content_type,
-                                    CacheControl='max-age=600')
+    extra_arguments = {} if metadata is None else {'Metadata': metadata}
+    if content_encoding is not None:
+        extra_arguments['ContentEncoding'] = content_encoding
+    if write_conditions:
+        extra_arguments.update(write_conditions)
+    # Encoded once, here, so that the metric counts bytes rather than characters
+    body = data.encode() if isinstance(data, str) else data
+    s3.Object(bucket_name, key).put(Body=body, ContentType=content_type,
+                                    CacheControl='max-age=600', **extra_arguments)
+    metrics.add('UploadedBytes', len(body), metrics.UNIT_BYTES)
     return key
 
 
+@metrics.timed('Invalidation')
 def invalidate_cloudfront_cache(paths):
-    sanitized_paths = [
-        path if path.startswith('/') else '/{}'.format(path) for path in paths
-    ]
-    number_of_paths = len(sanitized_paths)
-    print('Invalidating {} CloudFront paths: {}'.format(number_of_paths, sanitized_paths))
-
     distribution_id = os.environ.get('CLOUDFRONT_DISTRIBUTION_ID', None)
     if distribution_id:
-        request_id = slugid.nice()
-
-        try:
-            cloudfront.create_invalidation(
-                DistributionId=distribution_id,
-                InvalidationBatch={
-                    'Paths': {
-                        'Quantity': number_of_paths,
-                        'Items': sanitized_paths,
-                    },
-                    'CallerReference': request_id,
-                }
-            )
-        except ClientError as e:
-            print('WARN: Could not invalidate cache. Reason: {}'.format(e))
+        metrics.add('InvalidatedPaths', len(paths))
+        invalidation_batcher.add(paths)
+        invalidation_batcher.flush(cloudfront, distribution_id)
     else:
         print('CLOUDFRONT_DISTRIBUTION_ID not set. No cache to invalidate.')
-
-
-def generate_checksums(data):
-    if isinstance(data, str):
-        data = data.encode()
-    return {
-        'md5': hashlib.md5(data).hexdigest(),
-        'sha1': hashlib.sha1(data).hexdigest(),
-    }
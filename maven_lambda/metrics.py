@@ -0,0 +1,150 @@
+import json
+import os
+import threading
+import time
+
+from functools import wraps
+
+
+# Durations of each stage (listing, version parsing, rendering, uploads, invalidation) and what
+# they processed are summed over an invocation, then printed as a single line in CloudWatch's
+# Embedded Metric Format. CloudWatch turns that line into metrics, without any API call. See
+# https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format.html
+# When disabled, instrumented functions only check a global variable.
+METRICS_ENV_VAR = 'METRICS_ENABLED'
+NAMESPACE_ENV_VAR = 'METRICS_NAMESPACE'
+DEFAULT_NAMESPACE = 'MavenLambda'
+
+UNIT_COUNT = 'Count'
+UNIT_BYTES = 'Bytes'
+UNIT_MILLISECONDS = 'Milliseconds'
+
+# Only set during an invocation, when metrics are enabled
+_recorder = None
+
+
+class MetricsRecorder:
+    def __init__(self, namespace, function_name=None, properties=None):
+        self.namespace = namespace
+        self.dimensions = {} if function_name is None else {'FunctionName': function_name}
+        self.properties = {} if properties is None else dict(properties)
+        self._value_and_unit_per_name = {}
+        # Artifact folders are processed concurrently
+        self._lock = threading.Lock()
+
+    def add(self, name, value, unit=UNIT_COUNT):
+        with self._lock:
+            previous_value, _ = self._value_and_unit_per_name.get(name, (0, unit))
+            self._value_and_unit_per_name[name] = (previous_value + value, unit)
+
+    def get(self, name):
+        return self._value_and_unit_per_name.get(name, (0, None))[0]
+
+    def to_embedded_metric_format(self, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            value_and_unit_per_name = dict(sorted(self._value_and_unit_per_name.items()))
+
+        document = dict(self.properties)
+        document.update(self.dimensions)
+        document.update({name: value for name, (value, _) in value_and_unit_per_name.items()})
+        document['_aws'] = {
+            'Timestamp': int(timestamp * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': self.namespace,
+                'Dimensions': [sorted(self.dimensions)],
+                'Metrics': [
+                    {'Name': name, 'Unit': unit}
+                    for name, (_, unit) in value_and_unit_per_name.items()
+                ],
+            }],
+        }
+        return document
+
+
+def is_enabled():
+    return bool(os.environ.get(METRICS_ENV_VAR, None))
+
+
+def add(name, value, unit=UNIT_COUNT):
+    recorder = _recorder
+    if recorder is not None:
+        recorder.add(name, value, unit)
+
+
+def timed(stage):
+    # Records "<stage>Duration" and "<stage>Calls"
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            recorder = _recorder
+            if recorder is None:
+                return function(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                recorder.add(
+                    '{}Duration'.format(stage), (time.perf_counter() - start) * 1000,
+                    UNIT_MILLISECONDS
+                )
+                recorder.add('{}Calls'.format(stage), 1)
+        return wrapper
+    return decorator
+
+
+def record_invocation(get_clients_to_count=None):
+    # Decorates a lambda handler. get_clients_to_count() returns the boto3 clients whose API calls
+    # are counted, per metric name.
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(event, context):
+            if not is_enabled():
+                return handler(event, context)
+
+            start_recording(context)
+            if get_clients_to_count is not None:
+                for metric_name, client in get_clients_to_count().items():
+                    count_api_calls(client, metric_name)
+            start = time.perf_counter()
+            try:
+                return handler(event, context)
+            finally:
+                add('InvocationDuration', (time.perf_counter() - start) * 1000, UNIT_MILLISECONDS)
+                stop_recording()
+        return wrapper
+    return decorator
+
+
+def start_recording(context=None):
+    global _recorder
+    _recorder = MetricsRecorder(
+        os.environ.get(NAMESPACE_ENV_VAR, DEFAULT_NAMESPACE),
+        function_name=getattr(context, 'function_name', None) or
+        os.environ.get('AWS_LAMBDA_FUNCTION_NAME', None),
+        properties={'requestId': getattr(context, 'aws_request_id', None)},
+    )
+    return _recorder
+
+
+def stop_recording():
+    global _recorder
+    recorder = _recorder
+    _recorder = None
+    if recorder is not None:
+        print(json.dumps(recorder.to_embedded_metric_format(), separators=(',', ':')))
+    return recorder
+
+
+def count_api_calls(client, metric_name):
+    # Stand-ins don't have any event system
+    events = getattr(getattr(client, 'meta', None), 'events', None)
+    if events is None:
+        return
+    # Emitted once per API call, whether the response is then stubbed or retried. The unique id
+    # makes it safe to register at every invocation.
+    events.register(
+        'provide-client-params', lambda **kwargs: add(metric_name, 1),
+        unique_id='maven-lambda-metrics-{}'.format(metric_name)
+    )
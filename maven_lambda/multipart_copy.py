@@ -0,0 +1,147 @@
+import math
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+# A single CopyObject request can't copy more than 5 GiB, and large objects are copied faster by
+# copying several ranges at once. Above a threshold, objects are therefore copied with a multipart
+# upload whose parts are copied in parallel, server-side, with UploadPartCopy.
+# See https://docs.aws.amazon.com/AmazonS3/latest/userguide/qfacts.html
+MIN_PART_SIZE = 5 * 1024 ** 2
+MAX_PART_SIZE = 5 * 1024 ** 3
+MAX_NUMBER_OF_PARTS = 10000
+
+MULTIPART_THRESHOLD_ENV_VAR = 'MULTIPART_COPY_THRESHOLD_BYTES'
+DEFAULT_MULTIPART_THRESHOLD = 128 * 1024 ** 2
+PART_SIZE_ENV_VAR = 'MULTIPART_COPY_PART_SIZE_BYTES'
+DEFAULT_PART_SIZE = 64 * 1024 ** 2
+MAX_PART_COPY_WORKERS = 8
+
+# Headers that a multipart upload doesn't copy from its source, unlike CopyObject
+PRESERVED_HEAD_FIELDS = (
+    'CacheControl',
+    'ContentDisposition',
+    'ContentEncoding',
+    'ContentLanguage',
+    'ContentType',
+    'Expires',
+    'Metadata',
+)
+
+
+def get_multipart_threshold():
+    return int(os.environ.get(MULTIPART_THRESHOLD_ENV_VAR, DEFAULT_MULTIPART_THRESHOLD))
+
+
+def get_part_size():
+    return int(os.environ.get(PART_SIZE_ENV_VAR, DEFAULT_PART_SIZE))
+
+
+def copy_s3_object(
+    s3_client, source_bucket, key, target_bucket, size=None, multipart_threshold=None,
+    part_size=None, max_workers=MAX_PART_COPY_WORKERS
+):
+    multipart_threshold = get_multipart_threshold() if multipart_threshold is None \
+        else multipart_threshold
+
+    head = None
+    if size is None:
+        head = s3_client.head_object(Bucket=source_bucket, Key=key)
+        size = head['ContentLength']
+
+    if size == 0 or size < multipart_threshold:
+        s3_client.copy_object(
+            Bucket=target_bucket,
+            CopySource={
+                'Bucket': source_bucket,
+                'Key': key,
+            },
+            Key=key,
+        )
+        return
+
+    if head is None:
+        head = s3_client.head_object(Bucket=source_bucket, Key=key)
+    part_size = get_part_size() if part_size is None else part_size
+    copy_s3_object_in_parts(
+        s3_client, source_bucket, key, target_bucket, head, part_size, max_workers
+    )
+
+
+def copy_s3_object_in_parts(
+    s3_client, source_bucket, key, target_bucket, head, part_size, max_workers
+):
+    part_ranges = split_in_part_ranges(head['ContentLength'], part_size)
+    print('Copying "{}" ({} bytes) in {} parts'.format(
+        key, head['ContentLength'], len(part_ranges)
+    ))
+    upload_id = s3_client.create_multipart_upload(
+        Bucket=target_bucket, Key=key,
+        **{field: head[field] for field in PRESERVED_HEAD_FIELDS if field in head}
+    )['UploadId']
+
+    # Once a part fails, there's no need to copy the next ones: they would be thrown away
+    stop_copying = threading.Event()
+    try:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(part_ranges))) as executor:
+            futures = [
+                executor.submit(
+                    _copy_part, s3_client, source_bucket, key, target_bucket, upload_id,
+                    part_number, part_range, head['ETag'], stop_copying
+                )
+                for part_number, part_range in enumerate(part_ranges, start=1)
+            ]
+        # Raises the error of the failed part, if any
+        parts = [future.result() for future in futures]
+
+        s3_client.complete_multipart_upload(
+            Bucket=target_bucket, Key=key, UploadId=upload_id, MultipartUpload={'Parts': parts}
+        )
+    except Exception:
+        # Otherwise, S3 keeps (and bills) the parts that were already copied
+        print('Aborting multipart copy of "{}"'.format(key))
+        s3_client.abort_multipart_upload(Bucket=target_bucket, Key=key, UploadId=upload_id)
+        raise
+
+
+def split_in_part_ranges(size, part_size):
+    # S3 refuses more than 10000 parts, and parts outside of the [5 MiB, 5 GiB] range (except the
+    # last one, which may be smaller)
+    part_size = max(part_size, MIN_PART_SIZE, math.ceil(size / MAX_NUMBER_OF_PARTS))
+    part_size = min(part_size, MAX_PART_SIZE)
+    return [
+        (start, min(start + part_size, size) - 1)
+        for start in range(0, size, part_size)
+    ]
+
+
+def _copy_part(
+    s3_client, source_bucket, key, target_bucket, upload_id, part_number, part_range, e_tag,
+    stop_copying
+):
+    if stop_copying.is_set():
+        return None
+
+    try:
+        response = s3_client.upload_part_copy(
+            Bucket=target_bucket,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            CopySource={
+                'Bucket': source_bucket,
+                'Key': key,
+            },
+            CopySourceRange='bytes={}-{}'.format(*part_range),
+            # Fails if the source gets overwritten in the middle of the copy
+            CopySourceIfMatch=e_tag,
+        )
+    except Exception:
+        stop_copying.set()
+        raise
+    return {
+        'ETag': response['CopyPartResult']['ETag'],
+        'PartNumber': part_number,
+    }
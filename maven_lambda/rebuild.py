@@ -0,0 +1,423 @@
+"""Regenerate maven-metadata.xml for every artifact folder of a bucket.
+
+Usage: python -m maven_lambda.rebuild --bucket some-bucket [--checkpoint rebuild.jsonl]
+           [--inventory s3://inventory-bucket --inventory-manifest path/to/manifest.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+from maven_lambda import metadata
+from maven_lambda.catalog import build_catalog_shard, get_catalog_shard_key, upload_catalog_shard
+from maven_lambda.conditional_writes import wait_before_retrying
+from maven_lambda.coordinates import parse_coordinate, parse_coordinates
+from maven_lambda.inventory import Inventory, InventoryError
+from maven_lambda.listing import discover_shards, iterate_objects
+from maven_lambda.metadata import (
+    CATALOG_PREFIX_ENV_VAR,
+    MAX_METADATA_WRITE_ATTEMPTS,
+    ConcurrentUpdateError,
+    fetch_metadata_head,
+    fetch_metadata_state,
+    forget_content_hash,
+    generate_catalog_entry,
+    generate_content_hash,
+    generate_metadata_and_checksums,
+    get_metadata_state,
+    invalidate_cloudfront_cache,
+    list_pom_files_in_subfolders,
+    regenerate_snapshot_version_folders,
+    stream_release_maven_metadata,
+    upload_maven_metadata,
+)
+
+
+# A full rebuild lists the whole repository once, instead of listing each artifact folder. The
+# listing is sharded by prefix, so that shards can be listed concurrently (see listing.py).
+# Then, rendering maven-metadata.xml (CPU-bound) happens in a process pool, while S3 requests
+# (I/O-bound) happen in a thread pool.
+DEFAULT_PREFIX = 'maven2/'
+DEFAULT_SHARD_DEPTH = 3
+DEFAULT_IO_WORKERS = 16
+DEFAULT_RENDER_WORKERS = os.cpu_count() or 1
+# The lambda keeps publishing while the repository is rebuilt. An artifact folder is listed
+# again, live, if its maven-metadata.xml changed since the listing started: otherwise, the
+# listing would overwrite versions published meanwhile. LastModified comes from the clock of S3,
+# hence a margin.
+CLOCK_SKEW_MARGIN = 60
+# The listing can come from an S3 Inventory instead (see inventory.py). An artifact folder is
+# listed again if its maven-metadata.xml is missing, or changed after the inventory was created,
+# or shortly before (S3 doesn't guarantee that inventories hold the latest changes). Folders that
+# only appeared since are left aside: their maven-metadata.xml was generated from a live listing
+# anyway.
+DEFAULT_RECENT_CHANGES_WINDOW = 24 * 60 * 60
+
+
+class RebuildReport:
+    def __init__(self):
+        self.number_of_shards = 0
+        self.number_of_listed_keys = 0
+        self.listing_duration = 0
+        self.number_of_folders_per_status = {
+            'updated': 0,
+            'unchanged': 0,
+            'failed': 0,
+            'skipped': 0,
+        }
+        self.number_of_relisted_folders = 0
+        self.failed_folders = []
+        self.uploaded_files = []
+        self.duration = 0
+
+    @property
+    def number_of_processed_folders(self):
+        return sum(
+            number for status, number in self.number_of_folders_per_status.items()
+            if status != 'skipped'
+        )
+
+    def add_result(self, result):
+        self.number_of_folders_per_status[result['status']] += 1
+        self.uploaded_files.extend(result['uploadedFiles'])
+        if result.get('relisted'):
+            self.number_of_relisted_folders += 1
+        if result['status'] == 'failed':
+            self.failed_folders.append(result['artifactFolder'])
+
+    def to_dict(self):
+        return {
+            'shards': self.number_of_shards,
+            'listedKeys': self.number_of_listed_keys,
+            'listingDuration': self.listing_duration,
+            'artifactFolders': dict(self.number_of_folders_per_status),
+            'relistedFolders': self.number_of_relisted_folders,
+            'failedFolders': list(self.failed_folders),
+            'duration': self.duration,
+            'foldersPerSecond': self.number_of_processed_folders / self.duration
+            if self.duration else 0,
+        }
+
+    def print_summary(self):
+        print('Listed {} keys in {} shard(s) in {:.1f}s'.format(
+            self.number_of_listed_keys, self.number_of_shards, self.listing_duration
+        ))
+        print('Processed {} artifact folder(s) in {:.1f}s ({:.1f} folders/s)'.format(
+            self.number_of_processed_folders, self.duration, self.to_dict()['foldersPerSecond']
+        ))
+        print(', '.join(
+            '{}: {}'.format(status, number)
+            for status, number in self.number_of_folders_per_status.items()
+        ))
+        if self.number_of_relisted_folders:
+            print('Listed {} artifact folder(s) again, because they changed since the '
+                  'listing'.format(self.number_of_relisted_folders))
+        for folder in self.failed_folders:
+            print('Failed: {}'.format(folder))
+
+
+def rebuild_repository(
+    bucket_name, prefix=DEFAULT_PREFIX, shard_depth=DEFAULT_SHARD_DEPTH,
+    io_workers=DEFAULT_IO_WORKERS, render_workers=DEFAULT_RENDER_WORKERS, checkpoint_path=None,
+    inventory=None, recent_changes_window=DEFAULT_RECENT_CHANGES_WINDOW
+):
+    start = time.perf_counter()
+    report = RebuildReport()
+    bucket = metadata.s3.Bucket(bucket_name)
+    if inventory is not None and inventory.source_bucket != bucket_name:
+        raise InventoryError('The inventory lists "{}", not "{}"'.format(
+            inventory.source_bucket, bucket_name
+        ))
+    if inventory is None:
+        changed_since = datetime.now(timezone.utc) - timedelta(seconds=CLOCK_SKEW_MARGIN)
+    else:
+        changed_since = inventory.created_at - timedelta(seconds=recent_changes_window)
+    done_folders = load_checkpoint(checkpoint_path) if checkpoint_path else set()
+
+    # Rendering happens in the I/O threads when there's no process pool
+    render_executor = ProcessPoolExecutor(render_workers) if render_workers > 0 else None
+    checkpoint_file = _open_checkpoint(checkpoint_path) if checkpoint_path else None
+    try:
+        with ThreadPoolExecutor(max_workers=io_workers) as io_executor:
+            if inventory is None:
+                pom_files_per_artifact_folder = list_pom_files_per_artifact_folder(
+                    bucket, prefix, shard_depth, io_executor, report
+                )
+            else:
+                pom_files_per_artifact_folder = list_pom_files_per_artifact_folder_from_inventory(
+                    inventory, prefix, report
+                )
+            report.listing_duration = time.perf_counter() - start
+
+            pending_futures = set()
+            for artifact_folder, pom_files in sorted(pom_files_per_artifact_folder.items()):
+                if artifact_folder in done_folders:
+                    report.number_of_folders_per_status['skipped'] += 1
+                    continue
+                pending_futures.add(io_executor.submit(
+                    rebuild_artifact_folder, bucket_name, artifact_folder, pom_files,
+                    render_executor, changed_since, inventory is not None
+                ))
+
+            while pending_futures:
+                done_futures, pending_futures = wait(pending_futures, return_when=FIRST_COMPLETED)
+                for future in done_futures:
+                    result = future.result()
+                    report.add_result(result)
+                    if checkpoint_file and result['status'] != 'failed':
+                        write_checkpoint(checkpoint_file, result)
+
+            catalog_prefix = os.environ.get(CATALOG_PREFIX_ENV_VAR, None)
+            if catalog_prefix:
+                report.uploaded_files.extend(rebuild_catalog(
+                    bucket, catalog_prefix, pom_files_per_artifact_folder, io_executor
+                ))
+    finally:
+        if checkpoint_file:
+            checkpoint_file.close()
+        if render_executor:
+            render_executor.shutdown()
+
+    if report.uploaded_files:
+        invalidate_cloudfront_cache(report.uploaded_files)
+
+    report.duration = time.perf_counter() - start
+    return report
+
+
+def list_pom_files_per_artifact_folder(bucket, prefix, shard_depth, executor, report):
+    s3_client = bucket.meta.client
+    shards = discover_shards(
+        s3_client, bucket.name, '{}/'.format(prefix.rstrip('/')) if prefix else '', shard_depth,
+        executor
+    )
+    report.number_of_shards = len([shard for shard in shards if shard[0] == 'prefix'])
+
+    # An artifact folder may span several shards if shard_depth goes deeper than it
+    return group_pom_files_per_artifact_folder(
+        iterate_objects(s3_client, bucket.name, shards=shards, executor=executor), report
+    )
+
+
+def list_pom_files_per_artifact_folder_from_inventory(inventory, prefix, report):
+    return group_pom_files_per_artifact_folder(inventory.iterate_objects(prefix or ''), report)
+
+
+def group_pom_files_per_artifact_folder(contents, report):
+    # Same .pom files as list_pom_files_in_subfolders() finds, folder by folder
+    def iterate_pom_files():
+        for content in contents:
+            report.number_of_listed_keys += 1
+            if content['Key'].endswith('.pom'):
+                yield content['Key']
+
+    pom_files_per_artifact_folder = {}
+    for pom_file in parse_coordinates(iterate_pom_files()):
+        pom_files_per_artifact_folder.setdefault(pom_file.artifact_folder, []).append(
+            pom_file.key
+        )
+    return pom_files_per_artifact_folder
+
+
+def rebuild_catalog(bucket, catalog_prefix, pom_files_per_artifact_folder, executor):
+    # The full listing is authoritative: every shard is overwritten, which also drops the
+    # artifacts that don't exist anymore
+    entries_per_artifact_id_per_group_id = {}
+    for artifact_folder, pom_files in sorted(pom_files_per_artifact_folder.items()):
+        first_pom_file = parse_coordinate(pom_files[0])
+        group_id = first_pom_file.group_id
+        try:
+            get_catalog_shard_key(catalog_prefix, group_id)
+            entry = generate_catalog_entry(pom_files)
+        except ValueError as e:
+            print('WARN: Not adding "{}" to the catalog: {}'.format(artifact_folder, e))
+            continue
+        entries_per_artifact_id = entries_per_artifact_id_per_group_id.setdefault(group_id, {})
+        entries_per_artifact_id[first_pom_file.artifact_id] = entry
+
+    return list(executor.map(
+        lambda item: upload_catalog_shard(
+            metadata.s3.Bucket(bucket.name), get_catalog_shard_key(catalog_prefix, item[0]),
+            build_catalog_shard(*item)
+        ),
+        sorted(entries_per_artifact_id_per_group_id.items())
+    ))
+
+
+def rebuild_artifact_folder(
+    bucket_name, artifact_folder, pom_files, render_executor=None, changed_since=None,
+    from_inventory=False
+):
+    # changed_since is when pom_files stop being trustworthy. A live listing holds every folder
+    # that existed then, but an inventory may miss .pom files of folders without
+    # maven-metadata.xml.
+    result = {
+        'bucket': bucket_name,
+        'artifactFolder': artifact_folder,
+        'status': 'failed',
+        'uploadedFiles': [],
+    }
+    try:
+        metadata_state = None
+        if changed_since is not None:
+            head_response = fetch_metadata_head(bucket_name, artifact_folder)
+            metadata_state = get_metadata_state(head_response)
+            if (
+                head_response is None and from_inventory or
+                head_response is not None and head_response['LastModified'] >= changed_since
+            ):
+                pom_files = list_pom_files_in_subfolders(
+                    metadata.s3.Bucket(bucket_name), artifact_folder
+                )
+                result['relisted'] = True
+                if not pom_files:
+                    # The artifact got deleted since
+                    result['status'] = 'unchanged'
+                    return result
+
+        for attempt in range(MAX_METADATA_WRITE_ATTEMPTS):
+            if render_executor is None:
+                rendered_metadata = render_artifact_folder(pom_files)
+            else:
+                rendered_metadata = render_executor.submit(
+                    render_artifact_folder, pom_files
+                ).result()
+            try:
+                uploaded_files = upload_maven_metadata(
+                    bucket_name, artifact_folder, *rendered_metadata,
+                    metadata_state=metadata_state
+                )
+                break
+            except ConcurrentUpdateError as e:
+                # Same as craft_and_upload_maven_metadata(): the lambda replaced maven-metadata.xml
+                # meanwhile, and may know .pom files this listing doesn't
+                if attempt + 1 == MAX_METADATA_WRITE_ATTEMPTS:
+                    forget_content_hash(bucket_name, artifact_folder)
+                    raise
+                delay = wait_before_retrying(attempt, metadata.METADATA_WRITE_BASE_DELAY)
+                print('{}. Listing again in {:.2f}s'.format(e, delay))
+                e_tag, _ = fetch_metadata_state(bucket_name, artifact_folder)
+                # Checksums of the lost attempt may have replaced the ones of maven-metadata.xml
+                metadata_state = (e_tag, None)
+                pom_files = list_pom_files_in_subfolders(
+                    metadata.s3.Bucket(bucket_name), artifact_folder
+                )
+                result['relisted'] = True
+                if not pom_files:
+                    result['status'] = 'unchanged'
+                    return result
+        uploaded_files += regenerate_snapshot_version_folders(
+            metadata.s3.Bucket(bucket_name), pom_files,
+            changed_since=None if result.get('relisted') else changed_since
+        )
+    except Exception as e:
+        print('Could not rebuild "{}": {}'.format(artifact_folder, e))
+        result['error'] = str(e)
+        return result
+
+    result['status'] = 'updated' if uploaded_files else 'unchanged'
+    result['uploadedFiles'] = uploaded_files
+    return result
+
+
+def render_artifact_folder(pom_files):
+    # Runs in a worker process: it must only depend on its arguments
+    rendered_metadata, checksums = generate_metadata_and_checksums(
+        stream_release_maven_metadata(None, sorted(pom_files))
+    )
+    return rendered_metadata, checksums, generate_content_hash(rendered_metadata)
+
+
+def load_checkpoint(checkpoint_path):
+    done_folders = set()
+    if not os.path.exists(checkpoint_path):
+        return done_folders
+
+    with open(checkpoint_path) as f:
+        for line in f:
+            try:
+                done_folders.add(json.loads(line)['artifactFolder'])
+            except (ValueError, KeyError):
+                # The previous run may have been interrupted in the middle of a line
+                print('WARN: Ignoring invalid checkpoint line: {}'.format(line.rstrip()))
+    return done_folders
+
+
+def _open_checkpoint(checkpoint_path):
+    needs_new_line = False
+    if os.path.exists(checkpoint_path) and os.path.getsize(checkpoint_path) > 0:
+        with open(checkpoint_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            # Don't append to a line the previous run didn't finish
+            needs_new_line = f.read() != b'\n'
+
+    checkpoint_file = open(checkpoint_path, 'a')
+    if needs_new_line:
+        checkpoint_file.write('\n')
+    return checkpoint_file
+
+
+def write_checkpoint(checkpoint_file, result):
+    checkpoint_file.write('{}\n'.format(json.dumps({
+        'artifactFolder': result['artifactFolder'],
+        'status': result['status'],
+    })))
+    # Makes sure the checkpoint survives if the rebuild gets interrupted
+    checkpoint_file.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bucket', required=True)
+    parser.add_argument('--prefix', default=DEFAULT_PREFIX)
+    parser.add_argument(
+        '--shard-depth', type=int, default=DEFAULT_SHARD_DEPTH,
+        help='Number of folder levels under --prefix the listing is sharded on'
+    )
+    parser.add_argument(
+        '--io-workers', type=int, default=DEFAULT_IO_WORKERS,
+        help='Number of threads sending S3 requests'
+    )
+    parser.add_argument(
+        '--render-workers', type=int, default=DEFAULT_RENDER_WORKERS,
+        help='Number of processes rendering maven-metadata.xml. 0 renders in the I/O threads.'
+    )
+    parser.add_argument(
+        '--checkpoint',
+        help='File recording every rebuilt artifact folder. They are skipped when resuming.'
+    )
+    parser.add_argument(
+        '--inventory',
+        help='Where the S3 Inventory of --bucket is: "s3://some-inventory-bucket", or a local '
+        'copy of it. The bucket is then not listed.'
+    )
+    parser.add_argument(
+        '--inventory-manifest',
+        help='Key of the manifest.json of the inventory, like '
+        '"some-bucket/some-inventory/2019-09-01T00-00Z/manifest.json"'
+    )
+    parser.add_argument(
+        '--recent-changes-window', type=int, default=DEFAULT_RECENT_CHANGES_WINDOW,
+        help='Artifact folders changed up to this many seconds before the inventory was created '
+        '(or after) are listed again'
+    )
+    args = parser.parse_args(argv)
+    if bool(args.inventory) != bool(args.inventory_manifest):
+        parser.error('--inventory and --inventory-manifest go together')
+
+    inventory = None if args.inventory is None else Inventory.from_location(
+        args.inventory, args.inventory_manifest, metadata.s3.meta.client
+    )
+    report = rebuild_repository(
+        args.bucket, args.prefix, args.shard_depth, args.io_workers, args.render_workers,
+        args.checkpoint, inventory, args.recent_changes_window
+    )
+    report.print_summary()
+    return 1 if report.failed_folders else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
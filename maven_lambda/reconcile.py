@@ -0,0 +1,203 @@
+"""Copy the objects a source bucket has but its target bucket misses, or holds a different copy of.
+
+Usage: python -m maven_lambda.reconcile --source-bucket some-bucket --target-bucket other-bucket
+"""
+import argparse
+import json
+import sys
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from maven_lambda import copy_to_bucket
+from maven_lambda.listing import (
+    DEFAULT_MAX_SHARDS_IN_FLIGHT,
+    DEFAULT_SHARD_DEPTH,
+    iterate_objects,
+)
+
+
+# copy_to_bucket only reacts to S3 events: a missed or failed event leaves the target bucket out
+# of sync. Reconciling lists both buckets, as sorted streams of (key, size, ETag), and merges them
+# like a sort-merge join. Neither bucket is held in memory.
+DEFAULT_PREFIX = 'maven2/'
+DEFAULT_COPY_WORKERS = 16
+
+STATUS_MISSING = 'missing'
+STATUS_CHANGED = 'changed'
+STATUS_EXTRA = 'extra'
+
+STATUS_PER_STATUS_CODE = {
+    200: 'copied',
+    404: 'notFound',
+    409: 'conflicting',
+    500: 'failed',
+}
+
+
+class ReconciliationReport:
+    def __init__(self):
+        self.number_of_objects_per_status = {
+            'identical': 0,
+            STATUS_MISSING: 0,
+            STATUS_CHANGED: 0,
+            STATUS_EXTRA: 0,
+        }
+        self.number_of_copies_per_status = {
+            status: 0 for status in STATUS_PER_STATUS_CODE.values()
+        }
+        self.duration = 0
+
+    def to_dict(self):
+        return {
+            'objects': dict(self.number_of_objects_per_status),
+            'copies': dict(self.number_of_copies_per_status),
+            'duration': self.duration,
+        }
+
+    def print_summary(self):
+        number_of_compared_objects = sum(self.number_of_objects_per_status.values())
+        print('Compared {} object(s) in {:.1f}s ({:.0f} objects/s)'.format(
+            number_of_compared_objects, self.duration,
+            number_of_compared_objects / self.duration if self.duration else 0
+        ))
+        for counts in (self.number_of_objects_per_status, self.number_of_copies_per_status):
+            print(', '.join('{}: {}'.format(status, number) for status, number in counts.items()))
+
+
+def to_manifest_entry(content):
+    # Compact: that's all the diff needs
+    return content['Key'], content['Size'], content['ETag'].strip('"')
+
+
+def iterate_manifest(s3_client, bucket_name, prefix, shard_depth, max_shards_in_flight):
+    for content in iterate_objects(
+        s3_client, bucket_name, prefix, shard_depth, max_shards_in_flight
+    ):
+        yield to_manifest_entry(content)
+
+
+def diff_manifests(source_manifest, target_manifest):
+    # Both manifests must be sorted by key. Identical objects are yielded too, with a None status,
+    # so that callers can count them.
+    source_entry = next(source_manifest, None)
+    target_entry = next(target_manifest, None)
+    while source_entry is not None or target_entry is not None:
+        if target_entry is None or (
+            source_entry is not None and source_entry[0] < target_entry[0]
+        ):
+            yield STATUS_MISSING, source_entry
+            source_entry = next(source_manifest, None)
+        elif source_entry is None or target_entry[0] < source_entry[0]:
+            yield STATUS_EXTRA, target_entry
+            target_entry = next(target_manifest, None)
+        else:
+            status = None if are_same_objects(source_entry, target_entry) else STATUS_CHANGED
+            yield status, source_entry
+            source_entry = next(source_manifest, None)
+            target_entry = next(target_manifest, None)
+
+
+def are_same_objects(source_entry, target_entry):
+    _, source_size, source_e_tag = source_entry
+    _, target_size, target_e_tag = target_entry
+    if source_size != target_size:
+        return False
+    # The ETag of a multipart object isn't the MD5 of its content, and it depends on the part
+    # size. Objects copied in parts (see multipart_copy) can therefore only be compared by size.
+    if '-' in source_e_tag or '-' in target_e_tag:
+        return True
+    return source_e_tag == target_e_tag
+
+
+def reconcile_buckets(
+    source_bucket, target_bucket, prefix=DEFAULT_PREFIX, shard_depth=DEFAULT_SHARD_DEPTH,
+    max_shards_in_flight=DEFAULT_MAX_SHARDS_IN_FLIGHT, copy_workers=DEFAULT_COPY_WORKERS,
+    dry_run=False, diff_file=None
+):
+    start = time.perf_counter()
+    report = ReconciliationReport()
+    s3_client = copy_to_bucket.s3
+
+    differences = diff_manifests(
+        iterate_manifest(s3_client, source_bucket, prefix, shard_depth, max_shards_in_flight),
+        iterate_manifest(s3_client, target_bucket, prefix, shard_depth, max_shards_in_flight),
+    )
+    with ThreadPoolExecutor(max_workers=copy_workers) as executor:
+        pending_futures = set()
+        for status, (key, size, _) in differences:
+            if status is None:
+                report.number_of_objects_per_status['identical'] += 1
+                continue
+            report.number_of_objects_per_status[status] += 1
+            if diff_file is not None:
+                diff_file.write('{}\n'.format(json.dumps({'key': key, 'status': status})))
+            # Extra objects are reported, but never deleted
+            if status == STATUS_EXTRA or dry_run:
+                continue
+
+            pending_futures.add(executor.submit(
+                _try_to_copy_object, target_bucket, source_bucket, key, size
+            ))
+            # Bounds memory, whatever the number of differences
+            if len(pending_futures) >= copy_workers * 2:
+                done_futures, pending_futures = wait(pending_futures, return_when=FIRST_COMPLETED)
+                _add_copy_results(report, done_futures)
+        _add_copy_results(report, pending_futures)
+
+    report.duration = time.perf_counter() - start
+    return report
+
+
+def _try_to_copy_object(target_bucket, source_bucket, key, size):
+    # Same rules as copy_to_bucket: objects with several versions in the source bucket aren't
+    # copied (409)
+    try:
+        return key, copy_to_bucket.copy_object(target_bucket, source_bucket, key, size)
+    except Exception as e:
+        print('Could not copy "{}": {}'.format(key, e))
+        return key, 500
+
+
+def _add_copy_results(report, futures):
+    for future in futures:
+        key, status_code = future.result()
+        status = STATUS_PER_STATUS_CODE[status_code]
+        report.number_of_copies_per_status[status] += 1
+        if status_code != 200:
+            print('Did not copy "{}": {}'.format(key, status))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--source-bucket', required=True)
+    parser.add_argument('--target-bucket', required=True)
+    parser.add_argument('--prefix', default=DEFAULT_PREFIX)
+    parser.add_argument(
+        '--shard-depth', type=int, default=DEFAULT_SHARD_DEPTH,
+        help='Number of folder levels under --prefix the listings are sharded on'
+    )
+    parser.add_argument(
+        '--listing-workers', type=int, default=DEFAULT_MAX_SHARDS_IN_FLIGHT,
+        help='Number of shards listed concurrently, per bucket'
+    )
+    parser.add_argument('--copy-workers', type=int, default=DEFAULT_COPY_WORKERS)
+    parser.add_argument('--dry-run', action='store_true', help='Only report differences')
+    parser.add_argument('--diff-output', help='JSON-lines file listing every difference')
+    args = parser.parse_args(argv)
+
+    diff_file = open(args.diff_output, 'w') if args.diff_output else None
+    try:
+        report = reconcile_buckets(
+            args.source_bucket, args.target_bucket, args.prefix, args.shard_depth,
+            args.listing_workers, args.copy_workers, args.dry_run, diff_file
+        )
+    finally:
+        if diff_file is not None:
+            diff_file.close()
+
+    report.print_summary()
+    return 1 if report.number_of_copies_per_status['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
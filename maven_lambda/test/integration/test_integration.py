@@ -85,6 +85,7 @@ from maven_lambda.copy_to_bucket import lambda_handler as copy_lambda_handler
                 "</metadata>"
             ),
             'xml_key': 'maven2/org/mozilla/geckoview/geckoview-nightly-x86/maven-metadata.xml',
+            'xml_content_hash': '47563e7f7a441a44c7bee14fd7f5c307d44f2565',
         },
     },
     [
@@ -171,6 +172,7 @@ from maven_lambda.copy_to_bucket import lambda_handler as copy_lambda_handler
                 "</metadata>"
             ),
             'xml_key': 'maven2/org/mozilla/geckoview/geckoview-nightly-x86/maven-metadata.xml',
+            'xml_content_hash': '47563e7f7a441a44c7bee14fd7f5c307d44f2565',
         },
     },
     [
@@ -207,7 +209,8 @@ def test_metadata_lambda_handler(monkeypatch, inserted_key, bucket_keys, expecte
 </project>''')
 
     bucket_mock.download_file.side_effect = fake_download
-    bucket_mock.objects.filter.return_value = [MagicMock(key=key) for key in bucket_keys]
+    paginate_mock = bucket_mock.meta.client.get_paginator.return_value.paginate
+    paginate_mock.return_value = [{'Contents': [{'Key': key} for key in bucket_keys]}]
     s3_mock.Bucket.return_value = bucket_mock
 
     object_mock = MagicMock()
@@ -222,15 +225,15 @@ def test_metadata_lambda_handler(monkeypatch, inserted_key, bucket_keys, expecte
 
     metadata_lambda_handler(event, context)
 
-    bucket_mock.objects.filter.assert_called_once_with(Prefix=expected_prefix)
+    paginate_mock.assert_called_once_with(Bucket='some_bucket_name', Prefix=expected_prefix)
 
     for expected_item in expected_metadata.values():
         assert call('some_bucket_name', expected_item['xml_key']) in s3_mock.Object.call_args_list
-        assert call(Body=expected_item['xml_data'], ContentType='text/xml', CacheControl='max-age=600') in object_mock.put.call_args_list
+        assert call(Body=expected_item['xml_data'].encode(), ContentType='text/xml', CacheControl='max-age=600', Metadata={'content-sha1': expected_item['xml_content_hash']}) in object_mock.put.call_args_list
         assert call('some_bucket_name', expected_item['md5_key']) in s3_mock.Object.call_args_list
-        assert call(Body=expected_item['md5_data'], ContentType='text/plain', CacheControl='max-age=600') in object_mock.put.call_args_list
+        assert call(Body=expected_item['md5_data'].encode(), ContentType='text/plain', CacheControl='max-age=600') in object_mock.put.call_args_list
         assert call('some_bucket_name', expected_item['sha1_key']) in s3_mock.Object.call_args_list
-        assert call(Body=expected_item['sha1_data'], ContentType='text/plain', CacheControl='max-age=600') in object_mock.put.call_args_list
+        assert call(Body=expected_item['sha1_data'].encode(), ContentType='text/plain', CacheControl='max-age=600') in object_mock.put.call_args_list
 
     expected_call_count = len(expected_metadata) * 3
     assert s3_mock.Object.call_count == expected_call_count
@@ -253,7 +256,7 @@ def s3_event():
         "Records": [{
             "s3": {
                 "bucket": {"name": "source_bucket"},
-                "object": {"key": "object_key"},
+                "object": {"key": "object_key", "size": 1234},
             }
         }]
     }
@@ -261,36 +264,39 @@ def s3_event():
 def test_copy_lambda_handler_not_found(s3_event):
     import os
     os.environ["TARGET_BUCKET"] = target_bucket = 'foo'
-    import boto3
     s3 = MagicMock()
-    boto3.client = MagicMock(return_value=s3)
+    maven_lambda.copy_to_bucket.s3 = s3
     def f(*args):
         raise maven_lambda.copy_to_bucket.NotFound()
     maven_lambda.copy_to_bucket.s3_object_has_more_than_one_version = f
-    assert copy_lambda_handler(s3_event, {}) == {"statusCode": 404}
+    assert copy_lambda_handler(s3_event, {}) == {"results": [
+        {"bucket": "source_bucket", "key": "object_key", "statusCode": 404},
+    ]}
 
 
 def test_copy_lambda_handler_conflict(s3_event):
     import os
     os.environ["TARGET_BUCKET"] = target_bucket = 'foo'
-    import boto3
     s3 = MagicMock()
-    boto3.client = MagicMock(return_value=s3)
+    maven_lambda.copy_to_bucket.s3 = s3
     def f(*args):
         return True
     maven_lambda.copy_to_bucket.s3_object_has_more_than_one_version = f
-    assert copy_lambda_handler(s3_event, {}) == {"statusCode": 409}
+    assert copy_lambda_handler(s3_event, {}) == {"results": [
+        {"bucket": "source_bucket", "key": "object_key", "statusCode": 409},
+    ]}
 
 def test_copy_lambda_handler_conflict(s3_event):
     import os
     os.environ["TARGET_BUCKET"] = target_bucket = 'foo'
-    import boto3
     s3 = MagicMock()
-    boto3.client = MagicMock(return_value=s3)
+    maven_lambda.copy_to_bucket.s3 = s3
     def f(*args):
         return False
     maven_lambda.copy_to_bucket.s3_object_has_more_than_one_version = f
-    assert copy_lambda_handler(s3_event, {}) == {"statusCode": 200}
+    assert copy_lambda_handler(s3_event, {}) == {"results": [
+        {"bucket": "source_bucket", "key": "object_key", "statusCode": 200},
+    ]}
     s3.copy_object.assert_called_once_with(
         Bucket=target_bucket,
         CopySource={
@@ -0,0 +1,808 @@
+import bisect
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+from botocore.exceptions import ClientError
+from collections import Counter
+from datetime import datetime, timezone
+from maven_lambda.work_queue import WorkQueue, get_drain_thresholds
+
+
+# In-memory stand-ins of the AWS services used by maven-lambda. They implement the subset of the
+# boto3 API the lambdas rely on, and count every call, so that tests and benchmarks can tell how
+# many requests a given code path would send to AWS. Requests can be slowed down with latency
+# (in seconds), like a real round trip would, and throttled.
+
+# See https://docs.aws.amazon.com/AmazonS3/latest/userguide/qfacts.html
+MAX_COPY_OBJECT_SIZE = 5 * 1024 ** 3
+MIN_PART_SIZE = 5 * 1024 ** 2
+
+
+class S3ClientStandIn:
+    def __init__(
+        self, max_keys=1000, max_copy_object_size=MAX_COPY_OBJECT_SIZE, latency=0, throttle_every=0
+    ):
+        self.max_keys = max_keys
+        # Lowering it lets tests exercise what happens to large objects without allocating them
+        self.max_copy_object_size = max_copy_object_size
+        self.latency = latency
+        # Every throttle_every-th request fails with SlowDown, like S3 does beyond its request rate
+        self.throttle_every = throttle_every
+        self.throttled_calls = 0
+        self._number_of_requests = 0
+        self.calls = Counter()
+        self.listed_entries = 0
+        self._objects_per_bucket = {}
+        self._sorted_keys_per_bucket = {}
+        # Buckets are unversioned until put_bucket_versioning() enables versioning. Every version
+        # of a key (delete markers included) is kept, newest first.
+        self._versioning_status_per_bucket = {}
+        self._versions_per_bucket = {}
+        self._sorted_versioned_keys_per_bucket = {}
+        self._version_counter = 0
+        # Ongoing multipart uploads, per upload id
+        self.multipart_uploads = {}
+        # UploadPartCopy fails for these part numbers
+        self.failing_part_numbers = set()
+        self._upload_counter = 0
+        # Lambdas send requests from several threads
+        self._lock = threading.Lock()
+
+    def put_object(
+        self, Bucket, Key, Body=b'', ContentType='binary/octet-stream', IfMatch=None,
+        IfNoneMatch=None, **kwargs
+    ):
+        self._record_call('PutObject')
+        if isinstance(Body, str):
+            Body = Body.encode()
+        elif not isinstance(Body, bytes):
+            Body = Body.read()
+        object_ = {
+            'Body': Body,
+            'ContentType': ContentType,
+            'ETag': '"{}"'.format(hashlib.md5(Body).hexdigest()),
+            'Metadata': kwargs.get('Metadata', {}),
+            'CacheControl': kwargs.get('CacheControl'),
+            'ContentEncoding': kwargs.get('ContentEncoding'),
+        }
+        response = {'ETag': self._store_object(
+            Bucket, Key, object_, if_match=IfMatch, if_none_match=IfNoneMatch
+        )}
+        if object_['VersionId'] != 'null':
+            response['VersionId'] = object_['VersionId']
+        return response
+
+    def copy_object(
+        self, Bucket, Key, CopySource, MetadataDirective='COPY', CopySourceIfMatch=None, **kwargs
+    ):
+        self._record_call('CopyObject')
+        source = self._get_stored_object(
+            CopySource['Bucket'], CopySource['Key'], 'CopyObject', error_code='NoSuchKey'
+        )
+        if CopySourceIfMatch is not None and CopySourceIfMatch != source['ETag']:
+            raise ClientError(
+                {'Error': {'Code': 'PreconditionFailed', 'Message': 'ETag mismatch'}},
+                'CopyObject'
+            )
+        if len(source['Body']) > self.max_copy_object_size:
+            raise ClientError(
+                {'Error': {'Code': 'InvalidRequest', 'Message': 'Source too large'}}, 'CopyObject'
+            )
+        copied_object = dict(source)
+        if MetadataDirective == 'REPLACE':
+            copied_object.update({
+                'ContentType': kwargs.get('ContentType', 'binary/octet-stream'),
+                'Metadata': kwargs.get('Metadata', {}),
+                'CacheControl': kwargs.get('CacheControl'),
+                'ContentEncoding': kwargs.get('ContentEncoding'),
+            })
+        e_tag = self._store_object(Bucket, Key, copied_object)
+        return {'CopyObjectResult': {'ETag': e_tag}}
+
+    def create_multipart_upload(self, Bucket, Key, ContentType='binary/octet-stream', **kwargs):
+        self._record_call('CreateMultipartUpload')
+        with self._lock:
+            self._upload_counter += 1
+            upload_id = 'upload-{}'.format(self._upload_counter)
+            self.multipart_uploads[upload_id] = {
+                'Bucket': Bucket,
+                'Key': Key,
+                'ContentType': ContentType,
+                'Metadata': kwargs.get('Metadata', {}),
+                'CacheControl': kwargs.get('CacheControl'),
+                'ContentEncoding': kwargs.get('ContentEncoding'),
+                'Parts': {},
+            }
+        return {'Bucket': Bucket, 'Key': Key, 'UploadId': upload_id}
+
+    def upload_part_copy(
+        self, Bucket, Key, UploadId, PartNumber, CopySource, CopySourceRange=None,
+        CopySourceIfMatch=None, **kwargs
+    ):
+        self._record_call('UploadPartCopy')
+        upload = self._get_multipart_upload(UploadId, 'UploadPartCopy')
+        if self.failing_part_numbers and PartNumber in self.failing_part_numbers:
+            raise ClientError(
+                {'Error': {'Code': 'InternalError', 'Message': 'Injected error'}}, 'UploadPartCopy'
+            )
+
+        source = self._get_stored_object(
+            CopySource['Bucket'], CopySource['Key'], 'UploadPartCopy', error_code='NoSuchKey'
+        )
+        if CopySourceIfMatch is not None and CopySourceIfMatch != source['ETag']:
+            raise ClientError(
+                {'Error': {'Code': 'PreconditionFailed', 'Message': 'ETag mismatch'}},
+                'UploadPartCopy'
+            )
+
+        body = source['Body']
+        if CopySourceRange is not None:
+            start, end = CopySourceRange[len('bytes='):].split('-')
+            body = body[int(start):int(end) + 1]
+        e_tag = '"{}"'.format(hashlib.md5(body).hexdigest())
+        with self._lock:
+            upload['Parts'][PartNumber] = {'Body': body, 'ETag': e_tag}
+        return {'CopyPartResult': {'ETag': e_tag}}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        self._record_call('CompleteMultipartUpload')
+        upload = self._get_multipart_upload(UploadId, 'CompleteMultipartUpload')
+        parts = MultipartUpload['Parts']
+        if [part['PartNumber'] for part in parts] != sorted(part['PartNumber'] for part in parts):
+            raise ClientError(
+                {'Error': {'Code': 'InvalidPartOrder', 'Message': 'Unsorted parts'}},
+                'CompleteMultipartUpload'
+            )
+
+        bodies = []
+        for index, part in enumerate(parts):
+            stored_part = upload['Parts'].get(part['PartNumber'])
+            if stored_part is None or stored_part['ETag'] != part['ETag']:
+                raise ClientError(
+                    {'Error': {'Code': 'InvalidPart', 'Message': 'Unknown part'}},
+                    'CompleteMultipartUpload'
+                )
+            if index < len(parts) - 1 and len(stored_part['Body']) < MIN_PART_SIZE:
+                raise ClientError(
+                    {'Error': {'Code': 'EntityTooSmall', 'Message': 'Part too small'}},
+                    'CompleteMultipartUpload'
+                )
+            bodies.append(stored_part['Body'])
+
+        digests = b''.join(bytes.fromhex(part['ETag'].strip('"')) for part in parts)
+        e_tag = self._store_object(Bucket, Key, {
+            'Body': b''.join(bodies),
+            'ContentType': upload['ContentType'],
+            'ETag': '"{}-{}"'.format(hashlib.md5(digests).hexdigest(), len(parts)),
+            'Metadata': upload['Metadata'],
+            'CacheControl': upload['CacheControl'],
+            'ContentEncoding': upload['ContentEncoding'],
+        })
+        with self._lock:
+            del self.multipart_uploads[UploadId]
+        return {'Bucket': Bucket, 'Key': Key, 'ETag': e_tag}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        self._record_call('AbortMultipartUpload')
+        self._get_multipart_upload(UploadId, 'AbortMultipartUpload')
+        with self._lock:
+            del self.multipart_uploads[UploadId]
+        return {}
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None, IfNoneMatch=None, **kwargs):
+        self._record_call('GetObject')
+        object_ = self._get_stored_object(Bucket, Key, 'GetObject', error_code='NoSuchKey')
+        if IfMatch is not None and IfMatch != object_['ETag']:
+            raise ClientError(
+                {'Error': {'Code': 'PreconditionFailed', 'Message': 'Precondition Failed'}},
+                'GetObject'
+            )
+        if IfNoneMatch is not None and IfNoneMatch == object_['ETag']:
+            # botocore reports it as an error, with the HTTP status code
+            raise ClientError({'Error': {'Code': '304', 'Message': 'Not Modified'}}, 'GetObject')
+
+        body = object_['Body']
+        response = self._generate_head(object_)
+        if Range is not None:
+            start, end = (int(position) for position in Range[len('bytes='):].split('-'))
+            if start >= len(body):
+                raise ClientError(
+                    {'Error': {'Code': 'InvalidRange', 'Message': 'Range Not Satisfiable'}},
+                    'GetObject'
+                )
+            end = min(end, len(body) - 1)
+            body = body[start:end + 1]
+            response['ContentLength'] = len(body)
+            response['ContentRange'] = 'bytes {}-{}/{}'.format(start, end, len(object_['Body']))
+        return dict(response, Body=_BodyStandIn(body))
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._record_call('HeadObject')
+        object_ = self._get_stored_object(Bucket, Key, 'HeadObject', error_code='404')
+        return self._generate_head(object_)
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._record_call('DeleteObject')
+        with self._lock:
+            if self._objects_per_bucket.get(Bucket, {}).pop(Key, None) is not None:
+                self._sorted_keys_per_bucket[Bucket].remove(Key)
+
+            if self._versioning_status_per_bucket.get(Bucket) == 'Enabled':
+                delete_marker = {'VersionId': self._generate_version_id(), 'DeleteMarker': True}
+                self._get_versions(Bucket, Key).insert(0, delete_marker)
+                return {'DeleteMarker': True, 'VersionId': delete_marker['VersionId']}
+
+            versions_per_key = self._versions_per_bucket.get(Bucket, {})
+            versions = [
+                version for version in versions_per_key.get(Key, [])
+                if version['VersionId'] != 'null'
+            ]
+            if versions:
+                versions_per_key[Key] = versions
+            elif versions_per_key.pop(Key, None) is not None:
+                self._sorted_versioned_keys_per_bucket[Bucket].remove(Key)
+        return {}
+
+    def put_bucket_versioning(self, Bucket, VersioningConfiguration, **kwargs):
+        self._record_call('PutBucketVersioning')
+        self._versioning_status_per_bucket[Bucket] = VersioningConfiguration['Status']
+        return {}
+
+    def get_bucket_versioning(self, Bucket, **kwargs):
+        self._record_call('GetBucketVersioning')
+        status = self._versioning_status_per_bucket.get(Bucket)
+        return {} if status is None else {'Status': status}
+
+    def list_object_versions(
+        self, Bucket, Prefix='', MaxKeys=None, KeyMarker=None, VersionIdMarker=None, **kwargs
+    ):
+        self._record_call('ListObjectVersions')
+        max_keys = self.max_keys if MaxKeys is None else min(MaxKeys, self.max_keys)
+        sorted_keys = self._sorted_versioned_keys_per_bucket.get(Bucket, [])
+        versions_per_key = self._versions_per_bucket.get(Bucket, {})
+
+        index = bisect.bisect_left(sorted_keys, Prefix)
+        if KeyMarker:
+            # Without VersionIdMarker, listing resumes after every version of KeyMarker
+            bisect_function = bisect.bisect_left if VersionIdMarker else bisect.bisect_right
+            index = max(index, bisect_function(sorted_keys, KeyMarker))
+
+        versions = []
+        delete_markers = []
+        last_returned = None
+        is_truncated = False
+        while index < len(sorted_keys) and sorted_keys[index].startswith(Prefix):
+            key = sorted_keys[index]
+            key_versions = versions_per_key[key]
+            first_position = 0
+            if VersionIdMarker and key == KeyMarker:
+                version_ids = [version['VersionId'] for version in key_versions]
+                if VersionIdMarker in version_ids:
+                    first_position = version_ids.index(VersionIdMarker) + 1
+
+            for position in range(first_position, len(key_versions)):
+                if len(versions) + len(delete_markers) == max_keys:
+                    is_truncated = True
+                    break
+                version = key_versions[position]
+                entry = {'Key': key, 'VersionId': version['VersionId'], 'IsLatest': position == 0}
+                if version.get('DeleteMarker'):
+                    delete_markers.append(entry)
+                else:
+                    entry.update(Size=len(version['Body']), ETag=version['ETag'])
+                    versions.append(entry)
+                last_returned = (key, version['VersionId'])
+
+            if is_truncated:
+                break
+            index += 1
+
+        response = {
+            'IsTruncated': is_truncated,
+            'KeyMarker': KeyMarker or '',
+            'MaxKeys': max_keys,
+            'Prefix': Prefix,
+        }
+        if versions:
+            response['Versions'] = versions
+        if delete_markers:
+            response['DeleteMarkers'] = delete_markers
+        if is_truncated:
+            response['NextKeyMarker'], response['NextVersionIdMarker'] = last_returned
+        return response
+
+    def list_objects_v2(
+        self, Bucket, Prefix='', Delimiter=None, MaxKeys=None, ContinuationToken=None,
+        StartAfter=None, **kwargs
+    ):
+        self._record_call('ListObjectsV2')
+        max_keys = self.max_keys if MaxKeys is None else min(MaxKeys, self.max_keys)
+        sorted_keys = self._sorted_keys_per_bucket.get(Bucket, [])
+        objects = self._objects_per_bucket.get(Bucket, {})
+
+        index = bisect.bisect_left(sorted_keys, Prefix)
+        for marker in (StartAfter, ContinuationToken):
+            if marker:
+                index = max(index, bisect.bisect_right(sorted_keys, marker))
+        if ContinuationToken and Delimiter and ContinuationToken.endswith(Delimiter):
+            # The previous page ended with a common prefix
+            index = max(index, bisect.bisect_left(sorted_keys, ContinuationToken + '\U0010ffff'))
+
+        contents = []
+        common_prefixes = []
+        last_returned = None
+        while index < len(sorted_keys) and len(contents) + len(common_prefixes) < max_keys:
+            key = sorted_keys[index]
+            if not key.startswith(Prefix):
+                break
+
+            remainder = key[len(Prefix):]
+            if Delimiter and Delimiter in remainder:
+                common_prefix = Prefix + remainder[:remainder.index(Delimiter) + len(Delimiter)]
+                common_prefixes.append({'Prefix': common_prefix})
+                last_returned = common_prefix
+                # Skip every key sharing this common prefix
+                index = bisect.bisect_left(sorted_keys, common_prefix + '\U0010ffff')
+                continue
+
+            object_ = objects[key]
+            contents.append({
+                'Key': key,
+                'Size': len(object_['Body']),
+                'ETag': object_['ETag'],
+                'LastModified': object_['LastModified'],
+            })
+            last_returned = key
+            index += 1
+
+        is_truncated = index < len(sorted_keys) and sorted_keys[index].startswith(Prefix)
+        self.listed_entries += len(contents) + len(common_prefixes)
+
+        response = {
+            'IsTruncated': is_truncated,
+            'KeyCount': len(contents) + len(common_prefixes),
+            'MaxKeys': max_keys,
+            'Prefix': Prefix,
+        }
+        if contents:
+            response['Contents'] = contents
+        if common_prefixes:
+            response['CommonPrefixes'] = common_prefixes
+        if is_truncated:
+            response['NextContinuationToken'] = last_returned
+        return response
+
+    def get_paginator(self, operation_name):
+        if operation_name != 'list_objects_v2':
+            raise NotImplementedError('No stand-in paginator for "{}"'.format(operation_name))
+        return _ListObjectsV2PaginatorStandIn(self)
+
+    def _record_call(self, operation_name):
+        with self._lock:
+            self.calls[operation_name] += 1
+            self._number_of_requests += 1
+            is_throttled = bool(self.throttle_every) and \
+                self._number_of_requests % self.throttle_every == 0
+            if is_throttled:
+                self.throttled_calls += 1
+
+        if self.latency:
+            time.sleep(self.latency)
+        if is_throttled:
+            raise ClientError({
+                'Error': {'Code': 'SlowDown', 'Message': 'Please reduce your request rate.'},
+                'ResponseMetadata': {'HTTPStatusCode': 503},
+            }, operation_name)
+
+    def _store_object(self, bucket, key, object_, if_match=None, if_none_match=None):
+        with self._lock:
+            objects = self._objects_per_bucket.setdefault(bucket, {})
+            # Conditions are checked and the object is stored atomically, like S3 does
+            existing_object = objects.get(key)
+            if (
+                if_match is not None and
+                (existing_object is None or existing_object['ETag'] != if_match)
+            ) or (if_none_match == '*' and existing_object is not None):
+                raise ClientError(
+                    {'Error': {'Code': 'PreconditionFailed', 'Message': 'Precondition Failed'}},
+                    'PutObject'
+                )
+            if key not in objects:
+                bisect.insort(self._sorted_keys_per_bucket.setdefault(bucket, []), key)
+            object_['LastModified'] = datetime.now(timezone.utc)
+            objects[key] = object_
+
+            versions = self._get_versions(bucket, key)
+            if self._versioning_status_per_bucket.get(bucket) == 'Enabled':
+                object_['VersionId'] = self._generate_version_id()
+            else:
+                # Unversioned (or suspended) buckets overwrite the "null" version
+                object_['VersionId'] = 'null'
+                versions[:] = [version for version in versions if version['VersionId'] != 'null']
+            versions.insert(0, object_)
+        return object_['ETag']
+
+    def _get_versions(self, bucket, key):
+        versions_per_key = self._versions_per_bucket.setdefault(bucket, {})
+        if key not in versions_per_key:
+            bisect.insort(self._sorted_versioned_keys_per_bucket.setdefault(bucket, []), key)
+            versions_per_key[key] = []
+        return versions_per_key[key]
+
+    def _generate_version_id(self):
+        self._version_counter += 1
+        return 'version-{}'.format(self._version_counter)
+
+    def _get_multipart_upload(self, upload_id, operation_name):
+        try:
+            return self.multipart_uploads[upload_id]
+        except KeyError:
+            raise ClientError(
+                {'Error': {'Code': 'NoSuchUpload', 'Message': 'Not Found'}}, operation_name
+            )
+
+    def _get_stored_object(self, bucket, key, operation_name, error_code):
+        try:
+            return self._objects_per_bucket[bucket][key]
+        except KeyError:
+            raise ClientError(
+                {'Error': {'Code': error_code, 'Message': 'Not Found'}}, operation_name
+            )
+
+    @staticmethod
+    def _generate_head(object_):
+        head = {
+            'ContentLength': len(object_['Body']),
+            'ContentType': object_['ContentType'],
+            'ETag': object_['ETag'],
+            'LastModified': object_['LastModified'],
+            'Metadata': dict(object_['Metadata']),
+        }
+        for optional_field in ('CacheControl', 'ContentEncoding'):
+            if object_[optional_field] is not None:
+                head[optional_field] = object_[optional_field]
+        if object_.get('VersionId', 'null') != 'null':
+            head['VersionId'] = object_['VersionId']
+        return head
+
+
+def deliver_inventory(
+    s3_client, bucket_name, directory, created_at=None, rows_per_file=1000, with_versions=False
+):
+    # Writes in directory what S3 Inventory would deliver to its destination bucket: gzipped CSV
+    # files, and a manifest.json. Returns the key of the manifest.
+    created_at = datetime.now(timezone.utc) if created_at is None else created_at
+    inventory_prefix = '{}/all-objects'.format(bucket_name)
+    if with_versions:
+        fields = ['Bucket', 'Key', 'VersionId', 'IsLatest', 'IsDeleteMarker', 'Size', 'ETag']
+        rows = [
+            [
+                bucket_name, key, version['VersionId'], str(position == 0).lower(),
+                str(bool(version.get('DeleteMarker'))).lower(),
+                '' if version.get('DeleteMarker') else str(len(version['Body'])),
+                version.get('ETag', '').strip('"'),
+            ]
+            for key in s3_client._sorted_versioned_keys_per_bucket.get(bucket_name, [])
+            for position, version in enumerate(s3_client._versions_per_bucket[bucket_name][key])
+        ]
+    else:
+        fields = ['Bucket', 'Key', 'Size', 'LastModifiedDate', 'ETag']
+        objects = s3_client._objects_per_bucket.get(bucket_name, {})
+        rows = [
+            [
+                bucket_name, key, str(len(objects[key]['Body'])),
+                objects[key]['LastModified'].strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                objects[key]['ETag'].strip('"'),
+            ]
+            for key in s3_client._sorted_keys_per_bucket.get(bucket_name, [])
+        ]
+
+    files = []
+    for index in range(0, max(len(rows), 1), rows_per_file):
+        text = io.StringIO()
+        writer = csv.writer(text, quoting=csv.QUOTE_ALL, lineterminator='\n')
+        for row in rows[index:index + rows_per_file]:
+            # Keys are URL-encoded
+            row[1] = urllib.parse.quote_plus(row[1], safe='/')
+            writer.writerow(row)
+        data = gzip.compress(text.getvalue().encode())
+        key = '{}/data/{:08d}.csv.gz'.format(inventory_prefix, index // rows_per_file)
+        _write_file(directory, key, data)
+        files.append({'key': key, 'size': len(data), 'MD5checksum': hashlib.md5(data).hexdigest()})
+
+    manifest_key = '{}/{}/manifest.json'.format(
+        inventory_prefix, created_at.strftime('%Y-%m-%dT%H-%MZ')
+    )
+    _write_file(directory, manifest_key, json.dumps({
+        'sourceBucket': bucket_name,
+        'destinationBucket': 'arn:aws:s3:::inventory-bucket',
+        'version': '2016-11-30',
+        'creationTimestamp': str(int(created_at.timestamp() * 1000)),
+        'fileFormat': 'CSV',
+        'fileSchema': ', '.join(fields),
+        'files': files,
+    }).encode())
+    return manifest_key
+
+
+def _write_file(directory, key, data):
+    path = os.path.join(directory, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+class _ListObjectsV2PaginatorStandIn:
+    def __init__(self, client):
+        self._client = client
+
+    def paginate(self, **kwargs):
+        continuation_token = None
+        while True:
+            if continuation_token is not None:
+                kwargs['ContinuationToken'] = continuation_token
+            page = self._client.list_objects_v2(**kwargs)
+            yield page
+            if not page['IsTruncated']:
+                return
+            continuation_token = page['NextContinuationToken']
+
+
+class _BodyStandIn:
+    def __init__(self, data):
+        self._data = data
+        self._position = 0
+
+    def read(self, amount=None):
+        end = len(self._data) if amount is None else self._position + amount
+        chunk = self._data[self._position:end]
+        self._position += len(chunk)
+        return chunk
+
+    def close(self):
+        pass
+
+
+class CloudFrontClientStandIn:
+    # Validates invalidation batches the way CloudFront does. Errors (like "Throttling") can be
+    # injected with errors_to_raise: each call pops the first error code, if any.
+    def __init__(self, errors_to_raise=(), latency=0):
+        self.latency = latency
+        self.calls = Counter()
+        self.invalidations = []
+        self.errors_to_raise = list(errors_to_raise)
+        self._caller_references = set()
+
+    def create_invalidation(self, DistributionId, InvalidationBatch):
+        self.calls['CreateInvalidation'] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.errors_to_raise:
+            raise ClientError(
+                {'Error': {'Code': self.errors_to_raise.pop(0), 'Message': 'Injected error'}},
+                'CreateInvalidation'
+            )
+
+        paths = InvalidationBatch['Paths']
+        caller_reference = InvalidationBatch['CallerReference']
+        if (
+            paths['Quantity'] != len(paths['Items']) or
+            len(paths['Items']) > 3000 or
+            sum(path.endswith('*') for path in paths['Items']) > 15 or
+            any(not path.startswith('/') or '*' in path[:-1] for path in paths['Items']) or
+            caller_reference in self._caller_references
+        ):
+            raise ClientError(
+                {'Error': {'Code': 'InvalidArgument', 'Message': 'Invalid batch'}},
+                'CreateInvalidation'
+            )
+
+        self._caller_references.add(caller_reference)
+        self.invalidations.append({
+            'DistributionId': DistributionId,
+            'Paths': list(paths['Items']),
+        })
+        return {'Invalidation': {'Id': 'I{}'.format(len(self.invalidations)), 'Status': 'InProgress'}}
+
+
+# Resource API, as used by metadata.py: s3.Bucket(), s3.Object(), bucket.objects.filter()...
+
+
+class S3ResourceStandIn:
+    def __init__(self, client=None):
+        self.meta = _MetaStandIn(S3ClientStandIn() if client is None else client)
+
+    def Bucket(self, name):
+        return _BucketStandIn(self.meta.client, name)
+
+    def Object(self, bucket_name, key):
+        return _ObjectStandIn(self.meta.client, bucket_name, key)
+
+
+class _MetaStandIn:
+    def __init__(self, client):
+        self.client = client
+
+
+class _BucketStandIn:
+    def __init__(self, client, name):
+        self.meta = _MetaStandIn(client)
+        self.name = name
+        self.objects = _ObjectCollectionStandIn(client, name)
+
+    def Object(self, key):
+        return _ObjectStandIn(self.meta.client, self.name, key)
+
+
+class _ObjectCollectionStandIn:
+    def __init__(self, client, bucket_name):
+        self._client = client
+        self._bucket_name = bucket_name
+
+    def filter(self, Prefix=''):
+        paginator = self._client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self._bucket_name, Prefix=Prefix):
+            for content in page.get('Contents', []):
+                yield _ObjectSummaryStandIn(
+                    self._bucket_name, content['Key'], content['Size'], content['ETag']
+                )
+
+
+class _ObjectSummaryStandIn:
+    def __init__(self, bucket_name, key, size, e_tag):
+        self.bucket_name = bucket_name
+        self.key = key
+        self.size = size
+        self.e_tag = e_tag
+
+
+class _ObjectStandIn:
+    def __init__(self, client, bucket_name, key):
+        self._client = client
+        self.bucket_name = bucket_name
+        self.key = key
+
+    def get(self, **kwargs):
+        return self._client.get_object(Bucket=self.bucket_name, Key=self.key, **kwargs)
+
+    def put(self, **kwargs):
+        return self._client.put_object(Bucket=self.bucket_name, Key=self.key, **kwargs)
+
+    def load(self):
+        self._client.head_object(Bucket=self.bucket_name, Key=self.key)
+
+    def delete(self):
+        return self._client.delete_object(Bucket=self.bucket_name, Key=self.key)
+
+
+class InMemoryWorkQueue(WorkQueue):
+    # Same behavior as DynamoDBWorkQueue
+    def __init__(self):
+        self._state_per_folder = {}
+        self._lock = threading.Lock()
+
+    def enqueue(self, bucket_name, artifact_folder, keys=(), event_time=None):
+        event_time = time.time() if event_time is None else event_time
+        folder = (bucket_name, artifact_folder)
+        with self._lock:
+            first_event_time, last_event_time, queued_keys = self._state_per_folder.get(
+                folder, (event_time, event_time, frozenset())
+            )
+            self._state_per_folder[folder] = (
+                min(first_event_time, event_time), max(last_event_time, event_time),
+                queued_keys | set(keys),
+            )
+
+    def get_quiet_folders(self, quiet_window, now=None, max_delay=None):
+        quiet_threshold, max_delay_threshold = get_drain_thresholds(quiet_window, now, max_delay)
+        with self._lock:
+            return [
+                (bucket_name, artifact_folder, last_event_time, tuple(sorted(queued_keys)))
+                for (bucket_name, artifact_folder), (first_event_time, last_event_time, queued_keys)
+                in self._state_per_folder.items()
+                if last_event_time <= quiet_threshold or (
+                    max_delay_threshold is not None and first_event_time <= max_delay_threshold
+                )
+            ]
+
+    def acknowledge(self, bucket_name, artifact_folder, event_time, keys=()):
+        folder = (bucket_name, artifact_folder)
+        with self._lock:
+            _, last_event_time, queued_keys = self._state_per_folder.get(
+                folder, (None, None, None)
+            )
+            if last_event_time != event_time or queued_keys != set(keys):
+                return False
+            del self._state_per_folder[folder]
+            return True
+
+
+class SQLiteWorkQueue(WorkQueue):
+    # Persists on disk, like a DynamoDB table outlives lambda invocations
+    def __init__(self, database=':memory:'):
+        self._connection = sqlite3.connect(database, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS pending_folders ('
+                'bucket_name TEXT NOT NULL, '
+                'artifact_folder TEXT NOT NULL, '
+                'first_event_time REAL NOT NULL, '
+                'last_event_time REAL NOT NULL, '
+                'PRIMARY KEY (bucket_name, artifact_folder))'
+            )
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS pending_keys ('
+                'bucket_name TEXT NOT NULL, '
+                'artifact_folder TEXT NOT NULL, '
+                'key TEXT NOT NULL, '
+                'PRIMARY KEY (bucket_name, artifact_folder, key))'
+            )
+
+    def enqueue(self, bucket_name, artifact_folder, keys=(), event_time=None):
+        event_time = time.time() if event_time is None else event_time
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT INTO pending_folders '
+                '(bucket_name, artifact_folder, first_event_time, last_event_time) '
+                'VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (bucket_name, artifact_folder) DO UPDATE '
+                'SET first_event_time = MIN(first_event_time, excluded.first_event_time), '
+                'last_event_time = MAX(last_event_time, excluded.last_event_time)',
+                (bucket_name, artifact_folder, event_time, event_time)
+            )
+            self._connection.executemany(
+                'INSERT OR IGNORE INTO pending_keys (bucket_name, artifact_folder, key) '
+                'VALUES (?, ?, ?)',
+                [(bucket_name, artifact_folder, key) for key in keys]
+            )
+
+    def get_quiet_folders(self, quiet_window, now=None, max_delay=None):
+        quiet_threshold, max_delay_threshold = get_drain_thresholds(quiet_window, now, max_delay)
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT bucket_name, artifact_folder, last_event_time FROM pending_folders '
+                'WHERE last_event_time <= ? OR first_event_time <= ? ORDER BY last_event_time',
+                (
+                    quiet_threshold,
+                    float('-inf') if max_delay_threshold is None else max_delay_threshold,
+                )
+            ).fetchall()
+            return [
+                (bucket_name, artifact_folder, last_event_time, self._select_keys(
+                    bucket_name, artifact_folder
+                ))
+                for bucket_name, artifact_folder, last_event_time in rows
+            ]
+
+    def acknowledge(self, bucket_name, artifact_folder, event_time, keys=()):
+        with self._lock, self._connection:
+            if self._select_keys(bucket_name, artifact_folder) != tuple(sorted(set(keys))):
+                return False
+            cursor = self._connection.execute(
+                'DELETE FROM pending_folders '
+                'WHERE bucket_name = ? AND artifact_folder = ? AND last_event_time = ?',
+                (bucket_name, artifact_folder, event_time)
+            )
+            if cursor.rowcount != 1:
+                return False
+            self._connection.execute(
+                'DELETE FROM pending_keys WHERE bucket_name = ? AND artifact_folder = ?',
+                (bucket_name, artifact_folder)
+            )
+            return True
+
+    def _select_keys(self, bucket_name, artifact_folder):
+        return tuple(key for key, in self._connection.execute(
+            'SELECT key FROM pending_keys WHERE bucket_name = ? AND artifact_folder = ? '
+            'ORDER BY key',
+            (bucket_name, artifact_folder)
+        ))
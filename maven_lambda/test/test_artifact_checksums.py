@@ -0,0 +1,201 @@
+import hashlib
+import pytest
+
+from botocore.exceptions import ClientError
+
+from maven_lambda.artifact_checksums import (
+    compute_digests,
+    fetch_checksum_file,
+    get_algorithms_to_write,
+    is_artifact,
+    process_artifact,
+    process_artifact_checksums,
+)
+from maven_lambda.test.stand_ins import S3ClientStandIn
+
+
+ARTIFACT_KEY = 'maven2/org/mozilla/geckoview/geckoview/63.0/geckoview-63.0.aar'
+ARTIFACT_BODY = b'some artifact content ' * 1000
+
+
+def _get_digest(algorithm, body=ARTIFACT_BODY):
+    return hashlib.new(algorithm, body).hexdigest()
+
+
+@pytest.fixture
+def s3_client():
+    s3_client = S3ClientStandIn()
+    s3_client.put_object(Bucket='some-bucket', Key=ARTIFACT_KEY, Body=ARTIFACT_BODY)
+    return s3_client
+
+
+@pytest.mark.parametrize('environment_value, expected', (
+    ('1', ()),
+    ('sha512', ('sha512',)),
+    ('md5, sha1,sha256, sha512', ('md5', 'sha1', 'sha256', 'sha512')),
+    ('sha3, sha512', ('sha512',)),
+))
+def test_get_algorithms_to_write(environment_value, expected):
+    assert get_algorithms_to_write(environment_value) == expected
+
+
+@pytest.mark.parametrize('key, expected', (
+    (ARTIFACT_KEY, True),
+    ('maven2/org/mozilla/geckoview/geckoview/63.0/geckoview-63.0.pom', True),
+    ('maven2/org/mozilla/geckoview/geckoview/63.0/geckoview-63.0.aar.sha1', False),
+    ('maven2/org/mozilla/geckoview/geckoview/63.0/geckoview-63.0.aar.sha512', False),
+    ('maven2/org/mozilla/geckoview/geckoview/63.0/geckoview-63.0.aar.asc', False),
+    ('maven2/org/mozilla/geckoview/geckoview/maven-metadata.xml', False),
+    ('maven2/org/mozilla/geckoview/geckoview/maven-metadata.xml.md5', False),
+    ('maven2/org/mozilla/geckoview/geckoview/63.0/', False),
+))
+def test_is_artifact(key, expected):
+    assert is_artifact(key) == expected
+
+
+def test_compute_digests_reads_the_body_in_chunks(s3_client):
+    read_amounts = []
+    original_get_object = s3_client.get_object
+
+    def get_object(**kwargs):
+        response = original_get_object(**kwargs)
+        original_read = response['Body'].read
+
+        def read(amount=None):
+            read_amounts.append(amount)
+            return original_read(amount)
+
+        response['Body'].read = read
+        return response
+
+    s3_client.get_object = get_object
+
+    assert compute_digests(s3_client, 'some-bucket', ARTIFACT_KEY, chunk_size=1000) == {
+        algorithm: _get_digest(algorithm) for algorithm in ('md5', 'sha1', 'sha256', 'sha512')
+    }
+    # 22 full chunks, then an empty one
+    assert read_amounts == [1000] * 23
+
+
+@pytest.mark.parametrize('content, expected', (
+    (b'0123abcd', '0123abcd'),
+    (b'0123ABCD\n', '0123abcd'),
+    (b'0123abcd  geckoview-63.0.aar\n', '0123abcd'),
+    (b'', ''),
+))
+def test_fetch_checksum_file(s3_client, content, expected):
+    s3_client.put_object(Bucket='some-bucket', Key='{}.sha1'.format(ARTIFACT_KEY), Body=content)
+    assert fetch_checksum_file(s3_client, 'some-bucket', '{}.sha1'.format(ARTIFACT_KEY)) == expected
+
+
+def test_fetch_checksum_file_returns_none_when_missing(s3_client):
+    assert fetch_checksum_file(s3_client, 'some-bucket', '{}.sha1'.format(ARTIFACT_KEY)) is None
+
+
+def test_process_artifact_verifies_and_writes_checksums(s3_client):
+    s3_client.put_object(
+        Bucket='some-bucket', Key='{}.md5'.format(ARTIFACT_KEY), Body=_get_digest('md5')
+    )
+    s3_client.put_object(
+        Bucket='some-bucket', Key='{}.sha1'.format(ARTIFACT_KEY),
+        Body='{}  geckoview-63.0.aar\n'.format(_get_digest('sha1')),
+    )
+
+    assert process_artifact(
+        s3_client, 'some-bucket', ARTIFACT_KEY, algorithms_to_write=('sha256', 'sha512')
+    ) == {
+        'bucket': 'some-bucket',
+        'key': ARTIFACT_KEY,
+        'verifiedChecksums': ['md5', 'sha1'],
+        'writtenChecksums': ['sha256', 'sha512'],
+        'mismatchingChecksums': [],
+        'status': 'verified',
+    }
+    for algorithm in ('sha256', 'sha512'):
+        response = s3_client.get_object(
+            Bucket='some-bucket', Key='{}.{}'.format(ARTIFACT_KEY, algorithm)
+        )
+        assert response['Body'].read() == _get_digest(algorithm).encode()
+        assert response['ContentType'] == 'text/plain'
+
+
+def test_process_artifact_does_not_write_unrequested_checksums(s3_client):
+    result = process_artifact(s3_client, 'some-bucket', ARTIFACT_KEY)
+
+    assert result['writtenChecksums'] == []
+    assert result['status'] == 'verified'
+    assert [
+        content['Key'] for content in s3_client.list_objects_v2(Bucket='some-bucket')['Contents']
+    ] == [ARTIFACT_KEY]
+
+
+def test_process_artifact_does_not_overwrite_checksums_of_the_uploader(s3_client):
+    original_put_object = s3_client.put_object
+
+    def put_object(Key, **kwargs):
+        if Key.endswith('.sha512'):
+            # The uploader wrote it right after it was fetched
+            original_put_object(Key=Key, Bucket='some-bucket', Body=_get_digest('sha512', b'other'))
+        return original_put_object(Key=Key, **kwargs)
+    s3_client.put_object = put_object
+
+    result = process_artifact(
+        s3_client, 'some-bucket', ARTIFACT_KEY, algorithms_to_write=('sha256', 'sha512')
+    )
+
+    assert result['writtenChecksums'] == ['sha256']
+    assert result['mismatchingChecksums'] == ['sha512']
+    assert s3_client.get_object(
+        Bucket='some-bucket', Key='{}.sha512'.format(ARTIFACT_KEY)
+    )['Body'].read() == _get_digest('sha512', b'other').encode()
+
+
+def test_process_artifact_reports_mismatching_checksums(s3_client):
+    s3_client.put_object(
+        Bucket='some-bucket', Key='{}.sha1'.format(ARTIFACT_KEY), Body=_get_digest('sha1', b'other')
+    )
+
+    result = process_artifact(s3_client, 'some-bucket', ARTIFACT_KEY)
+
+    assert result['mismatchingChecksums'] == ['sha1']
+    assert result['status'] == 'mismatch'
+    # Mismatching checksums are reported, never overwritten
+    assert s3_client.get_object(
+        Bucket='some-bucket', Key='{}.sha1'.format(ARTIFACT_KEY)
+    )['Body'].read() == _get_digest('sha1', b'other').encode()
+
+
+def test_process_artifact_missing_artifact(s3_client):
+    assert process_artifact(s3_client, 'some-bucket', 'maven2/deleted.jar')['status'] == 'missing'
+
+
+def test_process_artifact_checksums(s3_client):
+    other_key = 'maven2/org/mozilla/geckoview/geckoview/63.0/geckoview-63.0.pom'
+    s3_client.put_object(Bucket='some-bucket', Key=other_key, Body=b'<project/>')
+
+    def get_object(Bucket, Key, **kwargs):
+        if Key == other_key:
+            raise ClientError({'Error': {'Code': 'AccessDenied'}}, 'GetObject')
+        return original_get_object(Bucket=Bucket, Key=Key, **kwargs)
+
+    original_get_object = s3_client.get_object
+    s3_client.get_object = get_object
+
+    results = process_artifact_checksums(s3_client, [
+        ('some-bucket', ARTIFACT_KEY),
+        ('some-bucket', '{}.sha1'.format(ARTIFACT_KEY)),
+        ('some-bucket', other_key),
+    ], algorithms_to_write=('sha256',))
+
+    assert [(result['key'], result['status']) for result in results] == [
+        (ARTIFACT_KEY, 'verified'),
+        # A single faulty artifact doesn't stop the other ones
+        (other_key, 'failed'),
+    ]
+    assert results[0]['writtenChecksums'] == ['sha256']
+
+
+def test_process_artifact_checksums_without_artifacts(s3_client):
+    assert process_artifact_checksums(s3_client, [
+        ('some-bucket', '{}.sha1'.format(ARTIFACT_KEY)),
+    ]) == []
@@ -0,0 +1,111 @@
+import pytest
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
+from maven_lambda import aws_clients
+from maven_lambda.aws_clients import (
+    build_config,
+    get_client,
+    get_resource,
+    lazy_client,
+    lazy_resource,
+    set_client,
+    set_resource,
+)
+from maven_lambda.test.stand_ins import S3ClientStandIn, S3ResourceStandIn
+
+
+@pytest.fixture(autouse=True)
+def session_mock(monkeypatch):
+    aws_clients.reset()
+    session_mock = MagicMock()
+    session_class_mock = MagicMock(return_value=session_mock)
+    monkeypatch.setattr('boto3.session.Session', session_class_mock)
+    yield session_mock
+    aws_clients.reset()
+
+
+def test_get_client_builds_clients_once(session_mock):
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        clients = list(executor.map(lambda _: get_client('s3'), range(32)))
+
+    assert all(client is session_mock.client.return_value for client in clients)
+    session_mock.client.assert_called_once()
+    assert session_mock.client.call_args[0] == ('s3',)
+
+    get_client('cloudfront')
+    get_resource('s3')
+    assert session_mock.client.call_count == 2
+    session_mock.resource.assert_called_once()
+
+
+def test_lazy_client(session_mock):
+    cloudfront = lazy_client('cloudfront')
+    session_mock.client.assert_not_called()
+
+    cloudfront.create_invalidation(DistributionId='some-id')
+    session_mock.client.assert_called_once()
+    session_mock.client.return_value.create_invalidation.assert_called_once_with(
+        DistributionId='some-id'
+    )
+
+
+def test_set_client_and_set_resource(session_mock):
+    client = S3ClientStandIn()
+    resource = S3ResourceStandIn(client)
+    set_client('s3', client)
+    set_resource('s3', resource)
+
+    lazy_client('s3').put_object(Bucket='some-bucket', Key='some-key', Body=b'some data')
+    assert lazy_resource('s3').Object('some-bucket', 'some-key').get()['Body'].read() == \
+        b'some data'
+    session_mock.client.assert_not_called()
+    session_mock.resource.assert_not_called()
+
+
+def test_get_resource_copies_the_resource_per_thread(session_mock):
+    client = S3ClientStandIn()
+    set_resource('s3', S3ResourceStandIn(client))
+
+    barrier = threading.Barrier(4)
+
+    def get_resource_twice(_):
+        # Every worker thread runs at the same time
+        barrier.wait()
+        resource = get_resource('s3')
+        assert get_resource('s3') is resource
+        return resource
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        resources = list(executor.map(get_resource_twice, range(4)))
+
+    assert len({id(resource) for resource in resources}) == 4
+    assert all(resource.meta.client is client for resource in resources)
+    assert get_resource('s3') is get_resource('s3')
+
+    other_client = S3ClientStandIn()
+    set_resource('s3', S3ResourceStandIn(other_client))
+    assert get_resource('s3').meta.client is other_client
+    session_mock.resource.assert_not_called()
+
+
+@pytest.mark.parametrize('environment, expected_pool_size, expected_retries', ((
+    {},
+    32,
+    {'max_attempts': 5, 'mode': 'standard'},
+), (
+    {'AWS_MAX_POOL_CONNECTIONS': '64', 'AWS_MAX_ATTEMPTS': '10', 'AWS_RETRY_MODE': 'adaptive'},
+    64,
+    {'max_attempts': 10, 'mode': 'adaptive'},
+)))
+def test_build_config(monkeypatch, environment, expected_pool_size, expected_retries):
+    for name in ('AWS_MAX_POOL_CONNECTIONS', 'AWS_MAX_ATTEMPTS', 'AWS_RETRY_MODE'):
+        monkeypatch.delenv(name, raising=False)
+    for name, value in environment.items():
+        monkeypatch.setenv(name, value)
+
+    config = build_config()
+    assert config.max_pool_connections == expected_pool_size
+    assert config.retries == expected_retries
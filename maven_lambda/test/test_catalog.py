@@ -0,0 +1,162 @@
+import gzip
+import json
+import pytest
+
+from botocore.exceptions import ClientError
+from maven_lambda.catalog import (
+    build_catalog_entry,
+    build_catalog_shard,
+    fetch_catalog_shard,
+    fetch_catalog_shard_and_e_tag,
+    get_catalog_shard_key,
+    update_catalog,
+    upload_catalog_shard,
+)
+from maven_lambda.test.stand_ins import S3ResourceStandIn
+
+
+SHARD_KEY = 'catalog/org.mozilla.components.json.gz'
+
+
+@pytest.fixture
+def bucket():
+    return S3ResourceStandIn().Bucket('some_bucket_name')
+
+
+@pytest.mark.parametrize('catalog_prefix', ('catalog', 'catalog/'))
+def test_get_catalog_shard_key(catalog_prefix):
+    assert get_catalog_shard_key(catalog_prefix, 'org.mozilla.components') == SHARD_KEY
+
+
+def test_get_catalog_shard_key_without_group_id():
+    with pytest.raises(ValueError):
+        get_catalog_shard_key('catalog/', '')
+
+
+def test_build_catalog_shard():
+    assert build_catalog_shard('org.mozilla.components', {
+        'browser-state': build_catalog_entry('1.1.0', 2, '20200101120000'),
+        'browser-domains': build_catalog_entry('0.30.0', 1, '20200102120000'),
+    }) == {
+        'format': 1,
+        'groupId': 'org.mozilla.components',
+        'artifacts': {
+            'browser-domains': {
+                'latest': '0.30.0', 'versionCount': 1, 'lastUpdated': '20200102120000',
+            },
+            'browser-state': {
+                'latest': '1.1.0', 'versionCount': 2, 'lastUpdated': '20200101120000',
+            },
+        },
+    }
+
+
+def test_upload_and_fetch_catalog_shard(bucket):
+    shard = build_catalog_shard('org.mozilla.components', {
+        'browser-state': build_catalog_entry('1.1.0', 2, '20200101120000'),
+    })
+
+    assert upload_catalog_shard(bucket, SHARD_KEY, shard) == SHARD_KEY
+
+    response = bucket.Object(SHARD_KEY).get()
+    assert response['ContentEncoding'] == 'gzip'
+    assert response['ContentType'] == 'application/json'
+    data = response['Body'].read()
+    # Compact, and identical for identical shards
+    assert gzip.decompress(data) == json.dumps(shard, separators=(',', ':')).encode()
+    upload_catalog_shard(bucket, SHARD_KEY, shard)
+    assert bucket.Object(SHARD_KEY).get()['Body'].read() == data
+
+    assert fetch_catalog_shard(bucket, SHARD_KEY) == shard
+
+
+@pytest.mark.parametrize('data', (
+    None,
+    b'not gzipped',
+    gzip.compress(b'not json'),
+    gzip.compress(b'{"format": 0}'),
+))
+def test_fetch_catalog_shard_ignores_missing_or_invalid_shards(bucket, data):
+    if data is not None:
+        bucket.Object(SHARD_KEY).put(Body=data)
+    assert fetch_catalog_shard(bucket, SHARD_KEY) is None
+
+
+def test_update_catalog(bucket):
+    update_catalog(
+        bucket, 'catalog/', 'org.mozilla.components', 'browser-state',
+        build_catalog_entry('1.0.0', 1, '20200101120000'),
+    )
+    update_catalog(
+        bucket, 'catalog/', 'org.mozilla.components', 'browser-domains',
+        build_catalog_entry('0.30.0', 1, '20200102120000'),
+    )
+    assert update_catalog(
+        bucket, 'catalog/', 'org.mozilla.components', 'browser-state',
+        build_catalog_entry('1.1.0', 2, '20200103120000'),
+    ) == SHARD_KEY
+
+    assert fetch_catalog_shard(bucket, SHARD_KEY)['artifacts'] == {
+        'browser-domains': {'latest': '0.30.0', 'versionCount': 1, 'lastUpdated': '20200102120000'},
+        'browser-state': {'latest': '1.1.0', 'versionCount': 2, 'lastUpdated': '20200103120000'},
+    }
+    # Other groups have their own shard
+    update_catalog(
+        bucket, 'catalog/', 'org.mozilla.telemetry', 'glean',
+        build_catalog_entry('1.0.0', 1, '20200101120000'),
+    )
+    assert list(fetch_catalog_shard(bucket, SHARD_KEY)['artifacts']) == [
+        'browser-domains', 'browser-state',
+    ]
+
+
+@pytest.mark.parametrize('shard_exists', (True, False))
+def test_update_catalog_merges_concurrent_updates(bucket, monkeypatch, shard_exists):
+    if shard_exists:
+        update_catalog(
+            bucket, 'catalog/', 'org.mozilla.components', 'browser-state',
+            build_catalog_entry('1.0.0', 1, '20200101120000'),
+        )
+    monkeypatch.setattr('maven_lambda.catalog.CATALOG_WRITE_BASE_DELAY', 0)
+
+    def fetch_before_another_invocation_writes(*args):
+        result = fetch_catalog_shard_and_e_tag(*args)
+        if not hasattr(fetch_before_another_invocation_writes, 'called'):
+            fetch_before_another_invocation_writes.called = True
+            # Another invocation adds browser-domains between the read and the write of this one
+            shard, e_tag = result
+            entries_per_artifact_id = {} if shard is None else dict(shard['artifacts'])
+            entries_per_artifact_id['browser-domains'] = build_catalog_entry(
+                '0.30.0', 1, '20200102120000'
+            )
+            upload_catalog_shard(bucket, SHARD_KEY, build_catalog_shard(
+                'org.mozilla.components', entries_per_artifact_id
+            ))
+        return result
+    monkeypatch.setattr(
+        'maven_lambda.catalog.fetch_catalog_shard_and_e_tag', fetch_before_another_invocation_writes
+    )
+
+    assert update_catalog(
+        bucket, 'catalog/', 'org.mozilla.components', 'browser-state',
+        build_catalog_entry('1.1.0', 2, '20200103120000'),
+    ) == SHARD_KEY
+
+    assert fetch_catalog_shard(bucket, SHARD_KEY)['artifacts'] == {
+        'browser-domains': {'latest': '0.30.0', 'versionCount': 1, 'lastUpdated': '20200102120000'},
+        'browser-state': {'latest': '1.1.0', 'versionCount': 2, 'lastUpdated': '20200103120000'},
+    }
+
+
+def test_update_catalog_gives_up_after_max_attempts(bucket, monkeypatch):
+    monkeypatch.setattr('maven_lambda.catalog.CATALOG_WRITE_BASE_DELAY', 0)
+    monkeypatch.setattr('maven_lambda.catalog.fetch_catalog_shard_and_e_tag', lambda *_: (
+        None, '"some-e-tag"'
+    ))
+
+    with pytest.raises(ClientError):
+        update_catalog(
+            bucket, 'catalog/', 'org.mozilla.components', 'browser-state',
+            build_catalog_entry('1.0.0', 1, '20200101120000'),
+        )
+    assert fetch_catalog_shard(bucket, SHARD_KEY) is None
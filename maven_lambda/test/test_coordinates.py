@@ -0,0 +1,134 @@
+import pytest
+
+from maven_lambda.coordinates import (
+    MavenCoordinate,
+    RepositoryLayout,
+    get_repository_layout,
+    parse_coordinate,
+    parse_coordinates,
+)
+
+
+GECKOVIEW_POM = 'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom'
+
+
+@pytest.mark.parametrize('key, expected', ((
+    GECKOVIEW_POM,
+    MavenCoordinate(
+        GECKOVIEW_POM, 'maven2/org/mozilla/geckoview/geckoview-nightly-x86/', 'maven2',
+        'org.mozilla.geckoview', 'geckoview-nightly-x86', '63.0.20180830111743',
+        'geckoview-nightly-x86-63.0.20180830111743.pom', 'maven'
+    ),
+), (
+    'org/mozilla/components/support-base/1.0.0/support-base-1.0.0.aar',
+    MavenCoordinate(
+        'org/mozilla/components/support-base/1.0.0/support-base-1.0.0.aar',
+        'org/mozilla/components/support-base/', '',
+        'org.mozilla.components', 'support-base', '1.0.0', 'support-base-1.0.0.aar', 'mobile'
+    ),
+), (
+    'maven/org/mozilla/components/support-base/1.0.0/',
+    MavenCoordinate(
+        'maven/org/mozilla/components/support-base/1.0.0/',
+        'maven/org/mozilla/components/support-base/', 'maven', 'org.mozilla.components',
+        'support-base', '1.0.0', '', 'mobile'
+    ),
+), (
+    'artifact/1.0/artifact-1.0.pom',
+    MavenCoordinate(
+        'artifact/1.0/artifact-1.0.pom', 'artifact/', '', '', 'artifact', '1.0',
+        'artifact-1.0.pom', 'maven'
+    ),
+)))
+def test_parse(key, expected):
+    coordinate = RepositoryLayout().parse(key)
+    assert coordinate == expected
+    assert not hasattr(coordinate, '__dict__')
+
+
+@pytest.mark.parametrize('key, artifact_folder, version_folder', ((
+    GECKOVIEW_POM,
+    'maven2/org/mozilla/geckoview/geckoview-nightly-x86/',
+    'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/',
+), (
+    'maven2/org/mozilla/components/browser-domains/0.30.0-SNAPSHOT/',
+    'maven2/org/mozilla/components/browser-domains/',
+    'maven2/org/mozilla/components/browser-domains/0.30.0-SNAPSHOT/',
+), (
+    'artifact/1.0/artifact-1.0.pom', 'artifact/', 'artifact/1.0/',
+)))
+def test_folders(key, artifact_folder, version_folder):
+    coordinate = RepositoryLayout().parse(key)
+    assert coordinate.artifact_folder == artifact_folder
+    assert coordinate.version_folder == version_folder
+
+
+def test_parse_many():
+    layout = RepositoryLayout()
+    keys = [
+        'maven2/org/mozilla/components/browser-domains/0.30.0/browser-domains-0.30.0.pom',
+        'maven2/org/mozilla/components/browser-domains/0.30.0/browser-domains-0.30.0.aar',
+        'maven2/org/mozilla/components/browser-domains/0.31.0/browser-domains-0.31.0.pom',
+        # Same prefix, but another artifact folder
+        'maven2/org/mozilla/components/browser-domains/extra/1.0/extra-1.0.pom',
+        'maven2/org/mozilla/geckoview/geckoview/65.0/geckoview-65.0.pom',
+    ]
+    coordinates = list(layout.parse_many(keys))
+
+    assert coordinates == [layout.parse(key) for key in keys]
+    # Coordinates of the same artifact share their strings
+    assert coordinates[0].artifact_folder is coordinates[2].artifact_folder
+    assert coordinates[0].artifact_id is coordinates[2].artifact_id
+    assert coordinates[0].group_id is coordinates[2].group_id
+
+
+@pytest.mark.parametrize('group_id, expected', (
+    ('org.mozilla.components', 'mobile'),
+    ('org.mozilla.components.support', 'mobile'),
+    ('org.mozilla.componentsx', 'maven'),
+    ('org.mozilla.geckoview', 'maven'),
+    ('org.mozilla.geckoview.special', 'mobile'),
+    ('', 'maven'),
+))
+def test_get_version_scheme(group_id, expected):
+    layout = RepositoryLayout(version_scheme_per_group_id={
+        'org.mozilla.components': 'mobile',
+        'org.mozilla.geckoview.special': 'mobile',
+    })
+    assert layout.get_version_scheme(group_id) == expected
+
+
+@pytest.mark.parametrize('value', (
+    'not json',
+    '["maven2"]',
+    '{"versionSchemes": {"org.mozilla": "semver"}}',
+    '{"defaultVersionScheme": "semver"}',
+))
+def test_from_json_invalid(value):
+    with pytest.raises(ValueError):
+        RepositoryLayout.from_json(value)
+
+
+def test_get_repository_layout(monkeypatch):
+    monkeypatch.delenv('REPOSITORY_LAYOUT', raising=False)
+    assert get_repository_layout() is get_repository_layout()
+    assert parse_coordinate(GECKOVIEW_POM).group_id == 'org.mozilla.geckoview'
+
+    monkeypatch.setenv(
+        'REPOSITORY_LAYOUT',
+        '{"roots": ["releases"], "versionSchemes": {}, "defaultVersionScheme": "mobile"}'
+    )
+    layout = get_repository_layout()
+    assert layout.roots == {'releases'}
+    assert layout is get_repository_layout()
+    coordinates = parse_coordinates([
+        'releases/org/mozilla/components/support-base/1.0.0/support-base-1.0.0.pom',
+        GECKOVIEW_POM,
+    ])
+    assert [
+        (coordinate.root, coordinate.group_id, coordinate.version_scheme)
+        for coordinate in coordinates
+    ] == [
+        ('releases', 'org.mozilla.components', 'mobile'),
+        ('', 'maven2.org.mozilla.geckoview', 'mobile'),
+    ]
@@ -1,7 +1,9 @@
-from unittest.mock import MagicMock
+from botocore.exceptions import ClientError
+from unittest.mock import MagicMock, call
 import pytest
 
 from maven_lambda.copy_to_bucket import (
+    is_bucket_versioned,
     lambda_handler,
     s3_object_has_more_than_one_version,
     NotFound,
@@ -17,17 +19,22 @@ def test_lambda_handler(monkeypatch):
                 },
                 'object': {
                     'key': 'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom',
+                    'size': 1234,
                 },
             },
         }],
     }
     context = {}
     s3_mock = MagicMock()
-    monkeypatch.setattr('boto3.client', lambda _: s3_mock)
+    monkeypatch.setattr('maven_lambda.copy_to_bucket.s3', s3_mock)
     monkeypatch.setattr('os.environ', {'TARGET_BUCKET': 'some_target_bucket'})
 
     monkeypatch.setattr('maven_lambda.copy_to_bucket.s3_object_has_more_than_one_version', lambda _, __, ___: False)
-    assert lambda_handler(event, context) == {"statusCode": 200}
+    assert lambda_handler(event, context) == {"results": [{
+        'bucket': 'some_bucket_name',
+        'key': 'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom',
+        'statusCode': 200,
+    }]}
     s3_mock.copy_object.assert_called_once_with(
         Bucket='some_target_bucket',
         CopySource={
@@ -39,16 +46,134 @@ def test_lambda_handler(monkeypatch):
     s3_mock.reset_mock()
 
     monkeypatch.setattr('maven_lambda.copy_to_bucket.s3_object_has_more_than_one_version', lambda _, __, ___: True)
-    assert lambda_handler(event, context) == {"statusCode": 409}
+    assert lambda_handler(event, context) == {"results": [{
+        'bucket': 'some_bucket_name',
+        'key': 'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom',
+        'statusCode': 409,
+    }]}
     s3_mock.copy_object.assert_not_called()
 
     def fail(_, __, ___):
         raise NotFound()
     monkeypatch.setattr('maven_lambda.copy_to_bucket.s3_object_has_more_than_one_version', fail)
-    assert lambda_handler(event, context) == {"statusCode": 404}
+    assert lambda_handler(event, context) == {"results": [{
+        'bucket': 'some_bucket_name',
+        'key': 'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom',
+        'statusCode': 404,
+    }]}
     s3_mock.copy_object.assert_not_called()
 
 
+def test_lambda_handler_processes_every_record(monkeypatch):
+    def generate_record(key):
+        return {'s3': {'bucket': {'name': 'some_bucket_name'}, 'object': {'key': key, 'size': 1234}}}
+
+    event = {
+        'Records': [
+            generate_record('some/copied.pom'),
+            generate_record('some/conflicting.pom'),
+            generate_record('some/missing.pom'),
+            # Duplicate
+            generate_record('some/copied.pom'),
+        ],
+    }
+    s3_mock = MagicMock()
+    monkeypatch.setattr('maven_lambda.copy_to_bucket.s3', s3_mock)
+    monkeypatch.setattr('os.environ', {'TARGET_BUCKET': 'some_target_bucket'})
+
+    def has_more_than_one_version(_, __, key):
+        if key == 'some/missing.pom':
+            raise NotFound()
+        return key == 'some/conflicting.pom'
+    monkeypatch.setattr('maven_lambda.copy_to_bucket.s3_object_has_more_than_one_version', has_more_than_one_version)
+
+    assert lambda_handler(event, {}) == {'results': [
+        {'bucket': 'some_bucket_name', 'key': 'some/copied.pom', 'statusCode': 200},
+        {'bucket': 'some_bucket_name', 'key': 'some/conflicting.pom', 'statusCode': 409},
+        {'bucket': 'some_bucket_name', 'key': 'some/missing.pom', 'statusCode': 404},
+    ]}
+    s3_mock.copy_object.assert_called_once_with(
+        Bucket='some_target_bucket',
+        CopySource={'Bucket': 'some_bucket_name', 'Key': 'some/copied.pom'},
+        Key='some/copied.pom',
+    )
+
+
+def test_lambda_handler_decodes_keys(monkeypatch):
+    event = {
+        'Records': [{
+            's3': {
+                'bucket': {'name': 'some_bucket_name'},
+                'object': {'key': 'maven2/some+artifact%2Bplus/1.0/some+artifact%2Bplus-1.0.pom', 'size': 1234},
+            },
+        }],
+    }
+    s3_mock = MagicMock()
+    monkeypatch.setattr('maven_lambda.copy_to_bucket.s3', s3_mock)
+    monkeypatch.setattr('os.environ', {'TARGET_BUCKET': 'some_target_bucket'})
+    checked_keys = []
+    monkeypatch.setattr(
+        'maven_lambda.copy_to_bucket.s3_object_has_more_than_one_version',
+        lambda _, __, key: checked_keys.append(key) and False
+    )
+
+    assert lambda_handler(event, {}) == {'results': [{
+        'bucket': 'some_bucket_name',
+        'key': 'maven2/some artifact+plus/1.0/some artifact+plus-1.0.pom',
+        'statusCode': 200,
+    }]}
+    assert checked_keys == ['maven2/some artifact+plus/1.0/some artifact+plus-1.0.pom']
+    s3_mock.copy_object.assert_called_once_with(
+        Bucket='some_target_bucket',
+        CopySource={
+            'Bucket': 'some_bucket_name',
+            'Key': 'maven2/some artifact+plus/1.0/some artifact+plus-1.0.pom',
+        },
+        Key='maven2/some artifact+plus/1.0/some artifact+plus-1.0.pom',
+    )
+
+
+def test_lambda_handler_copies_other_keys_before_raising(monkeypatch):
+    event = {
+        'Records': [
+            {'s3': {'bucket': {'name': 'some_bucket_name'}, 'object': {'key': key, 'size': 1234}}}
+            for key in ('some/failing.pom', 'some/copied.pom')
+        ],
+    }
+    s3_mock = MagicMock()
+
+    def copy_object(**kwargs):
+        if kwargs['Key'] == 'some/failing.pom':
+            raise ClientError({'Error': {'Code': 'AccessDenied'}}, 'CopyObject')
+        return {}
+    s3_mock.copy_object.side_effect = copy_object
+    monkeypatch.setattr('maven_lambda.copy_to_bucket.s3', s3_mock)
+    monkeypatch.setattr('os.environ', {'TARGET_BUCKET': 'some_target_bucket'})
+    monkeypatch.setattr('maven_lambda.copy_to_bucket.s3_object_has_more_than_one_version', lambda _, __, ___: False)
+
+    with pytest.raises(ClientError):
+        lambda_handler(event, {})
+    assert call(
+        Bucket='some_target_bucket',
+        CopySource={'Bucket': 'some_bucket_name', 'Key': 'some/copied.pom'},
+        Key='some/copied.pom',
+    ) in s3_mock.copy_object.call_args_list
+
+
+@pytest.fixture(autouse=True)
+def versioning_status_per_bucket(monkeypatch):
+    versioning_status_per_bucket = {}
+    monkeypatch.setattr('maven_lambda.copy_to_bucket._versioning_status_per_bucket', versioning_status_per_bucket)
+    return versioning_status_per_bucket
+
+
+def _generate_versioned_s3_mock(*pages):
+    s3 = MagicMock()
+    s3.get_bucket_versioning.return_value = {'Status': 'Enabled'}
+    s3.list_object_versions.side_effect = pages
+    return s3
+
+
 @pytest.mark.parametrize('versions, expected', ((
     {"Versions": [{"Key": "obj"}, {"Key": "obj"}]},
     True,
@@ -57,12 +182,90 @@ def test_lambda_handler(monkeypatch):
     False,
 )))
 def test_s3_object_has_more_than_one_version_single_version(versions, expected):
-    s3 = MagicMock()
-    s3.list_object_versions.return_value = versions
+    s3 = _generate_versioned_s3_mock(versions)
     assert s3_object_has_more_than_one_version(s3, 'some_bucket', 'obj') == expected
+    s3.list_object_versions.assert_called_once_with(Bucket='some_bucket', Prefix='obj', MaxKeys=4)
 
-def test_s3_object_has_more_than_one_version_single_version_not_found():
-    s3 = MagicMock()
-    s3.list_object_versions.return_value = {}
+
+@pytest.mark.parametrize('pages', (
+    [{}],
+    # Only a sibling sharing the prefix
+    [{"Versions": [{"Key": "obj.md5"}]}],
+    # Only a delete marker
+    [{"DeleteMarkers": [{"Key": "obj"}]}],
+))
+def test_s3_object_has_more_than_one_version_single_version_not_found(pages):
+    s3 = _generate_versioned_s3_mock(*pages)
     with pytest.raises(NotFound):
         s3_object_has_more_than_one_version(s3, 'some_bucket', 'obj')
+
+
+def test_s3_object_has_more_than_one_version_paginates():
+    s3 = _generate_versioned_s3_mock({
+        "DeleteMarkers": [{"Key": "obj"}, {"Key": "obj"}, {"Key": "obj"}],
+        "Versions": [{"Key": "obj"}],
+        "IsTruncated": True,
+        "NextKeyMarker": "obj",
+        "NextVersionIdMarker": "some-version-id",
+    }, {
+        "Versions": [{"Key": "obj"}, {"Key": "obj.md5"}],
+        "IsTruncated": True,
+        "NextKeyMarker": "obj.md5",
+        "NextVersionIdMarker": "some-other-version-id",
+    })
+    assert s3_object_has_more_than_one_version(s3, 'some_bucket', 'obj') is True
+    assert s3.list_object_versions.call_args_list == [
+        call(Bucket='some_bucket', Prefix='obj', MaxKeys=4),
+        call(
+            Bucket='some_bucket', Prefix='obj', MaxKeys=4, KeyMarker='obj',
+            VersionIdMarker='some-version-id',
+        ),
+    ]
+
+
+def test_s3_object_has_more_than_one_version_stops_after_the_exact_key():
+    s3 = _generate_versioned_s3_mock({
+        "Versions": [{"Key": "obj"}, {"Key": "obj.md5"}, {"Key": "obj.md5"}, {"Key": "obj.sha1"}],
+        "IsTruncated": True,
+        "NextKeyMarker": "obj.sha1",
+        "NextVersionIdMarker": "some-version-id",
+    })
+    assert s3_object_has_more_than_one_version(s3, 'some_bucket', 'obj') is False
+    s3.list_object_versions.assert_called_once()
+
+
+@pytest.mark.parametrize('head_side_effect, expected', (
+    (None, False),
+    (ClientError({'Error': {'Code': '404'}}, 'HeadObject'), NotFound),
+))
+def test_s3_object_has_more_than_one_version_unversioned_bucket(head_side_effect, expected):
+    s3 = MagicMock()
+    s3.get_bucket_versioning.return_value = {}
+    s3.head_object.side_effect = head_side_effect
+
+    if expected is NotFound:
+        with pytest.raises(NotFound):
+            s3_object_has_more_than_one_version(s3, 'some_bucket', 'obj')
+    else:
+        assert s3_object_has_more_than_one_version(s3, 'some_bucket', 'obj') is expected
+    s3.head_object.assert_called_once_with(Bucket='some_bucket', Key='obj')
+    s3.list_object_versions.assert_not_called()
+
+
+@pytest.mark.parametrize('get_bucket_versioning_kwargs, expected', (
+    ({'return_value': {'Status': 'Enabled'}}, True),
+    ({'return_value': {'Status': 'Suspended'}}, True),
+    ({'return_value': {}}, False),
+    ({'side_effect': ClientError({'Error': {'Code': 'AccessDenied'}}, 'GetBucketVersioning')}, True),
+))
+def test_is_bucket_versioned(versioning_status_per_bucket, get_bucket_versioning_kwargs, expected):
+    s3 = MagicMock()
+    s3.get_bucket_versioning.configure_mock(**get_bucket_versioning_kwargs)
+
+    assert is_bucket_versioned(s3, 'some_bucket', now=1000) is expected
+    assert is_bucket_versioned(s3, 'some_bucket', now=1000 + 299) is expected
+    s3.get_bucket_versioning.assert_called_once_with(Bucket='some_bucket')
+
+    # The status is checked again once it's too old
+    is_bucket_versioned(s3, 'some_bucket', now=1000 + 300)
+    assert s3.get_bucket_versioning.call_count == 2
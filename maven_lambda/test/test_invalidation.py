@@ -0,0 +1,159 @@
+import pytest
+
+from itertools import count
+from unittest.mock import MagicMock
+
+from maven_lambda.invalidation import (
+    InvalidationBatcher,
+    coalesce_invalidation_paths,
+)
+from maven_lambda.test.stand_ins import CloudFrontClientStandIn
+
+
+def _generate_metadata_paths(*artifact_folders):
+    return [
+        '{}maven-metadata.xml{}'.format(artifact_folder, extension)
+        for artifact_folder in artifact_folders
+        for extension in ('', '.md5', '.sha1')
+    ]
+
+
+@pytest.fixture(autouse=True)
+def caller_references(monkeypatch):
+    counter = count()
+    monkeypatch.setattr('slugid.nice', lambda: 'some-caller-reference-{}'.format(next(counter)))
+
+
+@pytest.mark.parametrize('max_explicit_paths, expected', ((
+    100,
+    _generate_metadata_paths(
+        '/maven2/org/mozilla/geckoview/geckoview/',
+        '/maven2/org/mozilla/geckoview/geckoview-nightly/',
+        '/maven2/org/mozilla/components/browser-state/',
+    ),
+), (
+    3,
+    [
+        '/maven2/org/mozilla/geckoview/geckoview/maven-metadata.xml*',
+        '/maven2/org/mozilla/geckoview/geckoview-nightly/maven-metadata.xml*',
+        '/maven2/org/mozilla/components/browser-state/maven-metadata.xml*',
+    ],
+), (
+    2,
+    [
+        '/maven2/org/mozilla/geckoview/*',
+        '/maven2/org/mozilla/components/browser-state/maven-metadata.xml*',
+    ],
+), (
+    1,
+    ['/maven2/org/mozilla/*'],
+)))
+def test_coalesce_invalidation_paths(max_explicit_paths, expected):
+    paths = _generate_metadata_paths(
+        'maven2/org/mozilla/geckoview/geckoview/',
+        '/maven2/org/mozilla/geckoview/geckoview-nightly/',
+        'maven2/org/mozilla/components/browser-state/',
+        # Duplicate
+        'maven2/org/mozilla/geckoview/geckoview/',
+    )
+    assert coalesce_invalidation_paths(paths, max_explicit_paths) == expected
+
+
+def test_coalesce_invalidation_paths_keeps_few_enough_wildcards():
+    # 16 "maven-metadata.xml*" wildcards would be few enough paths, but too many wildcards
+    paths = _generate_metadata_paths(*(
+        'maven2/org/mozilla/components/browser-{}/'.format(index) for index in range(16)
+    ))
+    assert coalesce_invalidation_paths(paths, 20) == ['/maven2/org/mozilla/components/*']
+
+    wildcard_paths = ['/some/folder/{}/*'.format(index) for index in range(16)]
+    assert coalesce_invalidation_paths(wildcard_paths, 100) == ['/some/folder/*']
+    assert coalesce_invalidation_paths(wildcard_paths[:15], 100) == wildcard_paths[:15]
+
+
+def test_coalesce_invalidation_paths_caps_max_explicit_paths():
+    paths = ['/some/path/{}/file'.format(index) for index in range(3001)]
+    assert coalesce_invalidation_paths(paths, 5000) == ['/some/path/*']
+
+
+def test_invalidation_batcher_flush_sends_a_single_request():
+    cloudfront = CloudFrontClientStandIn()
+    batcher = InvalidationBatcher()
+    batcher.add(['/some/path/{}/file'.format(index) for index in range(150)])
+    batcher.add(['/some/folder/{}/*'.format(index) for index in range(16)])
+
+    assert batcher.flush(cloudfront, 'some-distribution-id') == [['/some/path/*', '/some/folder/*']]
+    assert len(cloudfront.invalidations) == 1
+    assert batcher.pending_paths == []
+
+
+def test_invalidation_batcher_flush():
+    cloudfront = CloudFrontClientStandIn()
+    batcher = InvalidationBatcher(max_explicit_paths=2)
+    batcher.add(_generate_metadata_paths('maven2/org/mozilla/geckoview/geckoview/'))
+    batcher.add(_generate_metadata_paths('maven2/org/mozilla/geckoview/geckoview-nightly/'))
+
+    assert batcher.flush(cloudfront, 'some-distribution-id') == [[
+        '/maven2/org/mozilla/geckoview/geckoview/maven-metadata.xml*',
+        '/maven2/org/mozilla/geckoview/geckoview-nightly/maven-metadata.xml*',
+    ]]
+    assert cloudfront.invalidations == [{
+        'DistributionId': 'some-distribution-id',
+        'Paths': [
+            '/maven2/org/mozilla/geckoview/geckoview/maven-metadata.xml*',
+            '/maven2/org/mozilla/geckoview/geckoview-nightly/maven-metadata.xml*',
+        ],
+    }]
+    assert batcher.pending_paths == []
+
+
+def test_invalidation_batcher_retries_with_backoff():
+    cloudfront = CloudFrontClientStandIn(errors_to_raise=[
+        'TooManyInvalidationsInProgress', 'Throttling',
+    ])
+    sleep_mock = MagicMock()
+    batcher = InvalidationBatcher(base_delay=2, sleep=sleep_mock)
+    batcher.add(['some/path'])
+
+    assert batcher.flush(cloudfront, 'some-distribution-id') == [['/some/path']]
+    assert cloudfront.calls['CreateInvalidation'] == 3
+    assert len(cloudfront.invalidations) == 1
+    assert sleep_mock.call_count == 2
+    first_delay, second_delay = [call_args[0][0] for call_args in sleep_mock.call_args_list]
+    assert 0 <= first_delay <= 2
+    assert 0 <= second_delay <= 4
+
+
+def test_invalidation_batcher_keeps_paths_when_retries_are_exhausted():
+    cloudfront = CloudFrontClientStandIn(errors_to_raise=['TooManyInvalidationsInProgress'] * 2)
+    batcher = InvalidationBatcher(max_attempts=2, sleep=MagicMock())
+    batcher.add(['some/path'])
+
+    assert batcher.flush(cloudfront, 'some-distribution-id') == []
+    assert batcher.pending_paths == ['/some/path']
+
+    # Next invocation of the warm lambda
+    batcher.add(['some/other/path'])
+    assert batcher.flush(cloudfront, 'some-distribution-id') == [['/some/path', '/some/other/path']]
+    assert batcher.pending_paths == []
+
+
+def test_invalidation_batcher_drops_paths_on_non_retryable_errors():
+    cloudfront = CloudFrontClientStandIn(errors_to_raise=['AccessDenied'])
+    sleep_mock = MagicMock()
+    batcher = InvalidationBatcher(sleep=sleep_mock)
+    batcher.add(['some/path'])
+
+    assert batcher.flush(cloudfront, 'some-distribution-id') == [['/some/path']]
+    assert cloudfront.calls['CreateInvalidation'] == 1
+    assert cloudfront.invalidations == []
+    assert batcher.pending_paths == []
+    sleep_mock.assert_not_called()
+
+
+def test_cloudfront_stand_in_rejects_wildcards_in_the_middle():
+    cloudfront = CloudFrontClientStandIn()
+    batcher = InvalidationBatcher()
+    batcher.add(['/maven2/org/mozilla/geckoview/*/maven-metadata.xml*'])
+    batcher.flush(cloudfront, 'some-distribution-id')  # Does not raise
+    assert cloudfront.invalidations == []
@@ -0,0 +1,117 @@
+import json
+import os
+import pytest
+
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+from maven_lambda.inventory import Inventory, InventoryError
+from maven_lambda.test.stand_ins import S3ClientStandIn, deliver_inventory
+
+
+KEYS = (
+    'maven2/org/mozilla/geckoview/geckoview/65.0/geckoview-65.0.pom',
+    'maven2/org/mozilla/geckoview/geckoview/65.0/geckoview-65.0.aar',
+    'maven2/org/mozilla/geckoview/geckoview/66.0/geckoview-66.0.pom',
+    'maven2/some artifact+plus/1.0/some artifact+plus-1.0.pom',
+    'unrelated/file.pom',
+)
+
+
+@pytest.fixture
+def s3_client():
+    s3_client = S3ClientStandIn()
+    for key in KEYS:
+        s3_client.put_object(Bucket='some-bucket', Key=key, Body=key)
+    return s3_client
+
+
+def test_iterate_objects(s3_client, tmp_path):
+    created_at = datetime(2019, 9, 1, tzinfo=timezone.utc)
+    manifest_key = deliver_inventory(
+        s3_client, 'some-bucket', str(tmp_path), created_at=created_at, rows_per_file=2
+    )
+    inventory = Inventory.from_location(str(tmp_path), manifest_key)
+
+    assert inventory.source_bucket == 'some-bucket'
+    assert inventory.created_at == created_at
+    assert len(inventory.files) == 3
+    assert list(inventory.iterate_objects('maven2/')) == [
+        {'Key': key, 'Size': len(key), 'ETag': s3_client.head_object(
+            Bucket='some-bucket', Key=key
+        )['ETag']}
+        for key in sorted(KEYS[:4])
+    ]
+
+
+def test_iterate_objects_skips_old_versions_and_delete_markers(s3_client, tmp_path):
+    s3_client.put_bucket_versioning(
+        Bucket='some-bucket', VersioningConfiguration={'Status': 'Enabled'}
+    )
+    s3_client.put_object(Bucket='some-bucket', Key=KEYS[0], Body='new content')
+    s3_client.delete_object(Bucket='some-bucket', Key=KEYS[1])
+
+    manifest_key = deliver_inventory(s3_client, 'some-bucket', str(tmp_path), with_versions=True)
+    inventory = Inventory.from_location(str(tmp_path), manifest_key)
+
+    contents = list(inventory.iterate_objects())
+    assert [content['Key'] for content in contents] == sorted(set(KEYS) - {KEYS[1]})
+    assert contents[0]['Size'] == len('new content')
+
+
+def test_iterate_objects_streams_one_file_at_a_time(s3_client, tmp_path):
+    manifest_key = deliver_inventory(s3_client, 'some-bucket', str(tmp_path), rows_per_file=1)
+    inventory = Inventory.from_location(str(tmp_path), manifest_key)
+
+    opened_files = []
+    original_open_file = inventory._open_file
+    with patch.object(inventory, '_open_file', lambda key: (
+        opened_files.append(key) or original_open_file(key)
+    )):
+        contents = inventory.iterate_objects()
+        next(contents)
+        next(contents)
+        assert len(opened_files) == 2
+
+
+def test_from_location_s3(s3_client, tmp_path):
+    manifest_key = deliver_inventory(s3_client, 'some-bucket', str(tmp_path))
+    for directory, _, file_names in os.walk(str(tmp_path)):
+        for file_name in file_names:
+            path = os.path.join(directory, file_name)
+            with open(path, 'rb') as f:
+                s3_client.put_object(
+                    Bucket='inventory-bucket', Key=os.path.relpath(path, str(tmp_path)),
+                    Body=f.read()
+                )
+
+    inventory = Inventory.from_location('s3://inventory-bucket', manifest_key, s3_client)
+    assert [content['Key'] for content in inventory.iterate_objects()] == sorted(KEYS)
+
+
+def test_iterate_objects_checks_md5(s3_client, tmp_path):
+    manifest_key = deliver_inventory(s3_client, 'some-bucket', str(tmp_path))
+    manifest_path = str(tmp_path / manifest_key)
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    manifest['files'][0]['MD5checksum'] = 'some-other-md5'
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+
+    inventory = Inventory.from_location(str(tmp_path), manifest_key)
+    with pytest.raises(InventoryError):
+        list(inventory.iterate_objects())
+
+
+@pytest.mark.parametrize('manifest', (
+    {'fileFormat': 'Parquet'},
+    {'fileFormat': 'ORC'},
+    {'fileFormat': 'CSV', 'sourceBucket': 'some-bucket'},
+    {
+        'fileFormat': 'CSV', 'sourceBucket': 'some-bucket', 'creationTimestamp': '1567296000000',
+        'fileSchema': 'Bucket, Size', 'files': [],
+    },
+))
+def test_invalid_manifest(manifest):
+    with pytest.raises(InventoryError):
+        Inventory(manifest, open)
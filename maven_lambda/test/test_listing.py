@@ -0,0 +1,151 @@
+import pytest
+
+from botocore.exceptions import ClientError
+
+from maven_lambda.listing import (
+    discover_range_shards,
+    discover_shards,
+    iterate_objects,
+    iterate_objects_in_ranges,
+)
+from maven_lambda.test.stand_ins import S3ClientStandIn
+
+
+KEYS = (
+    'maven2/a.txt',
+    'maven2/a/1/a-1.pom',
+    'maven2/a/1/a-1.pom.md5',
+    'maven2/a/2/a-2.pom',
+    'maven2/a/file',
+    'maven2/a0/1/a0-1.pom',
+    'maven2/b/c/1/c-1.pom',
+    'maven2/b/c/2/c-2.pom',
+    'maven2/b/d/1/d-1.pom',
+    'maven2/z',
+    'other/file',
+)
+
+
+@pytest.fixture
+def s3_client():
+    s3_client = S3ClientStandIn(max_keys=2)
+    for key in KEYS:
+        s3_client.put_object(Bucket='some-bucket', Key=key, Body=key)
+    s3_client.calls.clear()
+    return s3_client
+
+
+def test_discover_shards(s3_client):
+    assert [
+        value if type_ == 'prefix' else value['Key']
+        for type_, value in discover_shards(s3_client, 'some-bucket', 'maven2/', shard_depth=2)
+    ] == [
+        'maven2/a.txt',
+        'maven2/a/1/',
+        'maven2/a/2/',
+        'maven2/a/file',
+        'maven2/a0/1/',
+        'maven2/b/c/',
+        'maven2/b/d/',
+        'maven2/z',
+    ]
+
+
+@pytest.mark.parametrize('shard_depth', (0, 1, 2, 3, 4, 10))
+@pytest.mark.parametrize('max_shards_in_flight', (1, 3, 16))
+def test_iterate_objects(s3_client, shard_depth, max_shards_in_flight):
+    contents = list(iterate_objects(
+        s3_client, 'some-bucket', 'maven2/', shard_depth, max_shards_in_flight, pages_per_shard=1
+    ))
+    assert [content['Key'] for content in contents] == [
+        key for key in KEYS if key.startswith('maven2/')
+    ]
+    assert contents[0]['Size'] == len('maven2/a.txt')
+
+
+@pytest.mark.parametrize('number_of_ranges, page_size, expected', (
+    (1, 2, [('maven2/', None, None, 3)]),
+    (2, 2, [('maven2/', None, 'maven2/a0/', 1), ('maven2/', 'maven2/a0/', None, 2)]),
+    (3, 2, [
+        ('maven2/', None, 'maven2/a0/', 1),
+        ('maven2/', 'maven2/a0/', 'maven2/b/', 1),
+        ('maven2/', 'maven2/b/', None, 1),
+    ]),
+    # There are only 3 sub-prefixes
+    (10, 2, [
+        ('maven2/', None, 'maven2/a0/', 1),
+        ('maven2/', 'maven2/a0/', 'maven2/b/', 1),
+        ('maven2/', 'maven2/b/', None, 1),
+    ]),
+    # About 30 objects fit in 2 pages of 20 keys
+    (3, 20, [('maven2/', None, 'maven2/a0/', 1), ('maven2/', 'maven2/a0/', None, 2)]),
+    # A single page holds them all
+    (3, 1000, [('maven2/', None, None, 3)]),
+))
+def test_discover_range_shards(s3_client, number_of_ranges, page_size, expected):
+    assert discover_range_shards(
+        s3_client, 'some-bucket', 'maven2/', number_of_ranges, page_size
+    ) == [('range', range_) for range_ in expected]
+
+
+@pytest.mark.parametrize('prefix', ('maven2/', 'maven2/a/', 'maven2/b/c/1/', 'missing/'))
+@pytest.mark.parametrize('number_of_ranges', (1, 2, 3, 5))
+def test_iterate_objects_in_ranges(s3_client, prefix, number_of_ranges):
+    assert [
+        content['Key']
+        for content in iterate_objects_in_ranges(
+            s3_client, 'some-bucket', prefix, number_of_ranges, pages_per_shard=1, page_size=2
+        )
+    ] == [key for key in KEYS if key.startswith(prefix)]
+
+
+def test_iterate_objects_in_ranges_stops_listing_past_the_range(s3_client):
+    list(iterate_objects_in_ranges(
+        s3_client, 'some-bucket', 'maven2/', number_of_ranges=3, page_size=2
+    ))
+    # 1 delimited listing of 3 pages, then 3 + 1 + 2 pages instead of 5 + 3 + 2
+    assert s3_client.calls['ListObjectsV2'] == 9
+
+
+def test_iterate_objects_in_ranges_sizes_the_last_page_of_each_range():
+    s3_client = S3ClientStandIn()
+    keys = [
+        'maven2/some-artifact/1.{0}/some-artifact-1.{0}{1}'.format(version, extension)
+        for version in range(500)
+        for extension in ('.pom', '.pom.md5', '.pom.sha1', '.jar', '.jar.md5', '.jar.sha1')
+        + ('-sources.jar', '-sources.jar.md5', '-sources.jar.sha1', '.module', '.module.md5', '.module.sha1')
+    ]
+    for key in keys:
+        s3_client.put_object(Bucket='some-bucket', Key=key)
+
+    assert [
+        content['Key']
+        for content in iterate_objects_in_ranges(s3_client, 'some-bucket', 'maven2/some-artifact/', 16)
+    ] == sorted(keys)
+    # 500 version folders found with a delimiter, then 6000 objects in 5 ranges of about a page
+    # each. Each range barely reads past its end.
+    assert s3_client.listed_entries < 500 + 6000 + 5 * 12
+    assert s3_client.calls['ListObjectsV2'] <= 1 + 2 * 5
+
+
+def test_iterate_objects_can_be_stopped_early(s3_client):
+    objects = iterate_objects(
+        s3_client, 'some-bucket', 'maven2/', shard_depth=2, max_shards_in_flight=2,
+        pages_per_shard=1
+    )
+    assert next(objects)['Key'] == 'maven2/a.txt'
+    objects.close()  # Does not hang
+
+
+def test_iterate_objects_raises_listing_errors(s3_client, monkeypatch):
+    original_list_objects_v2 = s3_client.list_objects_v2
+
+    def list_objects_v2(**kwargs):
+        if kwargs['Prefix'] == 'maven2/b/d/':
+            raise ClientError({'Error': {'Code': 'AccessDenied'}}, 'ListObjectsV2')
+        return original_list_objects_v2(**kwargs)
+    monkeypatch.setattr(s3_client, 'list_objects_v2', list_objects_v2)
+
+    objects = iterate_objects(s3_client, 'some-bucket', 'maven2/', shard_depth=2)
+    with pytest.raises(ClientError):
+        list(objects)
@@ -1,27 +1,56 @@
+import boto3
+import gzip
+import hashlib
+import io
+import json
 import pytest
+import threading
+import time
 
 from botocore.exceptions import ClientError
 from datetime import datetime
 from freezegun import freeze_time
 from unittest.mock import MagicMock, call
+from xml.etree import ElementTree as ET
 
+from maven_lambda.catalog import fetch_catalog_shard
+from maven_lambda.conditional_writes import supports_conditional_writes
+from maven_lambda.invalidation import InvalidationBatcher
+from maven_lambda.test.stand_ins import CloudFrontClientStandIn, InMemoryWorkQueue, S3ResourceStandIn
 from maven_lambda.metadata import (
     craft_and_upload_maven_metadata,
-    generate_checksums,
+    drain_handler,
+    drain_work_queue,
+    fetch_metadata_state,
+    fetch_packaging,
+    generate_content_hash,
+    generate_metadata_and_checksums,
     generate_last_updated,
-    generate_release_maven_metadata,
     generate_versions,
     get_artifact_id,
     get_artifact_folder,
     get_group_id,
     get_latest_version,
+    get_listing_function,
     get_version,
     get_version_folder,
+    group_keys_per_artifact_folder,
     invalidate_cloudfront_cache,
     lambda_handler,
+    list_pom_files_in_ranges,
     list_pom_files_in_subfolders,
+    list_pom_files_in_version_folders,
+    parse_versions,
+    regenerate_artifact_folder,
+    regenerate_snapshot_version_folders,
+    sort_versions,
+    stream_release_maven_metadata,
+    stream_snapshot_maven_metadata,
+    update_catalog_of_artifact,
     upload_s3_file,
-    _fetch_extension_from_pom_file_content,
+    ConcurrentUpdateError,
+    UploadError,
+    _parse_version_string,
 )
 
 
@@ -46,9 +75,9 @@ def test_lambda_handler(monkeypatch):
     ])
     monkeypatch.setattr(
         'maven_lambda.metadata.craft_and_upload_maven_metadata',
-        lambda _, __, ___, metadata_function=None: [
+        lambda _, __, list_pom_files, metadata_function=None: ([
             'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom',
-        ]
+        ], list_pom_files())
     )
 
     def cloudfront(paths):
@@ -65,6 +94,449 @@ def test_lambda_handler(monkeypatch):
         lambda_handler(event, context)
 
 
+def _generate_s3_record(bucket_name, key):
+    return {
+        's3': {
+            'bucket': {
+                'name': bucket_name,
+            },
+            'object': {
+                'key': key,
+            },
+        },
+    }
+
+
+def test_lambda_handler_processes_every_folder_once(monkeypatch):
+    event = {
+        'Records': [
+            _generate_s3_record('some_bucket_name', 'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom'),
+            _generate_s3_record('some_bucket_name', 'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.aar'),
+            _generate_s3_record('some_bucket_name', 'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.aar.sha1'),
+            _generate_s3_record('some_bucket_name', 'maven2/org/mozilla/components/browser-domains/0.30.0/browser-domains-0.30.0.pom'),
+        ],
+    }
+    s3_mock = MagicMock()
+    monkeypatch.setattr('maven_lambda.metadata.s3', s3_mock)
+
+    listed_folders = []
+
+    def list_pom_files(_, folder):
+        listed_folders.append(folder)
+        return ['{}some-version/some.pom'.format(folder)]
+    monkeypatch.setattr('maven_lambda.metadata.list_pom_files_in_subfolders', list_pom_files)
+    monkeypatch.setattr(
+        'maven_lambda.metadata.craft_and_upload_maven_metadata',
+        lambda _, folder, list_pom_files, metadata_function=None: (
+            ['{}maven-metadata.xml'.format(folder)], list_pom_files()
+        )
+    )
+    cloudfront_mock = MagicMock()
+    monkeypatch.setattr('maven_lambda.metadata.invalidate_cloudfront_cache', cloudfront_mock)
+
+    assert lambda_handler(event, {}) == {
+        'artifactFolders': [{
+            'bucket': 'some_bucket_name',
+            'artifactFolder': 'maven2/org/mozilla/geckoview/geckoview-nightly-x86/',
+            'keys': [
+                'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom',
+                'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.aar',
+                'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.aar.sha1',
+            ],
+            'status': 'updated',
+            'uploadedFiles': ['maven2/org/mozilla/geckoview/geckoview-nightly-x86/maven-metadata.xml'],
+        }, {
+            'bucket': 'some_bucket_name',
+            'artifactFolder': 'maven2/org/mozilla/components/browser-domains/',
+            'keys': ['maven2/org/mozilla/components/browser-domains/0.30.0/browser-domains-0.30.0.pom'],
+            'status': 'updated',
+            'uploadedFiles': ['maven2/org/mozilla/components/browser-domains/maven-metadata.xml'],
+        }],
+    }
+    # Folders are processed concurrently
+    assert sorted(listed_folders) == [
+        'maven2/org/mozilla/components/browser-domains/',
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/',
+    ]
+    cloudfront_mock.assert_called_once_with([
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/maven-metadata.xml',
+        'maven2/org/mozilla/components/browser-domains/maven-metadata.xml',
+    ])
+
+
+def test_lambda_handler_processes_other_folders_before_raising(monkeypatch):
+    event = {
+        'Records': [
+            _generate_s3_record('some_bucket_name', 'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom'),
+            _generate_s3_record('some_bucket_name', 'maven2/org/mozilla/components/browser-domains/0.30.0/browser-domains-0.30.0.pom'),
+        ],
+    }
+    monkeypatch.setattr('maven_lambda.metadata.s3', MagicMock())
+
+    def list_pom_files(_, folder):
+        if 'geckoview' in folder:
+            raise ConnectionError()
+        return ['{}some-version/some.pom'.format(folder)]
+    monkeypatch.setattr('maven_lambda.metadata.list_pom_files_in_subfolders', list_pom_files)
+    monkeypatch.setattr(
+        'maven_lambda.metadata.craft_and_upload_maven_metadata',
+        lambda _, folder, list_pom_files, metadata_function=None: (
+            ['{}maven-metadata.xml'.format(folder)], list_pom_files()
+        )
+    )
+    cloudfront_mock = MagicMock()
+    monkeypatch.setattr('maven_lambda.metadata.invalidate_cloudfront_cache', cloudfront_mock)
+
+    with pytest.raises(ConnectionError):
+        lambda_handler(event, {})
+
+    cloudfront_mock.assert_called_once_with([
+        'maven2/org/mozilla/components/browser-domains/maven-metadata.xml',
+    ])
+
+
+def test_lambda_handler_does_not_invalidate_unchanged_folders(monkeypatch):
+    event = {
+        'Records': [
+            _generate_s3_record('some_bucket_name', 'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom'),
+        ],
+    }
+    monkeypatch.setattr('maven_lambda.metadata.s3', MagicMock())
+    monkeypatch.setattr('maven_lambda.metadata.list_pom_files_in_subfolders', lambda _, __: [])
+    monkeypatch.setattr(
+        'maven_lambda.metadata.craft_and_upload_maven_metadata',
+        lambda _, __, list_pom_files, metadata_function=None: ([], list_pom_files())
+    )
+    cloudfront_mock = MagicMock()
+    monkeypatch.setattr('maven_lambda.metadata.invalidate_cloudfront_cache', cloudfront_mock)
+
+    assert lambda_handler(event, {})['artifactFolders'][0]['status'] == 'unchanged'
+    cloudfront_mock.assert_not_called()
+
+
+def test_lambda_handler_enqueues_folders_in_debouncing_mode(monkeypatch):
+    event = {
+        'Records': [
+            _generate_s3_record('some_bucket_name', 'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom'),
+            _generate_s3_record('some_bucket_name', 'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.aar'),
+        ],
+    }
+    work_queue = InMemoryWorkQueue()
+    monkeypatch.setattr('maven_lambda.metadata.get_work_queue', lambda: work_queue)
+    regenerate_mock = MagicMock()
+    monkeypatch.setattr('maven_lambda.metadata.regenerate_artifact_folder', regenerate_mock)
+
+    assert lambda_handler(event, {}) == {
+        'artifactFolders': [{
+            'bucket': 'some_bucket_name',
+            'artifactFolder': 'maven2/org/mozilla/geckoview/geckoview-nightly-x86/',
+            'keys': [
+                'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom',
+                'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.aar',
+            ],
+            'status': 'enqueued',
+            'uploadedFiles': [],
+        }],
+    }
+    regenerate_mock.assert_not_called()
+    assert [
+        (bucket_name, artifact_folder, keys)
+        for bucket_name, artifact_folder, _, keys in work_queue.get_quiet_folders(0)
+    ] == [('some_bucket_name', 'maven2/org/mozilla/geckoview/geckoview-nightly-x86/', (
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.aar',
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom',
+    ))]
+
+
+def test_lambda_handler_processes_artifact_checksums(monkeypatch):
+    artifact_key = 'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.aar'
+    event = {
+        'Records': [
+            _generate_s3_record('some_bucket_name', artifact_key),
+            _generate_s3_record('some_bucket_name', '{}.sha1'.format(artifact_key)),
+        ],
+    }
+    s3_resource = S3ResourceStandIn()
+    monkeypatch.setattr('maven_lambda.metadata.s3', s3_resource)
+    monkeypatch.setattr('maven_lambda.metadata.get_work_queue', lambda: InMemoryWorkQueue())
+    monkeypatch.setenv('ARTIFACT_CHECKSUMS', 'sha512')
+    s3_resource.meta.client.put_object(Bucket='some_bucket_name', Key=artifact_key, Body=b'aar')
+
+    response = lambda_handler(event, {})
+
+    assert response['artifactChecksums'] == [{
+        'bucket': 'some_bucket_name',
+        'key': artifact_key,
+        'verifiedChecksums': [],
+        'writtenChecksums': ['sha512'],
+        'mismatchingChecksums': [],
+        'status': 'verified',
+    }]
+    assert response['artifactFolders'][0]['status'] == 'enqueued'
+
+
+def test_lambda_handler_emits_metrics(monkeypatch, capsys):
+    s3_resource = S3ResourceStandIn()
+    monkeypatch.setattr('maven_lambda.metadata.s3', s3_resource)
+    monkeypatch.setattr('maven_lambda.metadata.get_work_queue', lambda: None)
+    monkeypatch.delenv('USE_VERSION_INDEX', raising=False)
+    monkeypatch.delenv('LISTING_MODE', raising=False)
+    monkeypatch.delenv('CLOUDFRONT_DISTRIBUTION_ID', raising=False)
+    monkeypatch.setenv('METRICS_ENABLED', '1')
+    keys = [
+        'maven2/org/mozilla/telemetry/glean/{0}/glean-{0}.pom'.format(version)
+        for version in ('1.0.0', '1.1.0')
+    ]
+    for key in keys:
+        s3_resource.meta.client.put_object(Bucket='some_bucket_name', Key=key)
+
+    lambda_handler({'Records': [_generate_s3_record('some_bucket_name', keys[-1])]}, None)
+
+    output = capsys.readouterr().out
+    emitted_metrics = json.loads(output.strip().split('\n')[-1])
+    assert emitted_metrics['ListedPomFiles'] == 2
+    assert emitted_metrics['ListingCalls'] == 1
+    assert emitted_metrics['VersionParsingCalls'] == 1
+    assert emitted_metrics['RenderingCalls'] == 1
+    # maven-metadata.xml and its 2 checksums
+    assert emitted_metrics['UploadCalls'] == 3
+    assert emitted_metrics['UploadedBytes'] > emitted_metrics['RenderedCharacters'] > 0
+    assert emitted_metrics['InvalidationCalls'] == 1
+    assert emitted_metrics['_aws']['CloudWatchMetrics'][0]['Namespace'] == 'MavenLambda'
+    # Content isn't logged anymore
+    assert '<version>1.1.0</version>' not in output
+
+
+def test_lambda_handler_components_snapshot(monkeypatch, packaging_cache):
+    s3_resource = S3ResourceStandIn()
+    monkeypatch.setattr('maven_lambda.metadata.s3', s3_resource)
+    monkeypatch.setattr('maven_lambda.metadata.get_work_queue', lambda: None)
+    for env_var in ('USE_VERSION_INDEX', 'LISTING_MODE', 'CLOUDFRONT_DISTRIBUTION_ID', 'CATALOG_PREFIX'):
+        monkeypatch.delenv(env_var, raising=False)
+    artifact_folder = 'maven2/org/mozilla/components/browser-domains/'
+    build_prefix = '{}0.30.0-SNAPSHOT/browser-domains-0.30.0-20181030.164630-2'.format(artifact_folder)
+    s3_resource.meta.client.put_object(
+        Bucket='some_bucket_name', Key='{}0.29.0/browser-domains-0.29.0.pom'.format(artifact_folder)
+    )
+    s3_resource.meta.client.put_object(
+        Bucket='some_bucket_name', Key='{}.pom'.format(build_prefix),
+        Body='<project><packaging>aar</packaging></project>'
+    )
+    for suffix in ('.aar', '-sources.jar', '-sources.jar.sha1'):
+        s3_resource.meta.client.put_object(Bucket='some_bucket_name', Key=build_prefix + suffix)
+
+    response = lambda_handler(
+        {'Records': [_generate_s3_record('some_bucket_name', '{}-sources.jar'.format(build_prefix))]},
+        None
+    )
+
+    assert response['artifactFolders'][0]['status'] == 'updated'
+    release_metadata = s3_resource.meta.client.get_object(
+        Bucket='some_bucket_name', Key='{}maven-metadata.xml'.format(artifact_folder)
+    )['Body'].read().decode()
+    assert '<latest>0.30.0-SNAPSHOT</latest>' in release_metadata
+    assert '<version>0.29.0</version><version>0.30.0-SNAPSHOT</version>' in release_metadata
+    snapshot_metadata = s3_resource.meta.client.get_object(
+        Bucket='some_bucket_name', Key='{}0.30.0-SNAPSHOT/maven-metadata.xml'.format(artifact_folder)
+    )['Body'].read().decode()
+    assert (
+        '<snapshotVersion><extension>aar</extension><value>0.30.0-20181030.164630-2</value>'
+    ) in snapshot_metadata
+    assert (
+        '<snapshotVersion><classifier>sources</classifier><extension>jar</extension>'
+        '<value>0.30.0-20181030.164630-2</value>'
+    ) in snapshot_metadata
+
+
+def test_drain_work_queue(monkeypatch):
+    work_queue = InMemoryWorkQueue()
+    for event_time in (100, 101, 102):
+        work_queue.enqueue('some_bucket_name', 'maven2/org/mozilla/geckoview/geckoview/', event_time=event_time)
+    work_queue.enqueue('some_bucket_name', 'maven2/org/mozilla/components/browser-domains/', event_time=100)
+    work_queue.enqueue('some_bucket_name', 'maven2/org/mozilla/components/browser-state/', event_time=150)
+
+    regenerated_folders = []
+
+    def regenerate(_, folder, __):
+        regenerated_folders.append(folder)
+        if 'browser-domains' in folder:
+            raise ConnectionError()
+        return ['{}maven-metadata.xml'.format(folder)]
+    monkeypatch.setattr('maven_lambda.metadata.regenerate_artifact_folder', regenerate)
+    cloudfront_mock = MagicMock()
+    monkeypatch.setattr('maven_lambda.metadata.invalidate_cloudfront_cache', cloudfront_mock)
+
+    with pytest.raises(ConnectionError):
+        drain_work_queue(work_queue, quiet_window=30, now=140)
+
+    assert sorted(regenerated_folders) == [
+        'maven2/org/mozilla/components/browser-domains/',
+        'maven2/org/mozilla/geckoview/geckoview/',
+    ]
+    cloudfront_mock.assert_called_once_with(['maven2/org/mozilla/geckoview/geckoview/maven-metadata.xml'])
+    # The failed folder is kept for the next drain, the one still receiving events isn't ready yet
+    assert sorted(work_queue.get_quiet_folders(0, now=1000)) == [
+        ('some_bucket_name', 'maven2/org/mozilla/components/browser-domains/', 100, ()),
+        ('some_bucket_name', 'maven2/org/mozilla/components/browser-state/', 150, ()),
+    ]
+
+
+def test_drain_work_queue_passes_the_keys_of_the_events(monkeypatch):
+    work_queue = InMemoryWorkQueue()
+    for event_time, version in ((100, '1.0.0'), (101, '1.1.0')):
+        work_queue.enqueue(
+            'some_bucket_name', GLEAN_FOLDER, ['{0}{1}/glean-{1}.pom'.format(GLEAN_FOLDER, version)],
+            event_time=event_time
+        )
+    regenerate_mock = MagicMock(return_value=[])
+    monkeypatch.setattr('maven_lambda.metadata.regenerate_artifact_folder', regenerate_mock)
+
+    drain_work_queue(work_queue, quiet_window=30, now=140)
+
+    # The version index gets updated from these keys, instead of a full listing
+    regenerate_mock.assert_called_once_with('some_bucket_name', GLEAN_FOLDER, [
+        '{}1.0.0/glean-1.0.0.pom'.format(GLEAN_FOLDER), '{}1.1.0/glean-1.1.0.pom'.format(GLEAN_FOLDER),
+    ])
+    assert work_queue.get_quiet_folders(0, now=1000) == []
+
+
+def test_drain_work_queue_acknowledges_folders_without_pom(monkeypatch):
+    s3 = S3ResourceStandIn()
+    monkeypatch.setattr('maven_lambda.metadata.s3', s3)
+    monkeypatch.delenv('USE_VERSION_INDEX', raising=False)
+    monkeypatch.delenv('LISTING_MODE', raising=False)
+    monkeypatch.delenv('CATALOG_PREFIX', raising=False)
+    cloudfront_mock = MagicMock()
+    monkeypatch.setattr('maven_lambda.metadata.invalidate_cloudfront_cache', cloudfront_mock)
+    # The .pom isn't uploaded yet
+    s3.meta.client.put_object(
+        Bucket='some_bucket_name', Key='maven2/org/mozilla/telemetry/glean/1.0.0/glean-1.0.0.jar'
+    )
+    work_queue = InMemoryWorkQueue()
+    work_queue.enqueue('some_bucket_name', 'maven2/org/mozilla/telemetry/glean/', event_time=100)
+
+    assert drain_work_queue(work_queue, quiet_window=30, now=140) == {'artifactFolders': [{
+        'bucket': 'some_bucket_name',
+        'artifactFolder': 'maven2/org/mozilla/telemetry/glean/',
+        'keys': [],
+        'status': 'unchanged',
+        'uploadedFiles': [],
+    }]}
+    assert work_queue.get_quiet_folders(0, now=1000) == []
+    assert s3.meta.client.calls['PutObject'] == 1
+    cloudfront_mock.assert_not_called()
+
+
+def test_drain_handler(monkeypatch):
+    work_queue = MagicMock()
+    monkeypatch.setattr('maven_lambda.metadata.get_work_queue', lambda: work_queue)
+    monkeypatch.setenv('DEBOUNCE_QUIET_WINDOW_SECONDS', '12.5')
+    monkeypatch.setenv('DEBOUNCE_MAX_DELAY_SECONDS', '300')
+    drain_mock = MagicMock(return_value={'artifactFolders': []})
+    monkeypatch.setattr('maven_lambda.metadata.drain_work_queue', drain_mock)
+
+    assert drain_handler({}, {}) == {'artifactFolders': []}
+    drain_mock.assert_called_once_with(work_queue, 12.5, max_delay=300)
+
+    monkeypatch.setattr('maven_lambda.metadata.get_work_queue', lambda: None)
+    with pytest.raises(ValueError):
+        drain_handler({}, {})
+
+
+@pytest.mark.parametrize('use_version_index', (None, '1'))
+def test_regenerate_artifact_folder(monkeypatch, use_version_index):
+    s3_mock = MagicMock()
+    monkeypatch.setattr('maven_lambda.metadata.s3', s3_mock)
+    if use_version_index:
+        monkeypatch.setenv('USE_VERSION_INDEX', use_version_index)
+    else:
+        monkeypatch.delenv('USE_VERSION_INDEX', raising=False)
+    monkeypatch.setenv('VERSION_INDEX_MAX_AGE_SECONDS', '3600')
+
+    pom_files = ['maven2/org/mozilla/geckoview/geckoview/65.0/geckoview-65.0.pom']
+    list_mock = MagicMock(return_value=pom_files)
+    monkeypatch.setattr('maven_lambda.metadata.list_pom_files_in_subfolders', list_mock)
+    list_with_index_mock = MagicMock(return_value=pom_files)
+    monkeypatch.setattr('maven_lambda.metadata.list_pom_files_with_version_index', list_with_index_mock)
+    crafted_folders = []
+
+    def craft(bucket, folder, list_pom_files, metadata_function):
+        assert metadata_function is stream_release_maven_metadata
+        crafted_folders.append(folder)
+        return ['{}maven-metadata.xml'.format(folder)], list_pom_files()
+    monkeypatch.setattr('maven_lambda.metadata.craft_and_upload_maven_metadata', craft)
+
+    assert regenerate_artifact_folder(
+        'some_bucket_name', 'maven2/org/mozilla/geckoview/geckoview/', pom_files
+    ) == ['maven2/org/mozilla/geckoview/geckoview/maven-metadata.xml']
+
+    bucket = s3_mock.Bucket.return_value
+    if use_version_index:
+        list_mock.assert_not_called()
+        list_with_index_mock.assert_called_once_with(
+            bucket, 'maven2/org/mozilla/geckoview/geckoview/', pom_files, list_mock, 3600.0
+        )
+    else:
+        list_mock.assert_called_once_with(bucket, 'maven2/org/mozilla/geckoview/geckoview/')
+        list_with_index_mock.assert_not_called()
+    assert crafted_folders == ['maven2/org/mozilla/geckoview/geckoview/']
+
+
+def test_group_keys_per_artifact_folder():
+    assert group_keys_per_artifact_folder([
+        _generate_s3_record('some_bucket_name', 'maven2/org/mozilla/geckoview/geckoview/65.0/geckoview-65.0.pom'),
+        _generate_s3_record('some_bucket_name', 'maven2/org/mozilla/geckoview/geckoview/65.0/geckoview-65.0.pom'),
+        _generate_s3_record('some_bucket_name', 'maven2/org/mozilla/geckoview/geckoview/66.0/geckoview%2B66.0.pom'),
+        _generate_s3_record('another_bucket_name', 'maven2/org/mozilla/geckoview/geckoview/65.0/geckoview-65.0.pom'),
+    ]) == {
+        ('some_bucket_name', 'maven2/org/mozilla/geckoview/geckoview/'): [
+            'maven2/org/mozilla/geckoview/geckoview/65.0/geckoview-65.0.pom',
+            'maven2/org/mozilla/geckoview/geckoview/66.0/geckoview+66.0.pom',
+        ],
+        ('another_bucket_name', 'maven2/org/mozilla/geckoview/geckoview/'): [
+            'maven2/org/mozilla/geckoview/geckoview/65.0/geckoview-65.0.pom',
+        ],
+    }
+
+
+@freeze_time('2020-01-01 12:00:00')
+def test_regenerate_artifact_folder_updates_catalog(monkeypatch):
+    s3 = S3ResourceStandIn()
+    monkeypatch.setattr('maven_lambda.metadata.s3', s3)
+    monkeypatch.delenv('USE_VERSION_INDEX', raising=False)
+    monkeypatch.delenv('LISTING_MODE', raising=False)
+    monkeypatch.setenv('CATALOG_PREFIX', 'catalog/')
+    for version in ('1.0.0', '1.1.0'):
+        s3.meta.client.put_object(
+            Bucket='some_bucket_name',
+            Key='maven2/org/mozilla/telemetry/glean/{0}/glean-{0}.pom'.format(version),
+        )
+
+    uploaded_files = regenerate_artifact_folder(
+        'some_bucket_name', 'maven2/org/mozilla/telemetry/glean/'
+    )
+
+    assert uploaded_files[-1] == 'catalog/org.mozilla.telemetry.json.gz'
+    assert fetch_catalog_shard(
+        s3.Bucket('some_bucket_name'), 'catalog/org.mozilla.telemetry.json.gz'
+    )['artifacts'] == {
+        'glean': {'latest': '1.1.0', 'versionCount': 2, 'lastUpdated': '20200101120000'},
+    }
+    # Unchanged metadata means an unchanged catalog entry
+    assert regenerate_artifact_folder(
+        'some_bucket_name', 'maven2/org/mozilla/telemetry/glean/'
+    ) == []
+
+
+def test_update_catalog_of_artifact_does_not_raise(monkeypatch):
+    monkeypatch.setattr(
+        'maven_lambda.metadata.update_catalog', MagicMock(side_effect=ConnectionError())
+    )
+    assert update_catalog_of_artifact(
+        MagicMock(), 'catalog/', ['maven2/org/mozilla/telemetry/glean/1.0.0/glean-1.0.0.pom']
+    ) == []
+
+
 @pytest.mark.parametrize('key, expected', ((
     'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom',
     'maven2/org/mozilla/geckoview/geckoview-nightly-x86/',
@@ -102,7 +574,10 @@ def test_list_pom_files_in_subfolders():
         'maven2/org/mozilla/geckoview/geckoview-nightly-x86/64.0.20181018103737/geckoview-nightly-x86-64.0.20181018103737.pom',
         'maven2/org/mozilla/geckoview/geckoview-nightly-x86/64.0.20181018103737/geckoview-nightly-x86-64.0.20181018103737.jar',
     ]
-    bucket_mock.objects.filter.return_value = [MagicMock(key=key) for key in keys]
+    paginate_mock = bucket_mock.meta.client.get_paginator.return_value.paginate
+    paginate_mock.return_value = [
+        {'Contents': [{'Key': key} for key in keys[:5]]}, {'Contents': [{'Key': key} for key in keys[5:]]}
+    ]
 
     assert list_pom_files_in_subfolders(
         bucket_mock, 'maven2/org/mozilla/geckoview/geckoview-nightly-x86'
@@ -110,11 +585,106 @@ def test_list_pom_files_in_subfolders():
         'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom',
         'maven2/org/mozilla/geckoview/geckoview-nightly-x86/64.0.20181018103737/geckoview-nightly-x86-64.0.20181018103737.pom',
     ]
-    bucket_mock.objects.filter.assert_called_once_with(
-        Prefix='maven2/org/mozilla/geckoview/geckoview-nightly-x86'
+    bucket_mock.meta.client.get_paginator.assert_called_once_with('list_objects_v2')
+    paginate_mock.assert_called_once_with(
+        Bucket=bucket_mock.name, Prefix='maven2/org/mozilla/geckoview/geckoview-nightly-x86'
     )
 
 
+@pytest.mark.parametrize('check_pom_exists, expected', ((
+    False,
+    [
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom',
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/64.0.20181018103737/geckoview-nightly-x86-64.0.20181018103737.pom',
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/65.0-SNAPSHOT/geckoview-nightly-x86-65.0-20181029.100346-1.pom',
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/65.0.20181029100346/geckoview-nightly-x86-65.0.20181029100346.pom',
+    ],
+), (
+    True,
+    [
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom',
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/64.0.20181018103737/geckoview-nightly-x86-64.0.20181018103737.pom',
+        # Timestamped builds, listed like in the default mode
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/65.0-SNAPSHOT/geckoview-nightly-x86-65.0-20181029.100346-1.pom',
+    ],
+)))
+def test_list_pom_files_in_version_folders(check_pom_exists, expected):
+    s3 = S3ResourceStandIn()
+    s3.meta.client.max_keys = 2
+    for key in (
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom',
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom.sha1',
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.jar',
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/64.0.20181018103737/geckoview-nightly-x86-64.0.20181018103737.pom',
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/65.0-SNAPSHOT/geckoview-nightly-x86-65.0-20181029.100346-1.aar',
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/65.0-SNAPSHOT/geckoview-nightly-x86-65.0-20181029.100346-1.pom',
+        # Upload still ongoing
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/65.0.20181029100346/geckoview-nightly-x86-65.0.20181029100346.jar',
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/maven-metadata.xml',
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86-other/63.0.20180830111743/geckoview-nightly-x86-other-63.0.20180830111743.pom',
+    ):
+        s3.meta.client.put_object(Bucket='some_bucket_name', Key=key)
+
+    assert list_pom_files_in_version_folders(
+        s3.Bucket('some_bucket_name'), 'maven2/org/mozilla/geckoview/geckoview-nightly-x86',
+        check_pom_exists=check_pom_exists
+    ) == expected
+    # 4 version folders + maven-metadata.xml, 2 per page. Then the 2 files of the SNAPSHOT one.
+    assert s3.meta.client.calls['ListObjectsV2'] == 4
+    assert s3.meta.client.listed_entries == 7
+
+
+@pytest.mark.parametrize('number_of_ranges', (1, 2, 3, 10))
+def test_list_pom_files_in_ranges(number_of_ranges):
+    s3 = S3ResourceStandIn()
+    s3.meta.client.max_keys = 2
+    keys = (
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.jar',
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom',
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom.sha1',
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/64.0.20181018103737/geckoview-nightly-x86-64.0.20181018103737.pom',
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/65.0-SNAPSHOT/geckoview-nightly-x86-65.0-20181029.100346-1.pom',
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/maven-metadata.xml',
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86-other/63.0.20180830111743/geckoview-nightly-x86-other-63.0.20180830111743.pom',
+    )
+    for key in keys:
+        s3.meta.client.put_object(Bucket='some_bucket_name', Key=key)
+
+    assert list_pom_files_in_ranges(
+        s3.Bucket('some_bucket_name'), 'maven2/org/mozilla/geckoview/geckoview-nightly-x86/',
+        number_of_ranges
+    ) == list_pom_files_in_subfolders(
+        s3.Bucket('some_bucket_name'), 'maven2/org/mozilla/geckoview/geckoview-nightly-x86/'
+    ) == [keys[1], keys[3], keys[4]]
+
+
+@pytest.mark.parametrize('listing_mode, expected_function, expected_keywords', (
+    (None, list_pom_files_in_subfolders, None),
+    ('objects', list_pom_files_in_subfolders, None),
+    ('version-folders', list_pom_files_in_version_folders, None),
+    ('checked-version-folders', list_pom_files_in_version_folders, {'check_pom_exists': True}),
+    ('ranges', list_pom_files_in_ranges, {'number_of_ranges': 8}),
+))
+def test_get_listing_function(monkeypatch, listing_mode, expected_function, expected_keywords):
+    if listing_mode is None:
+        monkeypatch.delenv('LISTING_MODE', raising=False)
+    else:
+        monkeypatch.setenv('LISTING_MODE', listing_mode)
+
+    function = get_listing_function()
+    if expected_keywords is None:
+        assert function is expected_function
+    else:
+        assert function.func is expected_function
+        assert function.keywords == expected_keywords
+
+
+def test_get_listing_function_unknown_mode(monkeypatch):
+    monkeypatch.setenv('LISTING_MODE', 'some-unknown-mode')
+    with pytest.raises(ValueError):
+        get_listing_function()
+
+
 @pytest.mark.parametrize('key', (
     'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom',
     'org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom',
@@ -144,17 +714,26 @@ def test_craft_and_upload_maven_metadata(monkeypatch):
 
     upload_s3_file_mock = MagicMock()
     monkeypatch.setattr('maven_lambda.metadata.upload_s3_file', upload_s3_file_mock)
+    s3_mock = MagicMock()
+    s3_mock.meta.client.head_object.return_value = {
+        'ETag': '"some-e-tag"', 'Metadata': {'content-sha1': 'some-outdated-hash'},
+    }
+    monkeypatch.setattr('maven_lambda.metadata.s3', s3_mock)
+    monkeypatch.setattr('maven_lambda.conditional_writes.supports_conditional_writes', lambda _: True)
+    pom_files = [
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom',
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/64.0.20181018103737/geckoview-nightly-x86-64.0.20181018103737.pom',
+    ]
 
-    assert craft_and_upload_maven_metadata(
+    _, listed_pom_files = craft_and_upload_maven_metadata(
         bucket_mock,
         'maven2/org/mozilla/geckoview/geckoview-nightly-x86/',
-        [
-            'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom',
-            'maven2/org/mozilla/geckoview/geckoview-nightly-x86/64.0.20181018103737/geckoview-nightly-x86-64.0.20181018103737.pom',
-        ],
+        lambda: pom_files,
         metadata_function_mock
     )
 
+    assert listed_pom_files == pom_files
+
     metadata_function_mock.assert_called_once_with(
         'some_bucket_name',
         [
@@ -168,7 +747,9 @@ def test_craft_and_upload_maven_metadata(monkeypatch):
         'maven2/org/mozilla/geckoview/geckoview-nightly-x86/',
         'maven-metadata.xml',
         '<some>metadata-data</some>',
-        content_type='text/xml'
+        content_type='text/xml',
+        metadata={'content-sha1': '72ab62c86d47363ceb9ec2e4079e5cbfd221e3d7'},
+        write_conditions={'IfMatch': '"some-e-tag"'}
     ) in upload_s3_file_mock.call_args_list
     assert call(
         'some_bucket_name',
@@ -184,9 +765,307 @@ def test_craft_and_upload_maven_metadata(monkeypatch):
     ) in upload_s3_file_mock.call_args_list
 
 
+def test_craft_and_upload_maven_metadata_skips_unchanged_metadata(monkeypatch):
+    bucket_mock = MagicMock()
+    bucket_mock.name = 'some_bucket_name'   # "name" is an argument to the Mock constructor
+    upload_s3_file_mock = MagicMock()
+    monkeypatch.setattr('maven_lambda.metadata.upload_s3_file', upload_s3_file_mock)
+    monkeypatch.setattr('maven_lambda.metadata.fetch_metadata_state', lambda _, __: ('"some-e-tag"', generate_content_hash(
+        '<metadata><lastUpdated>20181029160030</lastUpdated></metadata>'
+    )))
+
+    assert craft_and_upload_maven_metadata(
+        bucket_mock,
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/',
+        lambda: ['maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom'],
+        lambda _, __: '<metadata><lastUpdated>20181030120000</lastUpdated></metadata>'
+    ) == ([], ['maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom'])
+    upload_s3_file_mock.assert_not_called()
+
+
+def test_craft_and_upload_maven_metadata_uploads_metadata_last(monkeypatch, capsys):
+    bucket_mock = MagicMock()
+    bucket_mock.name = 'some_bucket_name'   # "name" is an argument to the Mock constructor
+    uploaded_file_names = []
+
+    def upload(_, folder, file_name, __, **___):
+        uploaded_file_names.append(file_name)
+        return '{}{}'.format(folder, file_name)
+    monkeypatch.setattr('maven_lambda.metadata.upload_s3_file', upload)
+    monkeypatch.setattr('maven_lambda.metadata.fetch_metadata_state', lambda _, __: (None, None))
+    monkeypatch.setattr('maven_lambda.conditional_writes.supports_conditional_writes', lambda _: False)
+
+    assert craft_and_upload_maven_metadata(
+        bucket_mock, 'some/folder/', lambda: ['some/folder/1.0/some-1.0.pom'], lambda _, __: '<metadata/>'
+    )[0] == ['some/folder/maven-metadata.xml', 'some/folder/maven-metadata.xml.md5', 'some/folder/maven-metadata.xml.sha1']
+    assert uploaded_file_names == ['maven-metadata.xml.md5', 'maven-metadata.xml.sha1', 'maven-metadata.xml']
+    assert 'WARN: This botocore can\'t send If-Match. "some/folder/maven-metadata.xml" is written unconditionally' in capsys.readouterr().out
+
+
+def test_supports_conditional_writes():
+    # Fails if botocore is older than what requirements/base.txt pins
+    assert supports_conditional_writes(boto3.client('s3', region_name='us-east-1'))
+
+
+def test_craft_and_upload_maven_metadata_uploads_gzip_variant(monkeypatch):
+    s3 = S3ResourceStandIn()
+    monkeypatch.setattr('maven_lambda.metadata.s3', s3)
+    folder = 'maven2/org/mozilla/geckoview/geckoview/'
+    metadata = '<metadata><lastUpdated>20181030120000</lastUpdated></metadata>'
+
+    def upload():
+        return craft_and_upload_maven_metadata(
+            s3.Bucket('some_bucket_name'), folder,
+            lambda: ['{}1.0/geckoview-1.0.pom'.format(folder)], lambda _, __: metadata
+        )[0]
+
+    assert len(upload()) == 3
+    assert upload() == []
+
+    # Turning the variant on uploads it, even if maven-metadata.xml didn't change
+    monkeypatch.setenv('METADATA_GZIP', '1')
+    assert upload() == [
+        '{}maven-metadata.xml'.format(folder),
+        '{}maven-metadata.xml.md5'.format(folder),
+        '{}maven-metadata.xml.sha1'.format(folder),
+        '{}maven-metadata.xml.gz'.format(folder),
+    ]
+    variant = s3.meta.client.get_object(
+        Bucket='some_bucket_name', Key='{}maven-metadata.xml.gz'.format(folder)
+    )
+    assert variant['ContentType'] == 'text/xml'
+    assert variant['ContentEncoding'] == 'gzip'
+    assert gzip.decompress(variant['Body'].read()).decode() == metadata
+    # Checksums are the ones of the uncompressed file
+    assert s3.meta.client.get_object(
+        Bucket='some_bucket_name', Key='{}maven-metadata.xml.sha1'.format(folder)
+    )['Body'].read().decode() == hashlib.sha1(metadata.encode()).hexdigest()
+    assert upload() == []
+
+
+def test_craft_and_upload_maven_metadata_reports_every_failed_checksum(monkeypatch):
+    bucket_mock = MagicMock()
+    bucket_mock.name = 'some_bucket_name'   # "name" is an argument to the Mock constructor
+    uploaded_file_names = []
+
+    def upload(_, folder, file_name, __, **___):
+        if file_name != 'maven-metadata.xml.md5':
+            raise ConnectionError('Could not reach S3')
+        uploaded_file_names.append(file_name)
+        return '{}{}'.format(folder, file_name)
+    monkeypatch.setattr('maven_lambda.metadata.upload_s3_file', upload)
+    monkeypatch.setattr('maven_lambda.metadata.fetch_metadata_state', lambda _, __: (None, None))
+
+    with pytest.raises(UploadError) as excinfo:
+        craft_and_upload_maven_metadata(
+            bucket_mock, 'some/folder/', lambda: ['some/folder/1.0/some-1.0.pom'], lambda _, __: '<metadata/>'
+        )
+
+    assert list(excinfo.value.errors_per_file_name) == ['maven-metadata.xml.sha1']
+    assert 'maven-metadata.xml was left untouched' in str(excinfo.value)
+    assert uploaded_file_names == ['maven-metadata.xml.md5']
+
+
+GLEAN_FOLDER = 'maven2/org/mozilla/telemetry/glean/'
+
+
+def _put_glean_pom(s3, version):
+    key = '{0}{1}/glean-{1}.pom'.format(GLEAN_FOLDER, version)
+    s3.meta.client.put_object(Bucket='some_bucket_name', Key=key)
+    return key
+
+
+def _fetch_glean_metadata(s3):
+    return s3.meta.client.get_object(
+        Bucket='some_bucket_name', Key='{}maven-metadata.xml'.format(GLEAN_FOLDER)
+    )['Body'].read()
+
+
+def test_craft_and_upload_maven_metadata_lists_again_after_concurrent_update(monkeypatch):
+    s3 = S3ResourceStandIn()
+    monkeypatch.setattr('maven_lambda.metadata.s3', s3)
+    monkeypatch.setattr('maven_lambda.conditional_writes.time.sleep', lambda _: None)
+    bucket = s3.Bucket('some_bucket_name')
+    _put_glean_pom(s3, '1.0.0')
+    listings = []
+
+    def list_pom_files():
+        pom_files = list_pom_files_in_subfolders(bucket, GLEAN_FOLDER)
+        listings.append(pom_files)
+        if len(listings) == 1:
+            # Another invocation lists 1.1.0 and writes maven-metadata.xml, once this one listed
+            craft_and_upload_maven_metadata(
+                bucket, GLEAN_FOLDER, lambda: pom_files + [_put_glean_pom(s3, '1.1.0')],
+                stream_release_maven_metadata
+            )
+        return pom_files
+
+    uploaded_files, pom_files = craft_and_upload_maven_metadata(
+        bucket, GLEAN_FOLDER, list_pom_files, stream_release_maven_metadata
+    )
+
+    assert len(listings) == 2
+    assert pom_files == listings[-1]
+    assert '{}maven-metadata.xml'.format(GLEAN_FOLDER) in uploaded_files
+    assert b'<version>1.1.0</version>' in _fetch_glean_metadata(s3)
+
+
+def test_craft_and_upload_maven_metadata_gives_up(monkeypatch):
+    monkeypatch.setattr('maven_lambda.metadata.s3', S3ResourceStandIn())
+    monkeypatch.setattr('maven_lambda.metadata.fetch_metadata_state', lambda _, __: (None, None))
+    sleeps = []
+    monkeypatch.setattr('maven_lambda.conditional_writes.time.sleep', sleeps.append)
+
+    def upload(_, folder, file_name, __, **kwargs):
+        if file_name == 'maven-metadata.xml':
+            assert kwargs['write_conditions'] == {'IfNoneMatch': '*'}
+            raise ClientError({'Error': {'Code': 'PreconditionFailed'}}, 'PutObject')
+        return '{}{}'.format(folder, file_name)
+    monkeypatch.setattr('maven_lambda.metadata.upload_s3_file', upload)
+    bucket_mock = MagicMock()
+    bucket_mock.name = 'some_bucket_name'   # "name" is an argument to the Mock constructor
+
+    with pytest.raises(ConcurrentUpdateError):
+        craft_and_upload_maven_metadata(
+            bucket_mock, 'some/folder/', lambda: ['some/folder/1.0/some-1.0.pom'], lambda _, __: '<metadata/>'
+        )
+    assert len(sleeps) == 4
+
+
+def test_craft_and_upload_maven_metadata_forgets_content_hash_when_giving_up(monkeypatch):
+    s3 = S3ResourceStandIn()
+    monkeypatch.setattr('maven_lambda.metadata.s3', s3)
+    monkeypatch.setattr('maven_lambda.conditional_writes.time.sleep', lambda _: None)
+    winning_metadata = '<metadata><version>1.0</version></metadata>'
+    s3.meta.client.put_object(
+        Bucket='some_bucket_name', Key='some/folder/maven-metadata.xml', Body=winning_metadata,
+        ContentType='text/xml', CacheControl='max-age=600',
+        Metadata={'content-sha1': generate_content_hash(winning_metadata)},
+    )
+    # Every other invocation replaced maven-metadata.xml right before this one wrote it
+    monkeypatch.setattr(
+        'maven_lambda.metadata.fetch_metadata_state', lambda _, __: ('"some-stale-e-tag"', None)
+    )
+    bucket_mock = MagicMock()
+    bucket_mock.name = 'some_bucket_name'   # "name" is an argument to the Mock constructor
+
+    with pytest.raises(ConcurrentUpdateError):
+        craft_and_upload_maven_metadata(
+            bucket_mock, 'some/folder/', lambda: ['some/folder/1.1/some-1.1.pom'],
+            lambda _, __: '<metadata><version>1.1</version></metadata>'
+        )
+
+    # The checksums now describe the losing render: the next invocation must not skip them
+    response = s3.meta.client.get_object(Bucket='some_bucket_name', Key='some/folder/maven-metadata.xml')
+    assert response['Body'].read() == winning_metadata.encode()
+    assert response['Metadata'] == {}
+    assert response['ContentType'] == 'text/xml'
+    assert s3.meta.client.get_object(
+        Bucket='some_bucket_name', Key='some/folder/maven-metadata.xml.sha1'
+    )['Body'].read() == hashlib.sha1(b'<metadata><version>1.1</version></metadata>').hexdigest().encode()
+
+
+@pytest.mark.parametrize('use_version_index', (False, True))
+def test_concurrent_invocations_never_drop_versions(monkeypatch, use_version_index):
+    s3 = S3ResourceStandIn()
+    # Requests take long enough for invocations to interleave
+    s3.meta.client.latency = 0.002
+    monkeypatch.setattr('maven_lambda.metadata.s3', s3)
+    monkeypatch.setattr('maven_lambda.metadata.METADATA_WRITE_BASE_DELAY', 0.01)
+    monkeypatch.setattr('maven_lambda.version_index.VERSION_INDEX_WRITE_BASE_DELAY', 0.01)
+    if use_version_index:
+        monkeypatch.setenv('USE_VERSION_INDEX', '1')
+    else:
+        monkeypatch.delenv('USE_VERSION_INDEX', raising=False)
+    monkeypatch.delenv('LISTING_MODE', raising=False)
+    monkeypatch.delenv('CATALOG_PREFIX', raising=False)
+    versions = ['1.{}.0'.format(index) for index in range(12)]
+    barrier = threading.Barrier(len(versions))
+
+    # Invocations that list first render slowest: without conditional writes, the first one
+    # would write last, and drop every version it didn't list
+    def render_slowly(metadata_chunks):
+        rendered = generate_metadata_and_checksums(metadata_chunks)
+        time.sleep((len(versions) - versions.index(threading.current_thread().name)) * 0.005)
+        return rendered
+    monkeypatch.setattr('maven_lambda.metadata.generate_metadata_and_checksums', render_slowly)
+
+    def upload_and_regenerate(version):
+        barrier.wait()
+        # Uploads land while other invocations are listing, rendering or uploading
+        time.sleep(versions.index(version) * 0.003)
+        key = _put_glean_pom(s3, version)
+        while True:
+            try:
+                return regenerate_artifact_folder('some_bucket_name', GLEAN_FOLDER, [key])
+            except ConcurrentUpdateError:
+                # AWS retries failed events
+                continue
+
+    threads = [
+        threading.Thread(target=upload_and_regenerate, args=(version,), name=version)
+        for version in versions
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    metadata = _fetch_glean_metadata(s3)
+    for version in versions:
+        assert '<version>{}</version>'.format(version).encode() in metadata
+    # Checksums match the winning maven-metadata.xml
+    for algorithm in ('md5', 'sha1'):
+        assert s3.meta.client.get_object(
+            Bucket='some_bucket_name', Key='{}maven-metadata.xml.{}'.format(GLEAN_FOLDER, algorithm)
+        )['Body'].read() == hashlib.new(algorithm, metadata).hexdigest().encode()
+
+
+def test_generate_content_hash():
+    assert generate_content_hash(
+        '<metadata><versions><version>1.0</version></versions><lastUpdated>20181029160030</lastUpdated></metadata>'
+    ) == generate_content_hash(
+        '<metadata><versions><version>1.0</version></versions><lastUpdated>20201231235959</lastUpdated></metadata>'
+    ) != generate_content_hash(
+        '<metadata><versions><version>1.1</version></versions><lastUpdated>20181029160030</lastUpdated></metadata>'
+    )
+
+
+@pytest.mark.parametrize('head_object, expected', ((
+    {'ETag': '"some-e-tag"', 'Metadata': {'content-sha1': 'some-hash'}},
+    ('"some-e-tag"', 'some-hash'),
+), (
+    {'ETag': '"some-e-tag"', 'Metadata': {}},
+    ('"some-e-tag"', None),
+), (
+    ClientError({'Error': {'Code': '404'}}, 'HeadObject'),
+    (None, None),
+)))
+def test_fetch_metadata_state(monkeypatch, head_object, expected):
+    s3_mock = MagicMock()
+    if isinstance(head_object, Exception):
+        s3_mock.meta.client.head_object.side_effect = head_object
+    else:
+        s3_mock.meta.client.head_object.return_value = head_object
+    monkeypatch.setattr('maven_lambda.metadata.s3', s3_mock)
+
+    assert fetch_metadata_state('some_bucket_name', 'some/folder/') == expected
+    s3_mock.meta.client.head_object.assert_called_once_with(
+        Bucket='some_bucket_name', Key='some/folder/maven-metadata.xml'
+    )
+
+
+def test_fetch_metadata_state_raises_other_errors(monkeypatch):
+    s3_mock = MagicMock()
+    s3_mock.meta.client.head_object.side_effect = ClientError({'Error': {'Code': '403'}}, 'HeadObject')
+    monkeypatch.setattr('maven_lambda.metadata.s3', s3_mock)
+    with pytest.raises(ClientError):
+        fetch_metadata_state('some_bucket_name', 'some/folder/')
+
+
 @freeze_time('2018-10-29 16:00:30')
 def test_generate_release_maven_metadata():
-    assert generate_release_maven_metadata('some_bucket_name', [
+    metadata, _ = generate_metadata_and_checksums(stream_release_maven_metadata('some_bucket_name', [
         'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom',
         'maven2/org/mozilla/geckoview/geckoview-nightly-x86/64.0.20181018103737/geckoview-nightly-x86-64.0.20181018103737.pom',
         'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom',
@@ -194,7 +1073,8 @@ def test_generate_release_maven_metadata():
         'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830100125/geckoview-nightly-x86-63.0.20180830100125.pom',
         'maven2/org/mozilla/geckoview/geckoview-nightly-x86/65.0.20181029100346/geckoview-nightly-x86-65.0.20181029100346.pom',
         'maven2/org/mozilla/geckoview/geckoview-nightly-x86/64.0.20181019100100/geckoview-nightly-x86-64.0.20181019100100.pom',
-    ]) == ("<?xml version='1.0' encoding='utf-8'?>\n"
+    ]))
+    assert metadata == ("<?xml version='1.0' encoding='utf-8'?>\n"
 "<metadata>"
     "<groupId>org.mozilla.geckoview</groupId>"
     "<artifactId>geckoview-nightly-x86</artifactId>"
@@ -214,7 +1094,74 @@ def test_generate_release_maven_metadata():
 "</metadata>")
 
 
-@pytest.mark.parametrize('xml_data, expected_format', ((
+def _generate_maven_metadata_with_element_tree(group_id, artifact_id, latest_version, versions, last_updated):
+    root = ET.Element('metadata')
+    ET.SubElement(root, 'groupId').text = group_id
+    ET.SubElement(root, 'artifactId').text = artifact_id
+    versioning = ET.SubElement(root, 'versioning')
+    ET.SubElement(versioning, 'latest').text = latest_version
+    ET.SubElement(versioning, 'release').text = '' if latest_version is None else latest_version
+    versions_element = ET.SubElement(versioning, 'versions')
+    for version in versions:
+        ET.SubElement(versions_element, 'version').text = version
+    ET.SubElement(versioning, 'lastUpdated').text = last_updated
+    stream = io.StringIO()
+    ET.ElementTree(root).write(
+        stream, encoding='unicode', xml_declaration=True, method='xml', short_empty_elements=False
+    )
+    return stream.getvalue()
+
+
+@freeze_time('2018-10-29 16:00:30')
+@pytest.mark.parametrize('number_of_versions', (1, 999, 1000, 2500))
+def test_stream_release_maven_metadata_matches_element_tree(monkeypatch, number_of_versions):
+    versions = ['1.{}.0'.format(index) for index in range(number_of_versions)]
+    keys = [
+        'maven2/org/mozilla/some&group/some<artifact>/{version}/some<artifact>-{version}.pom'.format(version=version)
+        for version in versions
+    ]
+    chunks = list(stream_release_maven_metadata('some_bucket_name', keys))
+
+    assert len(chunks) > 1
+    assert ''.join(chunks) == _generate_maven_metadata_with_element_tree(
+        'org.mozilla.some&group', 'some<artifact>', '1.{}.0'.format(number_of_versions - 1),
+        sorted(versions), '20181029160030'
+    )
+
+
+@freeze_time('2018-10-29 16:00:30')
+def test_stream_release_maven_metadata_without_latest_version(monkeypatch):
+    monkeypatch.setattr('maven_lambda.metadata.get_latest_version', lambda *_: None)
+    assert ''.join(stream_release_maven_metadata('some_bucket_name', [
+        'maven2/org/mozilla/geckoview/geckoview/65.0/geckoview-65.0.pom',
+    ])) == _generate_maven_metadata_with_element_tree(
+        'org.mozilla.geckoview', 'geckoview', None, ['65.0'], '20181029160030'
+    )
+
+
+@pytest.mark.parametrize('metadata_chunks', (
+    'known string',
+    ['known', ' ', 'string'],
+    (chunk for chunk in ('known ', 'string')),
+))
+def test_generate_metadata_and_checksums(metadata_chunks):
+    assert generate_metadata_and_checksums(metadata_chunks) == ('known string', {
+        'md5': 'a48fba03a9ac529b358935164826d9fe',
+        'sha1': '714f4de20aa1899ed09e22a82304e12d4658eac1',
+    })
+
+
+SNAPSHOT_POM_KEY = 'maven2/org/mozilla/components/browser-domains/0.30.0-SNAPSHOT/browser-domains-0.30.0-20181030.164630-2.pom'
+
+
+@pytest.fixture
+def packaging_cache(monkeypatch):
+    packaging_cache = {}
+    monkeypatch.setattr('maven_lambda.metadata._packaging_per_pom', packaging_cache)
+    return packaging_cache
+
+
+@pytest.mark.parametrize('xml_data, expected_packaging', ((
     '''<?xml version="1.0" encoding="utf-8"?>
 <project xmlns="http://maven.apache.org/POM/4.0.0">
 <packaging>aar</packaging>
@@ -231,25 +1178,209 @@ def test_generate_release_maven_metadata():
 <project xmlns="http://maven.apache.org/POM/4.0.0">
 </project>''',
     'jar',
+), (
+    '''<?xml version="1.0" encoding="utf-8"?>
+<project>
+<dependencies><dependency><packaging>pom</packaging></dependency></dependencies>
+<packaging> aar </packaging>
+</project>''',
+    'aar',
 )))
-def test_fetch_extension_from_pom_file_content(monkeypatch, xml_data, expected_format):
-    s3_mock = MagicMock()
-    bucket_mock = MagicMock()
-    s3_mock.Bucket.return_value = bucket_mock
+def test_fetch_packaging(monkeypatch, packaging_cache, xml_data, expected_packaging):
+    s3 = S3ResourceStandIn()
+    monkeypatch.setattr('maven_lambda.metadata.s3', s3)
+    s3.meta.client.put_object(Bucket='some_bucket_name', Key=SNAPSHOT_POM_KEY, Body=xml_data)
 
-    def fake_download(_, destination):
-        with open(destination, 'w') as f:
-            f.write(xml_data)
+    assert fetch_packaging('some_bucket_name', SNAPSHOT_POM_KEY) == expected_packaging
+    assert s3.meta.client.calls['GetObject'] == 1
 
-    bucket_mock.download_file.side_effect = fake_download
 
-    monkeypatch.setattr('maven_lambda.metadata.s3', s3_mock)
+@pytest.mark.parametrize('packaging_element, expected_packaging, expected_get_calls', (
+    # Stops at <packaging>, in the second range out of 4
+    ('<packaging>aar</packaging>', 'aar', 2),
+    # The whole POM is read
+    ('', 'jar', 4),
+))
+def test_fetch_packaging_reads_ranges(
+    monkeypatch, packaging_cache, packaging_element, expected_packaging, expected_get_calls
+):
+    monkeypatch.setattr('maven_lambda.metadata.POM_RANGE_SIZE', 100)
+    s3 = S3ResourceStandIn()
+    monkeypatch.setattr('maven_lambda.metadata.s3', s3)
+    xml_data = '''<?xml version="1.0" encoding="utf-8"?>
+<project xmlns="http://maven.apache.org/POM/4.0.0">
+<groupId>org.mozilla.components</groupId>{}
+<dependencies>{}</dependencies>
+</project>'''.format(packaging_element, '<dependency><artifactId>some-dependency</artifactId></dependency>' * 3)
+    s3.meta.client.put_object(Bucket='some_bucket_name', Key=SNAPSHOT_POM_KEY, Body=xml_data)
+
+    assert fetch_packaging('some_bucket_name', SNAPSHOT_POM_KEY) == expected_packaging
+    assert s3.meta.client.calls['GetObject'] == expected_get_calls
+
+
+def test_fetch_packaging_caches_packaging_by_e_tag(monkeypatch, packaging_cache):
+    s3 = S3ResourceStandIn()
+    monkeypatch.setattr('maven_lambda.metadata.s3', s3)
+    s3.meta.client.put_object(
+        Bucket='some_bucket_name', Key=SNAPSHOT_POM_KEY, Body='<project><packaging>aar</packaging></project>'
+    )
+
+    assert fetch_packaging('some_bucket_name', SNAPSHOT_POM_KEY) == 'aar'
+    # Not modified
+    assert fetch_packaging('some_bucket_name', SNAPSHOT_POM_KEY) == 'aar'
+    assert s3.meta.client.calls['GetObject'] == 2
+    assert list(packaging_cache.values()) == [
+        (s3.meta.client.head_object(Bucket='some_bucket_name', Key=SNAPSHOT_POM_KEY)['ETag'], 'aar'),
+    ]
+
+    s3.meta.client.put_object(
+        Bucket='some_bucket_name', Key=SNAPSHOT_POM_KEY, Body='<project><packaging>pom</packaging></project>'
+    )
+    assert fetch_packaging('some_bucket_name', SNAPSHOT_POM_KEY) == 'pom'
 
-    assert _fetch_extension_from_pom_file_content('some_bucket_name',
+
+def test_fetch_packaging_cache_is_bounded(monkeypatch, packaging_cache):
+    monkeypatch.setattr('maven_lambda.metadata.PACKAGING_CACHE_SIZE', 2)
+    s3 = S3ResourceStandIn()
+    monkeypatch.setattr('maven_lambda.metadata.s3', s3)
+    for build_number in range(3):
+        key = SNAPSHOT_POM_KEY.replace('-2.pom', '-{}.pom'.format(build_number))
+        s3.meta.client.put_object(Bucket='some_bucket_name', Key=key, Body='<project/>')
+        fetch_packaging('some_bucket_name', key)
+
+    assert [key for _, key in packaging_cache] == [
+        SNAPSHOT_POM_KEY.replace('-2.pom', '-1.pom'),
+        SNAPSHOT_POM_KEY.replace('-2.pom', '-2.pom'),
+    ]
+
+
+@freeze_time('2018-10-31 12:00:00')
+def test_stream_snapshot_maven_metadata(monkeypatch):
+    fetch_mock = MagicMock(return_value='aar')
+    monkeypatch.setattr('maven_lambda.metadata.fetch_packaging', fetch_mock)
+    s3 = S3ResourceStandIn()
+    monkeypatch.setattr('maven_lambda.metadata.s3', s3)
+    for file_name in (
+        'browser-domains-0.30.0-20181030.164630-9-sources.jar',
+        'browser-domains-0.30.0-20181030.164630-10.pom',
+        'browser-domains-0.30.0-20181030.164630-10.pom.sha1',
+        'browser-domains-0.30.0-20181030.164630-10-javadoc.jar',
+        'browser-domains-0.30.0-20181030.164630-10-javadoc.jar.md5',
+        'browser-domains-0.30.0-20181030.164630-10-sources.jar',
+        'browser-domains-0.30.0-20181030.164630-10-sources.jar.asc',
+        'browser-domains-0.30.0-20181030.164630-10.module',
+        # Another build, whose name starts like the one of build 10
+        'browser-domains-0.30.0-20181030.164630-100-tests.jar',
+    ):
+        s3.meta.client.put_object(
+            Bucket='some_bucket_name',
+            Key='maven2/org/mozilla/components/browser-domains/0.30.0-SNAPSHOT/{}'.format(file_name),
+        )
+
+    assert ''.join(stream_snapshot_maven_metadata('some_bucket_name', [
+        'maven2/org/mozilla/components/browser-domains/0.30.0-SNAPSHOT/browser-domains-0.30.0-20181029.154529-1.pom',
+        'maven2/org/mozilla/components/browser-domains/0.30.0-SNAPSHOT/browser-domains-0.30.0-20181030.164630-10.pom',
+        'maven2/org/mozilla/components/browser-domains/0.30.0-SNAPSHOT/browser-domains-0.30.0-20181030.164630-9.pom',
+    ])) == (
+        "<?xml version='1.0' encoding='utf-8'?>\n"
+        '<metadata>'
+        '<groupId>org.mozilla.components</groupId>'
+        '<artifactId>browser-domains</artifactId>'
+        '<version>0.30.0-SNAPSHOT</version>'
+        '<versioning>'
+        '<snapshot><timestamp>20181030.164630</timestamp><buildNumber>10</buildNumber></snapshot>'
+        '<lastUpdated>20181031120000</lastUpdated>'
+        '<snapshotVersions>'
+        '<snapshotVersion><extension>aar</extension><value>0.30.0-20181030.164630-10</value><updated>20181030164630</updated></snapshotVersion>'
+        '<snapshotVersion><extension>module</extension><value>0.30.0-20181030.164630-10</value><updated>20181030164630</updated></snapshotVersion>'
+        '<snapshotVersion><extension>pom</extension><value>0.30.0-20181030.164630-10</value><updated>20181030164630</updated></snapshotVersion>'
+        '<snapshotVersion><classifier>javadoc</classifier><extension>jar</extension><value>0.30.0-20181030.164630-10</value><updated>20181030164630</updated></snapshotVersion>'
+        '<snapshotVersion><classifier>sources</classifier><extension>jar</extension><value>0.30.0-20181030.164630-10</value><updated>20181030164630</updated></snapshotVersion>'
+        '</snapshotVersions>'
+        '</versioning>'
+        '</metadata>'
+    )
+    fetch_mock.assert_called_once_with(
+        'some_bucket_name',
+        'maven2/org/mozilla/components/browser-domains/0.30.0-SNAPSHOT/browser-domains-0.30.0-20181030.164630-10.pom',
+    )
+
+
+@pytest.mark.parametrize('keys, expected_version_folders', ((
+    (),
+    [
+        'maven2/org/mozilla/components/browser-domains/0.30.0-SNAPSHOT/',
+        'maven2/org/mozilla/components/browser-domains/0.31.0-SNAPSHOT/',
+    ],
+), (
+    ['maven2/org/mozilla/components/browser-domains/0.31.0-SNAPSHOT/browser-domains-0.31.0-20181101.100000-1.aar'],
+    ['maven2/org/mozilla/components/browser-domains/0.31.0-SNAPSHOT/'],
+), (
+    ['maven2/org/mozilla/components/browser-domains/0.29.0/browser-domains-0.29.0.pom'],
+    [],
+)))
+def test_regenerate_snapshot_version_folders(monkeypatch, keys, expected_version_folders):
+    pom_files = [
+        'maven2/org/mozilla/components/browser-domains/0.29.0/browser-domains-0.29.0.pom',
+        'maven2/org/mozilla/components/browser-domains/0.30.0-SNAPSHOT/browser-domains-0.30.0-20181029.154529-1.pom',
         'maven2/org/mozilla/components/browser-domains/0.30.0-SNAPSHOT/browser-domains-0.30.0-20181030.164630-2.pom',
-    ) == expected_format
+        # Not a timestamped build
+        'maven2/org/mozilla/components/browser-domains/0.30.0-SNAPSHOT/browser-domains-0.30.0-SNAPSHOT.pom',
+        'maven2/org/mozilla/components/browser-domains/0.31.0-SNAPSHOT/browser-domains-0.31.0-20181101.100000-1.pom',
+    ]
+    bucket = S3ResourceStandIn().Bucket('some_bucket_name')
+    for pom_file in pom_files:
+        bucket.Object(pom_file).put(Body='')
+    crafted_version_folders = []
 
-    s3_mock.Bucket.assert_called_once_with('some_bucket_name')
+    def craft(bucket, folder, list_pom_files, metadata_function):
+        assert metadata_function is stream_snapshot_maven_metadata
+        version_folder_pom_files = list_pom_files()
+        assert version_folder_pom_files
+        assert all(pom_file.startswith(folder) for pom_file in version_folder_pom_files)
+        assert all('-SNAPSHOT.pom' not in pom_file for pom_file in version_folder_pom_files)
+        crafted_version_folders.append(folder)
+        return ['{}maven-metadata.xml'.format(folder)], version_folder_pom_files
+    monkeypatch.setattr('maven_lambda.metadata.craft_and_upload_maven_metadata', craft)
+
+    assert regenerate_snapshot_version_folders(bucket, pom_files, keys) == [
+        '{}maven-metadata.xml'.format(version_folder) for version_folder in expected_version_folders
+    ]
+    assert sorted(crafted_version_folders) == expected_version_folders
+
+
+@pytest.mark.parametrize('listing_mode', ('', 'version-folders', 'checked-version-folders', 'ranges'))
+def test_regenerate_artifact_folder_with_snapshots(monkeypatch, packaging_cache, listing_mode):
+    s3 = S3ResourceStandIn()
+    monkeypatch.setattr('maven_lambda.metadata.s3', s3)
+    monkeypatch.delenv('USE_VERSION_INDEX', raising=False)
+    monkeypatch.setenv('LISTING_MODE', listing_mode)
+    pom_key = 'maven2/org/mozilla/telemetry/glean/0.30.0-SNAPSHOT/glean-0.30.0-20181030.164630-2.pom'
+    s3.meta.client.put_object(
+        Bucket='some_bucket_name', Key=pom_key,
+        Body='<project xmlns="http://maven.apache.org/POM/4.0.0"><packaging>aar</packaging></project>'
+    )
+
+    assert regenerate_artifact_folder(
+        'some_bucket_name', 'maven2/org/mozilla/telemetry/glean/', [pom_key]
+    ) == [
+        'maven2/org/mozilla/telemetry/glean/maven-metadata.xml',
+        'maven2/org/mozilla/telemetry/glean/maven-metadata.xml.md5',
+        'maven2/org/mozilla/telemetry/glean/maven-metadata.xml.sha1',
+        'maven2/org/mozilla/telemetry/glean/0.30.0-SNAPSHOT/maven-metadata.xml',
+        'maven2/org/mozilla/telemetry/glean/0.30.0-SNAPSHOT/maven-metadata.xml.md5',
+        'maven2/org/mozilla/telemetry/glean/0.30.0-SNAPSHOT/maven-metadata.xml.sha1',
+    ]
+    snapshot_metadata = s3.meta.client.get_object(
+        Bucket='some_bucket_name',
+        Key='maven2/org/mozilla/telemetry/glean/0.30.0-SNAPSHOT/maven-metadata.xml',
+    )['Body'].read().decode()
+    assert '<extension>aar</extension><value>0.30.0-20181030.164630-2</value>' in snapshot_metadata
+
+    # Nothing changed
+    assert regenerate_artifact_folder(
+        'some_bucket_name', 'maven2/org/mozilla/telemetry/glean/', [pom_key]
+    ) == []
 
 
 def test_generate_versions():
@@ -332,6 +1463,102 @@ def test_get_latest_version_error():
     assert '"maven2/org/mozilla/geckoview/geckoview-nightly-x86/64.0-TESTING/geckoview-nightly-x86-64.0-TESTING.pom" does not contain a valid version. See root error.' in str(excinfo.value)
 
 
+def test_parse_versions_parses_each_version_once(monkeypatch):
+    _parse_version_string.cache_clear()
+    parse_mock = MagicMock(side_effect=lambda version: 'parsed {}'.format(version))
+    monkeypatch.setattr('maven_lambda.coordinates.MavenVersion.parse', parse_mock)
+
+    versions_per_path = {
+        'maven2/org/mozilla/geckoview/geckoview/65.0/geckoview-65.0.pom': '65.0',
+        'maven2/org/mozilla/geckoview/geckoview/65.0/geckoview-65.0.aar': '65.0',
+        'maven2/org/mozilla/geckoview/geckoview/66.0/geckoview-66.0.pom': '66.0',
+    }
+    assert parse_versions(versions_per_path) == {'65.0': 'parsed 65.0', '66.0': 'parsed 66.0'}
+    assert parse_mock.call_count == 2
+
+    # Another invocation of a warm lambda
+    assert parse_versions(versions_per_path) == {'65.0': 'parsed 65.0', '66.0': 'parsed 66.0'}
+    assert parse_mock.call_count == 2
+    _parse_version_string.cache_clear()
+
+
+def test_parse_versions_uses_mobile_versions_for_components():
+    parsed_versions = parse_versions({
+        'maven2/org/mozilla/components/browser-engine-gecko/109.0b1/browser-engine-gecko-109.0b1.pom': '109.0b1',
+        'maven2/org/mozilla/geckoview/geckoview/65.0/geckoview-65.0.pom': '65.0',
+    })
+    assert type(parsed_versions['109.0b1']).__name__ == 'MobileVersion'
+    assert type(parsed_versions['65.0']).__name__ == 'MavenVersion'
+
+
+def test_parse_versions_follows_repository_layout(monkeypatch):
+    monkeypatch.setenv('REPOSITORY_LAYOUT', json.dumps({
+        'roots': ['releases'],
+        'versionSchemes': {'org.mozilla.geckoview': 'mobile'},
+    }))
+    parsed_versions = parse_versions({
+        'releases/org/mozilla/components/browser-engine-gecko/109.0.0/browser-engine-gecko-109.0.0.pom': '109.0.0',
+        'releases/org/mozilla/geckoview/geckoview/109.0b1/geckoview-109.0b1.pom': '109.0b1',
+    })
+    assert type(parsed_versions['109.0.0']).__name__ == 'MavenVersion'
+    assert type(parsed_versions['109.0b1']).__name__ == 'MobileVersion'
+    assert get_group_id(
+        'releases/org/mozilla/geckoview/geckoview/109.0b1/geckoview-109.0b1.pom'
+    ) == 'org.mozilla.geckoview'
+
+
+def test_sort_versions():
+    assert sort_versions({
+        'maven2/org/mozilla/components/browser-engine-gecko/109.0.1/browser-engine-gecko-109.0.1.pom': '109.0.1',
+        'maven2/org/mozilla/components/browser-engine-gecko/109.0/browser-engine-gecko-109.0.pom': '109.0',
+        'maven2/org/mozilla/components/browser-engine-gecko/109.0b10/browser-engine-gecko-109.0b10.pom': '109.0b10',
+        'maven2/org/mozilla/components/browser-engine-gecko/109.0b2/browser-engine-gecko-109.0b2.pom': '109.0b2',
+        'maven2/org/mozilla/components/browser-engine-gecko/108.0.0/browser-engine-gecko-108.0.0.pom': '108.0.0',
+        'maven2/org/mozilla/components/browser-engine-gecko/108.0.0/browser-engine-gecko-108.0.0.aar': '108.0.0',
+    }) == ['108.0.0', '109.0b2', '109.0b10', '109.0', '109.0.1']
+
+
+def test_sort_versions_with_snapshots():
+    versions_per_path = {
+        'maven2/org/mozilla/components/browser-domains/{0}/browser-domains-{0}.pom'.format(version): version
+        for version in ('0.30.0', '0.31.0-SNAPSHOT', '0.30.0-SNAPSHOT', '0.29.0', '0.30.0-beta.1')
+    }
+    assert sort_versions(versions_per_path) == [
+        '0.29.0', '0.30.0-beta.1', '0.30.0-SNAPSHOT', '0.30.0', '0.31.0-SNAPSHOT'
+    ]
+    assert get_latest_version(versions_per_path) == '0.31.0-SNAPSHOT'
+    del versions_per_path['maven2/org/mozilla/components/browser-domains/0.31.0-SNAPSHOT/browser-domains-0.31.0-SNAPSHOT.pom']
+    assert get_latest_version(versions_per_path) == '0.30.0'
+
+
+@freeze_time('2018-10-29 16:00:30')
+@pytest.mark.parametrize('versions_order, expected_versions', (
+    (None, '<version>10.0</version><version>9.0</version>'),
+    ('lexical', '<version>10.0</version><version>9.0</version>'),
+    ('version', '<version>9.0</version><version>10.0</version>'),
+))
+def test_stream_release_maven_metadata_versions_order(monkeypatch, versions_order, expected_versions):
+    if versions_order is None:
+        monkeypatch.delenv('VERSIONS_ORDER', raising=False)
+    else:
+        monkeypatch.setenv('VERSIONS_ORDER', versions_order)
+
+    assert '<versions>{}</versions>'.format(expected_versions) in ''.join(stream_release_maven_metadata(
+        'some_bucket_name', [
+            'maven2/org/mozilla/geckoview/geckoview/9.0/geckoview-9.0.pom',
+            'maven2/org/mozilla/geckoview/geckoview/10.0/geckoview-10.0.pom',
+        ]
+    ))
+
+
+def test_stream_release_maven_metadata_unknown_versions_order(monkeypatch):
+    monkeypatch.setenv('VERSIONS_ORDER', 'some-unknown-order')
+    with pytest.raises(ValueError):
+        ''.join(stream_release_maven_metadata('some_bucket_name', [
+            'maven2/org/mozilla/geckoview/geckoview/9.0/geckoview-9.0.pom',
+        ]))
+
+
 def test_upload_s3_file(monkeypatch):
     s3_mock = MagicMock()
     object_mock = MagicMock()
@@ -344,7 +1571,32 @@ def test_upload_s3_file(monkeypatch):
     ) == 'some/folder/some_file'
 
     s3_mock.Object.assert_called_once_with('some_bucket', 'some/folder/some_file')
-    object_mock.put.assert_called_once_with(Body='some data', ContentType='some/content-type', CacheControl='max-age=600')
+    object_mock.put.assert_called_once_with(Body=b'some data', ContentType='some/content-type', CacheControl='max-age=600')
+
+    object_mock.reset_mock()
+    upload_s3_file('some_bucket', 'some/folder/', 'some_file', 'some data', metadata={'some': 'metadata'})
+    object_mock.put.assert_called_once_with(
+        Body=b'some data', ContentType='text/plain', CacheControl='max-age=600', Metadata={'some': 'metadata'}
+    )
+
+    object_mock.reset_mock()
+    upload_s3_file('some_bucket', 'some/folder/', 'some_file', b'some data', content_encoding='gzip')
+    object_mock.put.assert_called_once_with(
+        Body=b'some data', ContentType='text/plain', CacheControl='max-age=600', ContentEncoding='gzip'
+    )
+
+
+def test_upload_s3_file_counts_uploaded_bytes(monkeypatch):
+    monkeypatch.setattr('maven_lambda.metadata.s3', MagicMock())
+    add_mock = MagicMock()
+    monkeypatch.setattr('maven_lambda.metrics.add', add_mock)
+
+    # 9 characters, 10 bytes in UTF-8
+    upload_s3_file('some_bucket', 'some/folder/', 'some_file', 'Some data')
+    upload_s3_file('some_bucket', 'some/folder/', 'some_file', 'Söme data')
+    assert add_mock.call_args_list == [
+        call('UploadedBytes', 9, 'Bytes'), call('UploadedBytes', 10, 'Bytes'),
+    ]
 
 
 @pytest.mark.parametrize('cloudfront_distribution_id, paths, expected_items, expected_quantity', ((
@@ -388,12 +1640,25 @@ def test_invalidate_cloudfront_does_not_bail_out_on_client_error(monkeypatch):
     invalidate_cloudfront_cache(['some/folder/some_file'])  # Does not raise
 
 
-@pytest.mark.parametrize('data', (
-    'known string',
-    b'known string',
-))
-def test_generate_checksums(data):
-    assert generate_checksums(data) == {
-        'md5': 'a48fba03a9ac529b358935164826d9fe',
-        'sha1': '714f4de20aa1899ed09e22a82304e12d4658eac1',
-    }
+def test_invalidate_cloudfront_coalesces_paths(monkeypatch):
+    cloudfront = CloudFrontClientStandIn()
+    monkeypatch.setattr('maven_lambda.metadata.cloudfront', cloudfront)
+    monkeypatch.setattr('maven_lambda.metadata.invalidation_batcher', InvalidationBatcher(max_explicit_paths=3))
+    monkeypatch.setattr('os.environ.get', lambda _, __: 'some-id')
+
+    invalidate_cloudfront_cache([
+        '{}maven-metadata.xml{}'.format(artifact_folder, extension)
+        for artifact_folder in (
+            'maven2/org/mozilla/geckoview/geckoview/',
+            'maven2/org/mozilla/geckoview/geckoview-nightly/',
+        )
+        for extension in ('', '.md5', '.sha1')
+    ])
+
+    assert cloudfront.invalidations == [{
+        'DistributionId': 'some-id',
+        'Paths': [
+            '/maven2/org/mozilla/geckoview/geckoview/maven-metadata.xml*',
+            '/maven2/org/mozilla/geckoview/geckoview-nightly/maven-metadata.xml*',
+        ],
+    }]
@@ -0,0 +1,140 @@
+import boto3
+import json
+import pytest
+
+from botocore.stub import Stubber
+from types import SimpleNamespace
+
+from maven_lambda import metrics
+from maven_lambda.metrics import (
+    MetricsRecorder,
+    add,
+    count_api_calls,
+    record_invocation,
+    start_recording,
+    stop_recording,
+    timed,
+)
+
+
+@pytest.fixture(autouse=True)
+def no_recording():
+    stop_recording()
+    yield
+    metrics._recorder = None
+
+
+def test_metrics_recorder_embedded_metric_format():
+    recorder = MetricsRecorder('SomeNamespace', 'some-function', {'requestId': 'some-id'})
+    recorder.add('UploadedBytes', 100, 'Bytes')
+    recorder.add('UploadedBytes', 20, 'Bytes')
+    recorder.add('ListedPomFiles', 3)
+
+    assert recorder.to_embedded_metric_format(timestamp=1577880000.5) == {
+        'requestId': 'some-id',
+        'FunctionName': 'some-function',
+        'ListedPomFiles': 3,
+        'UploadedBytes': 120,
+        '_aws': {
+            'Timestamp': 1577880000500,
+            'CloudWatchMetrics': [{
+                'Namespace': 'SomeNamespace',
+                'Dimensions': [['FunctionName']],
+                'Metrics': [
+                    {'Name': 'ListedPomFiles', 'Unit': 'Count'},
+                    {'Name': 'UploadedBytes', 'Unit': 'Bytes'},
+                ],
+            }],
+        },
+    }
+
+
+def test_timed_and_add_do_nothing_when_not_recording():
+    @timed('Some')
+    def function(value):
+        add('SomeValue', value)
+        return value
+
+    assert function(5) == 5
+    assert metrics._recorder is None
+
+
+def test_timed():
+    @timed('Some')
+    def function(value):
+        if value is None:
+            raise ValueError()
+        return value
+
+    recorder = start_recording()
+    assert function(5) == 5
+    with pytest.raises(ValueError):
+        function(None)
+
+    assert recorder.get('SomeCalls') == 2
+    assert recorder.get('SomeDuration') > 0
+
+
+def test_record_invocation(monkeypatch, capsys):
+    monkeypatch.setenv('METRICS_ENABLED', '1')
+    monkeypatch.setenv('METRICS_NAMESPACE', 'SomeNamespace')
+
+    @record_invocation()
+    def handler(event, context):
+        add('SomeValue', event['value'])
+        return 'some result'
+
+    context = SimpleNamespace(function_name='some-function', aws_request_id='some-id')
+    assert handler({'value': 2}, context) == 'some result'
+
+    emitted_metrics = json.loads(capsys.readouterr().out)
+    assert emitted_metrics['SomeValue'] == 2
+    assert emitted_metrics['FunctionName'] == 'some-function'
+    assert emitted_metrics['requestId'] == 'some-id'
+    assert emitted_metrics['InvocationDuration'] > 0
+    assert emitted_metrics['_aws']['CloudWatchMetrics'][0]['Namespace'] == 'SomeNamespace'
+    assert metrics._recorder is None
+
+
+def test_record_invocation_emits_metrics_of_failed_invocations(monkeypatch, capsys):
+    monkeypatch.setenv('METRICS_ENABLED', '1')
+
+    @record_invocation()
+    def handler(event, context):
+        add('SomeValue', 1)
+        raise ConnectionError()
+
+    with pytest.raises(ConnectionError):
+        handler({}, None)
+    assert json.loads(capsys.readouterr().out)['SomeValue'] == 1
+
+
+def test_record_invocation_when_disabled(monkeypatch, capsys):
+    monkeypatch.delenv('METRICS_ENABLED', raising=False)
+
+    @record_invocation(lambda: pytest.fail('Clients must not be created'))
+    def handler(event, context):
+        return metrics._recorder
+
+    assert handler({}, None) is None
+    assert capsys.readouterr().out == ''
+
+
+def test_count_api_calls():
+    s3_client = boto3.client(
+        's3', region_name='us-east-1', aws_access_key_id='some-id',
+        aws_secret_access_key='some-secret',
+    )
+    # Registering twice doesn't count calls twice
+    count_api_calls(s3_client, 'S3Calls')
+    count_api_calls(s3_client, 'S3Calls')
+    # Stand-ins are ignored
+    count_api_calls(object(), 'OtherCalls')
+
+    recorder = start_recording()
+    with Stubber(s3_client) as stubber:
+        for _ in range(2):
+            stubber.add_response('head_object', {}, {'Bucket': 'some-bucket', 'Key': 'some-key'})
+            s3_client.head_object(Bucket='some-bucket', Key='some-key')
+
+    assert recorder.get('S3Calls') == 2
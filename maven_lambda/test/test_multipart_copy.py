@@ -0,0 +1,136 @@
+import os
+import pytest
+
+from botocore.exceptions import ClientError
+
+from maven_lambda.copy_to_bucket import lambda_handler
+from maven_lambda.multipart_copy import (
+    copy_s3_object,
+    copy_s3_object_in_parts,
+    split_in_part_ranges,
+)
+from maven_lambda.test.stand_ins import S3ClientStandIn
+
+
+MIB = 1024 ** 2
+KEY = 'maven2/org/mozilla/geckoview/geckoview/70.0.0/geckoview-70.0.0.aar'
+
+
+@pytest.fixture
+def s3_client():
+    s3_client = S3ClientStandIn()
+    s3_client.put_object(
+        Bucket='source_bucket', Key=KEY, Body=os.urandom(12 * MIB),
+        ContentType='application/octet-stream', CacheControl='max-age=600',
+        Metadata={'some-key': 'some-value'},
+    )
+    s3_client.put_object(Bucket='source_bucket', Key='small.pom', Body=b'<project/>')
+    s3_client.calls.clear()
+    return s3_client
+
+
+def _get_object(s3_client, bucket, key):
+    response = s3_client.get_object(Bucket=bucket, Key=key)
+    response['Body'] = response['Body'].read()
+    return response
+
+
+@pytest.mark.parametrize('size, expected_calls', (
+    (10, {'CopyObject': 1}),
+    (None, {'HeadObject': 1, 'CopyObject': 1}),
+))
+def test_copy_s3_object_small_object(s3_client, size, expected_calls):
+    copy_s3_object(s3_client, 'source_bucket', 'small.pom', 'target_bucket', size=size)
+    assert s3_client.calls == expected_calls
+    assert _get_object(s3_client, 'target_bucket', 'small.pom')['Body'] == b'<project/>'
+
+
+@pytest.mark.parametrize('size', (12 * MIB, None))
+def test_copy_s3_object_large_object(s3_client, size):
+    copy_s3_object(
+        s3_client, 'source_bucket', KEY, 'target_bucket', size=size,
+        multipart_threshold=8 * MIB, part_size=5 * MIB,
+    )
+
+    assert s3_client.calls == {
+        'HeadObject': 1,
+        'CreateMultipartUpload': 1,
+        'UploadPartCopy': 3,
+        'CompleteMultipartUpload': 1,
+    }
+    source = _get_object(s3_client, 'source_bucket', KEY)
+    target = _get_object(s3_client, 'target_bucket', KEY)
+    assert target['Body'] == source['Body']
+    assert target['ETag'].endswith('-3"')
+    for field in ('ContentType', 'CacheControl', 'Metadata'):
+        assert target[field] == source[field]
+    assert s3_client.multipart_uploads == {}
+
+
+def test_copy_s3_object_in_parts_aborts_on_failure(s3_client):
+    s3_client.failing_part_numbers = {2}
+    head = s3_client.head_object(Bucket='source_bucket', Key=KEY)
+
+    with pytest.raises(ClientError):
+        copy_s3_object_in_parts(
+            s3_client, 'source_bucket', KEY, 'target_bucket', head, part_size=5 * MIB,
+            max_workers=1,
+        )
+
+    assert s3_client.calls['AbortMultipartUpload'] == 1
+    assert s3_client.calls['CompleteMultipartUpload'] == 0
+    # The failure stopped the copy of the next parts
+    assert s3_client.calls['UploadPartCopy'] == 2
+    assert s3_client.multipart_uploads == {}
+    with pytest.raises(ClientError):
+        s3_client.head_object(Bucket='target_bucket', Key=KEY)
+
+
+def test_copy_s3_object_in_parts_aborts_when_source_changes(s3_client):
+    head = s3_client.head_object(Bucket='source_bucket', Key=KEY)
+    s3_client.put_object(Bucket='source_bucket', Key=KEY, Body=os.urandom(12 * MIB))
+
+    with pytest.raises(ClientError) as excinfo:
+        copy_s3_object_in_parts(
+            s3_client, 'source_bucket', KEY, 'target_bucket', head, part_size=5 * MIB,
+            max_workers=4,
+        )
+    assert excinfo.value.response['Error']['Code'] == 'PreconditionFailed'
+    assert s3_client.multipart_uploads == {}
+
+
+@pytest.mark.parametrize('size, part_size, expected', (
+    (12 * MIB, 5 * MIB, [(0, 5 * MIB - 1), (5 * MIB, 10 * MIB - 1), (10 * MIB, 12 * MIB - 1)]),
+    (10 * MIB, 5 * MIB, [(0, 5 * MIB - 1), (5 * MIB, 10 * MIB - 1)]),
+    # Parts can't be smaller than 5 MiB
+    (6 * MIB, 1 * MIB, [(0, 5 * MIB - 1), (5 * MIB, 6 * MIB - 1)]),
+))
+def test_split_in_part_ranges(size, part_size, expected):
+    assert split_in_part_ranges(size, part_size) == expected
+
+
+def test_split_in_part_ranges_stays_under_10000_parts():
+    size = 100 * 1024 ** 3
+    part_ranges = split_in_part_ranges(size, 5 * MIB)
+    assert len(part_ranges) <= 10000
+    assert part_ranges[-1][1] == size - 1
+
+
+def test_lambda_handler_copies_objects_too_large_for_copy_object(monkeypatch):
+    # Anything larger than 6 MiB stands for objects larger than 5 GiB
+    s3_client = S3ClientStandIn(max_copy_object_size=6 * MIB)
+    s3_client.put_object(Bucket='source_bucket', Key=KEY, Body=os.urandom(12 * MIB))
+    monkeypatch.setattr('maven_lambda.copy_to_bucket.s3', s3_client)
+    monkeypatch.setattr('maven_lambda.copy_to_bucket.s3_object_has_more_than_one_version', lambda _, __, ___: False)
+    monkeypatch.setenv('TARGET_BUCKET', 'target_bucket')
+    monkeypatch.setenv('MULTIPART_COPY_THRESHOLD_BYTES', str(6 * MIB))
+    monkeypatch.setenv('MULTIPART_COPY_PART_SIZE_BYTES', str(5 * MIB))
+
+    event = {'Records': [{
+        's3': {'bucket': {'name': 'source_bucket'}, 'object': {'key': KEY, 'size': 12 * MIB}},
+    }]}
+    assert lambda_handler(event, {}) == {'results': [
+        {'bucket': 'source_bucket', 'key': KEY, 'statusCode': 200},
+    ]}
+    assert _get_object(s3_client, 'target_bucket', KEY)['Body'] == \
+        _get_object(s3_client, 'source_bucket', KEY)['Body']
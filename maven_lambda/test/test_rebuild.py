@@ -0,0 +1,341 @@
+import hashlib
+import json
+import pytest
+
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+
+from maven_lambda.catalog import fetch_catalog_shard, upload_catalog_shard
+from maven_lambda.inventory import Inventory, InventoryError
+from maven_lambda.metadata import regenerate_artifact_folder
+from maven_lambda.rebuild import (
+    RebuildReport,
+    list_pom_files_per_artifact_folder,
+    rebuild_artifact_folder,
+    load_checkpoint,
+    render_artifact_folder,
+    main,
+    rebuild_repository,
+)
+from maven_lambda.test.stand_ins import S3ResourceStandIn, deliver_inventory
+from concurrent.futures import ThreadPoolExecutor
+
+
+ARTIFACT_FOLDERS = (
+    'maven2/org/mozilla/geckoview/geckoview/',
+    'maven2/org/mozilla/geckoview/geckoview-nightly/',
+    'maven2/org/mozilla/components/browser-state/',
+    'maven2/org/mozilla/telemetry/glean/',
+    # Shallower than the shard depth
+    'maven2/some-artifact/',
+)
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    s3 = S3ResourceStandIn()
+    for artifact_folder in ARTIFACT_FOLDERS:
+        artifact_id = artifact_folder.split('/')[-2]
+        for version in ('1.0.0', '1.1.0'):
+            for extension in ('.pom', '.pom.sha1', '.aar'):
+                s3.meta.client.put_object(
+                    Bucket='some-bucket',
+                    Key='{}{}/{}-{}{}'.format(artifact_folder, version, artifact_id, version, extension),
+                )
+    s3.meta.client.put_object(Bucket='some-bucket', Key='unrelated/file.pom')
+    s3.meta.client.calls.clear()
+
+    monkeypatch.setattr('maven_lambda.metadata.s3', s3)
+    monkeypatch.setattr('maven_lambda.metadata.invalidate_cloudfront_cache', MagicMock())
+    monkeypatch.setattr('maven_lambda.rebuild.invalidate_cloudfront_cache', MagicMock())
+    # The stand-in shares the clock of the tests
+    monkeypatch.setattr('maven_lambda.rebuild.CLOCK_SKEW_MARGIN', 0)
+    return s3
+
+
+def _get_metadata(s3, artifact_folder):
+    return s3.meta.client.get_object(
+        Bucket='some-bucket', Key='{}maven-metadata.xml'.format(artifact_folder)
+    )['Body'].read().decode()
+
+
+@pytest.mark.parametrize('shard_depth', (0, 1, 2, 3, 4))
+def test_list_pom_files_per_artifact_folder(s3, shard_depth):
+    report = RebuildReport()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        pom_files_per_artifact_folder = list_pom_files_per_artifact_folder(
+            s3.Bucket('some-bucket'), 'maven2/', shard_depth, executor, report
+        )
+
+    assert sorted(pom_files_per_artifact_folder) == sorted(ARTIFACT_FOLDERS)
+    assert pom_files_per_artifact_folder['maven2/org/mozilla/telemetry/glean/'] == [
+        'maven2/org/mozilla/telemetry/glean/1.0.0/glean-1.0.0.pom',
+        'maven2/org/mozilla/telemetry/glean/1.1.0/glean-1.1.0.pom',
+    ]
+    assert report.number_of_listed_keys == len(ARTIFACT_FOLDERS) * 6
+
+
+@pytest.mark.parametrize('render_workers', (0, 2))
+def test_rebuild_repository(s3, render_workers):
+    report = rebuild_repository('some-bucket', io_workers=4, render_workers=render_workers)
+
+    assert report.number_of_folders_per_status == {
+        'updated': 5, 'unchanged': 0, 'failed': 0, 'skipped': 0,
+    }
+    assert len(report.uploaded_files) == 15
+    metadata = _get_metadata(s3, 'maven2/org/mozilla/components/browser-state/')
+    assert '<groupId>org.mozilla.components</groupId>' in metadata
+    assert '<versions><version>1.0.0</version><version>1.1.0</version></versions>' in metadata
+
+    # Nothing changed in the meantime
+    report = rebuild_repository('some-bucket', io_workers=4, render_workers=render_workers)
+    assert report.number_of_folders_per_status == {
+        'updated': 0, 'unchanged': 5, 'failed': 0, 'skipped': 0,
+    }
+    assert report.uploaded_files == []
+
+
+def test_rebuild_repository_regenerates_snapshot_version_folders(s3):
+    s3.meta.client.put_object(
+        Bucket='some-bucket',
+        Key='maven2/org/mozilla/telemetry/glean/2.0.0-SNAPSHOT/glean-2.0.0-20200101.120000-1.pom',
+        Body='<project><packaging>aar</packaging></project>',
+    )
+
+    report = rebuild_repository('some-bucket', io_workers=4, render_workers=0)
+
+    assert len(report.uploaded_files) == 18
+    metadata = _get_metadata(s3, 'maven2/org/mozilla/telemetry/glean/2.0.0-SNAPSHOT/')
+    assert '<snapshot><timestamp>20200101.120000</timestamp><buildNumber>1</buildNumber></snapshot>' in metadata
+
+
+def _publish_after_listing(s3, monkeypatch, key):
+    # The lambda publishes key once the rebuild has listed the bucket
+    original_list_function = list_pom_files_per_artifact_folder
+
+    def list_then_publish(*args):
+        pom_files_per_artifact_folder = original_list_function(*args)
+        s3.meta.client.put_object(
+            Bucket='some-bucket', Key=key, Body='<project><packaging>aar</packaging></project>'
+        )
+        regenerate_artifact_folder('some-bucket', 'maven2/org/mozilla/telemetry/glean/', [key])
+        return pom_files_per_artifact_folder
+    monkeypatch.setattr(
+        'maven_lambda.rebuild.list_pom_files_per_artifact_folder', list_then_publish
+    )
+
+
+def test_rebuild_repository_keeps_versions_published_meanwhile(s3, monkeypatch):
+    rebuild_repository('some-bucket', io_workers=4, render_workers=0)
+    _publish_after_listing(
+        s3, monkeypatch, 'maven2/org/mozilla/telemetry/glean/1.2.0/glean-1.2.0.pom'
+    )
+
+    report = rebuild_repository('some-bucket', io_workers=4, render_workers=0)
+
+    assert report.number_of_relisted_folders == 1
+    assert report.number_of_folders_per_status['failed'] == 0
+    assert '<version>1.2.0</version>' in _get_metadata(s3, 'maven2/org/mozilla/telemetry/glean/')
+
+
+def test_rebuild_repository_keeps_snapshot_builds_published_meanwhile(s3, monkeypatch):
+    s3.meta.client.put_object(
+        Bucket='some-bucket',
+        Key='maven2/org/mozilla/telemetry/glean/2.0.0-SNAPSHOT/glean-2.0.0-20200101.120000-1.pom',
+        Body='<project><packaging>aar</packaging></project>',
+    )
+    rebuild_repository('some-bucket', io_workers=4, render_workers=0)
+    # maven2/org/mozilla/telemetry/glean/maven-metadata.xml doesn't change
+    _publish_after_listing(
+        s3, monkeypatch,
+        'maven2/org/mozilla/telemetry/glean/2.0.0-SNAPSHOT/glean-2.0.0-20200102.120000-2.pom'
+    )
+
+    report = rebuild_repository('some-bucket', io_workers=4, render_workers=0)
+
+    assert report.number_of_relisted_folders == 0
+    assert '<buildNumber>2</buildNumber>' in _get_metadata(
+        s3, 'maven2/org/mozilla/telemetry/glean/2.0.0-SNAPSHOT/'
+    )
+
+
+def test_rebuild_artifact_folder_lists_again_if_changed_since(s3):
+    rebuild_repository('some-bucket', io_workers=4, render_workers=0)
+    changed_since = datetime.now(timezone.utc)
+    stale_pom_files = [
+        'maven2/org/mozilla/telemetry/glean/1.0.0/glean-1.0.0.pom',
+        'maven2/org/mozilla/telemetry/glean/1.1.0/glean-1.1.0.pom',
+    ]
+    key = 'maven2/org/mozilla/telemetry/glean/1.2.0/glean-1.2.0.pom'
+    s3.meta.client.put_object(Bucket='some-bucket', Key=key)
+    regenerate_artifact_folder('some-bucket', 'maven2/org/mozilla/telemetry/glean/', [key])
+
+    result = rebuild_artifact_folder(
+        'some-bucket', 'maven2/org/mozilla/telemetry/glean/', stale_pom_files,
+        changed_since=changed_since
+    )
+
+    assert result['relisted']
+    assert result['status'] == 'unchanged'
+    assert '<version>1.2.0</version>' in _get_metadata(s3, 'maven2/org/mozilla/telemetry/glean/')
+
+
+def test_rebuild_artifact_folder_lists_again_after_concurrent_update(s3, monkeypatch):
+    monkeypatch.setattr('maven_lambda.conditional_writes.time.sleep', lambda _: None)
+    pom_files = [
+        'maven2/org/mozilla/telemetry/glean/1.0.0/glean-1.0.0.pom',
+        'maven2/org/mozilla/telemetry/glean/1.1.0/glean-1.1.0.pom',
+    ]
+    rendered_pom_files = []
+
+    def render_while_the_lambda_publishes(pom_files):
+        if not rendered_pom_files:
+            key = 'maven2/org/mozilla/telemetry/glean/1.2.0/glean-1.2.0.pom'
+            s3.meta.client.put_object(Bucket='some-bucket', Key=key)
+            regenerate_artifact_folder('some-bucket', 'maven2/org/mozilla/telemetry/glean/', [key])
+        rendered_pom_files.append(pom_files)
+        return render_artifact_folder(pom_files)
+    monkeypatch.setattr('maven_lambda.rebuild.render_artifact_folder', render_while_the_lambda_publishes)
+
+    result = rebuild_artifact_folder(
+        'some-bucket', 'maven2/org/mozilla/telemetry/glean/', pom_files,
+        changed_since=datetime.now(timezone.utc)
+    )
+
+    assert len(rendered_pom_files) == 2
+    assert result['relisted']
+    assert result['status'] == 'updated'
+    metadata = _get_metadata(s3, 'maven2/org/mozilla/telemetry/glean/')
+    assert '<version>1.2.0</version>' in metadata
+    assert s3.meta.client.get_object(
+        Bucket='some-bucket', Key='maven2/org/mozilla/telemetry/glean/maven-metadata.xml.sha1'
+    )['Body'].read().decode() == hashlib.sha1(metadata.encode()).hexdigest()
+
+
+def test_rebuild_repository_rebuilds_catalog(s3, monkeypatch):
+    monkeypatch.setenv('CATALOG_PREFIX', 'catalog/')
+    # Isn't in the repository anymore
+    upload_catalog_shard(s3.Bucket('some-bucket'), 'catalog/org.mozilla.telemetry.json.gz', {
+        'format': 1, 'groupId': 'org.mozilla.telemetry', 'artifacts': {'removed': {}},
+    })
+
+    report = rebuild_repository('some-bucket', io_workers=4, render_workers=0)
+
+    assert sorted(key for key in report.uploaded_files if key.startswith('catalog/')) == [
+        'catalog/org.mozilla.components.json.gz',
+        'catalog/org.mozilla.geckoview.json.gz',
+        'catalog/org.mozilla.telemetry.json.gz',
+        # maven2/some-artifact/ has no groupId
+    ]
+    shard = fetch_catalog_shard(s3.Bucket('some-bucket'), 'catalog/org.mozilla.geckoview.json.gz')
+    assert sorted(shard['artifacts']) == ['geckoview', 'geckoview-nightly']
+    assert shard['artifacts']['geckoview']['latest'] == '1.1.0'
+    assert shard['artifacts']['geckoview']['versionCount'] == 2
+    shard = fetch_catalog_shard(s3.Bucket('some-bucket'), 'catalog/org.mozilla.telemetry.json.gz')
+    assert list(shard['artifacts']) == ['glean']
+
+
+def test_rebuild_repository_resumes_from_checkpoint(s3, tmp_path, monkeypatch):
+    checkpoint_path = str(tmp_path / 'checkpoint.jsonl')
+    with open(checkpoint_path, 'w') as f:
+        f.write('{"artifactFolder": "maven2/org/mozilla/geckoview/geckoview/", "status": "updated"}\n')
+        # Interrupted while writing
+        f.write('{"artifactFolder": "maven2/org/mo')
+
+    upload_mock = MagicMock(side_effect=[Exception('Some S3 error'), [], [], []])
+    monkeypatch.setattr('maven_lambda.rebuild.upload_maven_metadata', upload_mock)
+
+    report = rebuild_repository(
+        'some-bucket', io_workers=1, render_workers=0, checkpoint_path=checkpoint_path
+    )
+
+    assert report.number_of_folders_per_status == {
+        'updated': 0, 'unchanged': 3, 'failed': 1, 'skipped': 1,
+    }
+    assert report.failed_folders == ['maven2/org/mozilla/components/browser-state/']
+    # Failed folders aren't checkpointed: they're retried at the next run
+    assert load_checkpoint(checkpoint_path) == {
+        'maven2/org/mozilla/geckoview/geckoview/',
+        'maven2/org/mozilla/geckoview/geckoview-nightly/',
+        'maven2/org/mozilla/telemetry/glean/',
+        'maven2/some-artifact/',
+    }
+
+
+def test_rebuild_repository_from_inventory(s3, tmp_path):
+    rebuild_repository('some-bucket', io_workers=4, render_workers=0)
+    now = datetime.now(timezone.utc)
+    manifest_key = deliver_inventory(
+        s3.meta.client, 'some-bucket', str(tmp_path), created_at=now + timedelta(hours=1),
+        rows_per_file=7
+    )
+    inventory = Inventory.from_location(str(tmp_path), manifest_key)
+
+    # Uploaded after the inventory was created: the lambda regenerated maven-metadata.xml then
+    s3.meta.client.put_object(
+        Bucket='some-bucket', Key='maven2/org/mozilla/telemetry/glean/1.2.0/glean-1.2.0.pom'
+    )
+    metadata_key = 'maven2/org/mozilla/telemetry/glean/maven-metadata.xml'
+    s3.meta.client._objects_per_bucket['some-bucket'][metadata_key]['LastModified'] = \
+        now + timedelta(hours=2)
+    # Not in the inventory either, and nothing points at it: left to the lambda
+    s3.meta.client.put_object(Bucket='some-bucket', Key='maven2/new-artifact/1.0/new-artifact-1.0.pom')
+    s3.meta.client.calls.clear()
+
+    report = rebuild_repository(
+        'some-bucket', io_workers=4, render_workers=0, inventory=inventory,
+        recent_changes_window=0
+    )
+
+    assert report.number_of_folders_per_status == {
+        'updated': 1, 'unchanged': 4, 'failed': 0, 'skipped': 0,
+    }
+    assert report.number_of_relisted_folders == 1
+    # maven-metadata.xml and its checksums are in the inventory too
+    assert report.number_of_listed_keys == len(ARTIFACT_FOLDERS) * 9
+    # Only the changed folder got listed
+    assert s3.meta.client.calls['ListObjectsV2'] == 1
+    assert '<version>1.2.0</version>' in _get_metadata(s3, 'maven2/org/mozilla/telemetry/glean/')
+
+
+def test_rebuild_repository_from_inventory_of_another_bucket(s3, tmp_path):
+    manifest_key = deliver_inventory(s3.meta.client, 'some-bucket', str(tmp_path))
+    inventory = Inventory.from_location(str(tmp_path), manifest_key)
+
+    with pytest.raises(InventoryError):
+        rebuild_repository('some-other-bucket', inventory=inventory)
+
+
+def test_main(s3, tmp_path, capsys):
+    checkpoint_path = str(tmp_path / 'checkpoint.jsonl')
+    assert main([
+        '--bucket', 'some-bucket', '--render-workers', '0', '--checkpoint', checkpoint_path,
+    ]) == 0
+
+    output = capsys.readouterr().out
+    assert 'Listed 30 keys in 3 shard(s)' in output
+    assert 'Processed 5 artifact folder(s) in ' in output
+    assert 'updated: 5, unchanged: 0, failed: 0, skipped: 0' in output
+    with open(checkpoint_path) as f:
+        assert len([json.loads(line) for line in f]) == 5
+
+    assert main([
+        '--bucket', 'some-bucket', '--render-workers', '0', '--checkpoint', checkpoint_path,
+    ]) == 0
+    assert 'updated: 0, unchanged: 0, failed: 0, skipped: 5' in capsys.readouterr().out
+
+
+def test_main_inventory(s3, tmp_path, capsys):
+    inventory_path = str(tmp_path / 'inventory')
+    manifest_key = deliver_inventory(s3.meta.client, 'some-bucket', inventory_path)
+    assert main([
+        '--bucket', 'some-bucket', '--render-workers', '0',
+        '--inventory', inventory_path, '--inventory-manifest', manifest_key,
+    ]) == 0
+    output = capsys.readouterr().out
+    assert 'updated: 5, unchanged: 0, failed: 0, skipped: 0' in output
+    # maven-metadata.xml files didn't exist
+    assert 'Listed 5 artifact folder(s) again' in output
+
+    with pytest.raises(SystemExit):
+        main(['--bucket', 'some-bucket', '--inventory', inventory_path])
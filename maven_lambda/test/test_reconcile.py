@@ -0,0 +1,109 @@
+import json
+import pytest
+
+from maven_lambda.copy_to_bucket import NotFound
+from maven_lambda.reconcile import are_same_objects, diff_manifests, main, reconcile_buckets
+from maven_lambda.test.stand_ins import S3ClientStandIn
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    s3_client = S3ClientStandIn(max_keys=2)
+    for key, body in (
+        ('maven2/a/1/a-1.pom', b'identical'),
+        ('maven2/a/2/a-2.pom', b'missing'),
+        ('maven2/b/1/b-1.pom', b'changed'),
+        ('maven2/b/2/b-2.pom', b'conflicting'),
+        ('maven2/c/1/c-1.pom', b'missing too'),
+    ):
+        s3_client.put_object(Bucket='source-bucket', Key=key, Body=body)
+    for key, body in (
+        ('maven2/a/1/a-1.pom', b'identical'),
+        ('maven2/b/1/b-1.pom', b'CHANGED'),
+        ('maven2/b/3/b-3.pom', b'extra'),
+    ):
+        s3_client.put_object(Bucket='target-bucket', Key=key, Body=body)
+
+    def s3_object_has_more_than_one_version(_, __, key):
+        if key == 'maven2/c/1/c-1.pom':
+            # Deleted since it was listed
+            raise NotFound()
+        return key == 'maven2/b/2/b-2.pom'
+
+    monkeypatch.setattr('maven_lambda.copy_to_bucket.s3', s3_client)
+    monkeypatch.setattr(
+        'maven_lambda.copy_to_bucket.s3_object_has_more_than_one_version',
+        s3_object_has_more_than_one_version
+    )
+    return s3_client
+
+
+def _get_body(s3_client, bucket, key):
+    return s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
+
+
+def test_diff_manifests():
+    source_manifest = iter([('a', 1, 'x'), ('b', 1, 'x'), ('d', 1, 'x'), ('e', 1, 'x')])
+    target_manifest = iter([('a', 1, 'x'), ('b', 1, 'y'), ('c', 1, 'x'), ('e', 1, 'x'), ('f', 1, 'x')])
+    assert list(diff_manifests(source_manifest, target_manifest)) == [
+        (None, ('a', 1, 'x')),
+        ('changed', ('b', 1, 'x')),
+        ('extra', ('c', 1, 'x')),
+        ('missing', ('d', 1, 'x')),
+        (None, ('e', 1, 'x')),
+        ('extra', ('f', 1, 'x')),
+    ]
+
+
+@pytest.mark.parametrize('source_entry, target_entry, expected', (
+    (('a', 1, 'abc'), ('a', 1, 'abc'), True),
+    (('a', 1, 'abc'), ('a', 1, 'def'), False),
+    (('a', 1, 'abc'), ('a', 2, 'abc'), False),
+    # Copied in parts
+    (('a', 1, 'abc'), ('a', 1, 'def-3'), True),
+    (('a', 1, 'abc'), ('a', 2, 'def-3'), False),
+))
+def test_are_same_objects(source_entry, target_entry, expected):
+    assert are_same_objects(source_entry, target_entry) is expected
+
+
+@pytest.mark.parametrize('shard_depth', (0, 1, 2))
+def test_reconcile_buckets(s3_client, shard_depth):
+    report = reconcile_buckets(
+        'source-bucket', 'target-bucket', shard_depth=shard_depth, copy_workers=1
+    )
+
+    assert report.to_dict()['objects'] == {
+        'identical': 1, 'missing': 3, 'changed': 1, 'extra': 1,
+    }
+    assert report.to_dict()['copies'] == {
+        'copied': 2, 'notFound': 1, 'conflicting': 1, 'failed': 0,
+    }
+    assert _get_body(s3_client, 'target-bucket', 'maven2/a/2/a-2.pom') == b'missing'
+    assert _get_body(s3_client, 'target-bucket', 'maven2/b/1/b-1.pom') == b'changed'
+    # Extra objects are left untouched
+    assert _get_body(s3_client, 'target-bucket', 'maven2/b/3/b-3.pom') == b'extra'
+
+    report = reconcile_buckets('source-bucket', 'target-bucket', shard_depth=shard_depth)
+    assert report.to_dict()['objects'] == {
+        'identical': 3, 'missing': 2, 'changed': 0, 'extra': 1,
+    }
+
+
+def test_main_dry_run(s3_client, tmp_path, capsys):
+    diff_output = str(tmp_path / 'diff.jsonl')
+    assert main([
+        '--source-bucket', 'source-bucket', '--target-bucket', 'target-bucket', '--dry-run',
+        '--diff-output', diff_output,
+    ]) == 0
+
+    assert s3_client.calls['CopyObject'] == 0
+    assert 'identical: 1, missing: 3, changed: 1, extra: 1' in capsys.readouterr().out
+    with open(diff_output) as f:
+        assert [json.loads(line) for line in f] == [
+            {'key': 'maven2/a/2/a-2.pom', 'status': 'missing'},
+            {'key': 'maven2/b/1/b-1.pom', 'status': 'changed'},
+            {'key': 'maven2/b/2/b-2.pom', 'status': 'missing'},
+            {'key': 'maven2/b/3/b-3.pom', 'status': 'extra'},
+            {'key': 'maven2/c/1/c-1.pom', 'status': 'missing'},
+        ]
@@ -0,0 +1,157 @@
+import pytest
+
+from botocore.exceptions import ClientError
+
+from maven_lambda.test.stand_ins import S3ClientStandIn, S3ResourceStandIn
+
+
+@pytest.fixture
+def s3_client():
+    client = S3ClientStandIn(max_keys=2)
+    for key in ('a/1/x', 'a/1/y', 'a/2/x', 'a/3/x', 'a/file', 'b/1/x'):
+        client.put_object(Bucket='some_bucket', Key=key, Body=key)
+    return client
+
+
+def _list_all(client, **kwargs):
+    pages = list(client.get_paginator('list_objects_v2').paginate(Bucket='some_bucket', **kwargs))
+    keys = [content['Key'] for page in pages for content in page.get('Contents', [])]
+    prefixes = [prefix['Prefix'] for page in pages for prefix in page.get('CommonPrefixes', [])]
+    return len(pages), keys, prefixes
+
+
+def test_list_objects_v2_paginates(s3_client):
+    assert _list_all(s3_client, Prefix='a/') == (
+        3, ['a/1/x', 'a/1/y', 'a/2/x', 'a/3/x', 'a/file'], []
+    )
+    assert s3_client.calls['ListObjectsV2'] == 3
+
+
+def test_list_objects_v2_with_delimiter(s3_client):
+    assert _list_all(s3_client, Prefix='a/', Delimiter='/') == (
+        2, ['a/file'], ['a/1/', 'a/2/', 'a/3/']
+    )
+    assert _list_all(s3_client, Delimiter='/') == (1, [], ['a/', 'b/'])
+
+
+def test_list_objects_v2_start_after(s3_client):
+    assert _list_all(s3_client, Prefix='a/', StartAfter='a/2/x') == (1, ['a/3/x', 'a/file'], [])
+
+
+def test_get_head_and_delete_object(s3_client):
+    assert s3_client.get_object(Bucket='some_bucket', Key='a/1/x')['Body'].read() == b'a/1/x'
+    assert s3_client.head_object(Bucket='some_bucket', Key='a/1/x')['ContentLength'] == 5
+
+    s3_client.delete_object(Bucket='some_bucket', Key='a/1/x')
+    with pytest.raises(ClientError) as excinfo:
+        s3_client.get_object(Bucket='some_bucket', Key='a/1/x')
+    assert excinfo.value.response['Error']['Code'] == 'NoSuchKey'
+    with pytest.raises(ClientError) as excinfo:
+        s3_client.head_object(Bucket='some_bucket', Key='a/1/x')
+    assert excinfo.value.response['Error']['Code'] == '404'
+
+
+def test_get_object_range_and_conditions(s3_client):
+    e_tag = s3_client.head_object(Bucket='some_bucket', Key='a/file')['ETag']
+
+    response = s3_client.get_object(Bucket='some_bucket', Key='a/file', Range='bytes=2-3')
+    assert response['Body'].read() == b'fi'
+    assert response['ContentRange'] == 'bytes 2-3/6'
+    response = s3_client.get_object(
+        Bucket='some_bucket', Key='a/file', Range='bytes=4-100', IfMatch=e_tag
+    )
+    assert response['Body'].read() == b'le'
+    assert response['ContentRange'] == 'bytes 4-5/6'
+
+    for arguments, expected_code in (
+        ({'Range': 'bytes=6-10'}, 'InvalidRange'),
+        ({'IfMatch': '"other"'}, 'PreconditionFailed'),
+        ({'IfNoneMatch': e_tag}, '304'),
+    ):
+        with pytest.raises(ClientError) as excinfo:
+            s3_client.get_object(Bucket='some_bucket', Key='a/file', **arguments)
+        assert excinfo.value.response['Error']['Code'] == expected_code
+
+
+def test_put_object_conditions(s3_client):
+    e_tag = s3_client.head_object(Bucket='some_bucket', Key='a/file')['ETag']
+
+    for key, arguments in (
+        ('a/file', {'IfMatch': '"other"'}),
+        ('a/file', {'IfNoneMatch': '*'}),
+        ('c/missing', {'IfMatch': e_tag}),
+    ):
+        with pytest.raises(ClientError) as excinfo:
+            s3_client.put_object(Bucket='some_bucket', Key=key, Body='new', **arguments)
+        assert excinfo.value.response['Error']['Code'] == 'PreconditionFailed'
+    assert s3_client.get_object(Bucket='some_bucket', Key='a/file')['Body'].read() == b'a/file'
+
+    s3_client.put_object(Bucket='some_bucket', Key='a/file', Body='new', IfMatch=e_tag)
+    s3_client.put_object(Bucket='some_bucket', Key='c/new', Body='new', IfNoneMatch='*')
+    assert s3_client.get_object(Bucket='some_bucket', Key='a/file')['Body'].read() == b'new'
+
+
+def _list_all_versions(client, **kwargs):
+    entries = []
+    number_of_pages = 0
+    while True:
+        page = client.list_object_versions(Bucket='some_bucket', **kwargs)
+        number_of_pages += 1
+        entries.extend(
+            (entry['Key'], entry['VersionId'], entry['IsLatest'], 'Size' not in entry)
+            for entry in page.get('Versions', []) + page.get('DeleteMarkers', [])
+        )
+        if not page['IsTruncated']:
+            return number_of_pages, sorted(entries)
+        kwargs.update(KeyMarker=page['NextKeyMarker'], VersionIdMarker=page['NextVersionIdMarker'])
+
+
+def test_versioning(s3_client):
+    assert s3_client.get_bucket_versioning(Bucket='some_bucket') == {}
+    # Unversioned buckets only hold "null" versions
+    assert _list_all_versions(s3_client, Prefix='a/1/') == (1, [
+        ('a/1/x', 'null', True, False), ('a/1/y', 'null', True, False),
+    ])
+
+    s3_client.put_bucket_versioning(
+        Bucket='some_bucket', VersioningConfiguration={'Status': 'Enabled'}
+    )
+    assert s3_client.get_bucket_versioning(Bucket='some_bucket') == {'Status': 'Enabled'}
+    version_id = s3_client.put_object(Bucket='some_bucket', Key='a/1/x', Body='new')['VersionId']
+    assert s3_client.head_object(Bucket='some_bucket', Key='a/1/x')['VersionId'] == version_id
+    delete_marker_id = s3_client.delete_object(Bucket='some_bucket', Key='a/1/y')['VersionId']
+
+    assert _list_all_versions(s3_client, Prefix='a/1/') == (2, [
+        ('a/1/x', 'null', False, False),
+        ('a/1/x', version_id, True, False),
+        ('a/1/y', 'null', False, False),
+        ('a/1/y', delete_marker_id, True, True),
+    ])
+    assert _list_all(s3_client, Prefix='a/1/') == (1, ['a/1/x'], [])
+
+
+def test_latency_and_throttling(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr('maven_lambda.test.stand_ins.time.sleep', sleeps.append)
+    client = S3ClientStandIn(latency=0.02, throttle_every=3)
+
+    for index in range(2):
+        client.put_object(Bucket='some_bucket', Key=str(index))
+    with pytest.raises(ClientError) as excinfo:
+        client.head_object(Bucket='some_bucket', Key='0')
+    assert excinfo.value.response['Error']['Code'] == 'SlowDown'
+    client.head_object(Bucket='some_bucket', Key='0')
+
+    assert sleeps == [0.02] * 4
+    assert client.throttled_calls == 1
+    assert client.calls == {'PutObject': 2, 'HeadObject': 2}
+
+
+def test_resource_stand_in(s3_client):
+    s3 = S3ResourceStandIn(s3_client)
+    bucket = s3.Bucket('some_bucket')
+    assert [summary.key for summary in bucket.objects.filter(Prefix='a/1/')] == ['a/1/x', 'a/1/y']
+
+    s3.Object('some_bucket', 'c/new').put(Body='some data', ContentType='text/plain')
+    assert bucket.Object('c/new').get()['Body'].read() == b'some data'
+    bucket.Object('c/new').load()
@@ -0,0 +1,243 @@
+import hashlib
+import io
+import json
+import pytest
+
+from botocore.exceptions import ClientError
+from unittest.mock import MagicMock
+
+from maven_lambda.test.stand_ins import S3ResourceStandIn
+from maven_lambda.version_index import (
+    build_version_index,
+    fetch_version_index,
+    get_pom_files_from_version_index,
+    get_version_index_key,
+    list_pom_files_with_version_index,
+    update_version_index,
+    upload_version_index,
+)
+
+
+ARTIFACT_FOLDER = 'maven2/org/mozilla/geckoview/geckoview-nightly-x86/'
+INDEX_KEY = 'maven2/org/mozilla/geckoview/geckoview-nightly-x86/maven-lambda-index.json'
+
+
+def _generate_bucket_mock(objects):
+    bucket_mock = MagicMock()
+
+    def get_object(key):
+        object_mock = MagicMock()
+
+        def get():
+            try:
+                return {
+                    'Body': io.BytesIO(objects[key].encode()),
+                    'ETag': '"{}"'.format(hashlib.md5(objects[key].encode()).hexdigest()),
+                }
+            except KeyError:
+                raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+
+        def put(Body, **kwargs):
+            objects[key] = Body
+
+        object_mock.get.side_effect = get
+        object_mock.put.side_effect = put
+        return object_mock
+
+    def head_object(Bucket, Key):
+        if Key not in objects:
+            raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        return {}
+
+    bucket_mock.Object.side_effect = get_object
+    bucket_mock.meta.client.head_object.side_effect = head_object
+    # Like stand-ins, conditional writes are supported
+    bucket_mock.meta.client.meta.service_model = None
+    return bucket_mock
+
+
+def _generate_list_function(pom_files):
+    list_function = MagicMock(return_value=pom_files)
+    return list_function
+
+
+def test_get_version_index_key():
+    assert get_version_index_key(ARTIFACT_FOLDER) == INDEX_KEY
+
+
+def test_build_version_index_and_back():
+    pom_files = [
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/64.0.20181018103737/geckoview-nightly-x86-64.0.20181018103737.pom',
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom',
+    ]
+    index = build_version_index(ARTIFACT_FOLDER, pom_files, last_full_listing=100)
+    assert index == {
+        'format': 1,
+        'lastFullListing': 100,
+        'pomFiles': [
+            '63.0.20180830111743/geckoview-nightly-x86-63.0.20180830111743.pom',
+            '64.0.20181018103737/geckoview-nightly-x86-64.0.20181018103737.pom',
+        ],
+    }
+    assert get_pom_files_from_version_index(ARTIFACT_FOLDER, index) == sorted(pom_files)
+
+
+@pytest.mark.parametrize('objects, expected', ((
+    {},
+    (None, None),
+), (
+    {INDEX_KEY: 'not json'},
+    (None, '"{}"'.format(hashlib.md5(b'not json').hexdigest())),
+), (
+    {INDEX_KEY: '{"format":0,"lastFullListing":100,"pomFiles":[]}'},
+    (None, '"{}"'.format(hashlib.md5(b'{"format":0,"lastFullListing":100,"pomFiles":[]}').hexdigest())),
+), (
+    {INDEX_KEY: '{"format":1,"lastFullListing":100,"pomFiles":["1.0/a-1.0.pom"]}'},
+    (
+        {'format': 1, 'lastFullListing': 100, 'pomFiles': ['1.0/a-1.0.pom']},
+        '"{}"'.format(hashlib.md5(b'{"format":1,"lastFullListing":100,"pomFiles":["1.0/a-1.0.pom"]}').hexdigest()),
+    ),
+)))
+def test_fetch_version_index(objects, expected):
+    assert fetch_version_index(_generate_bucket_mock(objects), ARTIFACT_FOLDER) == expected
+
+
+def test_fetch_version_index_raises_other_errors():
+    bucket_mock = MagicMock()
+    bucket_mock.Object.return_value.get.side_effect = ClientError(
+        {'Error': {'Code': 'AccessDenied'}}, 'GetObject'
+    )
+    with pytest.raises(ClientError):
+        fetch_version_index(bucket_mock, ARTIFACT_FOLDER)
+
+
+@pytest.mark.parametrize('e_tag, expected_condition', (
+    (None, {'IfNoneMatch': '*'}),
+    ('"some-e-tag"', {'IfMatch': '"some-e-tag"'}),
+))
+def test_upload_version_index(e_tag, expected_condition):
+    bucket_mock = MagicMock()
+    bucket_mock.meta.client.meta.service_model = None
+    assert upload_version_index(bucket_mock, ARTIFACT_FOLDER, {'format': 1}, e_tag) == INDEX_KEY
+    bucket_mock.Object.assert_called_once_with(INDEX_KEY)
+    bucket_mock.Object.return_value.put.assert_called_once_with(
+        Body='{"format":1}', ContentType='application/json', CacheControl='no-cache',
+        **expected_condition
+    )
+
+
+def test_update_version_index():
+    objects = {
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/65.0.20181029100346/geckoview-nightly-x86-65.0.20181029100346.pom': '',
+    }
+    index = {
+        'format': 1,
+        'lastFullListing': 100,
+        'pomFiles': ['64.0.20181018103737/geckoview-nightly-x86-64.0.20181018103737.pom'],
+    }
+    assert update_version_index(_generate_bucket_mock(objects), ARTIFACT_FOLDER, index, [
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/65.0.20181029100346/geckoview-nightly-x86-65.0.20181029100346.pom',
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/65.0.20181029100346/geckoview-nightly-x86-65.0.20181029100346.jar',
+        # Deleted in the meantime
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/64.0.20181018103737/geckoview-nightly-x86-64.0.20181018103737.pom',
+    ])
+    assert index['pomFiles'] == ['65.0.20181029100346/geckoview-nightly-x86-65.0.20181029100346.pom']
+
+    assert not update_version_index(_generate_bucket_mock(objects), ARTIFACT_FOLDER, index, [
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/65.0.20181029100346/geckoview-nightly-x86-65.0.20181029100346.pom',
+    ])
+
+
+def test_list_pom_files_with_version_index_updates_existing_index():
+    new_pom = 'maven2/org/mozilla/geckoview/geckoview-nightly-x86/65.0.20181029100346/geckoview-nightly-x86-65.0.20181029100346.pom'
+    objects = {
+        INDEX_KEY: json.dumps({
+            'format': 1,
+            'lastFullListing': 100,
+            'pomFiles': ['64.0.20181018103737/geckoview-nightly-x86-64.0.20181018103737.pom'],
+        }),
+        new_pom: '',
+    }
+    list_function = _generate_list_function([])
+
+    assert list_pom_files_with_version_index(
+        _generate_bucket_mock(objects), ARTIFACT_FOLDER, [new_pom], list_function, max_age=60, now=150
+    ) == [
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/64.0.20181018103737/geckoview-nightly-x86-64.0.20181018103737.pom',
+        new_pom,
+    ]
+    list_function.assert_not_called()
+    assert json.loads(objects[INDEX_KEY]) == {
+        'format': 1,
+        'lastFullListing': 100,
+        'pomFiles': [
+            '64.0.20181018103737/geckoview-nightly-x86-64.0.20181018103737.pom',
+            '65.0.20181029100346/geckoview-nightly-x86-65.0.20181029100346.pom',
+        ],
+    }
+
+
+@pytest.mark.parametrize('index, event_keys', ((
+    None,
+    ['maven2/org/mozilla/geckoview/geckoview-nightly-x86/65.0.20181029100346/geckoview-nightly-x86-65.0.20181029100346.pom'],
+), (
+    # Too old
+    {'format': 1, 'lastFullListing': 10, 'pomFiles': []},
+    ['maven2/org/mozilla/geckoview/geckoview-nightly-x86/65.0.20181029100346/geckoview-nightly-x86-65.0.20181029100346.pom'],
+), (
+    # No idea what changed
+    {'format': 1, 'lastFullListing': 100, 'pomFiles': []},
+    [],
+)))
+def test_list_pom_files_with_version_index_rebuilds_index(index, event_keys):
+    objects = {} if index is None else {INDEX_KEY: json.dumps(index)}
+    pom_files = [
+        'maven2/org/mozilla/geckoview/geckoview-nightly-x86/65.0.20181029100346/geckoview-nightly-x86-65.0.20181029100346.pom',
+    ]
+    list_function = _generate_list_function(pom_files)
+    bucket_mock = _generate_bucket_mock(objects)
+
+    assert list_pom_files_with_version_index(
+        bucket_mock, ARTIFACT_FOLDER, event_keys, list_function, max_age=60, now=150
+    ) == pom_files
+    list_function.assert_called_once_with(bucket_mock, ARTIFACT_FOLDER)
+    assert json.loads(objects[INDEX_KEY]) == {
+        'format': 1,
+        'lastFullListing': 150,
+        'pomFiles': ['65.0.20181029100346/geckoview-nightly-x86-65.0.20181029100346.pom'],
+    }
+
+
+def test_list_pom_files_with_version_index_merges_concurrent_updates(monkeypatch):
+    s3 = S3ResourceStandIn()
+    bucket = s3.Bucket('some-bucket')
+    pom_files = [
+        '{}{}/geckoview-nightly-x86-{}.pom'.format(ARTIFACT_FOLDER, version, version)
+        for version in ('64.0', '65.0', '66.0')
+    ]
+    for pom_file in pom_files:
+        s3.meta.client.put_object(Bucket='some-bucket', Key=pom_file)
+    upload_version_index(bucket, ARTIFACT_FOLDER, build_version_index(
+        ARTIFACT_FOLDER, pom_files[:1], last_full_listing=100
+    ), None)
+    monkeypatch.setattr('maven_lambda.version_index.VERSION_INDEX_WRITE_BASE_DELAY', 0)
+
+    original_update_version_index = update_version_index
+    def update_after_another_invocation(*args):
+        if not hasattr(update_after_another_invocation, 'called'):
+            update_after_another_invocation.called = True
+            # Another invocation adds 66.0 between the read and the write of this one
+            upload_version_index(bucket, ARTIFACT_FOLDER, build_version_index(
+                ARTIFACT_FOLDER, [pom_files[0], pom_files[2]], last_full_listing=100
+            ), fetch_version_index(bucket, ARTIFACT_FOLDER)[1])
+        return original_update_version_index(*args)
+    monkeypatch.setattr(
+        'maven_lambda.version_index.update_version_index', update_after_another_invocation
+    )
+
+    assert list_pom_files_with_version_index(
+        bucket, ARTIFACT_FOLDER, [pom_files[1]], _generate_list_function([]), max_age=60, now=150
+    ) == pom_files
+    assert fetch_version_index(bucket, ARTIFACT_FOLDER)[0]['pomFiles'] == [
+        pom_file[len(ARTIFACT_FOLDER):] for pom_file in pom_files
+    ]
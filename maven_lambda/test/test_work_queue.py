@@ -0,0 +1,255 @@
+import pytest
+
+from botocore.exceptions import ClientError
+from unittest.mock import MagicMock
+
+from maven_lambda.test.stand_ins import InMemoryWorkQueue, SQLiteWorkQueue
+from maven_lambda.work_queue import DynamoDBWorkQueue, WorkQueue
+
+
+@pytest.fixture(params=(InMemoryWorkQueue, SQLiteWorkQueue))
+def work_queue(request):
+    return request.param()
+
+
+def test_work_queue_requires_every_method():
+    class IncompleteWorkQueue(WorkQueue):
+        def enqueue(self, bucket_name, artifact_folder, event_time=None):
+            pass
+
+        def get_quiet_folders(self, quiet_window, now=None, max_delay=None):
+            return []
+
+    with pytest.raises(TypeError):
+        WorkQueue()
+    with pytest.raises(TypeError):
+        IncompleteWorkQueue()
+
+
+def test_work_queue_only_returns_quiet_folders(work_queue):
+    work_queue.enqueue('some_bucket', 'maven2/org/mozilla/geckoview/geckoview/', event_time=100)
+    work_queue.enqueue('some_bucket', 'maven2/org/mozilla/components/browser-domains/', event_time=150)
+
+    assert work_queue.get_quiet_folders(60, now=170) == [
+        ('some_bucket', 'maven2/org/mozilla/geckoview/geckoview/', 100, ()),
+    ]
+    assert sorted(work_queue.get_quiet_folders(60, now=210)) == [
+        ('some_bucket', 'maven2/org/mozilla/components/browser-domains/', 150, ()),
+        ('some_bucket', 'maven2/org/mozilla/geckoview/geckoview/', 100, ()),
+    ]
+
+
+def test_work_queue_coalesces_events_of_the_same_folder(work_queue):
+    for event_time in (100, 120, 110):
+        work_queue.enqueue('some_bucket', 'maven2/org/mozilla/geckoview/geckoview/', event_time=event_time)
+
+    assert work_queue.get_quiet_folders(60, now=170) == []
+    assert work_queue.get_quiet_folders(60, now=180) == [
+        ('some_bucket', 'maven2/org/mozilla/geckoview/geckoview/', 120, ()),
+    ]
+
+
+def test_work_queue_drains_busy_folders_after_max_delay(work_queue):
+    # Events keep coming faster than the quiet window
+    for event_time in range(100, 200, 20):
+        work_queue.enqueue('some_bucket', 'maven2/org/mozilla/geckoview/geckoview/', event_time=event_time)
+    work_queue.enqueue('some_bucket', 'maven2/org/mozilla/components/browser-domains/', event_time=150)
+
+    assert work_queue.get_quiet_folders(60, now=200) == []
+    assert work_queue.get_quiet_folders(60, now=200, max_delay=120) == []
+    assert work_queue.get_quiet_folders(60, now=200, max_delay=100) == [
+        ('some_bucket', 'maven2/org/mozilla/geckoview/geckoview/', 180, ()),
+    ]
+
+
+def test_work_queue_keeps_the_keys_of_every_event(work_queue):
+    work_queue.enqueue('some_bucket', 'some/folder/', ['some/folder/1.1/some-1.1.pom'], event_time=120)
+    work_queue.enqueue('some_bucket', 'some/folder/', ['some/folder/1.0/some-1.0.pom', 'some/folder/1.0/some-1.0.jar'], event_time=100)
+    work_queue.enqueue('some_bucket', 'some/folder/', ['some/folder/1.1/some-1.1.pom'], event_time=130)
+
+    assert work_queue.get_quiet_folders(60, now=200) == [(
+        'some_bucket', 'some/folder/', 130,
+        ('some/folder/1.0/some-1.0.jar', 'some/folder/1.0/some-1.0.pom', 'some/folder/1.1/some-1.1.pom'),
+    )]
+
+
+def test_work_queue_acknowledge_keeps_folders_that_received_older_events(work_queue):
+    work_queue.enqueue('some_bucket', 'some/folder/', ['some/folder/1.1/some-1.1.pom'], event_time=200)
+    (_, _, event_time, keys), = work_queue.get_quiet_folders(0, now=1000)
+    # Enqueued late, while the folder was being regenerated
+    work_queue.enqueue('some_bucket', 'some/folder/', ['some/folder/1.0/some-1.0.pom'], event_time=100)
+
+    assert not work_queue.acknowledge('some_bucket', 'some/folder/', event_time, keys)
+    assert work_queue.get_quiet_folders(0, now=1000) == [
+        ('some_bucket', 'some/folder/', 200, ('some/folder/1.0/some-1.0.pom', 'some/folder/1.1/some-1.1.pom')),
+    ]
+    assert work_queue.acknowledge(
+        'some_bucket', 'some/folder/', 200, ('some/folder/1.0/some-1.0.pom', 'some/folder/1.1/some-1.1.pom')
+    )
+    assert work_queue.get_quiet_folders(0, now=1000) == []
+
+
+def test_work_queue_acknowledge(work_queue):
+    work_queue.enqueue('some_bucket', 'maven2/org/mozilla/geckoview/geckoview/', event_time=100)
+    assert work_queue.acknowledge('some_bucket', 'maven2/org/mozilla/geckoview/geckoview/', 100)
+    assert work_queue.get_quiet_folders(0, now=1000) == []
+
+
+def test_work_queue_acknowledge_keeps_folders_that_received_new_events(work_queue):
+    work_queue.enqueue('some_bucket', 'maven2/org/mozilla/geckoview/geckoview/', event_time=100)
+    work_queue.enqueue('some_bucket', 'maven2/org/mozilla/geckoview/geckoview/', event_time=200)
+
+    assert not work_queue.acknowledge('some_bucket', 'maven2/org/mozilla/geckoview/geckoview/', 100)
+    assert work_queue.get_quiet_folders(0, now=1000) == [
+        ('some_bucket', 'maven2/org/mozilla/geckoview/geckoview/', 200, ()),
+    ]
+
+
+def test_sqlite_work_queue_persists_on_disk(tmp_path):
+    database = str(tmp_path / 'queue.sqlite')
+    SQLiteWorkQueue(database).enqueue('some_bucket', 'some/folder/', event_time=100)
+    assert SQLiteWorkQueue(database).get_quiet_folders(0, now=100) == [
+        ('some_bucket', 'some/folder/', 100, ()),
+    ]
+
+
+def test_dynamodb_work_queue_enqueue():
+    dynamodb_mock = MagicMock()
+    DynamoDBWorkQueue('some_table', dynamodb_mock).enqueue('some_bucket', 'some/folder/', event_time=100.5)
+
+    dynamodb_mock.update_item.assert_called_once_with(
+        TableName='some_table',
+        Key={
+            'bucket_name': {'S': 'some_bucket'},
+            'artifact_folder': {'S': 'some/folder/'},
+        },
+        UpdateExpression='SET last_event_time = :event_time, first_event_time = if_not_exists(first_event_time, :event_time)',
+        ConditionExpression='attribute_not_exists(last_event_time) OR last_event_time < :event_time',
+        ExpressionAttributeValues={':event_time': {'N': '100.5'}},
+    )
+
+
+def test_dynamodb_work_queue_enqueue_keys():
+    dynamodb_mock = MagicMock()
+    DynamoDBWorkQueue('some_table', dynamodb_mock).enqueue(
+        'some_bucket', 'some/folder/', ['some/folder/1.1/some-1.1.pom', 'some/folder/1.0/some-1.0.pom'], event_time=100.5
+    )
+
+    dynamodb_mock.update_item.assert_called_once_with(
+        TableName='some_table',
+        Key={
+            'bucket_name': {'S': 'some_bucket'},
+            'artifact_folder': {'S': 'some/folder/'},
+        },
+        UpdateExpression='SET last_event_time = :event_time, first_event_time = if_not_exists(first_event_time, :event_time) ADD event_keys :keys',
+        ConditionExpression='attribute_not_exists(last_event_time) OR last_event_time < :event_time',
+        ExpressionAttributeValues={
+            ':event_time': {'N': '100.5'},
+            ':keys': {'SS': ['some/folder/1.0/some-1.0.pom', 'some/folder/1.1/some-1.1.pom']},
+        },
+    )
+
+
+def test_dynamodb_work_queue_enqueue_keys_of_older_event():
+    dynamodb_mock = MagicMock()
+    dynamodb_mock.update_item.side_effect = [
+        ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'UpdateItem'),
+        {},
+    ]
+    DynamoDBWorkQueue('some_table', dynamodb_mock).enqueue(
+        'some_bucket', 'some/folder/', ['some/folder/1.0/some-1.0.pom'], event_time=100
+    )
+
+    assert dynamodb_mock.update_item.call_count == 2
+    assert dynamodb_mock.update_item.call_args.kwargs == {
+        'TableName': 'some_table',
+        'Key': {
+            'bucket_name': {'S': 'some_bucket'},
+            'artifact_folder': {'S': 'some/folder/'},
+        },
+        'UpdateExpression': 'SET last_event_time = if_not_exists(last_event_time, :event_time), first_event_time = if_not_exists(first_event_time, :event_time) ADD event_keys :keys',
+        'ExpressionAttributeValues': {
+            ':event_time': {'N': '100'},
+            ':keys': {'SS': ['some/folder/1.0/some-1.0.pom']},
+        },
+    }
+
+
+def test_dynamodb_work_queue_enqueue_older_event():
+    dynamodb_mock = MagicMock()
+    dynamodb_mock.update_item.side_effect = ClientError(
+        {'Error': {'Code': 'ConditionalCheckFailedException'}}, 'UpdateItem'
+    )
+    DynamoDBWorkQueue('some_table', dynamodb_mock).enqueue('some_bucket', 'some/folder/', event_time=100)  # Does not raise
+
+    dynamodb_mock.update_item.side_effect = ClientError(
+        {'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'UpdateItem'
+    )
+    with pytest.raises(ClientError):
+        DynamoDBWorkQueue('some_table', dynamodb_mock).enqueue('some_bucket', 'some/folder/', event_time=100)
+
+
+def test_dynamodb_work_queue_get_quiet_folders():
+    dynamodb_mock = MagicMock()
+    dynamodb_mock.get_paginator.return_value.paginate.return_value = [{
+        'Items': [{
+            'bucket_name': {'S': 'some_bucket'},
+            'artifact_folder': {'S': 'some/folder/'},
+            'last_event_time': {'N': '100'},
+            'event_keys': {'SS': ['some/folder/1.1/some-1.1.pom', 'some/folder/1.0/some-1.0.pom']},
+        }],
+    }, {
+        'Items': [],
+    }]
+
+    assert DynamoDBWorkQueue('some_table', dynamodb_mock).get_quiet_folders(60, now=200) == [
+        ('some_bucket', 'some/folder/', 100.0, ('some/folder/1.0/some-1.0.pom', 'some/folder/1.1/some-1.1.pom')),
+    ]
+    dynamodb_mock.get_paginator.assert_called_once_with('scan')
+    dynamodb_mock.get_paginator.return_value.paginate.assert_called_once_with(
+        TableName='some_table',
+        FilterExpression='last_event_time <= :threshold',
+        ExpressionAttributeValues={':threshold': {'N': '140'}},
+        ConsistentRead=True,
+    )
+
+
+def test_dynamodb_work_queue_get_quiet_folders_with_max_delay():
+    dynamodb_mock = MagicMock()
+    dynamodb_mock.get_paginator.return_value.paginate.return_value = []
+
+    assert DynamoDBWorkQueue('some_table', dynamodb_mock).get_quiet_folders(60, now=200, max_delay=150) == []
+    dynamodb_mock.get_paginator.return_value.paginate.assert_called_once_with(
+        TableName='some_table',
+        FilterExpression='last_event_time <= :threshold OR first_event_time <= :max_delay_threshold',
+        ExpressionAttributeValues={':threshold': {'N': '140'}, ':max_delay_threshold': {'N': '50'}},
+        ConsistentRead=True,
+    )
+
+
+def test_dynamodb_work_queue_acknowledge():
+    dynamodb_mock = MagicMock()
+    work_queue = DynamoDBWorkQueue('some_table', dynamodb_mock)
+    assert work_queue.acknowledge('some_bucket', 'some/folder/', 100.0)
+    dynamodb_mock.delete_item.assert_called_once_with(
+        TableName='some_table',
+        Key={
+            'bucket_name': {'S': 'some_bucket'},
+            'artifact_folder': {'S': 'some/folder/'},
+        },
+        ConditionExpression='last_event_time = :event_time AND attribute_not_exists(event_keys)',
+        ExpressionAttributeValues={':event_time': {'N': '100.0'}},
+    )
+
+    dynamodb_mock.reset_mock()
+    assert work_queue.acknowledge('some_bucket', 'some/folder/', 100.0, ('some/folder/1.0/some-1.0.pom',))
+    assert dynamodb_mock.delete_item.call_args.kwargs['ConditionExpression'] == \
+        'last_event_time = :event_time AND size(event_keys) = :size'
+    assert dynamodb_mock.delete_item.call_args.kwargs['ExpressionAttributeValues'] == {
+        ':event_time': {'N': '100.0'}, ':size': {'N': '1'},
+    }
+
+    dynamodb_mock.delete_item.side_effect = ClientError(
+        {'Error': {'Code': 'ConditionalCheckFailedException'}}, 'DeleteItem'
+    )
+    assert not work_queue.acknowledge('some_bucket', 'some/folder/', 100.0)
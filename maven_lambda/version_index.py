@@ -0,0 +1,142 @@
+import json
+import time
+
+from botocore.exceptions import ClientError
+from maven_lambda.conditional_writes import (
+    get_error_code,
+    get_write_conditions,
+    is_concurrent_write_error,
+    wait_before_retrying,
+)
+
+
+# The version index is a small JSON file stored next to maven-metadata.xml. It lists the .pom
+# files of an artifact folder, so that we don't have to list the whole folder (which contains
+# about 12 files per version) every time a new version gets uploaded. A full listing is still
+# done whenever the index is missing, unreadable, or older than a given age. This repairs any
+# version an update could have missed.
+VERSION_INDEX_FILE_NAME = 'maven-lambda-index.json'
+VERSION_INDEX_FORMAT = 1
+MAX_VERSION_INDEX_WRITE_ATTEMPTS = 5
+VERSION_INDEX_WRITE_BASE_DELAY = 0.1
+
+
+def list_pom_files_with_version_index(
+    bucket, artifact_folder, event_keys, list_function, max_age, now=None
+):
+    now = time.time() if now is None else now
+    for attempt in range(MAX_VERSION_INDEX_WRITE_ATTEMPTS):
+        index, e_tag = fetch_version_index(bucket, artifact_folder)
+
+        if index is None or not event_keys or now - index['lastFullListing'] > max_age:
+            # We don't know what changed: let's rebuild the index from scratch
+            print('Rebuilding version index of "{}" from a full listing'.format(artifact_folder))
+            pom_files = list_function(bucket, artifact_folder)
+            index = build_version_index(artifact_folder, pom_files, now)
+        elif update_version_index(bucket, artifact_folder, index, event_keys):
+            pom_files = get_pom_files_from_version_index(artifact_folder, index)
+        else:
+            return get_pom_files_from_version_index(artifact_folder, index)
+
+        # Concurrent invocations update the same index: each of them only replaces the one it
+        # read. The one that lost reads the index again, and applies its event keys to it.
+        try:
+            upload_version_index(bucket, artifact_folder, index, e_tag)
+            return pom_files
+        except ClientError as e:
+            if not is_concurrent_write_error(e) or attempt + 1 == MAX_VERSION_INDEX_WRITE_ATTEMPTS:
+                raise
+            delay = wait_before_retrying(attempt, VERSION_INDEX_WRITE_BASE_DELAY)
+            print('Version index of "{}" was updated meanwhile. Read it again after '
+                  '{:.2f}s'.format(artifact_folder, delay))
+
+
+def get_version_index_key(artifact_folder):
+    return '{}/{}'.format(artifact_folder.rstrip('/'), VERSION_INDEX_FILE_NAME)
+
+
+def build_version_index(artifact_folder, pom_files, last_full_listing):
+    return {
+        'format': VERSION_INDEX_FORMAT,
+        'lastFullListing': last_full_listing,
+        'pomFiles': sorted(
+            _get_relative_path(artifact_folder, pom_file) for pom_file in pom_files
+        ),
+    }
+
+
+def get_pom_files_from_version_index(artifact_folder, index):
+    return [
+        '{}{}'.format(artifact_folder, relative_path) for relative_path in index['pomFiles']
+    ]
+
+
+def update_version_index(bucket, artifact_folder, index, event_keys):
+    # S3 events don't necessarily come in order. Checking whether the .pom still exists tells
+    # whether it was created or deleted.
+    known_pom_files = set(index['pomFiles'])
+    for key in event_keys:
+        if not key.endswith('.pom'):
+            continue
+        relative_path = _get_relative_path(artifact_folder, key)
+        if s3_object_exists(bucket, key):
+            known_pom_files.add(relative_path)
+        else:
+            known_pom_files.discard(relative_path)
+
+    pom_files = sorted(known_pom_files)
+    has_changed = pom_files != index['pomFiles']
+    index['pomFiles'] = pom_files
+    return has_changed
+
+
+def fetch_version_index(bucket, artifact_folder):
+    # Returns the index and its ETag. The ETag is None if there's no index, the index is None if
+    # it can't be used.
+    key = get_version_index_key(artifact_folder)
+    try:
+        response = bucket.Object(key).get()
+    except ClientError as e:
+        if get_error_code(e) in ('NoSuchKey', '404'):
+            return None, None
+        raise
+    e_tag = response.get('ETag')
+
+    try:
+        index = json.loads(response['Body'].read())
+    except ValueError:
+        print('WARN: "{}" is not valid JSON. Ignoring it.'.format(key))
+        return None, e_tag
+
+    if not isinstance(index, dict) or index.get('format') != VERSION_INDEX_FORMAT:
+        print('WARN: "{}" has an unknown format. Ignoring it.'.format(key))
+        return None, e_tag
+
+    return index, e_tag
+
+
+def upload_version_index(bucket, artifact_folder, index, e_tag):
+    # Only replaces the index whose ETag is e_tag, or creates it if e_tag is None
+    key = get_version_index_key(artifact_folder)
+    bucket.Object(key).put(
+        Body=json.dumps(index, separators=(',', ':')),
+        ContentType='application/json',
+        CacheControl='no-cache',
+        **get_write_conditions(bucket.meta.client, key, e_tag)
+    )
+    return key
+
+
+def s3_object_exists(bucket, key):
+    # Called from thread pools: unlike resources, clients are thread-safe
+    try:
+        bucket.meta.client.head_object(Bucket=bucket.name, Key=key)
+    except ClientError as e:
+        if get_error_code(e) in ('NoSuchKey', '404'):
+            return False
+        raise
+    return True
+
+
+def _get_relative_path(artifact_folder, key):
+    return key[len(artifact_folder):] if key.startswith(artifact_folder) else key
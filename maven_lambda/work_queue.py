@@ -0,0 +1,140 @@
+import time
+
+from abc import ABC, abstractmethod
+from botocore.exceptions import ClientError
+
+
+# A work queue holds the artifact folders whose maven-metadata.xml must be regenerated. Each
+# folder is stored once, along with the time of its first and latest events, and the keys of these
+# events: the version index and SNAPSHOT version folders only need these keys, instead of a full
+# listing. Draining a queue is done in 2 steps: get_quiet_folders() tells which folders haven't
+# received any event for a while, then acknowledge() removes a folder once its metadata got
+# regenerated. acknowledge() is a no-op if another event came in the meantime, so that the folder
+# gets regenerated again at the next drain. A folder that keeps receiving events is still returned
+# once its first event is older than max_delay.
+
+
+class WorkQueue(ABC):
+    @abstractmethod
+    def enqueue(self, bucket_name, artifact_folder, keys=(), event_time=None):
+        pass
+
+    @abstractmethod
+    def get_quiet_folders(self, quiet_window, now=None, max_delay=None):
+        # Returns (bucket_name, artifact_folder, event_time, keys) tuples. keys are sorted.
+        pass
+
+    @abstractmethod
+    def acknowledge(self, bucket_name, artifact_folder, event_time, keys=()):
+        # event_time and keys are the ones get_quiet_folders() returned
+        pass
+
+
+class DynamoDBWorkQueue(WorkQueue):
+    # The table must have "bucket_name" as partition key and "artifact_folder" as sort key. Keys
+    # are stored in a string set: a folder can't hold more than about 3000 of them (DynamoDB items
+    # are limited to 400KB), which takes way more events than a release.
+    def __init__(self, table_name, dynamodb_client):
+        self.table_name = table_name
+        self._dynamodb = dynamodb_client
+
+    def enqueue(self, bucket_name, artifact_folder, keys=(), event_time=None):
+        event_time = time.time() if event_time is None else event_time
+        values = {':event_time': {'N': repr(event_time)}}
+        add_expression = ''
+        if keys:
+            # DynamoDB refuses empty sets
+            values[':keys'] = {'SS': sorted(set(keys))}
+            add_expression = ' ADD event_keys :keys'
+        try:
+            self._dynamodb.update_item(
+                TableName=self.table_name,
+                Key=_generate_dynamodb_key(bucket_name, artifact_folder),
+                UpdateExpression='SET last_event_time = :event_time, '
+                                 'first_event_time = if_not_exists(first_event_time, :event_time)'
+                                 + add_expression,
+                ConditionExpression='attribute_not_exists(last_event_time) '
+                                    'OR last_event_time < :event_time',
+                ExpressionAttributeValues=values,
+            )
+        except ClientError as e:
+            if not _is_conditional_check_failure(e):
+                raise
+            if not keys:
+                return
+            # A more recent event was already recorded, but the keys of this one are still needed.
+            # The folder may have been acknowledged since, hence the if_not_exists().
+            self._dynamodb.update_item(
+                TableName=self.table_name,
+                Key=_generate_dynamodb_key(bucket_name, artifact_folder),
+                UpdateExpression='SET last_event_time = '
+                                 'if_not_exists(last_event_time, :event_time), '
+                                 'first_event_time = if_not_exists(first_event_time, :event_time)'
+                                 + add_expression,
+                ExpressionAttributeValues=values,
+            )
+
+    def get_quiet_folders(self, quiet_window, now=None, max_delay=None):
+        quiet_threshold, max_delay_threshold = get_drain_thresholds(quiet_window, now, max_delay)
+        filter_expression = 'last_event_time <= :threshold'
+        values = {':threshold': {'N': repr(quiet_threshold)}}
+        if max_delay_threshold is not None:
+            filter_expression += ' OR first_event_time <= :max_delay_threshold'
+            values[':max_delay_threshold'] = {'N': repr(max_delay_threshold)}
+        paginator = self._dynamodb.get_paginator('scan')
+        pages = paginator.paginate(
+            TableName=self.table_name,
+            FilterExpression=filter_expression,
+            ExpressionAttributeValues=values,
+            ConsistentRead=True,
+        )
+        return [
+            (
+                item['bucket_name']['S'],
+                item['artifact_folder']['S'],
+                float(item['last_event_time']['N']),
+                tuple(sorted(item.get('event_keys', {}).get('SS', []))),
+            )
+            for page in pages
+            for item in page.get('Items', [])
+        ]
+
+    def acknowledge(self, bucket_name, artifact_folder, event_time, keys=()):
+        # Keys are only ever added: if there are more of them, an older event came in meanwhile
+        values = {':event_time': {'N': repr(event_time)}}
+        if keys:
+            condition_expression = 'last_event_time = :event_time AND size(event_keys) = :size'
+            values[':size'] = {'N': str(len(set(keys)))}
+        else:
+            condition_expression = 'last_event_time = :event_time ' \
+                                   'AND attribute_not_exists(event_keys)'
+        try:
+            self._dynamodb.delete_item(
+                TableName=self.table_name,
+                Key=_generate_dynamodb_key(bucket_name, artifact_folder),
+                ConditionExpression=condition_expression,
+                ExpressionAttributeValues=values,
+            )
+        except ClientError as e:
+            if _is_conditional_check_failure(e):
+                return False
+            raise
+        return True
+
+
+def get_drain_thresholds(quiet_window, now=None, max_delay=None):
+    # Folders whose latest event is older than the first threshold are quiet. Those whose first
+    # event is older than the second one are drained anyway. No max_delay means no second one.
+    now = time.time() if now is None else now
+    return now - quiet_window, None if max_delay is None else now - max_delay
+
+
+def _generate_dynamodb_key(bucket_name, artifact_folder):
+    return {
+        'bucket_name': {'S': bucket_name},
+        'artifact_folder': {'S': artifact_folder},
+    }
+
+
+def _is_conditional_check_failure(error):
+    return error.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException'
@@ -1,6 +1,6 @@
 import os
 import re
-from setuptools import setup, find_packages
+from setuptools import setup, find_namespace_packages
 
 
 project_dir = os.path.abspath(os.path.dirname(__file__))
@@ -24,11 +24,20 @@ setup(
     author='Mozilla Release Engineering',
     author_email='release+python@mozilla.com',
     url='https://github.com/mozilla-releng/maven-lambda',
-    packages=find_packages(),
+    # maven_lambda/ has no __init__.py: it's a namespace package, which find_packages() skips
+    packages=find_namespace_packages(
+        include=['maven_lambda', 'maven_lambda.*'], exclude=['*.test', '*.test.*']
+    ),
     include_package_data=True,
     zip_safe=False,
     license='MPL2',
     install_requires=requirements_without_comments,
+    entry_points={
+        'console_scripts': [
+            'maven-lambda-rebuild = maven_lambda.rebuild:main',
+            'maven-lambda-reconcile = maven_lambda.reconcile:main',
+        ],
+    },
     classifiers=(
         'Programming Language :: Python :: 3',
     ),